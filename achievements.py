@@ -0,0 +1,127 @@
+# FILE: achievements.py
+"""
+Автоматическая выдача ачивок по событиям: заказ подтверждён, игра рассчитана,
+приглашён реферал. Каждое событие меняет несколько счётчиков пользователя
+(achievement_counters: покупки, траты, игры, серия побед и т. д.), и
+проверяются только правила этих счётчиков: ачивка выдаётся, когда изменение
+переходит её порог. История не пересчитывается, поэтому стоимость события не
+зависит от того, сколько у пользователя покупок и игр.
+Счётчики и выдача — одна транзакция; поздравления уходят через outbox.
+При первом запуске счётчики заполняются из накопленной истории, ачивки за уже
+пройденные пороги выдаются без уведомлений.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import outbox
+from database import bump_achievement_counters, backfill_achievement_counters
+
+logger = logging.getLogger(__name__)
+
+# Код ачивки из achievements_list → (счётчик, порог)
+RULES = {
+    'first_purchase': ('purchases', 1),
+    'spent_50k': ('spent', 50_000),
+    'economy': ('saved', 500),
+    'night_10': ('night_purchases', 10),
+    'screenshots_5': ('screenshots', 5),
+    'games_100': ('casino_games', 100),
+    'mines_10_streak': ('mines_streak', 10),
+    'referrer_10': ('referrals', 10),
+}
+# Ночные покупки — с 00:00 до 06:00
+NIGHT_END_HOUR = 6
+
+_events: Dict[str, Callable] = {}
+
+
+def on(event: str):
+    """Регистрирует перевод события в изменения счётчиков: f(**данные) → [(user_id, счётчик, delta)]."""
+    def register(handler: Callable):
+        _events[event] = handler
+        return handler
+    return register
+
+
+@on('order_approved')
+def _order_approved(user_id: int, price: float, discount: float = 0, screenshot: bool = False,
+                    at: Optional[datetime] = None) -> list:
+    updates = [(user_id, 'purchases', 1), (user_id, 'spent', int(price))]
+    if discount:
+        updates.append((user_id, 'saved', int(discount)))
+    if screenshot:
+        updates.append((user_id, 'screenshots', 1))
+    if (at or datetime.now()).hour < NIGHT_END_HOUR:
+        updates.append((user_id, 'night_purchases', 1))
+    return updates
+
+
+@on('game_settled')
+def _game_settled(user_id: int, game_type: str, won: bool) -> list:
+    if game_type == 'mines':
+        return [(user_id, 'mines_streak', 1 if won else None)]
+    if game_type.startswith('casino'):
+        return [(user_id, 'casino_games', 1)]
+    return []
+
+
+@on('referral_added')
+def _referral_added(user_id: int) -> list:
+    return [(user_id, 'referrals', 1)]
+
+
+class AchievementEngine:
+    def __init__(self):
+        self._thresholds: Dict[str, List[tuple]] = {}
+        for code, (counter, threshold) in RULES.items():
+            self._thresholds.setdefault(counter, []).append((threshold, code))
+        self._counters = {'events': 0, 'updates': 0, 'awarded': 0}
+
+    def load(self):
+        """При первом запуске заполняет счётчики из истории."""
+        awarded = backfill_achievement_counters(self._thresholds)
+        if awarded:
+            logger.info(f"Счётчики ачивок заполнены из истории, выдано ачивок: {awarded}")
+
+    def emit(self, event: str, **data) -> list:
+        """Одно событие; см. emit_many."""
+        return self.emit_many([(event, data)])
+
+    def emit_many(self, events: List[tuple]) -> list:
+        """
+        События [(имя, данные)] одной транзакцией. Ошибка здесь не должна мешать
+        основному действию, поэтому она только пишется в лог.
+        Возвращает новые ачивки: [(user_id, code, name, icon)].
+        """
+        updates = []
+        for event, data in events:
+            handler = _events.get(event)
+            if handler is None:
+                logger.warning(f"Неизвестное событие ачивок: {event}")
+                continue
+            try:
+                updates.extend(handler(**data))
+            except Exception as e:
+                logger.error(f"Ошибка обработки события ачивок {event}: {e}")
+        self._counters['events'] += len(events)
+        if not updates:
+            return []
+        self._counters['updates'] += len(updates)
+        awarded = bump_achievement_counters(updates, self._thresholds)
+        if awarded:
+            self._counters['awarded'] += len(awarded)
+            try:
+                outbox.notify(*[
+                    outbox.notification(user_id, f"🏆 <b>Новая ачивка!</b>\n\n{icon} <b>{name}</b>")
+                    for user_id, code, name, icon in awarded
+                ])
+            except Exception as e:
+                logger.error(f"Ошибка уведомления о новых ачивках: {e}")
+        return awarded
+
+    def stats(self) -> dict:
+        return dict(self._counters)
+
+
+achievement_engine = AchievementEngine()
@@ -0,0 +1,206 @@
+# FILE: assignment.py
+"""
+Автоназначение новых тикетов наименее загруженному агенту на смене.
+Нагрузка (число незакрытых назначенных тикетов), дежурство и навыки агентов
+держатся в памяти; индекс строится из БД при старте и дальше меняется точечно.
+Выбор — вершина кучи: O(log n) на назначение вместо перебора всех агентов.
+Навык тикета — группа из правил разбора (triage); если на смене нет никого
+с этим навыком, тикет получает любой агент на смене.
+"""
+import heapq
+import itertools
+import logging
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+import cache_bus
+from config import AGENT_MAX_OPEN_TICKETS
+from database import (
+    assign_ticket, get_agent_presence, set_agent_presence, get_agent_open_tickets, get_staff_role
+)
+
+logger = logging.getLogger(__name__)
+
+ASSIGNABLE_ROLES = ('agent', 'moder', 'admin', 'tech_admin', 'owner')
+_ANY = ''  # куча со всеми агентами на смене
+
+
+def parse_skills(text: str) -> FrozenSet[str]:
+    return frozenset(skill.strip().lower() for skill in (text or '').split(',') if skill.strip())
+
+
+class WorkloadIndex:
+    """
+    Нагрузка агентов и кучи (нагрузка, порядок, агент) — общая и по каждому навыку.
+    Записи в кучах не удаляются при изменении: устаревшие (другая нагрузка, агент
+    ушёл со смены, навык снят) отбрасываются, когда оказываются на вершине.
+    При равной нагрузке первым идёт тот, чья нагрузка менялась раньше.
+    """
+
+    def __init__(self):
+        self.loads: Dict[int, int] = {}
+        self.skills: Dict[int, FrozenSet[str]] = {}
+        self.online = set()
+        self._heaps: Dict[str, list] = {_ANY: []}
+        self._seq = itertools.count()
+
+    def set_agent(self, agent_id: int, online: bool, skills: FrozenSet[str] = frozenset(), load: int = None):
+        self.skills[agent_id] = frozenset(skills)
+        if load is not None:
+            self.loads[agent_id] = load
+        self.loads.setdefault(agent_id, 0)
+        if online:
+            self.online.add(agent_id)
+            self._push(agent_id)
+        else:
+            self.online.discard(agent_id)
+
+    def set_load(self, agent_id: int, load: int):
+        self.loads[agent_id] = max(0, load)
+        if agent_id in self.online:
+            self._push(agent_id)
+
+    def _push(self, agent_id: int):
+        entry = (self.loads[agent_id], next(self._seq), agent_id)
+        for key in (_ANY, *self.skills.get(agent_id, ())):
+            heap = self._heaps.setdefault(key, [])
+            heapq.heappush(heap, entry)
+            if len(heap) > 4 * len(self.online) + 64:
+                self._compact(key)
+
+    def _compact(self, key: str):
+        heap = self._heaps[key]
+        current = {}
+        for entry in heap:
+            if self._valid(entry, key):
+                current[entry[2]] = entry
+        self._heaps[key] = list(current.values())
+        heapq.heapify(self._heaps[key])
+
+    def _valid(self, entry: tuple, key: str) -> bool:
+        load, _, agent_id = entry
+        return (
+            agent_id in self.online
+            and self.loads.get(agent_id) == load
+            and (key == _ANY or key in self.skills.get(agent_id, ()))
+        )
+
+    def _top(self, key: str, eligible: Callable = None) -> Optional[tuple]:
+        heap = self._heaps.get(key)
+        while heap:
+            entry = heap[0]
+            if not self._valid(entry, key):
+                heapq.heappop(heap)
+                continue
+            if eligible and not eligible(entry[2]):
+                # Агент больше не может брать тикеты (например, снята роль) — снимаем со смены
+                self.online.discard(entry[2])
+                heapq.heappop(heap)
+                continue
+            return entry
+        return None
+
+    def pick(self, skill: str = None, eligible: Callable = None, max_load: int = 0) -> Optional[int]:
+        """
+        Наименее загруженный агент на смене: сначала среди владеющих навыком, потом среди всех.
+        max_load — предел нагрузки: если он достигнут даже у вершины кучи навыка, загружены
+        все с этим навыком, и тикет достаётся любому агенту на смене со свободным местом.
+        """
+        for key in ((skill.lower(), _ANY) if skill else (_ANY,)):
+            entry = self._top(key, eligible)
+            if entry and not (max_load and entry[0] >= max_load):
+                return entry[2]
+        return None
+
+
+class AgentDispatcher:
+    def __init__(self):
+        self.index = WorkloadIndex()
+        self._loaded = False
+        cache_bus.subscribe('assignment', self._apply)
+
+    def load(self):
+        """Строит индекс из БД: дежурства и навыки, нагрузка по незакрытым тикетам."""
+        index = WorkloadIndex()
+        loads = get_agent_open_tickets()
+        for agent_id, online, skills in get_agent_presence():
+            index.set_agent(agent_id, bool(online) and self._eligible(agent_id), parse_skills(skills),
+                            loads.get(agent_id, 0))
+        for agent_id, load in loads.items():
+            index.loads.setdefault(agent_id, load)
+        self.index = index
+        self._loaded = True
+        logger.info(f"Автоназначение: на смене {len(index.online)} агентов")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    @staticmethod
+    def _eligible(agent_id: int) -> bool:
+        return get_staff_role(agent_id) in ASSIGNABLE_ROLES
+
+    # ========== ОБНОВЛЕНИЕ ==========
+    def _refresh_local(self, agent_id: int):
+        rows = get_agent_presence(agent_id)
+        online, skills = (bool(rows[0][1]), rows[0][2]) if rows else (False, '')
+        self.index.set_agent(agent_id, online and self._eligible(agent_id), parse_skills(skills),
+                             get_agent_open_tickets(agent_id))
+
+    def refresh(self, agent_id: int):
+        """Перечитывает агента из БД после закрытия его тикета или смены дежурства."""
+        if not agent_id:
+            return
+        self._ensure_loaded()
+        self._refresh_local(agent_id)
+        cache_bus.publish('assignment', str(agent_id))
+
+    def _apply(self, key: str = None):
+        if not self._loaded:
+            return
+        if key is None:
+            self.load()
+            return
+        self._refresh_local(int(key))
+
+    def set_online(self, agent_id: int, online: bool) -> bool:
+        ok = set_agent_presence(agent_id, online=online)
+        self.refresh(agent_id)
+        return ok
+
+    def set_skills(self, agent_id: int, skills: str) -> bool:
+        ok = set_agent_presence(agent_id, skills=",".join(sorted(parse_skills(skills))))
+        self.refresh(agent_id)
+        return ok
+
+    # ========== НАЗНАЧЕНИЕ ==========
+    def assign(self, ticket_id: int, skill: str = None) -> Optional[int]:
+        """Назначает тикет; None — на смене никого нет или все загружены до предела."""
+        self._ensure_loaded()
+        agent_id = self.index.pick(skill, self._eligible, AGENT_MAX_OPEN_TICKETS)
+        if agent_id is None:
+            return None
+        load = self.index.loads[agent_id]
+        if not assign_ticket(ticket_id, agent_id):
+            return None
+        self.index.set_load(agent_id, load + 1)
+        cache_bus.publish('assignment', str(agent_id))
+        return agent_id
+
+    # ========== ЧТЕНИЕ ==========
+    def is_online(self, agent_id: int) -> bool:
+        self._ensure_loaded()
+        return agent_id in self.index.online
+
+    def workload(self) -> List[tuple]:
+        """[(agent_id, на смене, нагрузка, навыки)] по возрастанию нагрузки."""
+        self._ensure_loaded()
+        index = self.index
+        agents = set(index.online) | {agent_id for agent_id, load in index.loads.items() if load}
+        return sorted(
+            ((agent_id, agent_id in index.online, index.loads.get(agent_id, 0), index.skills.get(agent_id, frozenset()))
+             for agent_id in agents),
+            key=lambda row: (not row[1], row[2], row[0])
+        )
+
+
+agent_dispatcher = AgentDispatcher()
@@ -0,0 +1,447 @@
+# FILE: backups.py
+"""
+Бекапы базы через SQLite backup API: копия снимается постранично из живой БД
+(писатели не блокируются), сжимается gzip и сопровождается манифестом
+с контрольными суммами. Инкрементальные бекапы хранят только изменившиеся
+страницы и образуют цепочку: полный бекап + дельты.
+Все функции блокирующие — вызывать через asyncio.to_thread.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import time
+from datetime import datetime
+
+import cache_bus
+from config import (
+    DATABASE_NAME, BACKUP_DIR, DB_BUSY_TIMEOUT,
+    BACKUP_PAGES_STEP, BACKUP_STEP_SLEEP, BACKUP_COMPRESS_LEVEL, BACKUP_CHAIN_LENGTH
+)
+from database import cache_clear, clear_settings_cache, get_db_version
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Индексы в памяти (очередь модерации, правила разбора, нагрузка агентов, промокоды),
+# которые после восстановления перечитываются здесь и в остальных процессах
+RESTORE_RELOAD = ('moderation', 'triage', 'assignment', 'promocodes')
+PAGE_HASH_SIZE = 8
+
+
+class BackupError(Exception):
+    pass
+
+
+class _HashingWriter:
+    """Файл-обёртка, считающая sha256 и размер записанного."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+BACKUP_SUFFIXES = (".db.gz", ".delta.gz", ".db")
+
+
+def _base_path(backup_path: str) -> str:
+    for suffix in BACKUP_SUFFIXES:
+        if backup_path.endswith(suffix):
+            return backup_path[:-len(suffix)]
+    return backup_path
+
+
+def _manifest_path(backup_path: str) -> str:
+    return _base_path(backup_path) + ".json"
+
+
+def _hashes_path(backup_path: str) -> str:
+    return _base_path(backup_path) + ".pages"
+
+
+def _read_manifest(backup_path: str):
+    path = _manifest_path(backup_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _snapshot(target_path: str) -> dict:
+    """Постраничная онлайн-копия живой БД в target_path."""
+    src = sqlite3.connect(DATABASE_NAME, timeout=DB_BUSY_TIMEOUT)
+    dst = sqlite3.connect(target_path)
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        # Пауза между шагами — окно для писателей
+        if BACKUP_STEP_SLEEP:
+            time.sleep(BACKUP_STEP_SLEEP)
+
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_STEP, progress=progress)
+        page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+        # Копия не должна остаться в WAL-режиме, иначе файл будет неполным без -wal
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+    return {"page_size": page_size, "pages": page_count, "steps": steps}
+
+
+def _check_integrity(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"Проверка целостности не пройдена: {result}")
+
+
+def _page_hashes(raw_path: str, page_size: int) -> bytes:
+    """Короткие хэши всех страниц файла БД (8 байт на страницу)."""
+    digests = bytearray()
+    with open(raw_path, "rb") as f:
+        for page in iter(lambda: f.read(page_size), b""):
+            digests += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+    return bytes(digests)
+
+
+def _new_base_name() -> str:
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base = os.path.join(BACKUP_DIR, f"backup_{timestamp}")
+    suffix = 1
+    while os.path.exists(base + ".json"):
+        base = os.path.join(BACKUP_DIR, f"backup_{timestamp}_{suffix}")
+        suffix += 1
+    return base
+
+
+def _finish(backup_path: str, manifest: dict, hashes: bytes, started: float):
+    manifest["file"] = os.path.basename(backup_path)
+    manifest["created_at"] = datetime.now().isoformat(timespec="seconds")
+    manifest["db_version"] = get_db_version()
+    manifest["compression"] = "gzip"
+    manifest["duration"] = round(time.perf_counter() - started, 3)
+    with open(_hashes_path(backup_path), "wb") as f:
+        f.write(hashes)
+    _write_json_atomic(_manifest_path(backup_path), manifest)
+    logger.info(
+        f"Бекап {manifest['file']} ({manifest['kind']}): {manifest['raw_size']} → {manifest['size']} байт "
+        f"за {manifest['duration']} с"
+    )
+
+
+# ========== СОЗДАНИЕ ==========
+def create_backup() -> str:
+    """Снимает полный бекап, возвращает путь к backup_*.db.gz."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    started = time.perf_counter()
+    base = _new_base_name()
+    raw_path = base + ".db.tmp"
+    backup_path = base + ".db.gz"
+    try:
+        info = _snapshot(raw_path)
+        raw_sha256 = hashlib.sha256()
+        raw_size = 0
+        with open(raw_path, "rb") as src, open(backup_path + ".tmp", "wb") as out:
+            writer = _HashingWriter(out)
+            with gzip.GzipFile(filename="", mode="wb", fileobj=writer, compresslevel=BACKUP_COMPRESS_LEVEL) as gz:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    raw_sha256.update(chunk)
+                    raw_size += len(chunk)
+                    gz.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        hashes = _page_hashes(raw_path, info["page_size"])
+        os.replace(backup_path + ".tmp", backup_path)
+    finally:
+        for path in (raw_path, backup_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    _finish(backup_path, {
+        "kind": "full",
+        "base": os.path.basename(backup_path),
+        "parent": None,
+        "size": writer.size,
+        "sha256": writer.sha256.hexdigest(),
+        "raw_size": raw_size,
+        "raw_sha256": raw_sha256.hexdigest(),
+        "page_size": info["page_size"],
+        "pages": info["pages"],
+        "changed_pages": info["pages"],
+    }, hashes, started)
+    return backup_path
+
+
+def create_incremental_backup() -> str:
+    """
+    Снимает дельту относительно последней точки цепочки: в архив попадают
+    только страницы, чьи хэши изменились. Если цепочки нет, она слишком
+    длинная или сменился размер страницы — снимается полный бекап.
+    """
+    chains = get_backup_chains()
+    if not chains:
+        return create_backup()
+    chain = chains[0]
+    parent = chain[-1]
+    manifest = parent['manifest']
+    hashes_file = _hashes_path(parent['path'])
+    if len(chain) - 1 >= BACKUP_CHAIN_LENGTH or not os.path.exists(hashes_file):
+        return create_backup()
+    with open(hashes_file, "rb") as f:
+        parent_hashes = f.read()
+
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    started = time.perf_counter()
+    base = _new_base_name()
+    raw_path = base + ".db.tmp"
+    backup_path = base + ".delta.gz"
+    try:
+        info = _snapshot(raw_path)
+        if info["page_size"] != manifest["page_size"]:
+            os.remove(raw_path)
+            return create_backup()
+        page_size = info["page_size"]
+        raw_sha256 = hashlib.sha256()
+        raw_size = 0
+        hashes = bytearray()
+        changed = 0
+        with open(raw_path, "rb") as src, open(backup_path + ".tmp", "wb") as out:
+            writer = _HashingWriter(out)
+            with gzip.GzipFile(filename="", mode="wb", fileobj=writer, compresslevel=BACKUP_COMPRESS_LEVEL) as gz:
+                for index, page in enumerate(iter(lambda: src.read(page_size), b"")):
+                    raw_sha256.update(page)
+                    raw_size += len(page)
+                    digest = hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+                    hashes += digest
+                    offset = index * PAGE_HASH_SIZE
+                    if parent_hashes[offset:offset + PAGE_HASH_SIZE] != digest:
+                        gz.write(struct.pack(">I", index))
+                        gz.write(page)
+                        changed += 1
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(backup_path + ".tmp", backup_path)
+    finally:
+        for path in (raw_path, backup_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    _finish(backup_path, {
+        "kind": "delta",
+        "base": manifest["base"],
+        "parent": parent['name'],
+        "size": writer.size,
+        "sha256": writer.sha256.hexdigest(),
+        "raw_size": raw_size,
+        "raw_sha256": raw_sha256.hexdigest(),
+        "page_size": page_size,
+        "pages": info["pages"],
+        "changed_pages": changed,
+    }, bytes(hashes), started)
+    # Хэши нужны только последней точке цепочки
+    os.remove(hashes_file)
+    return backup_path
+
+
+# ========== СПИСОК И ОЧИСТКА ==========
+def _backup_files() -> list:
+    files = []
+    for suffix in BACKUP_SUFFIXES:
+        files += glob.glob(os.path.join(BACKUP_DIR, f"backup_*{suffix}"))
+    return files
+
+
+def _describe(path: str) -> dict:
+    return {
+        'path': path,
+        'name': os.path.basename(path),
+        'size': os.path.getsize(path),
+        'mtime': datetime.fromtimestamp(os.path.getmtime(path)),
+        'manifest': _read_manifest(path),
+    }
+
+
+def get_backup_chains() -> list:
+    """
+    Цепочки бекапов: [полный, дельта, дельта, ...], новые цепочки первыми.
+    Старые бекапы без манифеста — цепочки из одного элемента.
+    """
+    items = {}
+    for path in _backup_files():
+        item = _describe(path)
+        items[item['name']] = item
+    chains = {}
+    for name, item in items.items():
+        manifest = item['manifest']
+        base = manifest['base'] if manifest else name
+        chains.setdefault(base, []).append(item)
+    result = []
+    for base, chain in chains.items():
+        if base not in items:
+            # Полный бекап цепочки удалён — дельты восстановить нельзя
+            continue
+        chain.sort(key=lambda b: (b['name'] != base, b['mtime'], b['name']))
+        result.append(chain)
+    result.sort(key=lambda c: c[0]['mtime'], reverse=True)
+    return result
+
+
+def list_backups():
+    """Плоский список для интерфейса: цепочки по порядку, внутри — от полного к последней дельте."""
+    return [item for chain in get_backup_chains() for item in chain]
+
+
+def _remove_files(path: str):
+    for f in (path, _manifest_path(path), _hashes_path(path)):
+        if os.path.exists(f):
+            os.remove(f)
+
+
+def delete_backup(filepath: str):
+    """Удаляет бекап и все дельты, которые от него зависят."""
+    name = os.path.basename(filepath)
+    for chain in get_backup_chains():
+        names = [b['name'] for b in chain]
+        if name in names:
+            # У оставшейся последней точки нет файла хэшей,
+            # поэтому следующий бекап начнёт новую цепочку с полного
+            for item in chain[names.index(name):]:
+                _remove_files(item['path'])
+            return
+    _remove_files(filepath)
+
+
+def cleanup_old_backups(keep_count: int = 7):
+    """Оставляет keep_count последних цепочек (полный бекап + его дельты)."""
+    for chain in get_backup_chains()[keep_count:]:
+        for item in chain:
+            _remove_files(item['path'])
+
+
+def get_backup_chain(filepath: str) -> list:
+    """Элементы цепочки от полного бекапа до filepath включительно."""
+    name = os.path.basename(filepath)
+    for chain in get_backup_chains():
+        names = [b['name'] for b in chain]
+        if name in names:
+            return chain[:names.index(name) + 1]
+    raise BackupError("Бекап не найден")
+
+
+# ========== ВОССТАНОВЛЕНИЕ ==========
+def _check_archive(path: str, manifest: dict):
+    if manifest and _file_sha256(path) != manifest["sha256"]:
+        raise BackupError(f"Контрольная сумма архива {os.path.basename(path)} не совпадает")
+
+
+def _apply_delta(path: str, out, page_size: int):
+    record = struct.calcsize(">I") + page_size
+    with gzip.open(path, "rb") as src:
+        for data in iter(lambda: src.read(record), b""):
+            if len(data) != record:
+                raise BackupError(f"Дельта {os.path.basename(path)} повреждена")
+            index = struct.unpack(">I", data[:4])[0]
+            out.seek(index * page_size)
+            out.write(data[4:])
+
+
+def verify_backup(filepath: str) -> str:
+    """
+    Проверяет контрольные суммы и целостность бекапа. Для дельты база собирается
+    из полного бекапа и всех дельт цепочки до выбранной точки.
+    Возвращает путь к распакованной копии (её нужно удалить после использования).
+    """
+    manifest = _read_manifest(filepath)
+    chain = get_backup_chain(filepath) if manifest else [{'path': filepath, 'manifest': None}]
+    raw_path = DATABASE_NAME + ".restore"
+    try:
+        base = chain[0]
+        _check_archive(base['path'], base['manifest'])
+        opener = gzip.open if base['path'].endswith(".gz") else open
+        with opener(base['path'], "rb") as src, open(raw_path, "wb") as out:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                out.write(chunk)
+        if len(chain) > 1:
+            with open(raw_path, "r+b") as out:
+                for item in chain[1:]:
+                    _check_archive(item['path'], item['manifest'])
+                    _apply_delta(item['path'], out, manifest["page_size"])
+                out.truncate(manifest["pages"] * manifest["page_size"])
+        if manifest and _file_sha256(raw_path) != manifest["raw_sha256"]:
+            raise BackupError("Контрольная сумма базы не совпадает")
+        _check_integrity(raw_path)
+    except Exception:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        raise
+    return raw_path
+
+
+def restore_backup(filepath: str):
+    """
+    Восстанавливает БД из бекапа. Проверенная копия переносится в живую базу
+    через backup API одной транзакцией: открытые соединения не видят
+    промежуточного состояния, а WAL-файл остаётся согласованным.
+    """
+    try:
+        raw_path = verify_backup(filepath)
+    except Exception as e:
+        logger.error(f"Бекап {filepath} не прошёл проверку: {e}")
+        return False
+    try:
+        src = sqlite3.connect(raw_path)
+        dst = sqlite3.connect(DATABASE_NAME, timeout=DB_BUSY_TIMEOUT)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        cache_clear()
+        clear_settings_cache()
+        for kind in RESTORE_RELOAD:
+            cache_bus.apply(kind)
+            cache_bus.publish(kind)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка восстановления бекапа: {e}")
+        return False
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from config import DATABASE_NAME, BACKUP_DIR, SCREENSHOTS_DIR
+
+
+@contextmanager
+def isolated_workdir(prefix: str):
+    """
+    Временный рабочий каталог для бенчмарков, которые наполняют БД, снимают бекапы
+    или пишут скриншоты. DATABASE_NAME, BACKUP_DIR и SCREENSHOTS_DIR — относительные
+    пути, поэтому внутри каталога рабочие файлы не затрагиваются; по выходу каталог удаляется.
+    """
+    paths = (("DATABASE_NAME", DATABASE_NAME), ("BACKUP_DIR", BACKUP_DIR), ("SCREENSHOTS_DIR", SCREENSHOTS_DIR))
+    for name, path in paths:
+        if os.path.isabs(path):
+            raise SystemExit(f"{name}={path} — абсолютный путь, бенчмарк писал бы в рабочие файлы")
+    previous = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(workdir)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+    try:
+        yield workdir
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,102 @@
+# FILE: benchmarks/achievement_bench.py
+"""
+Стоимость одного события ачивок в зависимости от размера истории пользователя.
+Пересчёт — как проверка «по истории»: на каждое событие все счётчики
+считаются агрегатами по покупкам, заказам и играм пользователя, затем
+award_achievement на каждый пройденный порог. Движок — achievement_engine.emit:
+изменение нескольких счётчиков и проверка только их порогов.
+Запуск из корня проекта: python -m benchmarks.achievement_bench --sizes 1000 10000 100000
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import random
+import time
+
+from benchmarks import isolated_workdir
+from achievements import RULES, achievement_engine
+from database import (
+    init_db, get_db_connection, create_user, get_user, award_achievement, ACHIEVEMENT_BACKFILL_QUERIES
+)
+
+
+def fill_history(user_id: int, size: int):
+    """size покупок (с заказами) и size игр казино у одного пользователя."""
+    conn = get_db_connection()
+    conn.execute("DELETE FROM purchase_history")
+    conn.execute("DELETE FROM orders")
+    conn.execute("DELETE FROM games")
+    conn.execute("DELETE FROM user_achievements")
+    conn.execute("DELETE FROM achievement_counters")
+    conn.executemany(
+        """INSERT INTO orders (id, user_id, amount, total_price, discount, status, screenshot_path)
+        VALUES (?, ?, 50, 100, 5, 'approved', 'shot.jpg')""",
+        [(i, user_id) for i in range(1, size + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO purchase_history (user_id, order_id, amount, total_price) VALUES (?, ?, 50, 95)",
+        [(user_id, i) for i in range(1, size + 1)]
+    )
+    conn.executemany(
+        """INSERT INTO games (game_id, user_id, game_type, bet_amount, result, processed)
+        VALUES (?, ?, 'casino_virtual', 10, 'lose', 1)""",
+        [(f"bench-{i}", user_id) for i in range(size)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def rescan_event(user_id: int, _event: tuple):
+    conn = get_db_connection()
+    values = {}
+    for counter, query in ACHIEVEMENT_BACKFILL_QUERIES.items():
+        row = conn.execute(f"SELECT value FROM ({query}) WHERE user_id = ?", (user_id,)).fetchone()
+        values[counter] = row[0] if row else 0
+    conn.close()
+    for code, (counter, threshold) in RULES.items():
+        if values.get(counter, 0) >= threshold:
+            award_achievement(user_id, code)
+
+
+def engine_event(user_id: int, event: tuple):
+    name, data = event
+    achievement_engine.emit(name, user_id=user_id, **data)
+
+
+def measure(play, user_id: int, events: list) -> float:
+    started = time.perf_counter()
+    for event in events:
+        play(user_id, event)
+    return (time.perf_counter() - started) / len(events) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--events", type=int, default=300)
+    args = parser.parse_args()
+
+    with isolated_workdir("achievement_bench_"):
+        init_db()
+        user_id = 1
+        if not get_user(user_id):
+            create_user(user_id, "bench", "Bench")
+        random.seed(1)
+        events = [
+            random.choice([
+                ('order_approved', {'price': 95, 'discount': 5, 'screenshot': True}),
+                ('game_settled', {'game_type': 'casino_virtual', 'won': False}),
+                ('game_settled', {'game_type': 'mines', 'won': random.random() < 1 / 3}),
+            ])
+            for _ in range(args.events)
+        ]
+
+        print(f"{'история':>10} {'пересчёт, мс':>14} {'движок, мс':>12}")
+        for size in args.sizes:
+            fill_history(user_id, size)
+            rescan = measure(rescan_event, user_id, events)
+            engine = measure(engine_event, user_id, events)
+            print(f"{size:>10} {rescan:>14.3f} {engine:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# FILE: benchmarks/assignment_bench.py
+"""
+Симуляция автоназначения: сотни агентов, поток тикетов, закрытия и смены
+дежурства. Сравнивается куча WorkloadIndex с перебором всех агентов
+(что делал бы SELECT ... ORDER BY нагрузка на каждый тикет, только без БД).
+Меряется время выбора агента и равномерность нагрузки.
+Запуск из корня проекта: python -m benchmarks.assignment_bench --agents 500 --tickets 200000
+"""
+import argparse
+import heapq
+import random
+import statistics
+import time
+
+from assignment import WorkloadIndex
+
+SKILLS = ("payments", "stars", "withdrawals", "games", "accounts")
+
+
+class LinearIndex:
+    """Тот же выбор перебором: O(n) на тикет."""
+
+    def __init__(self):
+        self.loads = {}
+        self.skills = {}
+        self.online = set()
+
+    def set_agent(self, agent_id, online, skills=frozenset(), load=None):
+        self.skills[agent_id] = frozenset(skills)
+        if load is not None:
+            self.loads[agent_id] = load
+        self.loads.setdefault(agent_id, 0)
+        (self.online.add if online else self.online.discard)(agent_id)
+
+    def set_load(self, agent_id, load):
+        self.loads[agent_id] = max(0, load)
+
+    def pick(self, skill=None, eligible=None):
+        for wanted in ((skill, None) if skill else (None,)):
+            best = None
+            for agent_id in self.online:
+                if wanted and wanted not in self.skills[agent_id]:
+                    continue
+                if best is None or self.loads[agent_id] < self.loads[best]:
+                    best = agent_id
+            if best is not None:
+                return best
+        return None
+
+
+def simulate(index, args) -> dict:
+    random.seed(1)
+    for agent_id in range(args.agents):
+        skills = frozenset(random.sample(SKILLS, random.randint(0, 2)))
+        index.set_agent(agent_id, random.random() < 0.8, skills)
+    closes = []  # (время закрытия, агент)
+    latencies = []
+    clock = 0.0
+    for _ in range(args.tickets):
+        clock += random.expovariate(args.rate)
+        while closes and closes[0][0] <= clock:
+            _, agent_id = heapq.heappop(closes)
+            index.set_load(agent_id, index.loads[agent_id] - 1)
+        if random.random() < args.churn:
+            agent_id = random.randrange(args.agents)
+            index.set_agent(agent_id, agent_id not in index.online, index.skills[agent_id])
+        skill = random.choice(SKILLS) if random.random() < 0.6 else None
+        started = time.perf_counter()
+        agent_id = index.pick(skill)
+        if agent_id is not None:
+            index.set_load(agent_id, index.loads[agent_id] + 1)
+        latencies.append(time.perf_counter() - started)
+        if agent_id is not None:
+            heapq.heappush(closes, (clock + random.expovariate(1 / args.handle_time), agent_id))
+    online_loads = [index.loads[agent_id] for agent_id in index.online]
+    ordered = sorted(latencies)
+    return {
+        'p50': statistics.median(latencies),
+        'p95': ordered[int(len(ordered) * 0.95)],
+        'total': sum(latencies),
+        'spread': max(online_loads) - min(online_loads) if online_loads else 0,
+        'mean_load': statistics.mean(online_loads) if online_loads else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=500)
+    parser.add_argument("--tickets", type=int, default=200_000)
+    parser.add_argument("--rate", type=float, default=50, help="тикетов в секунду модельного времени")
+    parser.add_argument("--handle-time", type=float, default=120, help="среднее время жизни тикета, с")
+    parser.add_argument("--churn", type=float, default=0.001, help="доля событий «агент взял/сдал смену»")
+    args = parser.parse_args()
+
+    for name, index in (("перебор", LinearIndex()), ("куча", WorkloadIndex())):
+        result = simulate(index, args)
+        print(
+            f"{name:<8} выбор агента: медиана {result['p50'] * 1e6:>7.1f} мкс, p95 {result['p95'] * 1e6:>7.1f} мкс, "
+            f"всего {result['total']:.2f} с | нагрузка в конце: средняя {result['mean_load']:.1f}, "
+            f"разброс {result['spread']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
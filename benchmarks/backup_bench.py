@@ -0,0 +1,91 @@
+# FILE: benchmarks/backup_bench.py
+"""
+Время бекапа и задержка event loop: старая схема (shutil.copy2 прямо в хендлере)
+против backups.create_backup в отдельном потоке.
+Запуск из корня проекта: python -m benchmarks.backup_bench --size-mb 2048
+БД и бекапы создаются во временном каталоге и удаляются после прогона.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import time
+
+from benchmarks import isolated_workdir
+from config import DATABASE_NAME, BACKUP_DIR
+from backups import create_backup
+
+
+def fill_database(size_mb: int):
+    conn = sqlite3.connect(DATABASE_NAME)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS bench_blobs (id INTEGER PRIMARY KEY, payload BLOB)")
+    current = os.path.getsize(DATABASE_NAME) // (1024 * 1024)
+    while current < size_mb:
+        # наполовину сжимаемые данные
+        conn.executemany(
+            "INSERT INTO bench_blobs (payload) VALUES (?)",
+            [(os.urandom(2048) + bytes(2048),) for _ in range(5_000)]
+        )
+        conn.commit()
+        current = os.path.getsize(DATABASE_NAME) // (1024 * 1024)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+async def measure(name: str, coro_factory):
+    """Запускает бекап, параллельно тикая раз в 10 мс и меряя максимальную задержку тика."""
+    max_lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal max_lag
+        while not done:
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.perf_counter() - expected)
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    path = await coro_factory()
+    elapsed = time.perf_counter() - started
+    done = True
+    await tick_task
+    size = os.path.getsize(path) / 1024 / 1024
+    print(f"{name:<22} {elapsed:>7.2f} с | файл {size:>8.1f} МБ | макс. задержка loop {max_lag * 1000:>8.1f} мс")
+    os.remove(path)
+
+
+async def run(size_mb: int):
+    fill_database(size_mb)
+    print(f"БД: {os.path.getsize(DATABASE_NAME) / 1024 / 1024:.0f} МБ")
+
+    async def legacy():
+        path = os.path.join(BACKUP_DIR, "legacy_copy.db")
+        shutil.copy2(DATABASE_NAME, path)
+        return path
+
+    async def online():
+        path = await asyncio.to_thread(create_backup)
+        manifest = path[:-len(".db.gz")] + ".json"
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        return path
+
+    await measure("shutil.copy2 в loop", legacy)
+    await measure("backup API + gzip", online)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк бекапов")
+    parser.add_argument("--size-mb", type=int, default=2048)
+    args = parser.parse_args()
+
+    with isolated_workdir("backup_bench_"):
+        await run(args.size_mb)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
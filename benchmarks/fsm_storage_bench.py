@@ -0,0 +1,90 @@
+# FILE: benchmarks/fsm_storage_bench.py
+"""
+Сравнение MemoryStorage и SQLiteStorage на N одновременных диалогах.
+Запуск из корня проекта: python -m benchmarks.fsm_storage_bench --users 100000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import psutil
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import SQLiteStorage
+
+BOT_ID = 42
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+async def _run(storage, users: int) -> dict:
+    process = psutil.Process(os.getpid())
+    gc.collect()
+    rss_before = process.memory_info().rss
+    tracemalloc.start()
+
+    started = time.perf_counter()
+    for user_id in range(users):
+        key = _key(user_id)
+        await storage.set_state(key, "PurchaseStates:waiting_for_amount")
+        await storage.update_data(key, {"amount": 100 + user_id % 500, "total_price": 160.0})
+    write_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for user_id in range(users):
+        key = _key(user_id)
+        await storage.get_state(key)
+        await storage.get_data(key)
+    read_time = time.perf_counter() - started
+
+    flush_time = 0.0
+    if isinstance(storage, SQLiteStorage):
+        started = time.perf_counter()
+        storage.flush()
+        flush_time = time.perf_counter() - started
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = process.memory_info().rss
+    await storage.close()
+    return {
+        "write_ops": users * 2 / write_time,
+        "read_ops": users * 2 / read_time,
+        "flush_s": flush_time,
+        "peak_mb": peak / 1024 / 1024,
+        "rss_mb": (rss_after - rss_before) / 1024 / 1024,
+    }
+
+
+def _print(name: str, result: dict):
+    print(
+        f"{name:<14} запись: {result['write_ops']:>10.0f} оп/с | чтение: {result['read_ops']:>10.0f} оп/с | "
+        f"сброс: {result['flush_s']:.2f} c | пик: {result['peak_mb']:.1f} МБ | RSS: {result['rss_mb']:.1f} МБ"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк FSM-хранилищ")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--cache-size", type=int, default=10_000, help="размер in-memory слоя SQLiteStorage")
+    args = parser.parse_args()
+
+    _print("MemoryStorage", await _run(MemoryStorage(), args.users))
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(
+            path=os.path.join(tmp, "fsm.db"),
+            flush_interval=3600,
+            cache_size=args.cache_size,
+        )
+        _print("SQLiteStorage", await _run(storage, args.users))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+# FILE: benchmarks/game_settlement_bench.py
+"""
+Раунд игры «Мины» на одном ядре: прежний путь (create_game_record,
+check_game_processed, update_balance, update_game_result — четыре соединения
+и коммита) против settle_game — одна транзакция. Меряется раундов в секунду
+и проверяется, что итоговый баланс одинаковый.
+Запуск из корня проекта: python -m benchmarks.game_settlement_bench --rounds 3000
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import random
+import time
+import uuid
+
+from benchmarks import isolated_workdir
+from config import MINES_GAME_WIN_REWARD, MINES_GAME_LOSE_PENALTY
+from database import (
+    init_db, get_db_connection, create_user, get_user, create_game_record, check_game_processed,
+    update_balance, update_game_result, settle_game
+)
+
+START_BALANCE = 1_000_000
+
+
+def reset():
+    conn = get_db_connection()
+    conn.execute("DELETE FROM games")
+    conn.execute("UPDATE users SET virtual_balance = ?", (START_BALANCE,))
+    conn.commit()
+    conn.close()
+
+
+def old_round(user_id: int, won: bool):
+    game_id = str(uuid.uuid4())
+    create_game_record(game_id, user_id, "mines", 0)
+    if check_game_processed(game_id):
+        return
+    if won:
+        update_balance(user_id, MINES_GAME_WIN_REWARD, 'virtual', 'add')
+        update_game_result(game_id, MINES_GAME_WIN_REWARD, "win")
+    else:
+        update_balance(user_id, MINES_GAME_LOSE_PENALTY, 'virtual', 'subtract')
+        update_game_result(game_id, 0, "lose")
+
+
+def new_round(user_id: int, won: bool):
+    settle_game(
+        str(uuid.uuid4()), user_id, "mines", 0,
+        delta=MINES_GAME_WIN_REWARD if won else -MINES_GAME_LOSE_PENALTY,
+        win_amount=MINES_GAME_WIN_REWARD if won else 0,
+        result="win" if won else "lose"
+    )
+
+
+def run(name: str, play, args):
+    reset()
+    random.seed(1)
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        play(random.randint(1, args.users), random.random() < 1 / 3)
+    elapsed = time.perf_counter() - started
+    total = sum(get_user(user_id)[5] for user_id in range(1, args.users + 1))
+    print(f"{name:<18} {args.rounds / elapsed:>8.0f} раундов/с, сумма балансов {total}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    with isolated_workdir("game_settlement_bench_"):
+        init_db()
+        for user_id in range(1, args.users + 1):
+            if not get_user(user_id):
+                create_user(user_id, f"user{user_id}", f"User {user_id}")
+        run("четыре запроса", old_round, args)
+        run("settle_game", new_round, args)
+
+
+if __name__ == "__main__":
+    main()
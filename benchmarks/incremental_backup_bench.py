@@ -0,0 +1,95 @@
+# FILE: benchmarks/incremental_backup_bench.py
+"""
+Объём бекапов за сутки: полные бекапы против цепочки полный + дельты.
+Между запусками в базе меняется заданная доля строк (как при обычной работе бота).
+Запуск из корня проекта: python -m benchmarks.incremental_backup_bench --size-mb 512 --churn 0.01
+БД и бекапы создаются во временном каталоге и удаляются после прогона.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from benchmarks import isolated_workdir
+from config import DATABASE_NAME, AUTO_BACKUP_INTERVAL_HOURS
+from backups import create_backup, create_incremental_backup, delete_backup, verify_backup
+
+
+def fill_database(size_mb: int):
+    conn = sqlite3.connect(DATABASE_NAME)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS bench_rows (id INTEGER PRIMARY KEY, payload BLOB)")
+    current = os.path.getsize(DATABASE_NAME) // (1024 * 1024)
+    while current < size_mb:
+        conn.executemany(
+            "INSERT INTO bench_rows (payload) VALUES (?)",
+            [(os.urandom(256) + bytes(256),) for _ in range(20_000)]
+        )
+        conn.commit()
+        current = os.path.getsize(DATABASE_NAME) // (1024 * 1024)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def modify(churn: float):
+    """Обновляет долю строк и дописывает немного новых."""
+    conn = sqlite3.connect(DATABASE_NAME)
+    total = conn.execute("SELECT MAX(id) FROM bench_rows").fetchone()[0]
+    count = max(1, int(total * churn))
+    ids = random.sample(range(1, total + 1), count)
+    conn.executemany("UPDATE bench_rows SET payload = ? WHERE id = ?", [(os.urandom(512), i) for i in ids])
+    conn.executemany(
+        "INSERT INTO bench_rows (payload) VALUES (?)",
+        [(os.urandom(256) + bytes(256),) for _ in range(count // 10)]
+    )
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def clear_backups(created: list):
+    """Удаляет только бекапы этого прогона; delete_backup заодно убирает зависящие дельты."""
+    for path in created:
+        if os.path.exists(path):
+            delete_backup(path)
+
+
+def run(name: str, make_backup, runs: int, churn: float, seed: int):
+    random.seed(seed)
+    created = []
+    written = 0
+    elapsed = 0.0
+    last = None
+    for _ in range(runs):
+        modify(churn)
+        started = time.perf_counter()
+        last = make_backup()
+        elapsed += time.perf_counter() - started
+        created.append(last)
+        written += os.path.getsize(last)
+    # Последняя точка должна восстанавливаться
+    raw_path = verify_backup(last)
+    os.remove(raw_path)
+    print(f"{name:<14} запусков {runs:>3} | записано {written / 1024 / 1024:>9.1f} МБ | время {elapsed:>7.2f} с")
+    # Следующий прогон должен начать свою цепочку с полного бекапа
+    clear_backups(created)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--churn", type=float, default=0.01, help="доля строк, меняющихся между бекапами")
+    args = parser.parse_args()
+
+    runs = max(1, 24 // AUTO_BACKUP_INTERVAL_HOURS)
+    with isolated_workdir("incremental_backup_bench_"):
+        fill_database(args.size_mb)
+        print(f"БД: {os.path.getsize(DATABASE_NAME) / 1024 / 1024:.1f} МБ, бекапов в сутки: {runs}, churn {args.churn}")
+        # Одинаковый seed — одинаковая последовательность изменений в обоих прогонах
+        run("полные", create_backup, runs, args.churn, seed=1)
+        run("инкрементные", create_incremental_backup, runs, args.churn, seed=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# FILE: benchmarks/media_pipeline_bench.py
+"""
+Трафик и задержка на одну заявку: старая схема (скачать скриншот, загрузить
+владельцу файлом, загружать заново при каждом просмотре списка заявок)
+против отправки по file_id с архивацией в фоне.
+Работает с настоящим Bot API: нужен BOT_TOKEN из config и чат, куда бот может писать.
+Запуск из корня проекта: python -m benchmarks.media_pipeline_bench --chat-id 123 --image shot.jpg
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from config import BOT_TOKEN
+
+
+async def old_pipeline(bot: Bot, chat_id: int, file_id: str, views: int, path: str):
+    """Возвращает (задержка до уведомления владельца, байт передано за заявку)."""
+    size = 0
+    started = time.perf_counter()
+    file_info = await bot.get_file(file_id)
+    await bot.download_file(file_info.file_path, path)
+    size += os.path.getsize(path)
+    await bot.send_photo(chat_id, FSInputFile(path), caption="old: владелец")
+    size += os.path.getsize(path)
+    latency = time.perf_counter() - started
+    for _ in range(views):
+        await bot.send_photo(chat_id, FSInputFile(path), caption="old: список заявок")
+        size += os.path.getsize(path)
+    return latency, size
+
+
+async def new_pipeline(bot: Bot, chat_id: int, file_id: str, views: int):
+    size = 0
+    started = time.perf_counter()
+    await bot.send_photo(chat_id, file_id, caption="new: владелец")
+    latency = time.perf_counter() - started
+    for _ in range(views):
+        await bot.send_photo(chat_id, file_id, caption="new: список заявок")
+    # Архивация на диск — вне пути обработки заявки, но трафик учитываем
+    buffer = await bot.download(file_id)
+    size += len(buffer.getvalue())
+    return latency, size
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--image", required=True, help="пример скриншота")
+    parser.add_argument("--orders", type=int, default=10)
+    parser.add_argument("--views", type=int, default=2, help="сколько раз заявку открывают в списке")
+    args = parser.parse_args()
+
+    bot = Bot(token=BOT_TOKEN)
+    tmp_path = "media_bench.tmp.jpg"
+    try:
+        # Скриншот «от пользователя»: загружаем один раз, чтобы получить file_id
+        message = await bot.send_photo(args.chat_id, FSInputFile(args.image), caption="исходный скриншот")
+        file_id = message.photo[-1].file_id
+
+        for name, run in (
+            ("скачать + загрузить", lambda: old_pipeline(bot, args.chat_id, file_id, args.views, tmp_path)),
+            ("по file_id", lambda: new_pipeline(bot, args.chat_id, file_id, args.views)),
+        ):
+            latencies = []
+            sizes = []
+            for _ in range(args.orders):
+                latency, size = await run()
+                latencies.append(latency)
+                sizes.append(size)
+            print(
+                f"{name:<20} до владельца: медиана {statistics.median(latencies) * 1000:>7.0f} мс, "
+                f"макс {max(latencies) * 1000:>7.0f} мс | трафик на заявку {statistics.mean(sizes) / 1024:>8.1f} КБ"
+            )
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+# FILE: benchmarks/outbox_latency_bench.py
+"""
+Задержка обработчика с уведомлением: отправка прямо в обработчике
+против записи в outbox в той же транзакции и доставки фоновой задачей.
+Работает с настоящим Bot API: нужен BOT_TOKEN из config и чат, куда бот может писать.
+Запуск из корня проекта: python -m benchmarks.outbox_latency_bench --chat-id 123 --events 50
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiogram import Bot
+
+from benchmarks import isolated_workdir
+import outbox
+from config import BOT_TOKEN
+from database import init_db, get_db_connection, enqueue_notifications
+
+
+def write_event(index: int, notifications: list = None):
+    """Изменение «заявки», как в обычном обработчике: одна транзакция."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS bench_events (id INTEGER PRIMARY KEY, payload TEXT)")
+    cursor.execute("INSERT INTO bench_events (payload) VALUES (?)", (f"событие {index}",))
+    enqueue_notifications(cursor, notifications)
+    conn.commit()
+    conn.close()
+
+
+async def handler_inline(bot: Bot, chat_id: int, index: int):
+    write_event(index)
+    await bot.send_message(chat_id, f"inline: событие {index}")
+
+
+async def handler_outbox(bot: Bot, chat_id: int, index: int):
+    write_event(index, [outbox.notification(chat_id, f"outbox: событие {index}")])
+    outbox.wake()
+
+
+def report(name: str, latencies: list):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:<10} обработчик: медиана {statistics.median(latencies) * 1000:>7.1f} мс, "
+        f"p95 {p95 * 1000:>7.1f} мс, макс {max(latencies) * 1000:>7.1f} мс"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--events", type=int, default=50)
+    args = parser.parse_args()
+
+    with isolated_workdir("outbox_latency_bench_"):
+        init_db()
+        bot = Bot(token=BOT_TOKEN)
+        try:
+            for name, handler in (("без outbox", handler_inline), ("outbox", handler_outbox)):
+                latencies = []
+                for index in range(args.events):
+                    started = time.perf_counter()
+                    await handler(bot, args.chat_id, index)
+                    latencies.append(time.perf_counter() - started)
+                report(name, latencies)
+
+            # Доставка накопленного — то, что в боте делает задача планировщика
+            started = time.perf_counter()
+            await outbox.deliver(bot)
+            elapsed = time.perf_counter() - started
+            stats = outbox.stats()
+            print(
+                f"доставка outbox: {stats['sent']} сообщений за {elapsed:.2f} с, "
+                f"от записи до доставки p50 {stats['delay_p50']:.2f} с, p95 {stats['delay_p95']:.2f} с, "
+                f"не доставлено {stats['failed']}"
+            )
+        finally:
+            await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+# FILE: benchmarks/promocode_stress.py
+"""
+Одновременное использование промокода с лимитом: --redemptions заявок от разных
+пользователей в --threads потоках, стартующих разом. Прежний путь (SELECT
+«уже использовал», затем UPDATE used_count без проверки результата и запись
+использования) против promo_service.claim. Считается, сколько заявок получили
+скидку, used_count и записи used_promocodes; у claim скидок ровно max_uses.
+Затем — стоимость проверки промокода при вводе при --history записях
+used_promocodes: прежняя check_promocode_valid против promo_service.check.
+Запуск из корня проекта: python -m benchmarks.promocode_stress --redemptions 1000 --max-uses 100
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import isolated_workdir
+from database import init_db, get_db_connection, create_order, get_promocode
+from promocodes import promo_service
+
+CODE = "STRESS"
+
+
+def old_use(user_id: int, promocode_id: int, order_id: int) -> bool:
+    """Прежняя use_promocode."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT * FROM used_promocodes WHERE user_id = ? AND promocode_id = ?",
+            (user_id, promocode_id)
+        )
+        if cursor.fetchone():
+            return False
+        cursor.execute(
+            "UPDATE promocodes SET used_count = used_count + 1 WHERE id = ? AND (max_uses = 0 OR used_count < max_uses)",
+            (promocode_id,)
+        )
+        cursor.execute(
+            "INSERT INTO used_promocodes (user_id, promocode_id, order_id) VALUES (?, ?, ?)",
+            (user_id, promocode_id, order_id)
+        )
+        cursor.execute("SELECT discount_percent FROM promocodes WHERE id = ?", (promocode_id,))
+        discount_percent = cursor.fetchone()[0]
+        cursor.execute(
+            "UPDATE orders SET promocode_id = ?, discount = total_price * ? / 100 WHERE id = ?",
+            (promocode_id, discount_percent, order_id)
+        )
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def old_check(code: str, user_id: int):
+    """Прежняя check_promocode_valid без разбора даты: две выборки в двух соединениях."""
+    promocode = get_promocode(code)
+    if not promocode:
+        return False, "Промокод не найден"
+    promocode_id, _, discount_percent, max_uses, used_count, _, _ = promocode
+    if max_uses > 0 and used_count >= max_uses:
+        return False, "Промокод уже использован максимальное количество раз"
+    conn = get_db_connection()
+    try:
+        if conn.execute(
+            "SELECT * FROM used_promocodes WHERE user_id = ? AND promocode_id = ?", (user_id, promocode_id)
+        ).fetchone():
+            return False, "Вы уже использовали этот промокод"
+    finally:
+        conn.close()
+    return True, discount_percent
+
+
+def reset(max_uses: int, redemptions: int) -> list:
+    conn = get_db_connection()
+    conn.execute("DELETE FROM used_promocodes")
+    conn.execute("DELETE FROM orders")
+    conn.execute("DELETE FROM promocodes")
+    conn.commit()
+    conn.close()
+    promo_service.create(CODE, 10, max_uses)
+    return [create_order(user_id, 100, "@bench", None) for user_id in range(1, redemptions + 1)]
+
+
+def stress(name: str, redeem, args):
+    orders = reset(args.max_uses, args.redemptions)
+    promo_id = promo_service.get(CODE).id
+    barrier = threading.Barrier(args.threads)
+
+    def worker(part: list):
+        barrier.wait()
+        for user_id, order_id in part:
+            redeem(user_id, promo_id, order_id)
+
+    jobs = list(enumerate(orders, start=1))
+    parts = [jobs[i::args.threads] for i in range(args.threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(worker, parts))
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection()
+    discounted = conn.execute("SELECT COUNT(*) FROM orders WHERE discount > 0").fetchone()[0]
+    used_rows = conn.execute("SELECT COUNT(*) FROM used_promocodes").fetchone()[0]
+    used_count = conn.execute("SELECT used_count FROM promocodes WHERE code = ?", (CODE,)).fetchone()[0]
+    conn.close()
+    print(f"{name:<8} скидок {discounted:>5}, used_count {used_count:>4}, записей {used_rows:>5}, "
+          f"лимит {args.max_uses}, {args.redemptions / elapsed:>6.0f} заявок/с")
+
+
+def check_latency(args):
+    reset(0, 0)
+    promo_id = promo_service.get(CODE).id
+    conn = get_db_connection()
+    conn.execute("DROP INDEX IF EXISTS idx_used_promocodes_user")
+    conn.executemany(
+        "INSERT INTO used_promocodes (user_id, promocode_id) VALUES (?, ?)",
+        [(user_id, promo_id) for user_id in range(1_000_000, 1_000_000 + args.history)]
+    )
+    conn.commit()
+    conn.close()
+    rounds = 200
+    started = time.perf_counter()
+    for user_id in range(rounds):
+        old_check(CODE, user_id)
+    old = (time.perf_counter() - started) / rounds * 1000
+    # Индекс, с которым работает бот
+    init_db()
+    started = time.perf_counter()
+    for user_id in range(rounds):
+        promo_service.check(CODE, user_id)
+    new = (time.perf_counter() - started) / rounds * 1000
+    print(f"проверка при вводе, {args.history} использований: прежняя {old:.3f} мс, promo_service {new:.3f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redemptions", type=int, default=1000)
+    parser.add_argument("--max-uses", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--history", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with isolated_workdir("promocode_stress_"):
+        init_db()
+        stress("прежний", old_use, args)
+        stress("claim", lambda user_id, promo_id, order_id: promo_service.claim(CODE, user_id, order_id), args)
+        check_latency(args)
+
+
+if __name__ == "__main__":
+    main()
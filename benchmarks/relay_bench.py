@@ -0,0 +1,138 @@
+# FILE: benchmarks/relay_bench.py
+"""
+Пересылка ответов поддержки пользователям через outbox: задержка от записи
+в очередь до доставки по типу сообщения. Альбом копируется либо по частям
+(copy_message на каждую), либо одним copy_messages. Telegram не вызывается —
+бот-заглушка отвечает с задержкой --rtt-ms, запросы проходят через
+SendScheduler, поэтому лимит ~1 сообщение в секунду на личный чат настоящий.
+Запуск из корня проекта: python -m benchmarks.relay_bench --users 10 --album 5
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks import isolated_workdir
+import outbox
+from database import init_db, get_db_connection, add_notifications
+from send_scheduler import SendScheduler
+
+SUPPORT_CHAT = 500  # личка агента, из которой копируются сообщения
+MESSAGES = ('text', 'photo', 'video', 'voice', 'sticker')
+
+
+class FakeMessage:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+
+
+def _method(name: str):
+    def __init__(self, chat_id, **kwargs):
+        self.chat_id = chat_id
+    return type(name, (), {'__init__': __init__})
+
+
+class FakeBot:
+    """Заглушка бота: методы, которые вызывает outbox._send, с задержкой сети и лимитами SendScheduler."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.middleware = SendScheduler()
+        self.calls = 0
+        self.next_id = 1000
+
+    async def _request(self, name: str, chat_id: int, count: int = 1):
+        async def make_request(bot, method):
+            await asyncio.sleep(self.rtt)
+            return True
+        await self.middleware(make_request, self, _method(name)(chat_id))
+        self.calls += 1
+        self.next_id += count
+        return [FakeMessage(self.next_id - index) for index in range(count)]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return (await self._request('SendMessage', chat_id))[0]
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        return (await self._request('CopyMessage', chat_id))[0]
+
+    async def copy_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        return await self._request('CopyMessages', chat_id, len(message_ids))
+
+
+def enqueue(users: int, album: int, batched: bool):
+    notifications = []
+    source_id = 1
+    for user_id in range(1, users + 1):
+        ticket_id = user_id
+        for kind in MESSAGES:
+            method = None if kind == 'text' else 'copy'
+            notifications.append(outbox.notification(
+                user_id, f"📩 Ответ в тикете #{ticket_id}" if kind in ('text', 'photo', 'video', 'voice') else None,
+                media_type=method, relay=(ticket_id, kind, SUPPORT_CHAT, [source_id], None)
+            ))
+            source_id += 1
+        parts = list(range(source_id, source_id + album))
+        source_id += album
+        if batched:
+            notifications.append(outbox.notification(
+                user_id, media_type='copy', relay=(ticket_id, 'album', SUPPORT_CHAT, parts, None)
+            ))
+        else:
+            notifications.extend(
+                outbox.notification(user_id, media_type='copy', relay=(ticket_id, 'album', SUPPORT_CHAT, [part], None))
+                for part in parts
+            )
+    add_notifications(notifications)
+
+
+async def run(batched: bool, args) -> tuple:
+    conn = get_db_connection()
+    conn.execute("DELETE FROM outbox")
+    conn.execute("DELETE FROM outbox_relay")
+    conn.execute("DELETE FROM ticket_message_links")
+    conn.commit()
+    conn.close()
+    outbox._relay_delays.clear()
+    bot = FakeBot(args.rtt_ms / 1000)
+    started = time.perf_counter()
+    enqueue(args.users, args.album, batched)
+    while await outbox.deliver(bot):
+        pass
+    elapsed = time.perf_counter() - started
+    conn = get_db_connection()
+    links = conn.execute("SELECT COUNT(*) FROM ticket_message_links").fetchone()[0]
+    conn.close()
+    return {kind: list(delays) for kind, delays in outbox._relay_delays.items()}, bot.calls, elapsed, links
+
+
+def report(name: str, result: tuple, album: int):
+    delays, calls, elapsed, links = result
+    print(f"{name}: запросов {calls}, всё доставлено за {elapsed:.1f} с, связей сообщений {links // 2}")
+    for kind in (*MESSAGES, 'album'):
+        values = sorted(delays.get(kind, []))
+        if kind == 'album' and len(values) > 0 and name.startswith("по частям"):
+            # Альбом доставлен, когда доставлена его последняя часть
+            values = sorted(max(values[i:i + album]) for i in range(0, len(values), album))
+        if not values:
+            continue
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"  {kind:<8} медиана {statistics.median(values):>6.2f} с, p95 {p95:>6.2f} с")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10, help="пользователей, каждому — по сообщению каждого типа и альбом")
+    parser.add_argument("--album", type=int, default=5, help="частей в альбоме")
+    parser.add_argument("--rtt-ms", type=float, default=60)
+    args = parser.parse_args()
+
+    with isolated_workdir("relay_bench_"):
+        init_db()
+        report("по частям (copy_message)", await run(False, args), args.album)
+        report("альбом целиком (copy_messages)", await run(True, args), args.album)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+# FILE: benchmarks/screenshot_cleanup_bench.py
+"""
+Время очистки скриншотов: старый обход плоской папки (listdir + stat каждого файла)
+против удаления по индексу screenshots.created_at.
+Запуск из корня проекта: python -m benchmarks.screenshot_cleanup_bench --files 1000000
+БД и SCREENSHOTS_DIR создаются во временном каталоге и удаляются после прогона.
+"""
+import argparse
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import isolated_workdir
+from config import SCREENSHOTS_DIR
+from database import init_db, get_db_connection, set_setting
+from screenshots import cleanup_expired_screenshots
+
+PAYLOAD = b"\xff\xd8" + bytes(510)
+
+
+def legacy_cleanup(directory: str, days: int) -> int:
+    """Копия прежней helpers.cleanup_old_screenshots."""
+    cutoff = datetime.now() - timedelta(days=days)
+    count = 0
+    for filename in os.listdir(directory):
+        filepath = os.path.join(directory, filename)
+        if os.path.isfile(filepath):
+            mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
+            if mtime < cutoff:
+                os.remove(filepath)
+                count += 1
+    return count
+
+
+def make_flat(directory: str, files: int, expired_every: int, days: int):
+    os.makedirs(directory, exist_ok=True)
+    old = time.time() - (days + 1) * 86400
+    for i in range(files):
+        path = os.path.join(directory, f"{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(PAYLOAD)
+        if i % expired_every == 0:
+            os.utime(path, (old, old))
+
+
+def make_indexed(files: int, expired_every: int, days: int):
+    """Файлы по папкам дат за последние days дней, каждый expired_every-й — просрочен."""
+    init_db()
+    set_setting('screenshots_indexed', '1')
+    now = datetime.utcnow()
+    conn = get_db_connection()
+    rows = []
+    for i in range(files):
+        if i % expired_every == 0:
+            moment = now - timedelta(days=days + 1 + i % 30)
+        else:
+            moment = now - timedelta(days=i % days)
+        shard = os.path.join(SCREENSHOTS_DIR, moment.strftime('%Y'), moment.strftime('%m'), moment.strftime('%d'))
+        os.makedirs(shard, exist_ok=True)
+        path = os.path.join(shard, f"{i:064x}.jpg")
+        with open(path, "wb") as f:
+            f.write(PAYLOAD)
+        rows.append((path, f"{i:064x}", len(PAYLOAD), moment.strftime('%Y-%m-%d %H:%M:%S')))
+        if len(rows) >= 50_000:
+            conn.executemany("INSERT INTO screenshots (path, sha256, size, created_at) VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+            rows = []
+    if rows:
+        conn.executemany("INSERT INTO screenshots (path, sha256, size, created_at) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    conn.close()
+
+
+def run(args):
+    flat_dir = SCREENSHOTS_DIR + "_flat"
+    print(f"Файлов: {args.files}, просрочено: {args.files // args.expired_every}")
+
+    make_flat(flat_dir, args.files, args.expired_every, args.days)
+    started = time.perf_counter()
+    deleted = legacy_cleanup(flat_dir, args.days)
+    print(f"listdir + stat   {time.perf_counter() - started:>8.2f} с | удалено {deleted}")
+    started = time.perf_counter()
+    legacy_cleanup(flat_dir, args.days)
+    print(f"  повторный      {time.perf_counter() - started:>8.2f} с (удалять нечего)")
+    shutil.rmtree(flat_dir)
+
+    make_indexed(args.files, args.expired_every, args.days)
+    started = time.perf_counter()
+    deleted = cleanup_expired_screenshots(args.days)
+    print(f"индекс по дате   {time.perf_counter() - started:>8.2f} с | удалено {deleted}")
+    started = time.perf_counter()
+    cleanup_expired_screenshots(args.days)
+    print(f"  повторный      {time.perf_counter() - started:>8.2f} с (удалять нечего)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--expired-every", type=int, default=100, help="каждый N-й файл старше срока хранения")
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    with isolated_workdir("screenshot_cleanup_bench_"):
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
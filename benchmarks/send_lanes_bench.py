@@ -0,0 +1,75 @@
+# FILE: benchmarks/send_lanes_bench.py
+"""
+Ожидание ответов пользователям во время рассылки: одна общая очередь
+против полос приоритета send_scheduler. Telegram не вызывается — запросы
+проходят через middleware и «отправляются» с задержкой --rtt-ms, поэтому
+меряется только очередь на лимитах.
+Запуск из корня проекта: python -m benchmarks.send_lanes_bench --broadcast 600 --users 40
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from aiogram.methods import SendMessage
+
+import send_scheduler
+from send_scheduler import SendScheduler
+
+
+async def run(lanes: bool, args) -> tuple:
+    middleware = SendScheduler()
+    rtt = args.rtt_ms / 1000
+
+    async def make_request(bot, method):
+        await asyncio.sleep(rtt)
+        return True
+
+    async def broadcast():
+        if lanes:
+            send_scheduler.set_lane('broadcast')
+        started = time.perf_counter()
+        for user_id in range(1_000_000, 1_000_000 + args.broadcast):
+            await middleware(make_request, None, SendMessage(chat_id=user_id, text="рассылка"))
+        return time.perf_counter() - started
+
+    async def user(user_id: int, waits: list):
+        # Пользователь нажимает кнопки с паузами, на каждое нажатие — один ответ
+        for _ in range(args.clicks):
+            await asyncio.sleep(random.uniform(0.5, 2.0))
+            started = time.perf_counter()
+            await middleware(make_request, None, SendMessage(chat_id=user_id, text="ответ"))
+            waits.append(time.perf_counter() - started - rtt)
+
+    waits = []
+    # Рассылка шлёт сообщения параллельно несколькими задачами, как при нескольких рассылках сразу
+    tasks = [asyncio.create_task(broadcast()) for _ in range(args.parallel)]
+    await asyncio.sleep(0.5)
+    await asyncio.gather(*[user(user_id, waits) for user_id in range(1, args.users + 1)])
+    durations = await asyncio.gather(*tasks)
+    return waits, max(durations)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--broadcast", type=int, default=600, help="сообщений рассылки на одну задачу")
+    parser.add_argument("--parallel", type=int, default=4, help="параллельных задач рассылки")
+    parser.add_argument("--users", type=int, default=40, help="активных пользователей")
+    parser.add_argument("--clicks", type=int, default=10, help="нажатий на пользователя")
+    parser.add_argument("--rtt-ms", type=float, default=60)
+    args = parser.parse_args()
+
+    for name, lanes in (("одна очередь", False), ("полосы", True)):
+        random.seed(1)
+        waits, duration = await run(lanes, args)
+        ordered = sorted(waits)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(
+            f"{name:<14} ожидание ответа: медиана {statistics.median(waits) * 1000:>7.0f} мс, "
+            f"p95 {p95 * 1000:>7.0f} мс, макс {max(waits) * 1000:>7.0f} мс | рассылка {duration:>6.1f} с"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+# FILE: benchmarks/ticket_search_bench.py
+"""
+Поиск по переписке тикетов: FTS5 (search_tickets_text) против LIKE '%…%'.
+Заполняет БД синтетическими сообщениями, печатает размер индекса и задержку
+запросов. Заполнение идёт через обычные INSERT, поэтому индекс обновляют
+те же триггеры, что и в боте.
+Запуск из корня проекта: python -m benchmarks.ticket_search_bench --messages 5000000
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from benchmarks import isolated_workdir
+from config import DATABASE_NAME
+from database import init_db, get_db_connection, search_tickets_text
+
+BASE_WORDS = (
+    "оплата заказ звёзды вывод карта перевод не пришли баланс ошибка возврат "
+    "промокод обмен скриншот ожидание модератор аккаунт пополнение комиссия "
+    "telegram premium подарок доставка отмена сумма рубли сбербанк тинькофф"
+).split()
+# Частые слова встречаются почти в каждом сообщении, редкие (вроде номеров заказов) — единожды
+RARE_WORDS = [f"{word}{n}" for n in range(2000) for word in ("заказ", "чек", "id")]
+QUERIES = ["возврат", "не пришли звёзды", "промокод ошибка", "тинькофф перевод", "чек1234", "заказ77 оплата"]
+
+
+def make_message() -> str:
+    words = random.choices(BASE_WORDS, k=random.randint(4, 16))
+    if random.random() < 0.3:
+        words.append(random.choice(RARE_WORDS))
+    return " ".join(words)
+
+def fill(messages: int, per_ticket: int):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM ticket_messages")
+    have = cursor.fetchone()[0]
+    if have >= messages:
+        conn.close()
+        return
+    random.seed(1)
+    started = time.perf_counter()
+    batch = []
+    ticket_id = None
+    for index in range(have, messages):
+        if ticket_id is None or index % per_ticket == 0:
+            cursor.execute(
+                "INSERT INTO tickets (user_id, subject, status, priority) VALUES (?, ?, ?, '🟢')",
+                (1000 + index % 5000, " ".join(random.choices(BASE_WORDS, k=3)), random.choice(("open", "closed")))
+            )
+            ticket_id = cursor.lastrowid
+        batch.append((ticket_id, 1000 + index % 5000, make_message(), 0))
+        if len(batch) >= 10000:
+            cursor.executemany(
+                "INSERT INTO ticket_messages (ticket_id, user_id, message, is_from_support) VALUES (?, ?, ?, ?)", batch
+            )
+            conn.commit()
+            batch.clear()
+            print(f"\rзаписано {index + 1}/{messages}", end="", flush=True)
+    if batch:
+        cursor.executemany(
+            "INSERT INTO ticket_messages (ticket_id, user_id, message, is_from_support) VALUES (?, ?, ?, ?)", batch
+        )
+        conn.commit()
+    conn.close()
+    print(f"\rзаписано {messages} сообщений за {time.perf_counter() - started:.0f} с")
+
+
+def index_size() -> int:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE '%_fts%'")
+        size = cursor.fetchone()[0] or 0
+    except Exception:
+        size = 0  # sqlite собран без dbstat
+    conn.close()
+    return size
+
+
+def search_like(query: str, limit: int):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT t.id, t.subject, t.status, t.priority, tm.message, 0
+        FROM ticket_messages tm JOIN tickets t ON t.id = tm.ticket_id
+        WHERE tm.message LIKE ?
+        ORDER BY tm.id DESC LIMIT ?
+    """, (f"%{query}%", limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def measure(name: str, search, repeat: int, limit: int):
+    latencies = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            started = time.perf_counter()
+            search(query, limit)
+            latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<6} медиана {statistics.median(latencies) * 1000:>8.1f} мс, p95 {p95 * 1000:>8.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5_000_000)
+    parser.add_argument("--per-ticket", type=int, default=20, help="сообщений в одном тикете")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=6, help="строк на запрос, как страница в боте")
+    args = parser.parse_args()
+
+    with isolated_workdir("ticket_search_bench_"):
+        init_db()
+        fill(args.messages, args.per_ticket)
+        print(f"БД {os.path.getsize(DATABASE_NAME) / 2**20:.0f} МБ, индекс FTS {index_size() / 2**20:.0f} МБ")
+        measure("FTS5", search_tickets_text, args.repeat, args.limit)
+        measure("LIKE", search_like, args.repeat, args.limit)
+
+
+if __name__ == "__main__":
+    main()
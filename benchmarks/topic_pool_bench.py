@@ -0,0 +1,143 @@
+# FILE: benchmarks/topic_pool_bench.py
+"""
+Время создания тикета глазами пользователя: тема создаётся на месте против
+резерва topic_pool. Telegram не вызывается — бот-заглушка отвечает с задержкой
+--rtt-ms, а запросы проходят через SendScheduler, поэтому служебные сообщения
+в группе (создание темы, первое сообщение тикета) ждут лимита группы.
+Тикеты приходят пачками (--burst тикетов за --burst-seconds раз в --gap минут),
+время ускорено в --speed раз; результаты — в модельных секундах.
+Запуск из корня проекта: python -m benchmarks.topic_pool_bench --rounds 5 --burst 6
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from benchmarks import isolated_workdir
+import send_scheduler
+import topic_pool
+from config import (
+    TICKET_GROUP_ID, SEND_GROUP_RATE, SEND_GROUP_BURST, SEND_CHAT_RATE, TOPIC_POOL_REFILL_INTERVAL, TOPIC_POOL_SIZE
+)
+from database import init_db, get_db_connection
+from scheduler import scheduler
+from send_scheduler import SendScheduler
+
+
+class FakeTopic:
+    def __init__(self, message_thread_id: int):
+        self.message_thread_id = message_thread_id
+
+
+def _method(name: str):
+    """Запрос для middleware: SendScheduler смотрит только на имя класса и chat_id."""
+    def __init__(self, chat_id, **kwargs):
+        self.chat_id = chat_id
+    return type(name, (), {'__init__': __init__})
+
+
+CreateForumTopic = _method('CreateForumTopic')
+EditForumTopic = _method('EditForumTopic')
+SendMessage = _method('SendMessage')
+
+
+class FakeBot:
+    def __init__(self, speed: float, rtt: float):
+        self.speed = speed
+        self.rtt = rtt
+        self.next_topic = 1
+        # Лимиты ускорены вместе с модельным временем
+        self.middleware = SendScheduler()
+        self.middleware._group_rate = SEND_GROUP_RATE * speed
+        self.middleware._chat_rate = SEND_CHAT_RATE * speed
+        self.middleware._gate.bucket.rate *= speed
+        send_scheduler.send_scheduler = self.middleware
+
+    async def _make_request(self, bot, method):
+        await asyncio.sleep(self.rtt / self.speed)
+        if isinstance(method, CreateForumTopic):
+            self.next_topic += 1
+            return FakeTopic(self.next_topic)
+        return True
+
+    async def create_forum_topic(self, chat_id, name):
+        return await self.middleware(self._make_request, self, CreateForumTopic(chat_id))
+
+    async def edit_forum_topic(self, chat_id, message_thread_id, name):
+        return await self.middleware(self._make_request, self, EditForumTopic(chat_id))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self.middleware(self._make_request, self, SendMessage(chat_id))
+
+
+async def create_ticket(bot: FakeBot, ticket_id: int, latencies: list):
+    """Как process_ticket_message: тема, первое сообщение в теме, подтверждение пользователю."""
+    started = time.perf_counter()
+    topic_id, _ = await topic_pool.open_topic(bot, f"#{ticket_id} | Пользователь | Вопрос")
+    await bot.send_message(TICKET_GROUP_ID, f"🆕 Тикет #{ticket_id}", message_thread_id=topic_id)
+    await bot.send_message(ticket_id, f"✅ Тикет #{ticket_id} успешно создан!")
+    latencies.append((time.perf_counter() - started) * bot.speed)
+
+
+async def run(pool_size: int, args) -> list:
+    conn = get_db_connection()
+    conn.execute("DELETE FROM forum_topic_pool")
+    conn.commit()
+    conn.close()
+    topic_pool.TOPIC_POOL_SIZE = pool_size
+    bot = FakeBot(args.speed, args.rtt_ms / 1000)
+    scheduler.jobs.clear()
+    scheduler.register(topic_pool.JOB_NAME, lambda: topic_pool.refill(bot),
+                       interval=TOPIC_POOL_REFILL_INTERVAL / args.speed, jitter=0)
+    scheduler.start()
+    if pool_size:
+        # Резерв успевает заполниться до первых тикетов, как после запуска бота
+        scheduler.trigger(topic_pool.JOB_NAME)
+        await asyncio.sleep(args.warmup / args.speed)
+
+    latencies = []
+    tasks = []
+    ticket_id = 1
+    for _ in range(args.rounds):
+        for _ in range(args.burst):
+            await asyncio.sleep(random.uniform(0, args.burst_seconds / args.burst) / args.speed)
+            tasks.append(asyncio.create_task(create_ticket(bot, ticket_id, latencies)))
+            ticket_id += 1
+        await asyncio.sleep(args.gap * 60 / args.speed)
+    await asyncio.gather(*tasks)
+    await scheduler.stop()
+    return latencies
+
+
+def report(name: str, latencies: list):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<14} тикетов {len(latencies)}: медиана {statistics.median(latencies):.2f} с, "
+          f"p95 {p95:.2f} с, макс. {ordered[-1]:.2f} с")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5, help="пачек тикетов")
+    parser.add_argument("--burst", type=int, default=6, help="тикетов в пачке")
+    parser.add_argument("--burst-seconds", type=float, default=10, help="за сколько секунд приходит пачка")
+    parser.add_argument("--gap", type=float, default=3, help="минут между пачками")
+    parser.add_argument("--pool", type=int, default=TOPIC_POOL_SIZE, help="размер резерва")
+    parser.add_argument("--warmup", type=float, default=120, help="секунд на заполнение резерва перед тикетами")
+    parser.add_argument("--rtt-ms", type=float, default=150)
+    parser.add_argument("--speed", type=float, default=60, help="ускорение модельного времени")
+    args = parser.parse_args()
+
+    with isolated_workdir("topic_pool_bench_"):
+        init_db()
+        random.seed(1)
+        report("на месте", await run(0, args))
+        random.seed(1)
+        report(f"резерв {args.pool}", await run(args.pool, args))
+        print(f"лимит группы {SEND_GROUP_RATE * 60:.0f} в минуту, пачка до {SEND_GROUP_BURST}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
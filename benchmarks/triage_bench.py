@@ -0,0 +1,104 @@
+# FILE: benchmarks/triage_bench.py
+"""
+Разбор текста тикета: прежние циклы any(word in text) по спискам слов против
+triage_engine, где все правила собраны в одно выражение. Сравнивается на
+трёх исходных правилах и на наборе из --rules правил (как после того, как
+поддержка наполнит таблицу), на длинных сообщениях.
+Запуск из корня проекта: python -m benchmarks.triage_bench --length 4000 --rules 200
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import isolated_workdir
+from database import init_db, get_db_connection, add_triage_rule
+from triage import triage_engine
+
+FILLER = (
+    "здравствуйте оплатил заказ вчера вечером через карту деньги списались "
+    "подскажите пожалуйста что делать дальше жду ответа спасибо заранее"
+).split()
+
+
+def legacy_rules(extra_rules: list) -> list:
+    """Прежняя логика: список (приоритет, слова), проверяется по порядку."""
+    return [
+        ("⚫", ["бот не работает", "не отвечает", "сломался"]),
+        ("🔴", ["не пришли", "не получил", "нет звёзд"]),
+        ("🟡", ["ошибка", "проблема", "баг"]),
+    ] + extra_rules
+
+
+def legacy_priority(rules: list, text: str) -> str:
+    text_lower = text.lower()
+    for priority, words in rules:
+        if any(word in text_lower for word in words):
+            return priority
+    return "🟢"
+
+
+def make_text(length: int, hit: str = None) -> str:
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(random.choice(FILLER))
+    if hit:
+        words.insert(random.randrange(len(words)), hit)
+    return " ".join(words)
+
+
+def measure(name: str, func, texts: list, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        for text in texts:
+            started = time.perf_counter()
+            func(text)
+            latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"  {name:<10} медиана {statistics.median(latencies) * 1e6:>8.1f} мкс, p95 {p95 * 1e6:>8.1f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--length", type=int, default=4000, help="символов в сообщении (лимит Telegram — 4096)")
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--rules", type=int, default=200, help="правил во втором прогоне")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with isolated_workdir("triage_bench_"):
+        init_db()
+        conn = get_db_connection()
+        conn.execute("DELETE FROM triage_rules WHERE id > 3")
+        conn.commit()
+        conn.close()
+        triage_engine.load()
+
+        # Четверть сообщений без совпадений — худший случай для обоих способов
+        texts = [make_text(args.length, random.choice(["не пришли", "баг", "сломался", None])) for _ in range(args.texts)]
+        print(f"3 правила, {args.texts} сообщений по ~{args.length} символов:")
+        rules = legacy_rules([])
+        measure("any()", lambda text: legacy_priority(rules, text), texts, args.repeat)
+        measure("triage", triage_engine.classify, texts, args.repeat)
+
+        extra = []
+        for index in range(args.rules):
+            words = [f"товар{index}", f"код{index}ошибка", f"заказ номер {index}"]
+            extra.append(("🟡", words))
+            add_triage_rule(", ".join(words), priority="🟡", subject=f"категория {index}")
+        triage_engine.load()
+        rules = legacy_rules(extra)
+        print(f"{len(rules)} правил:")
+        measure("any()", lambda text: legacy_priority(rules, text), texts, args.repeat)
+        measure("triage", triage_engine.classify, texts, args.repeat)
+
+        # Результаты одинаковы на исходных правилах
+        mismatches = sum(legacy_priority(legacy_rules([]), text) != triage_engine.classify(text).priority for text in texts)
+        print(f"расхождений приоритета: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# FILE: benchmarks/webhook_load.py
+"""
+Нагрузочный тест приёма обновлений: вебхук (POST синтетических апдейтов
+на локальный WebhookServer) против polling-пути (пачки по 100 апдейтов
+через dp.feed_update задачами, как делает start_polling).
+Запуск из корня проекта: python -m benchmarks.webhook_load --updates 20000
+"""
+import argparse
+import asyncio
+import time
+
+from aiohttp import ClientSession
+from aiogram import Bot, Dispatcher, Router, types
+
+from webhook import WebhookServer, SECRET_HEADER
+
+HOST = "127.0.0.1"
+PORT = 18080
+PATH = "/webhook"
+SECRET = "load-test-secret"
+
+
+def make_update(update_id: int) -> dict:
+    user_id = 1_000_000 + update_id % 5000
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "text": "ping",
+        },
+    }
+
+
+def make_dispatcher(handler_ms: float, done: dict) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def echo(message: types.Message):
+        # Имитируем работу хендлера (БД, запросы к API)
+        await asyncio.sleep(handler_ms / 1000)
+        done["count"] += 1
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(name: str, total: int, elapsed: float, latencies: list, ack: list = None):
+    line = (
+        f"{name:<8} {total / elapsed:>9.0f} upd/s | обработка p50 {percentile(latencies, 50) * 1000:.1f} мс "
+        f"p99 {percentile(latencies, 99) * 1000:.1f} мс"
+    )
+    if ack:
+        line += f" | ответ 200 p50 {percentile(ack, 50) * 1000:.2f} мс p99 {percentile(ack, 99) * 1000:.2f} мс"
+    print(line)
+
+
+async def bench_webhook(bot: Bot, args) -> None:
+    done = {"count": 0}
+    dp = make_dispatcher(args.handler_ms, done)
+    server = WebhookServer(dp, bot, path=PATH, secret=SECRET, workers=args.workers)
+    await server.start(HOST, PORT)
+    url = f"http://{HOST}:{PORT}{PATH}"
+    ack = []
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def post(session: ClientSession, update_id: int):
+        async with sem:
+            started = time.perf_counter()
+            async with session.post(url, json=make_update(update_id), headers={SECRET_HEADER: SECRET}) as resp:
+                await resp.read()
+                if resp.status == 200:
+                    ack.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, i) for i in range(args.updates)))
+    while done["count"] < len(ack):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await server.stop()
+    report("webhook", done["count"], elapsed, list(server.latencies), ack)
+    print(f"         {server.stats()}")
+
+
+async def bench_polling(bot: Bot, args) -> None:
+    done = {"count": 0}
+    dp = make_dispatcher(args.handler_ms, done)
+    latencies = []
+
+    async def process(update: types.Update, received_at: float):
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - received_at)
+
+    tasks = set()
+    started = time.perf_counter()
+    for offset in range(0, args.updates, 100):
+        received_at = time.perf_counter()
+        for update_id in range(offset, min(offset + 100, args.updates)):
+            update = types.Update.model_validate(make_update(update_id), context={"bot": bot})
+            task = asyncio.create_task(process(update, received_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    report("polling", done["count"], elapsed, latencies)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест вебхука и polling")
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременных POST-запросов")
+    parser.add_argument("--workers", type=int, default=32, help="WEBHOOK_WORKERS")
+    parser.add_argument("--handler-ms", type=float, default=5.0, help="время работы хендлера")
+    args = parser.parse_args()
+
+    bot = Bot(token="123456:LOAD-TEST")
+    try:
+        await bench_webhook(bot, args)
+        await bench_polling(bot, args)
+    finally:
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
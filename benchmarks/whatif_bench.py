@@ -0,0 +1,98 @@
+# FILE: benchmarks/whatif_bench.py
+"""
+Предпросмотр настроек экономики на большой истории: --rows покупок (с заказами
+и реферальными наградами у части из них), обмены и выводы. Меряется первая
+загрузка столбцов из БД и повторный пересчёт из кэша, для сравнения — тот же
+пересчёт циклом по строкам Python.
+Запуск из корня проекта: python -m benchmarks.whatif_bench --rows 2000000
+БД создаётся во временном каталоге и удаляется после прогона.
+"""
+import argparse
+import random
+import time
+
+from benchmarks import isolated_workdir
+import whatif
+from database import init_db, get_db_connection, ECONOMY_HISTORY_QUERIES
+
+
+def seed(rows: int):
+    conn = get_db_connection()
+    if conn.execute("SELECT COUNT(*) FROM purchase_history").fetchone()[0] >= rows:
+        conn.close()
+        return
+    random.seed(1)
+    conn.execute("DELETE FROM purchase_history")
+    conn.execute("DELETE FROM orders")
+    conn.execute("DELETE FROM referral_rewards")
+    conn.execute("DELETE FROM exchanges")
+    conn.execute("DELETE FROM withdrawals")
+    orders, history, rewards = [], [], []
+    for order_id in range(1, rows + 1):
+        user_id = random.randint(1, 50_000)
+        amount = random.choice((50, 100, 250, 500, 1000))
+        total = amount * 1.6
+        discount = total * random.choice((0, 0, 0, 0.1, 0.2))
+        orders.append((order_id, user_id, amount, total, discount))
+        history.append((user_id, order_id, amount, total - discount))
+        if random.random() < 0.3:
+            rewards.append((user_id + 1, user_id, order_id, int((total - discount) * 0.05)))
+    conn.executemany("INSERT INTO orders (id, user_id, amount, total_price, discount, status) VALUES (?, ?, ?, ?, ?, 'approved')", orders)
+    conn.executemany("INSERT INTO purchase_history (user_id, order_id, amount, total_price) VALUES (?, ?, ?, ?)", history)
+    conn.executemany("INSERT INTO referral_rewards (referrer_id, referred_id, purchase_id, amount, paid) VALUES (?, ?, ?, ?, 1)", rewards)
+    conn.executemany(
+        "INSERT INTO exchanges (exchange_id, user_id, from_currency, to_currency, amount, status) VALUES (?, ?, ?, ?, ?, 'approved')",
+        [(f"e{i}", i % 50_000, *random.choice((('virtual', 'real'), ('real', 'virtual'))), random.randint(15, 800))
+         for i in range(rows // 4)]
+    )
+    conn.executemany(
+        "INSERT INTO withdrawals (withdrawal_id, user_id, amount, status) VALUES (?, ?, ?, 'approved')",
+        [(f"w{i}", i % 50_000, random.randint(50, 500)) for i in range(rows // 10)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def loop_evaluate(snapshot: dict) -> float:
+    """Та же выручка и рефералка построчно — как выглядел бы пересчёт без столбцов."""
+    conn = get_db_connection()
+    revenue = rewards = 0.0
+    percent = snapshot['referral_levels'][0]['percent'] if snapshot['referral_levels'] else 0
+    referred = {row[0] for row in conn.execute(ECONOMY_HISTORY_QUERIES['referrals'])}
+    for _, order_id, stars, paid, listed in conn.execute(ECONOMY_HISTORY_QUERIES['purchases'], (0,)):
+        price = stars * snapshot['star_rate'] * (paid / listed if listed else 1)
+        revenue += price
+        if order_id in referred:
+            rewards += int(price * percent / 100)
+    conn.close()
+    return revenue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000, help="покупок в истории")
+    args = parser.parse_args()
+
+    with isolated_workdir("whatif_bench_"):
+        init_db()
+        seed(args.rows)
+        overrides = {'star_rate': 1.8, 'withdraw_commission': 0.4,
+                     'referral_levels': [{"min": 0, "max": 999999, "percent": 7, "name": "Базовый"}]}
+
+        started = time.perf_counter()
+        history = whatif.load_history(max_age=0)
+        print(f"загрузка столбцов: {history['rows']} строк за {time.perf_counter() - started:.2f} с")
+        started = time.perf_counter()
+        whatif.load_history(max_age=0)
+        print(f"обновление (покупки — только новые): {time.perf_counter() - started:.2f} с")
+        result = whatif.preview(overrides)
+        print(f"пересчёт из кэша: {result['seconds'] * 1000:.0f} мс")
+        print(whatif.format_preview(result))
+
+        started = time.perf_counter()
+        loop_evaluate({**whatif.current_snapshot(), **overrides})
+        print(f"построчно (только покупки): {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# FILE: benchmarks/worker_scaling.py
+"""
+Масштабирование многопроцессного режима: апдейты шардируются по user_id
+(workers.shard_for) на 1..N процессов, каждый разбирает Update и делает
+типичную для хендлера работу с общим WAL-файлом SQLite.
+Запуск из корня проекта: python -m benchmarks.worker_scaling --updates 50000
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from aiogram.types import Update
+
+from workers import shard_for, update_user_id
+
+USERS = 10_000
+
+
+def make_update(update_id: int) -> dict:
+    user_id = 1_000_000 + update_id % USERS
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "data": "game:casino:15",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+        },
+    }
+
+
+def prepare_db(path: str):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, virtual_balance INTEGER, last_action TIMESTAMP)")
+    conn.execute("CREATE TABLE games (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, win_amount INTEGER)")
+    conn.executemany(
+        "INSERT INTO users (user_id, virtual_balance) VALUES (?, 1000)",
+        [(1_000_000 + i,) for i in range(USERS)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_worker(db_path: str, updates: multiprocessing.Queue, done: multiprocessing.Queue):
+    processed = 0
+    while True:
+        raw = updates.get()
+        if raw is None:
+            break
+        update = Update.model_validate(raw)
+        user_id = update.callback_query.from_user.id
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("SELECT virtual_balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        conn.execute("UPDATE users SET virtual_balance = virtual_balance - 15, last_action = CURRENT_TIMESTAMP WHERE user_id = ?", (user_id,))
+        conn.execute("INSERT INTO games (user_id, win_amount) VALUES (?, 0)", (user_id,))
+        conn.commit()
+        conn.close()
+        processed += 1
+    done.put(processed)
+
+
+def run(workers: int, total: int, db_path: str) -> float:
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    done = ctx.Queue()
+    processes = [ctx.Process(target=bench_worker, args=(db_path, queues[i], done)) for i in range(workers)]
+    for process in processes:
+        process.start()
+    raws = [make_update(i) for i in range(total)]
+
+    started = time.perf_counter()
+    for raw in raws:
+        queues[shard_for(update_user_id(raw), workers)].put(raw)
+    for q in queues:
+        q.put(None)
+    processed = sum(done.get() for _ in range(workers))
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    assert processed == total
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование воркеров по ядрам")
+    parser.add_argument("--updates", type=int, default=50_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    counts = sorted({1, 2, 4, 8, args.max_workers} & set(range(1, args.max_workers + 1)))
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in counts:
+            db_path = os.path.join(tmp, f"bench_{workers}.db")
+            prepare_db(db_path)
+            rate = run(workers, args.updates, db_path)
+            baseline = baseline or rate
+            print(f"воркеров: {workers:>2} | {rate:>8.0f} upd/s | ускорение x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
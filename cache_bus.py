@@ -0,0 +1,42 @@
+# FILE: cache_bus.py
+"""
+Канал инвалидации кэшей между процессами-воркерами.
+Модули с кэшами подписываются на свой вид сообщений, а при изменении данных
+публикуют ключ. В однопроцессном режиме издателя нет и publish ничего не делает.
+"""
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, List[Callable]] = {}
+_publisher: Optional[Callable] = None
+
+
+def subscribe(kind: str, handler: Callable):
+    """handler(key) сбрасывает локальный кэш; key=None — сбросить всё."""
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def set_publisher(publisher: Optional[Callable]):
+    global _publisher
+    _publisher = publisher
+
+
+def publish(kind: str, key: str = None):
+    """Сообщает остальным процессам, что кэш kind/key устарел."""
+    if _publisher is None:
+        return
+    try:
+        _publisher(kind, key)
+    except Exception as e:
+        logger.error(f"Ошибка публикации инвалидации {kind}:{key}: {e}")
+
+
+def apply(kind: str, key: str = None):
+    """Применяет пришедшую от другого процесса инвалидацию к локальным кэшам."""
+    for handler in _handlers.get(kind, []):
+        try:
+            handler(key)
+        except Exception as e:
+            logger.error(f"Ошибка инвалидации {kind}:{key}: {e}")
@@ -19,9 +19,10 @@ MIN_STARS = 50           # минимальная покупка в звёзда
 MINES_GAME_WIN_REWARD = 5      # +5 виртуальных звёзд за победу
 MINES_GAME_LOSE_PENALTY = 3    # -3 виртуальных звёзд за проигрыш
 CASINO_BET_AMOUNTS = [15, 25, 50, 200, 500]  # доступные ставки
-CASINO_WIN_CHANCE = 0.05       # 5% шанс выигрыша
 CASINO_WIN_MULTIPLIER = 2.5    # x2.5 при выигрыше
 CASINO_COOLDOWN_SECONDS = 30   # кулдаун между играми
+CASINO_REVEAL_DELAY = 2.0      # секунд анимации 🎰 до показа результата
+CASINO_STALE_GAME_MINUTES = 10 # незавершённая игра в казино закрывается с возвратом ставки
 
 # ========== Экономика и комиссии ==========
 VIRTUAL_TO_REAL_RATE = 0.5     # 1 вирт = 0.5 реальных
@@ -141,3 +142,91 @@ ITEMS_PER_PAGE = int(os.getenv("ITEMS_PER_PAGE", "10"))                 # эле
 # ========== Бекапы ==========
 AUTO_BACKUP_INTERVAL_HOURS = int(os.getenv("AUTO_BACKUP_INTERVAL_HOURS", "6"))  # авто-бекап каждые 6 часов
 BACKUP_KEEP_COUNT = int(os.getenv("BACKUP_KEEP_COUNT", "7"))                    # хранить последние 7 бекапов
+
+# ========== FSM-хранилище ==========
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")                        # sqlite / memory
+FSM_DATABASE_NAME = os.getenv("FSM_DATABASE_NAME", "fsm_storage.db")    # отдельный файл для состояний
+FSM_STATE_TTL_HOURS = int(os.getenv("FSM_STATE_TTL_HOURS", "24"))       # брошенные состояния живут сутки
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))      # секунд между сбросами на диск
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "50000"))              # состояний в памяти
+
+# ========== Вебхук ==========
+BOT_MODE = os.getenv("BOT_MODE", "polling")                             # polling / webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")                              # публичный https-адрес бота
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")                        # пусто = случайный при каждом запуске
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))               # одновременно обрабатываемых обновлений
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000"))      # потом отвечаем 503 и Telegram повторит
+WEBHOOK_DRAIN_TIMEOUT = int(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))   # секунд на доработку очереди при остановке
+
+# ========== Многопроцессный режим ==========
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))              # 1 = обычный однопроцессный режим
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "32"))         # одновременных обновлений в воркере
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "10000"))        # очередь обновлений на воркер
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "10"))             # секунд ожидания блокировки SQLite
+
+# ========== Планировщик задач ==========
+SCHEDULER_THREADS = int(os.getenv("SCHEDULER_THREADS", "2"))                    # потоков для блокирующих задач
+SCREENSHOTS_RETENTION_DAYS = int(os.getenv("SCREENSHOTS_RETENTION_DAYS", "30")) # хранить скриншоты 30 дней
+RECORDS_RETENTION_DAYS = int(os.getenv("RECORDS_RETENTION_DAYS", "30"))         # отметки обработанных действий
+ADMIN_LOGS_RETENTION_DAYS = int(os.getenv("ADMIN_LOGS_RETENTION_DAYS", "180"))  # журнал действий администрации
+MAILING_CHECK_INTERVAL = int(os.getenv("MAILING_CHECK_INTERVAL", "30"))         # секунд между проверками рассылок
+
+# ========== Онлайн-бекапы ==========
+BACKUP_PAGES_STEP = int(os.getenv("BACKUP_PAGES_STEP", "1024"))                 # страниц БД за один шаг копирования
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))              # пауза между шагами для писателей
+BACKUP_COMPRESS_LEVEL = int(os.getenv("BACKUP_COMPRESS_LEVEL", "6"))            # уровень сжатия gzip
+BACKUP_MODE = os.getenv("BACKUP_MODE", "incremental")                           # incremental | full
+BACKUP_CHAIN_LENGTH = int(os.getenv("BACKUP_CHAIN_LENGTH", "12"))               # дельт до следующего полного бекапа
+
+# ========== Хранилище скриншотов ==========
+SCREENSHOTS_CLEANUP_BATCH = int(os.getenv("SCREENSHOTS_CLEANUP_BATCH", "1000"))  # записей индекса за одну транзакцию очистки
+
+# ========== Медиа ==========
+MEDIA_ARCHIVE_INTERVAL = int(os.getenv("MEDIA_ARCHIVE_INTERVAL", "60"))        # секунд между архивациями скриншотов
+MEDIA_ARCHIVE_BATCH = int(os.getenv("MEDIA_ARCHIVE_BATCH", "20"))              # скриншотов за один запуск
+MEDIA_ARCHIVE_MAX_ATTEMPTS = int(os.getenv("MEDIA_ARCHIVE_MAX_ATTEMPTS", "5"))  # неудачных скачиваний до отказа от архивации
+
+# ========== Очередь модерации ==========
+MODERATION_LEASE_SECONDS = int(os.getenv("MODERATION_LEASE_SECONDS", "300"))   # на сколько заявка закрепляется за модератором
+MODERATION_PAGE_SIZE = int(os.getenv("MODERATION_PAGE_SIZE", "8"))             # заявок на странице очереди
+
+# ========== Исходящие уведомления ==========
+OUTBOX_INTERVAL = int(os.getenv("OUTBOX_INTERVAL", "2"))                       # секунд между проверками очереди
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))                            # уведомлений за одну выборку
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))               # попыток до отметки failed
+OUTBOX_RETRY_BASE = int(os.getenv("OUTBOX_RETRY_BASE", "5"))                   # секунд до первого повтора, дальше x2
+
+# ========== Лимиты отправки ==========
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "28"))                  # сообщений в секунду на бота (лимит ~30)
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))                       # сообщений в секунду в личный чат
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))                       # короткая пачка в личный чат без ожидания
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", "0.33"))                  # сообщений в секунду в группу (~20 в минуту)
+SEND_GROUP_BURST = int(os.getenv("SEND_GROUP_BURST", "5"))                     # пачка в группу без ожидания
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))                     # повторов после 429
+SEND_MAX_RETRY_WAIT = int(os.getenv("SEND_MAX_RETRY_WAIT", "60"))              # дольше retry_after не ждём, отдаём ошибку
+
+# ========== Тикеты: поиск, история и разбор ==========
+TICKET_SEARCH_PAGE_SIZE = int(os.getenv("TICKET_SEARCH_PAGE_SIZE", "5"))       # совпадений на странице поиска
+TICKET_HISTORY_PAGE_SIZE = int(os.getenv("TICKET_HISTORY_PAGE_SIZE", "10"))    # сообщений тикета на одной странице
+TICKET_MESSAGE_PREVIEW = int(os.getenv("TICKET_MESSAGE_PREVIEW", "300"))       # символов сообщения в истории, длиннее — обрезается
+TRIAGE_HITS_FLUSH_INTERVAL = int(os.getenv("TRIAGE_HITS_FLUSH_INTERVAL", "60"))  # раз в N секунд срабатывания правил разбора пишутся в БД
+
+# ========== Автоназначение тикетов ==========
+TICKET_AUTO_ASSIGN = os.getenv("TICKET_AUTO_ASSIGN", "1") == "1"               # назначать новые тикеты агентам на смене
+AGENT_MAX_OPEN_TICKETS = int(os.getenv("AGENT_MAX_OPEN_TICKETS", "0"))         # больше открытых тикетов агенту не назначается (0 — без предела)
+
+# ========== Резерв тем форума ==========
+TOPIC_POOL_SIZE = int(os.getenv("TOPIC_POOL_SIZE", "5"))                       # готовых тем для новых тикетов (0 — создавать на месте)
+TOPIC_POOL_REFILL_INTERVAL = int(os.getenv("TOPIC_POOL_REFILL_INTERVAL", "30"))  # секунд между проверками резерва
+TOPIC_POOL_REFILL_BATCH = int(os.getenv("TOPIC_POOL_REFILL_BATCH", "3"))       # тем за один запуск — не выбирать лимит группы
+
+# ========== Пересылка сообщений тикетов ==========
+RELAY_ALBUM_WAIT = float(os.getenv("RELAY_ALBUM_WAIT", "1.0"))                 # секунд ждать остальные части альбома перед пересылкой
+
+# ========== Симулятор экономики ==========
+ECONOMY_SIM_SESSIONS = int(os.getenv("ECONOMY_SIM_SESSIONS", "1000000"))       # игровых сессий в одном прогоне /simulate
+ECONOMY_SIM_HISTORY_DAYS = int(os.getenv("ECONOMY_SIM_HISTORY_DAYS", "30"))    # за сколько дней брать поведение игроков из games и exchanges
+WHATIF_CACHE_SECONDS = int(os.getenv("WHATIF_CACHE_SECONDS", "300"))          # сколько секунд переиспользовать загруженную историю для предпросмотра настроек
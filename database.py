@@ -4,14 +4,14 @@ import logging
 import uuid
 import json
 import time
-import os
-import shutil
-import glob
 import random
 import string
+import re
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 from config import *
+import cache_bus
+from sketch import QuantileSketch
 
 logger = logging.getLogger(__name__)
 
@@ -32,23 +32,128 @@ def cache_set(key: str, value, ttl: int = 60):
     _cache[key] = value
     _cache_ttl[key] = time.time() + ttl
 
+def _drop_cache(key: str = None):
+    global _routes_loaded, _roster_loaded
+    if key is None:
+        _cache.clear()
+        _cache_ttl.clear()
+        # Полный сброс (например, после восстановления бекапа) — перечитать и карты в памяти
+        _routes_loaded = False
+        _roster_loaded = False
+        return
+    _cache.pop(key, None)
+    _cache_ttl.pop(key, None)
+
 def cache_delete(key: str):
-    if key in _cache:
-        del _cache[key]
-    if key in _cache_ttl:
-        del _cache_ttl[key]
+    _drop_cache(key)
+    cache_bus.publish('cache', key)
 
 def cache_clear():
-    _cache.clear()
-    _cache_ttl.clear()
+    _drop_cache()
+    cache_bus.publish('cache')
+
+cache_bus.subscribe('cache', _drop_cache)
+
+# ========== КАРТЫ В ПАМЯТИ: ТЕМЫ ТИКЕТОВ И ПЕРСОНАЛ ==========
+# Каждое сообщение в группе поддержки проверяет тему и роль отправителя —
+# держим обе карты в памяти и обновляем их из функций, которые меняют данные.
+_topic_routes = {}   # topic_id -> (ticket_id, user_id, status)
+_ticket_topics = {}  # ticket_id -> topic_id
+_routes_loaded = False
+_staff_roles = {}    # user_id -> роль, только не 'user'
+_roster_loaded = False
+
+def load_ticket_routes():
+    global _routes_loaded
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, user_id, status, topic_id FROM tickets WHERE topic_id IS NOT NULL")
+    rows = cursor.fetchall()
+    conn.close()
+    _topic_routes.clear()
+    _ticket_topics.clear()
+    for ticket_id, user_id, status, topic_id in rows:
+        _set_ticket_route(ticket_id, user_id, status, topic_id)
+    _routes_loaded = True
+
+def _set_ticket_route(ticket_id: int, user_id: int, status: str, topic_id: int):
+    old_topic = _ticket_topics.pop(ticket_id, None)
+    if old_topic is not None:
+        _topic_routes.pop(old_topic, None)
+    if topic_id is not None:
+        _topic_routes[topic_id] = (ticket_id, user_id, status)
+        _ticket_topics[ticket_id] = topic_id
+
+def _refresh_ticket_route(key: str = None):
+    if not _routes_loaded:
+        return
+    if key is None:
+        load_ticket_routes()
+        return
+    ticket_id = int(key)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, status, topic_id FROM tickets WHERE id = ?", (ticket_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if row:
+        _set_ticket_route(ticket_id, *row)
+    else:
+        _set_ticket_route(ticket_id, None, None, None)
+
+cache_bus.subscribe('tickets', _refresh_ticket_route)
+
+def get_topic_route(topic_id: int):
+    """(ticket_id, user_id, status) тикета темы группы поддержки или None — без обращения к БД."""
+    if not _routes_loaded:
+        load_ticket_routes()
+    return _topic_routes.get(topic_id)
+
+def load_staff_roster():
+    global _roster_loaded
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, role FROM users WHERE role IS NOT NULL AND role != 'user'")
+    rows = cursor.fetchall()
+    conn.close()
+    _staff_roles.clear()
+    _staff_roles.update(rows)
+    _roster_loaded = True
+
+def _refresh_staff_role(key: str = None):
+    if not _roster_loaded:
+        return
+    if key is None:
+        load_staff_roster()
+        return
+    user_id = int(key)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if row and row[0] and row[0] != 'user':
+        _staff_roles[user_id] = row[0]
+    else:
+        _staff_roles.pop(user_id, None)
+
+cache_bus.subscribe('roster', _refresh_staff_role)
+
+def get_staff_role(user_id: int) -> str:
+    """Роль пользователя из карты персонала; всех, кого в ней нет, считаем 'user'."""
+    if not _roster_loaded:
+        load_staff_roster()
+    return _staff_roles.get(user_id, 'user')
 
 def get_db_connection():
-    return sqlite3.connect(DATABASE_NAME)
+    return sqlite3.connect(DATABASE_NAME, timeout=DB_BUSY_TIMEOUT)
 
 # ========== ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ (ВСЕ ТАБЛИЦЫ) ==========
 def init_db():
     conn = get_db_connection()
     cursor = conn.cursor()
+    # WAL: читатели не блокируют писателя, файл можно делить между воркерами
+    cursor.execute("PRAGMA journal_mode=WAL")
 
     # --- СУЩЕСТВУЮЩИЕ ТАБЛИЦЫ ---
     cursor.execute('''
@@ -184,6 +289,17 @@ def init_db():
             FOREIGN KEY (order_id) REFERENCES orders (id)
         )
     ''')
+    # Один промокод — одно использование на пользователя. Дубликаты, оставшиеся от
+    # прежней проверки отдельным SELECT, убираются один раз перед созданием индекса
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_used_promocodes_user'")
+    if not cursor.fetchone():
+        cursor.execute('''
+            DELETE FROM used_promocodes WHERE id NOT IN
+            (SELECT MIN(id) FROM used_promocodes GROUP BY user_id, promocode_id)
+        ''')
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_used_promocodes_user ON used_promocodes(user_id, promocode_id)"
+        )
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS games (
@@ -321,6 +437,16 @@ def init_db():
         )
     ''')
 
+    # Счётчики для ачивок (покупки, траты, игры, серии) — проверка без пересчёта истории
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS achievement_counters (
+            user_id INTEGER NOT NULL,
+            counter TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, counter)
+        ) WITHOUT ROWID
+    ''')
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS discount_links (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -434,6 +560,276 @@ def init_db():
         )
     ''')
 
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            name TEXT PRIMARY KEY,
+            last_run REAL,
+            last_duration REAL,
+            runs INTEGER DEFAULT 0,
+            failures INTEGER DEFAULT 0,
+            last_error TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS screenshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL,
+            sha256 TEXT,
+            size INTEGER,
+            user_id INTEGER,
+            order_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshots_created ON screenshots(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshots_sha256 ON screenshots(sha256)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshots_path ON screenshots(path)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_media (
+            order_id INTEGER PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            media_type TEXT DEFAULT 'photo',
+            archived INTEGER DEFAULT 0,
+            archive_attempts INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Базы, созданные до счётчика неудачных скачиваний
+    cursor.execute("PRAGMA table_info(order_media)")
+    if 'archive_attempts' not in {column[1] for column in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE order_media ADD COLUMN archive_attempts INTEGER DEFAULT 0")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_media_unique ON order_media(file_unique_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_media_archived ON order_media(archived)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_id_cache (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            file_id TEXT NOT NULL,
+            media_type TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS moderation_claims (
+            kind TEXT,
+            item_id TEXT,
+            moderator_id INTEGER,
+            expires_at REAL,
+            PRIMARY KEY (kind, item_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_exchanges_status ON exchanges(status)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            method TEXT DEFAULT 'message',
+            text TEXT,
+            file_id TEXT,
+            reply_markup TEXT,
+            thread_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL,
+            sent_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(status, next_attempt_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, status)')
+    # Пересылка сообщений тикета копией (copy_message): откуда копировать и на что ответить
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_relay (
+            notification_id INTEGER PRIMARY KEY,
+            ticket_id INTEGER NOT NULL,
+            content_type TEXT,
+            from_chat_id INTEGER NOT NULL,
+            message_ids TEXT NOT NULL,
+            reply_to INTEGER
+        )
+    ''')
+    # Пары «сообщение у пользователя — сообщение в теме» для ответов реплаем в обе стороны
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_message_links (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            ticket_id INTEGER NOT NULL,
+            peer_chat_id INTEGER NOT NULL,
+            peer_message_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # --- SLA поддержки: время первого ответа и решения, сводка по агентам ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_sla (
+            ticket_id INTEGER PRIMARY KEY,
+            first_response_at TIMESTAMP,
+            first_response_by INTEGER,
+            resolved_at TIMESTAMP,
+            resolved_by INTEGER,
+            FOREIGN KEY (ticket_id) REFERENCES tickets(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_agents (
+            ticket_id INTEGER,
+            agent_id INTEGER,
+            PRIMARY KEY (ticket_id, agent_id)
+        )
+    ''')
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'agent_stats'")
+    agent_stats_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agent_stats (
+            agent_id INTEGER PRIMARY KEY,
+            tickets_answered INTEGER DEFAULT 0,
+            tickets_closed INTEGER DEFAULT 0,
+            ratings_count INTEGER DEFAULT 0,
+            ratings_sum INTEGER DEFAULT 0,
+            rating_1 INTEGER DEFAULT 0,
+            rating_2 INTEGER DEFAULT 0,
+            rating_3 INTEGER DEFAULT 0,
+            rating_4 INTEGER DEFAULT 0,
+            rating_5 INTEGER DEFAULT 0,
+            response_sketch TEXT,
+            resolution_sketch TEXT
+        )
+    ''')
+    # Рейтинг агентов читается по индексу, без сортировки всех строк
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_agent_stats_rating
+        ON agent_stats ((CAST(ratings_sum AS REAL) / ratings_count) DESC, ratings_count DESC)
+        WHERE ratings_count > 0
+    ''')
+    if not agent_stats_exists:
+        _rebuild_agent_stats(cursor)
+
+    # --- Счётчики сообщений тикета, ведутся триггерами при вставке ---
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket ON ticket_messages(ticket_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id, created_at)')
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ticket_counters'")
+    counters_exist = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_counters (
+            ticket_id INTEGER PRIMARY KEY,
+            message_count INTEGER DEFAULT 0,
+            last_message_at TIMESTAMP,
+            FOREIGN KEY (ticket_id) REFERENCES tickets(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ticket_counters_ai AFTER INSERT ON ticket_messages BEGIN
+            INSERT INTO ticket_counters (ticket_id, message_count, last_message_at)
+            VALUES (new.ticket_id, 1, new.created_at)
+            ON CONFLICT(ticket_id) DO UPDATE SET message_count = message_count + 1,
+                last_message_at = excluded.last_message_at;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ticket_counters_ad AFTER DELETE ON ticket_messages BEGIN
+            UPDATE ticket_counters SET message_count = message_count - 1 WHERE ticket_id = old.ticket_id;
+        END
+    ''')
+    if not counters_exist:
+        cursor.execute('''
+            INSERT OR REPLACE INTO ticket_counters (ticket_id, message_count, last_message_at)
+            SELECT ticket_id, COUNT(*), MAX(created_at) FROM ticket_messages GROUP BY ticket_id
+        ''')
+
+    # --- Дежурство и навыки агентов для автоназначения ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS agent_presence (
+            agent_id INTEGER PRIMARY KEY,
+            online INTEGER DEFAULT 0,
+            skills TEXT DEFAULT '',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tickets_agent ON tickets(agent_id, status)')
+
+    # --- Резерв заранее созданных тем для новых тикетов ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS forum_topic_pool (
+            chat_id INTEGER NOT NULL,
+            topic_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, topic_id)
+        )
+    ''')
+
+    # --- Правила разбора тикетов ---
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'triage_rules'")
+    triage_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS triage_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern TEXT NOT NULL,
+            is_regex INTEGER DEFAULT 0,
+            priority TEXT,
+            subject TEXT,
+            template TEXT,
+            assign_group TEXT,
+            enabled INTEGER DEFAULT 1,
+            hits INTEGER DEFAULT 0,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if not triage_exists:
+        # Правила, которые раньше были зашиты в handlers/tickets.py
+        cursor.executemany(
+            "INSERT INTO triage_rules (pattern, priority) VALUES (?, ?)",
+            [
+                ("бот не работает, не отвечает, сломался", "⚫"),
+                ("не пришли, не получил, нет звёзд", "🔴"),
+                ("ошибка, проблема, баг", "🟡"),
+            ]
+        )
+
+    # --- Полнотекстовый поиск по тикетам ---
+    # FTS5-индексы без копии текста (content=...), синхронизируются триггерами
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ticket_messages_fts'")
+        fts_exists = cursor.fetchone() is not None
+        for table, column in (('ticket_messages', 'message'), ('tickets', 'subject')):
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                    {column}, content='{table}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF {column} ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                    INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            """)
+            if not fts_exists:
+                # Индекс создан на существующей базе — заполняем его из таблицы
+                cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 недоступен, поиск по тикетам будет через LIKE: {e}")
+
     # --- Базовые ачивки ---
     cursor.execute('''
         INSERT OR IGNORE INTO achievements_list (code, name, description, icon) VALUES
@@ -486,6 +882,17 @@ def init_db():
             "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
             default_settings
         )
+    # Комиссия вирт→реальные раньше сохранялась в процентах («50»), теперь все комиссии — доли
+    cursor.execute("SELECT 1 FROM settings WHERE key = 'commissions_migrated'")
+    if not cursor.fetchone():
+        cursor.execute(
+            """UPDATE settings SET value = CAST(value AS REAL) / 100
+            WHERE key IN ('withdraw_commission', 'exchange_commission', 'virtual_to_real_commission')
+              AND CAST(value AS REAL) > 1"""
+        )
+        if cursor.rowcount:
+            logger.info(f"Комиссий переведено из процентов в доли: {cursor.rowcount}")
+        cursor.execute("INSERT INTO settings (key, value) VALUES ('commissions_migrated', '1')")
 
     conn.commit()
     conn.close()
@@ -525,10 +932,7 @@ def create_user(user_id: int, username: str, full_name: str):
         conn.close()
 
 def get_user_role(user_id: int):
-    user = get_user(user_id)
-    if user:
-        return user[7] if len(user) > 7 else 'user'
-    return 'user'
+    return get_staff_role(user_id)
 
 def set_user_role(user_id: int, role: str):
     conn = get_db_connection()
@@ -539,6 +943,12 @@ def set_user_role(user_id: int, role: str):
             (role, user_id)
         )
         conn.commit()
+        if _roster_loaded:
+            if role and role != 'user':
+                _staff_roles[user_id] = role
+            else:
+                _staff_roles.pop(user_id, None)
+        cache_bus.publish('roster', str(user_id))
         logger.info(f"Пользователю {user_id} установлена роль: {role}")
     except Exception as e:
         conn.rollback()
@@ -670,6 +1080,10 @@ def create_ticket(user_id: int, subject: str, text: str, topic_id: int = None, t
             (ticket_id, user_id, text)
         )
         conn.commit()
+        if topic_id is not None:
+            if _routes_loaded:
+                _set_ticket_route(ticket_id, user_id, 'open', topic_id)
+            cache_bus.publish('tickets', str(ticket_id))
         logger.info(f"Создан тикет #{ticket_id} для пользователя {user_id}")
         return ticket_id
     except Exception as e:
@@ -694,6 +1108,8 @@ def update_ticket_topic(ticket_id: int, topic_id: int, topic_name: str = None):
                 (topic_id, ticket_id)
             )
         conn.commit()
+        _refresh_ticket_route(str(ticket_id))
+        cache_bus.publish('tickets', str(ticket_id))
     except Exception as e:
         conn.rollback()
         logger.error(f"Ошибка обновления темы тикета: {e}")
@@ -731,7 +1147,52 @@ def get_ticket_messages(ticket_id: int):
     conn.close()
     return messages
 
-def add_ticket_message(ticket_id: int, user_id: int, message: str, is_from_support: bool = False, media_type: str = None, file_id: str = None):
+def get_ticket_messages_page(ticket_id: int, limit: int, before_id: int = None, after_id: int = None):
+    """
+    Страница истории тикета по ключу id (без OFFSET): по умолчанию последние limit сообщений,
+    before_id — более старые, after_id — более новые. Сообщения в хронологическом порядке:
+    ([(id, user_id, message, is_from_support, media_type, created_at, username)], есть_старше, есть_новее).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    select = """SELECT tm.id, tm.user_id, tm.message, tm.is_from_support, tm.media_type, tm.created_at, u.username
+                FROM ticket_messages tm
+                LEFT JOIN users u ON tm.user_id = u.user_id
+                WHERE tm.ticket_id = ?"""
+    if after_id:
+        cursor.execute(select + " AND tm.id > ? ORDER BY tm.id ASC LIMIT ?", (ticket_id, after_id, limit))
+        messages = cursor.fetchall()
+    else:
+        cursor.execute(select + " AND tm.id < ? ORDER BY tm.id DESC LIMIT ?",
+                       (ticket_id, before_id or 2**63 - 1, limit))
+        messages = cursor.fetchall()[::-1]
+    has_older = has_newer = False
+    if messages:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM ticket_messages WHERE ticket_id = ? AND id < ?)",
+                       (ticket_id, messages[0][0]))
+        has_older = bool(cursor.fetchone()[0])
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM ticket_messages WHERE ticket_id = ? AND id > ?)",
+                       (ticket_id, messages[-1][0]))
+        has_newer = bool(cursor.fetchone()[0])
+    conn.close()
+    return messages, has_older, has_newer
+
+def get_ticket_counters(ticket_id: int):
+    """(число сообщений, время последнего) из ticket_counters."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT message_count, last_message_at FROM ticket_counters WHERE ticket_id = ?", (ticket_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row or (0, None)
+
+def add_ticket_message(ticket_id: int, user_id: int, message: str, is_from_support: bool = False, media_type: str = None, file_id: str = None,
+                       notifications: list = None, notify_delay: float = 0, album: tuple = None):
+    """
+    notifications пишутся в той же транзакции (с задержкой notify_delay);
+    album — (from_chat_id, message_id первой части, все message_id): очередная часть альбома
+    дописывается в ещё не отправленную копию, записанную вместе с первой частью.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
@@ -739,6 +1200,20 @@ def add_ticket_message(ticket_id: int, user_id: int, message: str, is_from_suppo
             "INSERT INTO ticket_messages (ticket_id, user_id, message, is_from_support, media_type, file_id) VALUES (?, ?, ?, ?, ?, ?)",
             (ticket_id, user_id, message, 1 if is_from_support else 0, media_type, file_id)
         )
+        if is_from_support:
+            _record_support_reply(cursor, ticket_id, user_id)
+        enqueue_notifications(cursor, notifications, notify_delay)
+        if album:
+            from_chat_id, first_id, message_ids = album
+            cursor.execute(
+                """UPDATE outbox_relay SET message_ids = ?
+                WHERE from_chat_id = ? AND content_type = 'album'
+                  AND EXISTS (SELECT 1 FROM json_each(outbox_relay.message_ids) WHERE value = ?)
+                  AND notification_id IN (SELECT id FROM outbox WHERE status = 'pending')""",
+                (json.dumps(message_ids), from_chat_id, first_id)
+            )
+            if not cursor.rowcount:
+                logger.warning(f"Часть альбома тикета #{ticket_id} пришла после отправки альбома и не переслана")
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -750,9 +1225,9 @@ def get_user_tickets(user_id: int):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        """SELECT t.*, 
-           (SELECT COUNT(*) FROM ticket_messages WHERE ticket_id = t.id) as message_count
+        """SELECT t.*, COALESCE(c.message_count, 0) as message_count, c.last_message_at
            FROM tickets t
+           LEFT JOIN ticket_counters c ON c.ticket_id = t.id
            WHERE t.user_id = ?
            ORDER BY t.created_at DESC""",
         (user_id,)
@@ -761,6 +1236,87 @@ def get_user_tickets(user_id: int):
     conn.close()
     return tickets
 
+_SEARCH_HIGHLIGHT = ('\x02', '\x03')  # маркеры совпадения в сниппете, в HTML их заменяет обработчик
+# Сообщений, просматриваемых на тикет страницы: длинная переписка не вытесняет другие тикеты
+_SEARCH_MESSAGES_PER_TICKET = 10
+
+def _fts_query(text: str) -> str:
+    """Запрос пользователя → выражение FTS5: все слова обязательны, каждое как префикс."""
+    words = re.findall(r'\w+', text)
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_tickets_text(query: str, limit: int, offset: int = 0):
+    """
+    Поиск по темам тикетов и тексту сообщений: по строке на тикет, сначала
+    совпавшие темой, затем по переписке, в каждой группе свежие первыми.
+    Возвращает [(ticket_id, subject, status, priority, snippet, from_subject)];
+    совпадения в snippet обрамлены маркерами _SEARCH_HIGHLIGHT.
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    start, end = _SEARCH_HIGHLIGHT
+    # Сортировка по rowid идёт по индексу FTS и останавливается на LIMIT;
+    # bm25 пришлось бы считать для всех совпадений, а частые слова есть в половине переписки
+    depth = limit + offset
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT ticket_id, subject, status, priority, snippet, from_subject
+            FROM (
+                SELECT hit.*, t.subject, t.status, t.priority, ROW_NUMBER() OVER (
+                    PARTITION BY hit.ticket_id ORDER BY hit.from_subject DESC, hit.message_id DESC
+                ) AS n
+                FROM (
+                    SELECT * FROM (
+                        SELECT rowid AS ticket_id, 0 AS message_id,
+                               snippet(tickets_fts, 0, '{start}', '{end}', '…', 12) AS snippet, 1 AS from_subject
+                        FROM tickets_fts WHERE tickets_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT tm.ticket_id, fts.rowid, fts.snippet, 0
+                        FROM (
+                            SELECT rowid, snippet(ticket_messages_fts, 0, '{start}', '{end}', '…', 12) AS snippet
+                            FROM ticket_messages_fts WHERE ticket_messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+                        ) fts JOIN ticket_messages tm ON tm.id = fts.rowid
+                    )
+                ) hit
+                JOIN tickets t ON t.id = hit.ticket_id
+            )
+            WHERE n = 1
+            ORDER BY from_subject DESC, message_id DESC, ticket_id DESC
+            LIMIT ? OFFSET ?
+        """, (match, depth, match, depth * _SEARCH_MESSAGES_PER_TICKET, limit, offset))
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+        # Без FTS5 — медленный поиск подстроки
+        like = f"%{query.strip()}%"
+        cursor.execute("""
+            SELECT id, subject, status, priority, snippet, from_subject
+            FROM (
+                SELECT hit.*, ROW_NUMBER() OVER (
+                    PARTITION BY hit.id ORDER BY hit.from_subject DESC, hit.message_id DESC
+                ) AS n
+                FROM (
+                    SELECT id, subject, status, priority, subject AS snippet, 1 AS from_subject, 0 AS message_id
+                    FROM tickets WHERE subject LIKE ?
+                    UNION ALL
+                    SELECT t.id, t.subject, t.status, t.priority, tm.message, 0, tm.id
+                    FROM ticket_messages tm JOIN tickets t ON t.id = tm.ticket_id
+                    WHERE tm.message LIKE ?
+                ) hit
+            )
+            WHERE n = 1
+            ORDER BY from_subject DESC, message_id DESC, id DESC
+            LIMIT ? OFFSET ?
+        """, (like, like, limit, offset))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
 def get_all_tickets(status: str = None):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -772,21 +1328,27 @@ def get_all_tickets(status: str = None):
     conn.close()
     return tickets
 
-def update_ticket_status(ticket_id: int, status: str):
+def update_ticket_status(ticket_id: int, status: str, notifications: list = None, closed_by: int = None):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         if status == 'closed':
             cursor.execute(
-                "UPDATE tickets SET status = ?, closed_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (status, ticket_id)
+                "UPDATE tickets SET status = ?, closed_at = CURRENT_TIMESTAMP, closed_by = COALESCE(?, closed_by) WHERE id = ?",
+                (status, closed_by, ticket_id)
             )
+            _record_resolution(cursor, ticket_id, closed_by)
         else:
             cursor.execute(
                 "UPDATE tickets SET status = ? WHERE id = ?",
                 (status, ticket_id)
             )
+        enqueue_notifications(cursor, notifications)
         conn.commit()
+        route = _topic_routes.get(_ticket_topics.get(ticket_id))
+        if route:
+            _topic_routes[_ticket_topics[ticket_id]] = (route[0], route[1], status)
+        cache_bus.publish('tickets', str(ticket_id))
     except Exception as e:
         conn.rollback()
         logger.error(f"Ошибка обновления статуса тикета: {e}")
@@ -811,11 +1373,12 @@ def update_ticket_priority(ticket_id: int, priority: str) -> bool:
         conn.close()
 
 def assign_ticket(ticket_id: int, agent_id: int) -> bool:
+    # Статус не меняется: назначенный тикет остаётся открытым для пользователя и поиска
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "UPDATE tickets SET agent_id = ?, status = 'in_progress' WHERE id = ?",
+            "UPDATE tickets SET agent_id = ? WHERE id = ?",
             (agent_id, ticket_id)
         )
         conn.commit()
@@ -827,6 +1390,52 @@ def assign_ticket(ticket_id: int, agent_id: int) -> bool:
     finally:
         conn.close()
 
+def get_agent_presence(agent_id: int = None):
+    """[(agent_id, online, skills)] — все агенты или один."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if agent_id is None:
+        cursor.execute("SELECT agent_id, online, skills FROM agent_presence")
+    else:
+        cursor.execute("SELECT agent_id, online, skills FROM agent_presence WHERE agent_id = ?", (agent_id,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def set_agent_presence(agent_id: int, online: bool = None, skills: str = None) -> bool:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT OR IGNORE INTO agent_presence (agent_id) VALUES (?)", (agent_id,))
+        cursor.execute(
+            """UPDATE agent_presence SET online = COALESCE(?, online), skills = COALESCE(?, skills),
+               updated_at = CURRENT_TIMESTAMP WHERE agent_id = ?""",
+            (None if online is None else int(online), skills, agent_id)
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка смены дежурства агента: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_agent_open_tickets(agent_id: int = None):
+    """Незакрытые назначенные тикеты: {agent_id: count} или число для одного агента."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if agent_id is None:
+        cursor.execute(
+            "SELECT agent_id, COUNT(*) FROM tickets WHERE agent_id IS NOT NULL AND status != 'closed' GROUP BY agent_id"
+        )
+        result = dict(cursor.fetchall())
+    else:
+        cursor.execute("SELECT COUNT(*) FROM tickets WHERE agent_id = ? AND status != 'closed'", (agent_id,))
+        result = cursor.fetchone()[0]
+    conn.close()
+    return result
+
 # ========== ОЦЕНКИ И СТАТИСТИКА АГЕНТОВ ==========
 def rate_ticket(ticket_id: int, user_id: int, agent_id: int, rating: int, comment: str = None):
     conn = get_db_connection()
@@ -843,6 +1452,7 @@ def rate_ticket(ticket_id: int, user_id: int, agent_id: int, rating: int, commen
                 "UPDATE tickets SET rating = ?, rating_comment = ? WHERE id = ?",
                 (rating, comment, ticket_id)
             )
+            _bump_agent_stats(cursor, agent_id, rating=rating)
             conn.commit()
             return True
         else:
@@ -857,42 +1467,164 @@ def rate_ticket(ticket_id: int, user_id: int, agent_id: int, rating: int, commen
     finally:
         conn.close()
 
-def get_agent_stats(agent_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(DISTINCT t.id) 
-        FROM tickets t
-        JOIN ticket_messages tm ON t.id = tm.ticket_id
-        WHERE tm.user_id = ? AND tm.is_from_support = 1
-    ''', (agent_id,))
-    total_tickets = cursor.fetchone()[0]
+def _bump_agent_stats(cursor, agent_id: int, answered: int = 0, closed: int = 0, rating: int = None,
+                      response: float = None, resolution: float = None):
+    """Обновляет сводку агента в текущей транзакции: счётчики и скетчи перцентилей."""
+    cursor.execute("INSERT OR IGNORE INTO agent_stats (agent_id) VALUES (?)", (agent_id,))
+    if response is not None or resolution is not None:
+        cursor.execute(
+            "SELECT response_sketch, resolution_sketch FROM agent_stats WHERE agent_id = ?", (agent_id,)
+        )
+        response_json, resolution_json = cursor.fetchone()
+        if response is not None:
+            sketch = QuantileSketch.from_json(response_json)
+            sketch.add(response)
+            response_json = sketch.to_json()
+        if resolution is not None:
+            sketch = QuantileSketch.from_json(resolution_json)
+            sketch.add(resolution)
+            resolution_json = sketch.to_json()
+        cursor.execute(
+            "UPDATE agent_stats SET response_sketch = ?, resolution_sketch = ? WHERE agent_id = ?",
+            (response_json, resolution_json, agent_id)
+        )
+    rating_column = f", rating_{int(rating)} = rating_{int(rating)} + 1" if rating else ""
+    cursor.execute(
+        f"""UPDATE agent_stats SET tickets_answered = tickets_answered + ?, tickets_closed = tickets_closed + ?,
+            ratings_count = ratings_count + ?, ratings_sum = ratings_sum + ?{rating_column}
+            WHERE agent_id = ?""",
+        (answered, closed, 1 if rating else 0, rating or 0, agent_id)
+    )
+
+def _record_support_reply(cursor, ticket_id: int, agent_id: int):
+    """Ответ поддержки: учитывает тикет за агентом и время первого ответа по тикету."""
+    cursor.execute("INSERT OR IGNORE INTO ticket_agents (ticket_id, agent_id) VALUES (?, ?)", (ticket_id, agent_id))
+    if cursor.rowcount == 0:
+        return  # агент уже отвечал в этом тикете — сводка не меняется
+    cursor.execute("INSERT OR IGNORE INTO ticket_sla (ticket_id) VALUES (?)", (ticket_id,))
+    cursor.execute(
+        """UPDATE ticket_sla SET first_response_at = CURRENT_TIMESTAMP, first_response_by = ?
+           WHERE ticket_id = ? AND first_response_at IS NULL""",
+        (agent_id, ticket_id)
+    )
+    response = None
+    if cursor.rowcount:
+        cursor.execute(
+            """SELECT (julianday(s.first_response_at) - julianday(t.created_at)) * 86400
+               FROM ticket_sla s JOIN tickets t ON t.id = s.ticket_id WHERE s.ticket_id = ?""",
+            (ticket_id,)
+        )
+        row = cursor.fetchone()
+        response = row[0] if row else None
+    _bump_agent_stats(cursor, agent_id, answered=1, response=response)
+
+def _record_resolution(cursor, ticket_id: int, closed_by: int = None):
+    """Закрытие тикета: время решения идёт закрывшему агенту, иначе — первому ответившему."""
+    cursor.execute("INSERT OR IGNORE INTO ticket_sla (ticket_id) VALUES (?)", (ticket_id,))
+    cursor.execute(
+        """UPDATE ticket_sla SET resolved_at = CURRENT_TIMESTAMP, resolved_by = COALESCE(?, first_response_by)
+           WHERE ticket_id = ? AND resolved_at IS NULL""",
+        (closed_by, ticket_id)
+    )
+    if not cursor.rowcount:
+        return  # тикет уже закрывали
+    cursor.execute(
+        """SELECT s.resolved_by, (julianday(s.resolved_at) - julianday(t.created_at)) * 86400
+           FROM ticket_sla s JOIN tickets t ON t.id = s.ticket_id WHERE s.ticket_id = ?""",
+        (ticket_id,)
+    )
+    row = cursor.fetchone()
+    if row and row[0]:
+        _bump_agent_stats(cursor, row[0], closed=1 if closed_by else 0, resolution=row[1])
 
+def _rebuild_agent_stats(cursor):
+    """Заполняет SLA и сводку агентов по уже накопленным тикетам (один раз, при создании таблиц)."""
+    cursor.execute(
+        "INSERT OR IGNORE INTO ticket_agents (ticket_id, agent_id) "
+        "SELECT DISTINCT ticket_id, user_id FROM ticket_messages WHERE is_from_support = 1"
+    )
     cursor.execute('''
-        SELECT COUNT(*) FROM tickets 
-        WHERE closed_by = ? AND status = 'closed'
-    ''', (agent_id,))
-    closed_tickets = cursor.fetchone()[0]
+        INSERT OR IGNORE INTO ticket_sla (ticket_id, first_response_at, first_response_by)
+        SELECT ticket_id, created_at, user_id FROM ticket_messages
+        WHERE id IN (SELECT MIN(id) FROM ticket_messages WHERE is_from_support = 1 GROUP BY ticket_id)
+    ''')
+    cursor.execute('''
+        INSERT INTO ticket_sla (ticket_id, resolved_at, resolved_by)
+        SELECT id, COALESCE(closed_at, created_at), closed_by FROM tickets WHERE status = 'closed'
+        ON CONFLICT(ticket_id) DO UPDATE SET resolved_at = excluded.resolved_at,
+            resolved_by = COALESCE(excluded.resolved_by, first_response_by)
+    ''')
 
+    stats = {}
+    def agent(agent_id):
+        if agent_id not in stats:
+            stats[agent_id] = {
+                'answered': 0, 'closed': 0, 'ratings': [0] * 6,
+                'response': QuantileSketch(), 'resolution': QuantileSketch()
+            }
+        return stats[agent_id]
+
+    cursor.execute("SELECT agent_id, COUNT(*) FROM ticket_agents GROUP BY agent_id")
+    for agent_id, count in cursor.fetchall():
+        agent(agent_id)['answered'] = count
+    cursor.execute("SELECT closed_by, COUNT(*) FROM tickets WHERE status = 'closed' AND closed_by IS NOT NULL GROUP BY closed_by")
+    for agent_id, count in cursor.fetchall():
+        agent(agent_id)['closed'] = count
+    cursor.execute("SELECT agent_id, rating, COUNT(*) FROM ticket_ratings GROUP BY agent_id, rating")
+    for agent_id, rating, count in cursor.fetchall():
+        agent(agent_id)['ratings'][rating] = count
     cursor.execute('''
-        SELECT AVG(rating), COUNT(*) FROM ticket_ratings WHERE agent_id = ?
-    ''', (agent_id,))
-    row = cursor.fetchone()
-    avg_rating = row[0] or 0
-    ratings_count = row[1] or 0
+        SELECT s.first_response_by, (julianday(s.first_response_at) - julianday(t.created_at)) * 86400,
+               s.resolved_by, (julianday(s.resolved_at) - julianday(t.created_at)) * 86400
+        FROM ticket_sla s JOIN tickets t ON t.id = s.ticket_id
+    ''')
+    for response_by, response, resolved_by, resolution in cursor.fetchall():
+        if response_by and response is not None:
+            agent(response_by)['response'].add(response)
+        if resolved_by and resolution is not None:
+            agent(resolved_by)['resolution'].add(resolution)
+
+    for agent_id, data in stats.items():
+        ratings = data['ratings']
+        cursor.execute('''
+            INSERT OR REPLACE INTO agent_stats (agent_id, tickets_answered, tickets_closed, ratings_count, ratings_sum,
+                rating_1, rating_2, rating_3, rating_4, rating_5, response_sketch, resolution_sketch)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            agent_id, data['answered'], data['closed'], sum(ratings), sum(r * c for r, c in enumerate(ratings)),
+            *ratings[1:], data['response'].to_json(), data['resolution'].to_json()
+        ))
+    if stats:
+        logger.info(f"Сводка SLA заполнена по истории тикетов: {len(stats)} агентов")
 
+def get_agent_stats(agent_id: int):
+    """Сводка агента из одной строки agent_stats; перцентили времени — в секундах."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute('''
-        SELECT rating, COUNT(*) FROM ticket_ratings WHERE agent_id = ? GROUP BY rating
+        SELECT tickets_answered, tickets_closed, ratings_count, ratings_sum,
+               rating_1, rating_2, rating_3, rating_4, rating_5, response_sketch, resolution_sketch
+        FROM agent_stats WHERE agent_id = ?
     ''', (agent_id,))
-    rating_dist = {r: c for r, c in cursor.fetchall()}
-
+    row = cursor.fetchone() or (0, 0, 0, 0, 0, 0, 0, 0, 0, None, None)
     conn.close()
+    answered, closed, ratings_count, ratings_sum = row[:4]
+    response = QuantileSketch.from_json(row[9])
+    resolution = QuantileSketch.from_json(row[10])
     return {
-        'total_tickets': total_tickets,
-        'closed_tickets': closed_tickets,
-        'avg_rating': round(avg_rating, 2),
+        'total_tickets': answered,
+        'closed_tickets': closed,
+        'avg_rating': round(ratings_sum / ratings_count, 2) if ratings_count else 0,
         'ratings_count': ratings_count,
-        'rating_dist': rating_dist
+        'rating_dist': {r: c for r, c in zip(range(1, 6), row[4:9]) if c},
+        'responses': response.count,
+        'response_p50': response.quantile(0.5),
+        'response_p90': response.quantile(0.9),
+        'response_p99': response.quantile(0.99),
+        'resolutions': resolution.count,
+        'resolution_p50': resolution.quantile(0.5),
+        'resolution_p90': resolution.quantile(0.9),
+        'resolution_p99': resolution.quantile(0.99),
     }
 
 def get_top_agents(limit: int = 10):
@@ -903,11 +1635,11 @@ def get_top_agents(limit: int = 10):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT u.username, u.full_name, AVG(tr.rating) as avg_rating, COUNT(tr.id) as votes
-        FROM ticket_ratings tr
-        JOIN users u ON tr.agent_id = u.user_id
-        GROUP BY tr.agent_id
-        ORDER BY avg_rating DESC, votes DESC
+        SELECT u.username, u.full_name, CAST(s.ratings_sum AS REAL) / s.ratings_count, s.ratings_count
+        FROM agent_stats s
+        JOIN users u ON s.agent_id = u.user_id
+        WHERE s.ratings_count > 0
+        ORDER BY CAST(s.ratings_sum AS REAL) / s.ratings_count DESC, s.ratings_count DESC
         LIMIT ?
     ''', (limit,))
     top = cursor.fetchall()
@@ -942,84 +1674,69 @@ def get_promocode(code: str):
     conn.close()
     return promocode
 
-def use_promocode(user_id: int, promocode_id: int, order_id: int = None):
+def has_used_promocode(user_id: int, promocode_id: int) -> bool:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT 1 FROM used_promocodes WHERE user_id = ? AND promocode_id = ?",
+        (user_id, promocode_id)
+    )
+    used = cursor.fetchone() is not None
+    conn.close()
+    return used
+
+def claim_promocode(user_id: int, promocode_id: int, order_id: int = None):
+    """
+    Использование промокода одной транзакцией: запись в used_promocodes (уникальный
+    индекс не даст использовать дважды) и условное увеличение used_count — лимит и
+    срок проверяет сам UPDATE, поэтому одновременные заявки его не превысят.
+    Возвращает (статус, процент, used_count): 'ok', 'used', 'exhausted', 'expired',
+    'not_found' или 'error'.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "SELECT * FROM used_promocodes WHERE user_id = ? AND promocode_id = ?",
-            (user_id, promocode_id)
-        )
-        if cursor.fetchone():
-            conn.close()
-            return False
-        cursor.execute(
-            "UPDATE promocodes SET used_count = used_count + 1 WHERE id = ? AND (max_uses = 0 OR used_count < max_uses)",
-            (promocode_id,)
+            """INSERT INTO used_promocodes (user_id, promocode_id, order_id) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, promocode_id) DO NOTHING RETURNING id""",
+            (user_id, promocode_id, order_id)
         )
+        if not cursor.fetchone():
+            conn.rollback()
+            return 'used', None, None
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         cursor.execute(
-            "INSERT INTO used_promocodes (user_id, promocode_id, order_id) VALUES (?, ?, ?)",
-            (user_id, promocode_id, order_id)
+            """UPDATE promocodes SET used_count = used_count + 1
+            WHERE id = ? AND (max_uses = 0 OR used_count < max_uses) AND (expires_at IS NULL OR expires_at > ?)
+            RETURNING discount_percent, used_count""",
+            (promocode_id, now)
         )
-        if order_id:
+        claimed = cursor.fetchone()
+        if not claimed:
             cursor.execute(
-                "SELECT discount_percent FROM promocodes WHERE id = ?",
+                "SELECT max_uses > 0 AND used_count >= max_uses, used_count FROM promocodes WHERE id = ?",
                 (promocode_id,)
             )
-            discount_percent = cursor.fetchone()[0]
+            row = cursor.fetchone()
+            conn.rollback()
+            if not row:
+                return 'not_found', None, None
+            return ('exhausted' if row[0] else 'expired'), None, row[1]
+        discount_percent, used_count = claimed
+        if order_id:
             cursor.execute(
                 "UPDATE orders SET promocode_id = ?, discount = total_price * ? / 100 WHERE id = ?",
                 (promocode_id, discount_percent, order_id)
             )
         conn.commit()
-        return True
+        return 'ok', discount_percent, used_count
     except Exception as e:
         conn.rollback()
         logger.error(f"Ошибка использования промокода: {e}")
-        return False
+        return 'error', None, None
     finally:
         conn.close()
 
-def check_promocode_valid(code: str, user_id: int):
-    promocode = get_promocode(code)
-    if not promocode:
-        return False, "Промокод не найден"
-    promocode_id, code_text, discount_percent, max_uses, used_count, created_at, expires_at = promocode
-    if expires_at:
-        try:
-            date_formats = [
-                '%Y-%m-%d %H:%M:%S.%f',
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d %H:%M',
-                '%Y-%m-%d'
-            ]
-            expires_at_datetime = None
-            for date_format in date_formats:
-                try:
-                    expires_at_datetime = datetime.strptime(expires_at, date_format)
-                    break
-                except ValueError:
-                    continue
-            if expires_at_datetime and expires_at_datetime < datetime.now():
-                return False, "Промокод истёк"
-        except Exception as e:
-            logger.error(f"Ошибка парсинга даты {expires_at}: {e}")
-            return False, "Ошибка проверки срока действия промокода"
-    if max_uses > 0 and used_count >= max_uses:
-        return False, "Промокод уже использован максимальное количество раз"
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT * FROM used_promocodes WHERE user_id = ? AND promocode_id = ?",
-            (user_id, promocode_id)
-        )
-        if cursor.fetchone():
-            return False, "Вы уже использовали этот промокод"
-    finally:
-        conn.close()
-    return True, discount_percent
-
 def get_all_promocodes():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -1104,7 +1821,7 @@ def get_order_status(order_id: int):
     conn.close()
     return result[0] if result else None
 
-def update_order_status(order_id: int, status: str):
+def update_order_status(order_id: int, status: str, notifications: list = None):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
@@ -1134,6 +1851,7 @@ def update_order_status(order_id: int, status: str):
                 user = get_user(user_id)
                 if user and user[9]:
                     create_referral_reward(user[9], user_id, order_id, final_price)
+        enqueue_notifications(cursor, notifications)
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -1161,9 +1879,10 @@ def get_pending_orders():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        """SELECT o.*, u.username as buyer_username 
+        """SELECT o.*, u.username as buyer_username, m.file_id, m.media_type
            FROM orders o
            JOIN users u ON o.user_id = u.user_id
+           LEFT JOIN order_media m ON m.order_id = o.id
            WHERE o.status = 'pending'
            ORDER BY o.created_at ASC"""
     )
@@ -1378,6 +2097,108 @@ def check_game_processed(game_id: str):
     finally:
         conn.close()
 
+def place_bet(game_id: str, user_id: int, game_type: str, bet_amount: int):
+    """
+    Создаёт игру и списывает ставку с виртуального баланса одной транзакцией.
+    ('ok', новый баланс), ('duplicate', None) — игра с таким game_id уже есть,
+    ('no_funds', None) — не хватает звёзд, ('error', None).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """INSERT INTO games (game_id, user_id, game_type, bet_amount, processed) VALUES (?, ?, ?, ?, 0)
+            ON CONFLICT(game_id) DO NOTHING""",
+            (game_id, user_id, game_type, bet_amount)
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return 'duplicate', None
+        cursor.execute(
+            """UPDATE users SET virtual_balance = virtual_balance - ?, last_action = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND virtual_balance >= ? RETURNING virtual_balance""",
+            (bet_amount, user_id, bet_amount)
+        )
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return 'no_funds', None
+        conn.commit()
+        invalidate_balance_cache(user_id)
+        return 'ok', row[0]
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка ставки в игре {game_id}: {e}")
+        return 'error', None
+    finally:
+        conn.close()
+
+def settle_game(game_id: str, user_id: int, game_type: str, bet_amount: int, delta: int,
+                win_amount: int, result: str, dice_message_id: int = None):
+    """
+    Итог игры одной транзакцией: строка игры создаётся или закрывается (только если ещё
+    не обработана) и виртуальный баланс меняется на delta, но не уходит в минус.
+    Повторный вызов с тем же game_id ничего не меняет.
+    ('ok', новый баланс), ('processed', None) — игра уже обработана,
+    ('no_funds', None) — delta списала бы больше, чем есть, ('error', None).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """INSERT INTO games (game_id, user_id, game_type, bet_amount, win_amount, result, dice_message_id, processed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(game_id) DO UPDATE SET
+                win_amount = excluded.win_amount, result = excluded.result,
+                dice_message_id = COALESCE(excluded.dice_message_id, games.dice_message_id), processed = 1
+            WHERE games.processed = 0""",
+            (game_id, user_id, game_type, bet_amount, win_amount, result, dice_message_id)
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return 'processed', None
+        cursor.execute(
+            """UPDATE users SET virtual_balance = virtual_balance + ?, last_action = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND virtual_balance + ? >= 0 RETURNING virtual_balance""",
+            (delta, user_id, delta)
+        )
+        row = cursor.fetchone()
+        if not row:
+            conn.rollback()
+            return 'no_funds', None
+        conn.commit()
+        if delta:
+            invalidate_balance_cache(user_id)
+        return 'ok', row[0]
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка расчёта игры {game_id}: {e}")
+        return 'error', None
+    finally:
+        conn.close()
+
+def refund_stale_games(game_type: str, minutes: int) -> int:
+    """Закрывает с возвратом ставки игры game_type, не обработанные дольше minutes минут."""
+    conn = get_db_connection()
+    try:
+        stale = conn.execute(
+            """SELECT game_id, user_id, bet_amount FROM games
+            WHERE game_type = ? AND processed = 0 AND created_at < datetime('now', ?)""",
+            (game_type, f'-{minutes} minutes')
+        ).fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка поиска незавершённых игр: {e}")
+        return 0
+    finally:
+        conn.close()
+    refunded = 0
+    for game_id, user_id, bet_amount in stale:
+        status, _ = settle_game(game_id, user_id, game_type, bet_amount,
+                                delta=bet_amount, win_amount=0, result="refund")
+        if status == 'ok':
+            refunded += 1
+    return refunded
+
 # ========== РЕФЕРАЛЬНЫЕ НАГРАДЫ ==========
 def create_referral_reward(referrer_id: int, referred_id: int, purchase_id: int, amount: int):
     conn = get_db_connection()
@@ -1705,6 +2526,7 @@ def set_setting(key: str, value: str):
         )
         conn.commit()
         _settings_cache[key] = value
+        cache_bus.publish('settings', key)
         return True
     except Exception as e:
         logger.error(f"Ошибка установки настройки {key}: {e}")
@@ -1712,9 +2534,17 @@ def set_setting(key: str, value: str):
     finally:
         conn.close()
 
+def _drop_settings(key: str = None):
+    if key is None:
+        _settings_cache.clear()
+    else:
+        _settings_cache.pop(key, None)
+
 def clear_settings_cache():
-    global _settings_cache
-    _settings_cache = {}
+    _drop_settings()
+    cache_bus.publish('settings')
+
+cache_bus.subscribe('settings', _drop_settings)
 
 def get_star_rate():
     return float(get_setting('star_rate', str(STAR_RATE)))
@@ -1915,6 +2745,124 @@ def get_achievement_stats(code: str):
     conn.close()
     return count
 
+def bump_achievement_counters(updates: list, thresholds: dict) -> list:
+    """
+    Меняет счётчики ачивок и выдаёт те, чей порог пройден этим изменением, — одной транзакцией.
+    updates — [(user_id, counter, delta)], delta None обнуляет счётчик (серия прервалась);
+    thresholds — {counter: [(порог, код ачивки)]}.
+    Возвращает новые ачивки: [(user_id, code, name, icon)].
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        earned = []
+        for user_id, counter, delta in updates:
+            if delta is None:
+                cursor.execute(
+                    "UPDATE achievement_counters SET value = 0 WHERE user_id = ? AND counter = ?",
+                    (user_id, counter)
+                )
+                continue
+            value = cursor.execute(
+                """INSERT INTO achievement_counters (user_id, counter, value) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, counter) DO UPDATE SET value = value + excluded.value
+                RETURNING value""",
+                (user_id, counter, delta)
+            ).fetchone()[0]
+            earned.extend(
+                (user_id, code) for threshold, code in thresholds.get(counter, ())
+                if value - delta < threshold <= value
+            )
+        awarded = []
+        for user_id, code in earned:
+            row = cursor.execute(
+                """INSERT OR IGNORE INTO user_achievements (user_id, ach_code)
+                SELECT ?, code FROM achievements_list WHERE code = ?
+                RETURNING ach_code""",
+                (user_id, code)
+            ).fetchone()
+            if row:
+                awarded.append((user_id, code))
+        result = []
+        for user_id, code in awarded:
+            name, icon = cursor.execute(
+                "SELECT name, icon FROM achievements_list WHERE code = ?", (code,)
+            ).fetchone()
+            result.append((user_id, code, name, icon))
+        conn.commit()
+        return result
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка обновления счётчиков ачивок: {e}")
+        return []
+    finally:
+        conn.close()
+
+def get_achievement_counters(user_id: int) -> dict:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT counter, value FROM achievement_counters WHERE user_id = ?", (user_id,))
+    counters = dict(cursor.fetchall())
+    conn.close()
+    return counters
+
+# Начальные значения счётчиков из уже накопленной истории (серии не восстанавливаются)
+ACHIEVEMENT_BACKFILL_QUERIES = {
+    'purchases': "SELECT user_id, COUNT(*) AS value FROM purchase_history GROUP BY user_id",
+    'spent': "SELECT user_id, CAST(SUM(total_price) AS INTEGER) AS value FROM purchase_history GROUP BY user_id",
+    'saved': """SELECT user_id, CAST(SUM(discount) AS INTEGER) AS value FROM orders
+                WHERE status = 'approved' GROUP BY user_id""",
+    'night_purchases': """SELECT user_id, COUNT(*) AS value FROM purchase_history
+                          WHERE CAST(strftime('%H', purchase_date, 'localtime') AS INTEGER) < 6 GROUP BY user_id""",
+    'screenshots': """SELECT user_id, COUNT(*) AS value FROM orders
+                      WHERE status = 'approved' AND (screenshot_path IS NOT NULL
+                            OR EXISTS (SELECT 1 FROM order_media m WHERE m.order_id = orders.id))
+                      GROUP BY user_id""",
+    'casino_games': """SELECT user_id, COUNT(*) AS value FROM games
+                       WHERE game_type LIKE 'casino%' AND processed = 1 AND result != 'refund' GROUP BY user_id""",
+    'referrals': """SELECT referrer_id AS user_id, COUNT(*) AS value FROM users
+                    WHERE referrer_id IS NOT NULL GROUP BY referrer_id""",
+}
+
+def backfill_achievement_counters(thresholds: dict) -> int:
+    """
+    Один раз заполняет счётчики из истории и молча выдаёт ачивки, чьи пороги уже пройдены.
+    Повторно не запускается (флаг в settings). Возвращает число выданных ачивок.
+    """
+    if get_setting('achievement_counters_ready') == '1':
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for counter, query in ACHIEVEMENT_BACKFILL_QUERIES.items():
+            # WHERE нужен, чтобы SQLite не принял ON CONFLICT за часть подзапроса
+            cursor.execute(
+                f"""INSERT INTO achievement_counters (user_id, counter, value)
+                SELECT user_id, ?, value FROM ({query}) WHERE value > 0
+                ON CONFLICT(user_id, counter) DO UPDATE SET value = MAX(value, excluded.value)""",
+                (counter,)
+            )
+        awarded = 0
+        for counter, rules in thresholds.items():
+            for threshold, code in rules:
+                cursor.execute(
+                    """INSERT OR IGNORE INTO user_achievements (user_id, ach_code)
+                    SELECT c.user_id, l.code FROM achievement_counters c
+                    JOIN achievements_list l ON l.code = ?
+                    WHERE c.counter = ? AND c.value >= ?""",
+                    (code, counter, threshold)
+                )
+                awarded += cursor.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка заполнения счётчиков ачивок: {e}")
+        return 0
+    finally:
+        conn.close()
+    set_setting('achievement_counters_ready', '1')
+    return awarded
+
 # ========== ССЫЛКИ СО СКИДКОЙ ==========
 def create_discount_link(discount_percent: int, max_uses: int = 1, expires_at: datetime = None, comment: str = "", created_by: int = None):
     code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
@@ -2170,6 +3118,75 @@ def get_sales_by_day(days: int):
     conn.close()
     return sales
 
+def get_economy_samples(days: int) -> dict:
+    """
+    Выборки поведения игроков за days дней для симулятора экономики.
+    Сессия — игры одного пользователя за один день.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    period = f'-{days} days'
+    cursor.execute(
+        """SELECT SUM(game_type = 'mines'), SUM(game_type LIKE 'casino%')
+           FROM games
+           WHERE processed = 1 AND result != 'refund' AND created_at >= datetime('now', ?)
+           GROUP BY user_id, DATE(created_at)""",
+        (period,)
+    )
+    sessions = cursor.fetchall()
+    cursor.execute(
+        """SELECT bet_amount FROM games
+           WHERE game_type LIKE 'casino%' AND processed = 1 AND result != 'refund'
+             AND created_at >= datetime('now', ?)""",
+        (period,)
+    )
+    casino_bets = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        """SELECT from_currency, amount FROM exchanges
+           WHERE status != 'rejected' AND created_at >= datetime('now', ?)""",
+        (period,)
+    )
+    exchanges = cursor.fetchall()
+    cursor.execute("SELECT virtual_balance FROM users")
+    balances = [row[0] or 0 for row in cursor.fetchall()]
+    conn.close()
+    return {
+        'mines_rounds': [row[0] for row in sessions],
+        'casino_rounds': [row[1] for row in sessions],
+        'casino_bets': casino_bets,
+        'virtual_to_real': [amount for currency, amount in exchanges if currency == 'virtual'],
+        'real_to_virtual': [amount for currency, amount in exchanges if currency == 'real'],
+        'balances': balances,
+    }
+
+# Запросы истории для пересчёта экономики при других настройках (whatif.py)
+ECONOMY_HISTORY_QUERIES = {
+    # покупки после id: id, заказ, количество звёзд, итоговая цена, цена до скидки
+    'purchases': """SELECT h.id, h.order_id, h.amount, h.total_price, COALESCE(o.total_price, h.total_price)
+                    FROM purchase_history h
+                    LEFT JOIN orders o ON o.id = h.order_id
+                    WHERE h.id > ?
+                    ORDER BY h.id""",
+    # заказы, за которые начислена реферальная награда
+    'referrals': "SELECT purchase_id FROM referral_rewards",
+    'withdrawals': "SELECT amount FROM withdrawals WHERE status != 'rejected'",
+    # 1 — виртуальные→реальные, 0 — реальные→виртуальные
+    'exchanges': "SELECT from_currency = 'virtual', amount FROM exchanges WHERE status != 'rejected'",
+}
+
+def iter_economy_history(kind: str, chunk_size: int, params: tuple = ()):
+    """Строки ECONOMY_HISTORY_QUERIES[kind] пачками по chunk_size."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(ECONOMY_HISTORY_QUERIES[kind], params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
 def count_users_by_role():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -2408,43 +3425,7 @@ def delete_sale(sale_id: int):
         return False
 
 # ========== БЕКАПЫ ==========
-def create_backup():
-    os.makedirs(BACKUP_DIR, exist_ok=True)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_file = f"{BACKUP_DIR}/backup_{timestamp}.db"
-    shutil.copy2(DATABASE_NAME, backup_file)
-    return backup_file
-
-def list_backups():
-    files = glob.glob(f"{BACKUP_DIR}/backup_*.db")
-    files.sort(key=os.path.getmtime, reverse=True)
-    backups = []
-    for f in files:
-        size = os.path.getsize(f)
-        mtime = os.path.getmtime(f)
-        backups.append({
-            'path': f,
-            'name': os.path.basename(f),
-            'size': size,
-            'mtime': datetime.fromtimestamp(mtime)
-        })
-    return backups
-
-def restore_backup(filepath: str):
-    try:
-        shutil.copy2(filepath, DATABASE_NAME)
-        clear_settings_cache()
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка восстановления бекапа: {e}")
-        return False
-
-def cleanup_old_backups(keep_count: int = 7):
-    files = glob.glob(f"{BACKUP_DIR}/backup_*.db")
-    files.sort(key=os.path.getmtime)
-    if len(files) > keep_count:
-        for f in files[:-keep_count]:
-            os.remove(f)
+# Создание, проверка и восстановление бекапов — см. backups.py
 
 # ========== РАССЫЛКИ ==========
 def create_mailing(
@@ -2501,6 +3482,54 @@ def update_mailing_status(mailing_id: int, status: str, sent: int = 0, failed: i
     finally:
         conn.close()
 
+def start_mailing(mailing_id: int, total_count: int) -> bool:
+    """Переводит рассылку в 'sending'. False — её уже забрал другой процесс."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE mailings SET status = 'sending', total_count = ? WHERE id = ? AND status = 'pending'",
+            (total_count, mailing_id)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+    except Exception as e:
+        logger.error(f"Ошибка запуска рассылки: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_mailing_recipients(filter_type: str, admin_id: int = None) -> list:
+    """Список user_id получателей рассылки по фильтру."""
+    if filter_type == 'test':
+        return [admin_id] if admin_id else []
+    if filter_type == 'active':
+        active, _ = get_users_by_activity(7)
+        return [row[0] for row in active]
+    if filter_type == 'inactive':
+        _, inactive = get_users_by_activity(30)
+        return [row[0] for row in inactive]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if filter_type == 'top':
+        cursor.execute('''
+            SELECT h.user_id
+            FROM purchase_history h
+            JOIN users u ON h.user_id = u.user_id
+            WHERE u.role NOT IN ('admin', 'tech_admin', 'owner', 'moder', 'agent')
+            GROUP BY h.user_id
+            ORDER BY SUM(h.total_price) DESC
+            LIMIT 10
+        ''')
+    elif filter_type == 'all':
+        cursor.execute("SELECT user_id FROM users")
+    else:
+        conn.close()
+        return []
+    rows = cursor.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
 def get_mailing_stats(mailing_id: int):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -2509,6 +3538,648 @@ def get_mailing_stats(mailing_id: int):
     conn.close()
     return row
 
+# ========== ПЛАНИРОВЩИК ==========
+def get_job_runs() -> dict:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, last_run, last_duration, runs, failures, last_error FROM scheduler_jobs")
+    rows = cursor.fetchall()
+    conn.close()
+    return {
+        row[0]: {'last_run': row[1], 'last_duration': row[2], 'runs': row[3], 'failures': row[4], 'last_error': row[5]}
+        for row in rows
+    }
+
+def save_job_run(name: str, last_run: float, duration: float, ok: bool, error: str = None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO scheduler_jobs (name, last_run, last_duration, runs, failures, last_error)
+            VALUES (?, ?, ?, 1, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                last_run = excluded.last_run,
+                last_duration = excluded.last_duration,
+                runs = runs + 1,
+                failures = failures + excluded.failures,
+                last_error = excluded.last_error
+        """, (name, last_run, duration, 0 if ok else 1, error))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка сохранения запуска задачи {name}: {e}")
+    finally:
+        conn.close()
+
+# ========== СКРИНШОТЫ ==========
+def add_screenshot(path: str, sha256: str, size: int, user_id: int) -> int:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO screenshots (path, sha256, size, user_id) VALUES (?, ?, ?, ?)",
+        (path, sha256, size, user_id)
+    )
+    screenshot_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return screenshot_id
+
+def find_screenshot_by_hash(sha256: str):
+    """(id, path, последняя заявка) для последней записи с таким содержимым или None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # path — из той же строки, что и id: при двух агрегатах SQLite не гарантирует, откуда берётся голый столбец
+    cursor.execute(
+        """SELECT id, path, (SELECT MAX(order_id) FROM screenshots WHERE sha256 = ?)
+        FROM screenshots WHERE sha256 = ? ORDER BY id DESC LIMIT 1""",
+        (sha256, sha256)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def link_screenshot(screenshot_id: int, order_id: int):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE screenshots SET order_id = ? WHERE id = ?", (order_id, screenshot_id))
+    conn.commit()
+    conn.close()
+
+def add_legacy_screenshots(rows: list):
+    """rows: (path, size, created_at) файлов, сохранённых до появления индекса."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO screenshots (path, size, created_at) VALUES (?, ?, ?)",
+            rows
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка индексации старых скриншотов: {e}")
+        raise
+    finally:
+        conn.close()
+
+def pop_expired_screenshots(days: int, limit: int):
+    """
+    Удаляет из индекса до limit записей старше days дней.
+    Возвращает (количество удалённых записей, пути файлов, на которые больше никто не ссылается).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT id, path FROM screenshots WHERE created_at < datetime('now', ?) ORDER BY created_at LIMIT ?",
+            (f'-{days} days', limit)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return 0, []
+        cursor.executemany("DELETE FROM screenshots WHERE id = ?", [(row[0],) for row in rows])
+        orphans = []
+        for path in {row[1] for row in rows}:
+            cursor.execute("SELECT 1 FROM screenshots WHERE path = ? LIMIT 1", (path,))
+            if cursor.fetchone() is None:
+                orphans.append(path)
+        conn.commit()
+        return len(rows), orphans
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка выборки старых скриншотов: {e}")
+        return 0, []
+    finally:
+        conn.close()
+
+# ========== МЕДИА ЗАЯВОК ==========
+def add_order_media(order_id: int, file_id: str, file_unique_id: str, media_type: str = 'photo',
+                    notifications: list = None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO order_media (order_id, file_id, file_unique_id, media_type) VALUES (?, ?, ?, ?)",
+        (order_id, file_id, file_unique_id, media_type)
+    )
+    enqueue_notifications(cursor, notifications)
+    conn.commit()
+    conn.close()
+
+def get_order_media(order_id: int):
+    """(file_id, media_type) скриншота заявки или None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT file_id, media_type FROM order_media WHERE order_id = ?", (order_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def find_order_by_file_unique_id(file_unique_id: str, exclude_order_id: int = None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT MAX(order_id) FROM order_media WHERE file_unique_id = ? AND order_id != ?",
+        (file_unique_id, exclude_order_id or 0)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def get_unarchived_media(limit: int = 20, max_attempts: int = MEDIA_ARCHIVE_MAX_ATTEMPTS):
+    """
+    (order_id, user_id, file_id) скриншотов, ещё не сохранённых на диск.
+    Не скачавшиеся идут после новых, а после max_attempts неудач не выбираются вовсе.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT m.order_id, o.user_id, m.file_id
+           FROM order_media m
+           JOIN orders o ON o.id = m.order_id
+           WHERE m.archived = 0 AND m.archive_attempts < ?
+           ORDER BY m.archive_attempts, m.order_id
+           LIMIT ?""",
+        (max_attempts, limit)
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def mark_media_failed(order_id: int):
+    """Неудачное скачивание скриншота: увеличивает счётчик попыток, возвращает его."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        row = cursor.execute(
+            "UPDATE order_media SET archive_attempts = archive_attempts + 1 WHERE order_id = ? RETURNING archive_attempts",
+            (order_id,)
+        ).fetchone()
+        conn.commit()
+        return row[0] if row else 0
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка отметки неудачной архивации скриншота заявки {order_id}: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def mark_media_archived(order_id: int, path: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE order_media SET archived = 1 WHERE order_id = ?", (order_id,))
+        cursor.execute("UPDATE orders SET screenshot_path = ? WHERE id = ?", (path, order_id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка отметки архивации скриншота заявки {order_id}: {e}")
+    finally:
+        conn.close()
+
+def get_cached_file_id(path: str, size: int, mtime: float):
+    """file_id ранее загруженного файла, если файл с тех пор не менялся."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT file_id FROM file_id_cache WHERE path = ? AND size = ? AND mtime = ?",
+        (path, size, mtime)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def save_cached_file_id(path: str, size: int, mtime: float, file_id: str, media_type: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO file_id_cache (path, size, mtime, file_id, media_type) VALUES (?, ?, ?, ?, ?)",
+        (path, size, mtime, file_id, media_type)
+    )
+    conn.commit()
+    conn.close()
+
+def drop_cached_file_id(path: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM file_id_cache WHERE path = ?", (path,))
+    conn.commit()
+    conn.close()
+
+# ========== ОЧЕРЕДЬ МОДЕРАЦИИ ==========
+# Строки очереди: (item_id, user_id, username, amount, value, details, created_at)
+_MODERATION_QUERIES = {
+    'order': """
+        SELECT o.id, o.user_id, u.username, o.amount, o.total_price - COALESCE(o.discount, 0),
+               COALESCE(o.comment, o.recipient_username), o.created_at
+        FROM orders o LEFT JOIN users u ON u.user_id = o.user_id
+        WHERE o.status = 'pending' {where}
+        ORDER BY o.created_at, o.id""",
+    'withdrawal': """
+        SELECT w.withdrawal_id, w.user_id, u.username, w.amount, w.payout_amount,
+               w.recipient_username, w.created_at
+        FROM withdrawals w LEFT JOIN users u ON u.user_id = w.user_id
+        WHERE w.status = 'pending' {where}
+        ORDER BY w.created_at, w.id""",
+    'exchange': """
+        SELECT e.exchange_id, e.user_id, u.username, e.amount, e.converted_amount,
+               e.from_currency || '_to_' || e.to_currency, e.created_at
+        FROM exchanges e LEFT JOIN users u ON u.user_id = e.user_id
+        WHERE e.status = 'pending' {where}
+        ORDER BY e.created_at, e.id""",
+}
+_MODERATION_KEYS = {'order': 'o.id', 'withdrawal': 'w.withdrawal_id', 'exchange': 'e.exchange_id'}
+
+def get_moderation_items(kind: str):
+    """Все ожидающие модерации заявки одного вида — для первичного заполнения очереди."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(_MODERATION_QUERIES[kind].format(where=""))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_moderation_item(kind: str, item_id):
+    """Строка заявки, если она всё ещё ожидает модерации, иначе None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        _MODERATION_QUERIES[kind].format(where=f"AND {_MODERATION_KEYS[kind]} = ?"),
+        (item_id,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def claim_moderation_item(kind: str, item_id: str, moderator_id: int, lease_seconds: int):
+    """
+    Закрепляет заявку за модератором, если она свободна, аренда истекла
+    или уже принадлежит ему (тогда аренда продлевается).
+    Возвращает (moderator_id, expires_at) фактического владельца.
+    """
+    now = time.time()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO moderation_claims (kind, item_id, moderator_id, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(kind, item_id) DO UPDATE SET
+                moderator_id = excluded.moderator_id,
+                expires_at = excluded.expires_at
+            WHERE moderation_claims.moderator_id = excluded.moderator_id
+               OR moderation_claims.expires_at < ?
+        """, (kind, str(item_id), moderator_id, now + lease_seconds, now))
+        cursor.execute(
+            "SELECT moderator_id, expires_at FROM moderation_claims WHERE kind = ? AND item_id = ?",
+            (kind, str(item_id))
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        return row
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка закрепления заявки {kind}:{item_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def release_moderation_item(kind: str, item_id: str, moderator_id: int = None):
+    """Снимает закрепление; с moderator_id — только если заявка закреплена за ним."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if moderator_id is None:
+        cursor.execute("DELETE FROM moderation_claims WHERE kind = ? AND item_id = ?", (kind, str(item_id)))
+    else:
+        cursor.execute(
+            "DELETE FROM moderation_claims WHERE kind = ? AND item_id = ? AND moderator_id = ?",
+            (kind, str(item_id), moderator_id)
+        )
+    released = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return released
+
+def get_moderation_claims(kind: str, item_ids: list) -> dict:
+    """Действующие закрепления для заявок одной страницы: {item_id: (moderator_id, expires_at)}."""
+    if not item_ids:
+        return {}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(item_ids))
+    cursor.execute(
+        f"SELECT item_id, moderator_id, expires_at FROM moderation_claims "
+        f"WHERE kind = ? AND item_id IN ({placeholders}) AND expires_at >= ?",
+        (kind, *[str(i) for i in item_ids], time.time())
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+# ========== ИСХОДЯЩИЕ УВЕДОМЛЕНИЯ ==========
+def enqueue_notifications(cursor, notifications: list, delay: float = 0):
+    """
+    Записывает уведомления (см. outbox.notification) курсором вызывающего,
+    то есть в той же транзакции, что и изменение, о котором они сообщают.
+    delay — через сколько секунд их можно отправлять (альбом, который ещё собирается).
+    """
+    if not notifications:
+        return
+    now = time.time()
+    for chat_id, method, text, file_id, markup, thread_id, relay in notifications:
+        cursor.execute(
+            """INSERT INTO outbox (chat_id, method, text, file_id, reply_markup, thread_id, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (chat_id, method, text, file_id, markup, thread_id, now + delay, now)
+        )
+        if relay:
+            ticket_id, content_type, from_chat_id, message_ids, reply_to = relay
+            cursor.execute(
+                """INSERT INTO outbox_relay (notification_id, ticket_id, content_type, from_chat_id, message_ids, reply_to)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (cursor.lastrowid, ticket_id, content_type, from_chat_id, json.dumps(message_ids), reply_to)
+            )
+
+def add_notifications(notifications: list) -> bool:
+    """Ставит уведомления в очередь отдельной транзакцией."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        enqueue_notifications(cursor, notifications)
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка записи уведомлений: {e}")
+        return False
+    finally:
+        conn.close()
+
+def get_due_notifications(limit: int):
+    """
+    Уведомления, которые пора отправить, в порядке постановки. Чат, у которого
+    более раннее уведомление ждёт повтора, пропускается — порядок внутри чата не нарушается.
+    Для пересылки сообщений тикета в конце строки — поля outbox_relay, иначе NULL.
+    """
+    now = time.time()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT o.id, o.chat_id, o.method, o.text, o.file_id, o.reply_markup, o.thread_id, o.attempts, o.created_at,
+               r.ticket_id, r.content_type, r.from_chat_id, r.message_ids, r.reply_to
+        FROM outbox o
+        LEFT JOIN outbox_relay r ON r.notification_id = o.id
+        WHERE status = 'pending' AND next_attempt_at <= ?
+          AND NOT EXISTS (
+              SELECT 1 FROM outbox w
+              WHERE w.chat_id = o.chat_id AND w.status = 'pending'
+                AND w.id < o.id AND w.next_attempt_at > ?
+          )
+        ORDER BY o.id LIMIT ?
+    """, (now, now, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def mark_notifications_sent(ids: list):
+    if not ids:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, last_error = NULL WHERE id = ?",
+        [(time.time(), i) for i in ids]
+    )
+    conn.commit()
+    conn.close()
+
+def reschedule_notification(notification_id: int, next_attempt_at: float, error: str, count_attempt: bool = True):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE outbox SET next_attempt_at = ?, last_error = ?, attempts = attempts + ? WHERE id = ?",
+        (next_attempt_at, error[:500], 1 if count_attempt else 0, notification_id)
+    )
+    conn.commit()
+    conn.close()
+
+def fail_notification(notification_id: int, error: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+        (error[:500], notification_id)
+    )
+    conn.commit()
+    conn.close()
+
+def save_message_links(links: list):
+    """Пары [(ticket_id, chat_id, message_id, peer_chat_id, peer_message_id)] — запоминаются в обе стороны."""
+    if not links:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            """INSERT OR REPLACE INTO ticket_message_links (chat_id, message_id, ticket_id, peer_chat_id, peer_message_id)
+            VALUES (?, ?, ?, ?, ?)""",
+            [row for ticket_id, chat_id, message_id, peer_chat_id, peer_message_id in links
+             for row in ((chat_id, message_id, ticket_id, peer_chat_id, peer_message_id),
+                         (peer_chat_id, peer_message_id, ticket_id, chat_id, message_id))]
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка сохранения связей сообщений тикета: {e}")
+    finally:
+        conn.close()
+
+def get_message_link(chat_id: int, message_id: int):
+    """(ticket_id, peer_chat_id, peer_message_id) для сообщения, пересланного в тикете, или None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT ticket_id, peer_chat_id, peer_message_id FROM ticket_message_links WHERE chat_id = ? AND message_id = ?",
+        (chat_id, message_id)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def get_outbox_stats() -> dict:
+    """{'pending': n, 'failed': n, 'oldest_pending': created_at или None}."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status = 'pending'")
+    pending, oldest = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'")
+    failed = cursor.fetchone()[0]
+    conn.close()
+    return {'pending': pending, 'failed': failed, 'oldest_pending': oldest}
+
+# ========== ПРАВИЛА РАЗБОРА ТИКЕТОВ ==========
+def get_triage_rules():
+    """[(id, pattern, is_regex, priority, subject, template, assign_group, enabled, hits)]"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, pattern, is_regex, priority, subject, template, assign_group, enabled, hits "
+        "FROM triage_rules ORDER BY id"
+    )
+    rules = cursor.fetchall()
+    conn.close()
+    return rules
+
+def add_triage_rule(pattern: str, is_regex: bool = False, priority: str = None, subject: str = None,
+                    template: str = None, assign_group: str = None, created_by: int = None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """INSERT INTO triage_rules (pattern, is_regex, priority, subject, template, assign_group, created_by)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (pattern, 1 if is_regex else 0, priority, subject, template, assign_group, created_by)
+        )
+        conn.commit()
+        return cursor.lastrowid
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка добавления правила разбора: {e}")
+        return None
+    finally:
+        conn.close()
+
+def update_triage_rule(rule_id: int, **fields) -> bool:
+    """Меняет поля правила (enabled, pattern, priority, ...)."""
+    allowed = {'pattern', 'is_regex', 'priority', 'subject', 'template', 'assign_group', 'enabled'}
+    fields = {k: v for k, v in fields.items() if k in allowed}
+    if not fields:
+        return False
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        cursor.execute(f"UPDATE triage_rules SET {assignments} WHERE id = ?", (*fields.values(), rule_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка изменения правила разбора: {e}")
+        return False
+    finally:
+        conn.close()
+
+def delete_triage_rule(rule_id: int) -> bool:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM triage_rules WHERE id = ?", (rule_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка удаления правила разбора: {e}")
+        return False
+    finally:
+        conn.close()
+
+def add_triage_hits(hits: dict) -> bool:
+    """Прибавляет накопленные в памяти срабатывания {rule_id: count}."""
+    if not hits:
+        return True
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "UPDATE triage_rules SET hits = hits + ? WHERE id = ?",
+            [(count, rule_id) for rule_id, count in hits.items()]
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка сохранения срабатываний правил: {e}")
+        return False
+    finally:
+        conn.close()
+
+# ========== РЕЗЕРВ ТЕМ ФОРУМА ==========
+def add_pool_topic(chat_id: int, topic_id: int) -> bool:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT OR IGNORE INTO forum_topic_pool (chat_id, topic_id, created_at) VALUES (?, ?, ?)",
+            (chat_id, topic_id, time.time())
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка добавления темы в резерв: {e}")
+        return False
+    finally:
+        conn.close()
+
+def claim_pool_topic(chat_id: int):
+    """Забирает самую старую тему из резерва: topic_id или None. Одну тему получает только один процесс."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """DELETE FROM forum_topic_pool WHERE chat_id = ? AND topic_id = (
+                   SELECT topic_id FROM forum_topic_pool WHERE chat_id = ? ORDER BY created_at LIMIT 1
+               ) RETURNING topic_id""",
+            (chat_id, chat_id)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка выдачи темы из резерва: {e}")
+        return None
+    finally:
+        conn.close()
+
+def count_pool_topics(chat_id: int) -> int:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM forum_topic_pool WHERE chat_id = ?", (chat_id,))
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+# ========== ОЧИСТКА СТАРЫХ ЗАПИСЕЙ ==========
+def cleanup_old_records(days: int = 30, admin_logs_days: int = 180) -> int:
+    """Удаляет отметки обработанных действий, старые записи журнала администрации и доставленные уведомления."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM processed_actions WHERE created_at < datetime('now', ?)",
+            (f'-{days} days',)
+        )
+        deleted = cursor.rowcount
+        cursor.execute(
+            "DELETE FROM admin_logs WHERE created_at < datetime('now', ?)",
+            (f'-{admin_logs_days} days',)
+        )
+        deleted += cursor.rowcount
+        cursor.execute(
+            "DELETE FROM outbox WHERE status != 'pending' AND created_at < ?",
+            (time.time() - days * 86400,)
+        )
+        deleted += cursor.rowcount
+        cursor.execute("DELETE FROM outbox_relay WHERE notification_id NOT IN (SELECT id FROM outbox)")
+        conn.commit()
+        return deleted
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Ошибка очистки старых записей: {e}")
+        return 0
+    finally:
+        conn.close()
+
 # ========== ВЕРСИЯ БД ==========
 def get_db_version():
     return "3.0"
@@ -0,0 +1,268 @@
+# FILE: economy_sim.py
+"""
+Симулятор экономики виртуальных звёзд методом Монте-Карло.
+Параметры игр и обмена подбирались на глаз; здесь их можно проверить до
+выкладки. Поведение игроков берётся из истории (games, exchanges, балансы
+users): сколько раундов «Мин» и казино в сессии, какие ставки, как часто и на
+сколько меняют звёзды. Сессии проигрываются пачками массивов numpy — миллион
+сессий считается за секунды. Итог по набору параметров: преимущество казино,
+изменение баланса игрока за сессию и прирост виртуальных звёзд (инфляция).
+Запуск: python -m economy_sim --sessions 1000000 --candidate "casino_multiplier=3,mines_reward=4"
+БД берётся по относительному пути DATABASE_NAME — запускайте из каталога бота.
+"""
+import argparse
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from config import (
+    MINES_GAME_WIN_REWARD, MINES_GAME_LOSE_PENALTY, CASINO_WIN_MULTIPLIER, CASINO_BET_AMOUNTS,
+    WITHDRAW_MIN_REAL, ECONOMY_SIM_SESSIONS, ECONOMY_SIM_HISTORY_DAYS
+)
+from database import (
+    get_economy_samples, get_virtual_to_real_rate, get_virtual_to_real_commission,
+    get_real_to_virtual_rate, get_exchange_commission
+)
+
+PARAMS = (
+    'casino_win_chance', 'casino_multiplier', 'mines_reward', 'mines_penalty',
+    'virtual_to_real_rate', 'virtual_to_real_commission', 'real_to_virtual_rate', 'exchange_commission',
+)
+# Выигрышный шар — один из трёх
+MINES_WIN_CHANCE = 1 / 3
+# Джекпот 🎰 — одно значение из 64; этот же шанс показывается игрокам
+CASINO_DICE_CHANCE = 1 / 64
+# Длиннее сессии обрезаются — выбросы не растягивают пачку
+MAX_ROUNDS = 500
+BATCH_SIZE = 250_000
+
+# Поведение по умолчанию, пока в БД нет истории
+DEFAULT_SAMPLES = {
+    'mines_rounds': [1, 2, 3, 5, 8, 0, 0, 4],
+    'casino_rounds': [0, 1, 0, 2, 3, 5, 1, 0],
+    'casino_bets': CASINO_BET_AMOUNTS[:3],
+    'virtual_to_real': [250, 400],
+    'real_to_virtual': [15, 30],
+    'balances': [0, 10, 25, 50, 100, 300],
+}
+
+
+def current_params() -> Dict[str, float]:
+    """Параметры, с которыми бот работает сейчас (курсы и комиссии — из настроек в БД)."""
+    return {
+        'casino_win_chance': CASINO_DICE_CHANCE,
+        'casino_multiplier': CASINO_WIN_MULTIPLIER,
+        'mines_reward': MINES_GAME_WIN_REWARD,
+        'mines_penalty': MINES_GAME_LOSE_PENALTY,
+        'virtual_to_real_rate': get_virtual_to_real_rate(),
+        'virtual_to_real_commission': get_virtual_to_real_commission(),
+        'real_to_virtual_rate': get_real_to_virtual_rate(),
+        'exchange_commission': get_exchange_commission(),
+    }
+
+
+def parse_params(text: str, base: Dict[str, float] = None) -> Dict[str, float]:
+    """«casino_multiplier=3, mines_reward=4» → параметры поверх base. ValueError на неизвестный ключ или не число."""
+    params = dict(base or current_params())
+    for item in text.replace(',', ' ').split():
+        key, sep, value = item.partition('=')
+        if not sep or key not in PARAMS:
+            raise ValueError(f"неизвестный параметр: {key}")
+        params[key] = float(value)
+    return params
+
+
+# ========== ПОВЕДЕНИЕ ИГРОКОВ ==========
+def fit_profile(samples: Dict[str, list] = None) -> dict:
+    """
+    Эмпирические распределения из get_economy_samples: сессии выбираются целиком
+    (раунды мин и казино вместе), ставки — с частотами из истории, обмены — с
+    вероятностью на сессию. Пустые выборки заменяются DEFAULT_SAMPLES.
+    """
+    if samples is None:
+        samples = get_economy_samples(ECONOMY_SIM_HISTORY_DAYS)
+    history = len(samples.get('mines_rounds') or ())
+    if history:
+        merged = {key: samples.get(key) or DEFAULT_SAMPLES[key] for key in DEFAULT_SAMPLES}
+        exchange_chance = {key: len(samples.get(key) or ()) / history for key in ('virtual_to_real', 'real_to_virtual')}
+    else:
+        merged = dict(DEFAULT_SAMPLES)
+        exchange_chance = {'virtual_to_real': 0.02, 'real_to_virtual': 0.02}
+    bets, counts = np.unique(np.asarray(merged['casino_bets'], dtype=np.int64), return_counts=True)
+    return {
+        'mines_rounds': np.minimum(np.asarray(merged['mines_rounds'], dtype=np.int64), MAX_ROUNDS),
+        'casino_rounds': np.minimum(np.asarray(merged['casino_rounds'], dtype=np.int64), MAX_ROUNDS),
+        'bets': bets,
+        'bet_weights': counts / counts.sum(),
+        'virtual_to_real': np.asarray(merged['virtual_to_real'], dtype=np.int64),
+        'real_to_virtual': np.asarray(merged['real_to_virtual'], dtype=np.int64),
+        'virtual_to_real_chance': min(1.0, exchange_chance['virtual_to_real']),
+        'real_to_virtual_chance': min(1.0, exchange_chance['real_to_virtual']),
+        'balances': np.asarray(merged['balances'], dtype=np.int64),
+        'history_sessions': history,
+    }
+
+
+# ========== СИМУЛЯЦИЯ ==========
+def _play(rng, balance, rounds, stake, win_delta, win_chance) -> tuple:
+    """
+    Раунды одной игры для всей пачки. Сессии упорядочены по убыванию числа раундов,
+    поэтому на шаге t считается только префикс тех, кто ещё играет. stake — ставка
+    или функция, выбирающая ставки на раунд (казино).
+    Играет только тот, кому хватает на ставку. Возвращает (раундов, сумма ставок, чистый итог игроков).
+    """
+    order = np.argsort(-rounds, kind='stable')
+    ordered = balance[order]
+    ascending = np.sort(rounds)
+    played = staked = net = 0
+    for t in range(int(ascending[-1]) if len(ascending) else 0):
+        active = len(ascending) - int(np.searchsorted(ascending, t, side='right'))
+        view = ordered[:active]
+        bet = stake(active) if callable(stake) else stake
+        can_play = view >= bet
+        won = rng.random(active) < win_chance
+        delta = np.where(won, win_delta(bet), -bet) * can_play
+        view += delta
+        played += int(can_play.sum())
+        staked += int((bet * can_play).sum())
+        net += int(delta.sum())
+    balance[order] = ordered
+    return played, staked, net
+
+
+def _exchange(rng, balance, chance: float, amounts) -> tuple:
+    """Кто из пачки меняет звёзды в этой сессии и на сколько (сумма из истории обменов)."""
+    chosen = rng.random(len(balance)) < chance
+    return chosen, amounts[rng.integers(len(amounts), size=len(balance))] * chosen
+
+
+def _simulate_batch(rng, profile: dict, params: Dict[str, float], size: int, totals: dict):
+    session = rng.integers(len(profile['mines_rounds']), size=size)
+    balance = profile['balances'][rng.integers(len(profile['balances']), size=size)].copy()
+    start = balance.copy()
+
+    # Покупка виртуальных звёзд за реальные — в начале сессии
+    _, real_in = _exchange(rng, balance, profile['real_to_virtual_chance'], profile['real_to_virtual'])
+    minted = (real_in * params['real_to_virtual_rate'] * (1 - params['exchange_commission'])).astype(np.int64)
+    balance += minted
+
+    penalty = int(params['mines_penalty'])
+    mines = _play(rng, balance, profile['mines_rounds'][session], penalty,
+                  lambda bet: int(params['mines_reward']), MINES_WIN_CHANCE)
+    casino = _play(rng, balance, profile['casino_rounds'][session],
+                   lambda active: rng.choice(profile['bets'], size=active, p=profile['bet_weights']),
+                   lambda bet: (bet * params['casino_multiplier']).astype(np.int64) - bet,
+                   params['casino_win_chance'])
+
+    # Вывод в реальные — в конце сессии, не больше баланса и не меньше минимума
+    rate = params['virtual_to_real_rate'] * (1 - params['virtual_to_real_commission'])
+    min_virtual = int(WITHDRAW_MIN_REAL / rate) if rate > 0 else 0
+    _, wanted = _exchange(rng, balance, profile['virtual_to_real_chance'], profile['virtual_to_real'])
+    burned = np.minimum(wanted, balance) * (np.minimum(wanted, balance) >= max(min_virtual, 1))
+    balance -= burned
+
+    totals['sessions'] += size
+    totals['start_supply'] += int(start.sum())
+    totals['mines_rounds'] += mines[0]
+    totals['mines_staked'] += mines[1]
+    totals['mines_net'] += mines[2]
+    totals['casino_rounds'] += casino[0]
+    totals['casino_staked'] += casino[1]
+    totals['casino_net'] += casino[2]
+    totals['minted'] += int(minted.sum())
+    totals['burned'] += int(burned.sum())
+    totals['real_in'] += int(real_in.sum())
+    totals['real_out'] += int((burned * rate).astype(np.int64).sum())
+    totals['drift'].append(balance - start)
+
+
+def simulate(params: Dict[str, float], sessions: int = ECONOMY_SIM_SESSIONS, profile: dict = None,
+             seed: Optional[int] = None) -> dict:
+    """
+    Прогоняет sessions игровых сессий с параметрами params. Блокирующая и
+    нагружает процессор — из бота вызывать через asyncio.to_thread.
+    """
+    started = time.perf_counter()
+    profile = profile if profile is not None else fit_profile()
+    rng = np.random.default_rng(seed)
+    totals = {key: 0 for key in (
+        'sessions', 'start_supply', 'mines_rounds', 'mines_staked', 'mines_net', 'casino_rounds',
+        'casino_staked', 'casino_net', 'minted', 'burned', 'real_in', 'real_out',
+    )}
+    totals['drift'] = []
+    for offset in range(0, sessions, BATCH_SIZE):
+        _simulate_batch(rng, profile, params, min(BATCH_SIZE, sessions - offset), totals)
+
+    drift = np.concatenate(totals.pop('drift'))
+    games_net = totals['mines_net'] + totals['casino_net']
+    created = games_net + totals['minted'] - totals['burned']
+    count = max(totals['sessions'], 1)
+    return {
+        **totals,
+        'mines_edge': -totals['mines_net'] / totals['mines_staked'] if totals['mines_staked'] else 0.0,
+        'casino_edge': -totals['casino_net'] / totals['casino_staked'] if totals['casino_staked'] else 0.0,
+        'drift_mean': float(drift.mean()),
+        'winning_sessions': float((drift > 0).mean()),
+        'drift_p5': float(np.percentile(drift, 5)),
+        'drift_p50': float(np.percentile(drift, 50)),
+        'drift_p95': float(np.percentile(drift, 95)),
+        'created_per_session': created / count,
+        'inflation': created / totals['start_supply'] if totals['start_supply'] else 0.0,
+        'real_net_per_session': (totals['real_out'] - totals['real_in']) / count,
+        'history_sessions': profile['history_sessions'],
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def compare(candidates: Dict[str, Dict[str, float]], sessions: int = ECONOMY_SIM_SESSIONS,
+            seed: int = 1) -> Dict[str, dict]:
+    """Прогон нескольких наборов параметров на одном профиле поведения и одинаковых случайных числах."""
+    profile = fit_profile()
+    return {name: simulate(params, sessions, profile, seed) for name, params in candidates.items()}
+
+
+def format_results(results: Dict[str, dict], candidates: Dict[str, Dict[str, float]]) -> str:
+    lines = []
+    base = current_params()
+    for name, result in results.items():
+        changed = {key: value for key, value in candidates[name].items() if value != base.get(key)}
+        lines.append(f"▶ {name}" + (f" ({', '.join(f'{k}={v:g}' for k, v in changed.items())})" if changed else ""))
+        lines.append(f"├─ Преимущество: мины {result['mines_edge']:+.1%}, казино {result['casino_edge']:+.1%}")
+        lines.append(
+            f"├─ Баланс игрока за сессию: p5 {result['drift_p5']:+.0f}, медиана {result['drift_p50']:+.0f}, "
+            f"p95 {result['drift_p95']:+.0f}, в плюсе {result['winning_sessions']:.0%} сессий"
+        )
+        lines.append(
+            f"├─ Новых виртуальных на сессию: {result['created_per_session']:+.2f} "
+            f"({result['inflation']:+.2%} от стартовых балансов)"
+        )
+        lines.append(f"└─ Реальных звёзд на сессию (вывод − покупка): {result['real_net_per_session']:+.3f}")
+    if results:
+        first = next(iter(results.values()))
+        lines.append(
+            f"\nСессий на набор: {first['sessions']}, сессий в истории: {first['history_sessions']}, "
+            f"{first['seconds']:.1f} с на набор"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Монте-Карло экономики виртуальных звёзд")
+    parser.add_argument("--sessions", type=int, default=ECONOMY_SIM_SESSIONS)
+    parser.add_argument("--candidate", action="append", default=[],
+                        help=f"набор параметров «ключ=значение,...»; ключи: {', '.join(PARAMS)}")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    candidates = {"сейчас": current_params()}
+    for index, text in enumerate(args.candidate, 1):
+        try:
+            candidates[f"вариант {index}"] = parse_params(text)
+        except ValueError as e:
+            parser.error(str(e))
+    print(format_results(compare(candidates, args.sessions, args.seed), candidates))
+
+
+if __name__ == "__main__":
+    main()
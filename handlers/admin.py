@@ -1,4 +1,6 @@
 # FILE: handlers/admin.py
+import asyncio
+import html
 import logging
 import os
 import json
@@ -7,41 +9,44 @@ from datetime import datetime, timedelta
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from config import (
     OWNER_ID, TECH_ADMIN_ID, ITEMS_PER_PAGE, BACKUP_DIR,
     MINES_GAME_WIN_REWARD, MINES_GAME_LOSE_PENALTY,
-    CASINO_BET_AMOUNTS, CASINO_WIN_CHANCE, CASINO_WIN_MULTIPLIER
+    CASINO_BET_AMOUNTS, CASINO_WIN_MULTIPLIER,
+    MODERATION_LEASE_SECONDS, MODERATION_PAGE_SIZE, ECONOMY_SIM_SESSIONS
 )
 from database import (
     get_user, get_user_role, set_user_role, get_user_by_id_or_username,
-    get_all_users, get_user_orders, get_pending_orders, get_order_status, update_order_status,
+    get_all_users, get_user_orders, get_order_status, update_order_status,
     get_revenue_for_period, get_active_users_count, get_average_check, get_sales_by_day,
     get_top_buyers_no_admins, get_top_buyers, count_users_by_role,
-    update_balance, create_promocode, get_promocode, delete_promocode, get_all_promocodes, update_promocode,
+    update_balance, get_promocode, get_all_promocodes,
     get_setting, set_setting, clear_settings_cache, get_star_rate, get_min_stars, get_withdraw_commission,
-    get_exchange_commission, get_withdraw_min_real, is_rounding_enabled,
+    get_exchange_commission, get_withdraw_min_real, is_rounding_enabled, get_virtual_to_real_commission,
     get_referral_levels, get_all_achievements, create_achievement, delete_achievement, update_achievement,
     get_achievement_stats, award_achievement, remove_achievement_from_user,
     create_discount_link, get_all_discount_links, delete_discount_link,
     freeze_user, unfreeze_user, is_user_frozen, get_all_frozen_users,
-    create_backup, list_backups, restore_backup, cleanup_old_backups,
     set_maintenance_mode, is_maintenance_mode, get_maintenance_info,
     log_admin_action, get_admin_logs,
     create_sale, get_all_sales, update_sale, delete_sale,
     save_ticket_template, delete_ticket_template, get_all_ticket_templates, get_ticket_template,
     get_birthday_info, set_birthday_info,
     create_mailing, get_pending_mailings, update_mailing_status, get_mailing_stats,
+    get_job_runs,
     get_users_by_activity, get_db_connection,
     add_warn, get_warns, remove_warn,
     add_ban, remove_ban, get_ban, is_user_banned, get_all_bans,
-    get_ticket, get_all_tickets, add_ticket_message, update_ticket_status
+    get_ticket, add_ticket_message, update_ticket_status,
+    add_triage_rule, update_triage_rule, delete_triage_rule
 )
 from keyboards import (
     AdminCallback, UserCallback, PromocodeCallback, BackupCallback, AchievementCallback,
-    get_admin_main_keyboard, get_back_to_admin_keyboard, get_economy_keyboard,
+    get_admin_main_keyboard, get_back_to_admin_keyboard, get_economy_keyboard, get_setting_confirm_keyboard,
     get_promocodes_main_keyboard, get_promocode_actions_keyboard,
     get_sales_main_keyboard, get_sale_actions_keyboard,
     get_birthday_keyboard, get_templates_main_keyboard, get_template_actions_keyboard,
@@ -50,9 +55,22 @@ from keyboards import (
     get_tech_main_keyboard, get_maintenance_keyboard, get_backup_menu_keyboard,
     get_backup_actions_keyboard, get_mailing_main_keyboard, get_mailing_filter_keyboard,
     get_mailing_preview_keyboard, get_logs_filter_keyboard, get_settings_main_keyboard,
-    get_pagination_keyboard, get_order_action_keyboard, get_processed_order_keyboard
+    get_pagination_keyboard, get_order_action_keyboard, get_processed_order_keyboard,
+    ModerationCallback, get_moderation_menu_keyboard, get_moderation_queue_keyboard,
+    get_moderation_item_keyboard, get_withdrawal_keyboard, get_exchange_approve_keyboard
 )
 from states import AdminStates
+from backups import create_backup, list_backups, restore_backup, delete_backup
+from media import send_file, send_order_screenshot
+from moderation import moderation_queue, claim_for_callback, KIND_TITLES
+import economy_sim
+import outbox
+import topic_pool
+import whatif
+from send_scheduler import send_scheduler, LANES, LANE_TITLES
+from assignment import agent_dispatcher
+from promocodes import promo_service
+from triage import triage_engine, validate_pattern as validate_triage_pattern, PRIORITIES as TRIAGE_PRIORITIES
 from helpers import (
     has_access, format_datetime, format_file_size, format_duration,
     get_role_display, invalidate_settings_cache, invalidate_top_cache, can_ban
@@ -69,7 +87,7 @@ async def cmd_admin(message: types.Message):
     username = user[2] or f"id{message.from_user.id}"
     role_display = get_role_display(user[7] if len(user) > 7 else 'user')
     text = f"🔐 <b>АДМИН-ПАНЕЛЬ</b>\n\nВы вошли как: @{username} (Роль: {role_display})"
-    await message.answer(text, reply_markup=get_admin_main_keyboard())
+    await message.answer(text, reply_markup=get_admin_main_keyboard(moderation_queue.total()))
 
 @router.callback_query(AdminCallback.filter(F.action == "main"))
 async def admin_main_menu(callback: types.CallbackQuery):
@@ -77,7 +95,7 @@ async def admin_main_menu(callback: types.CallbackQuery):
     username = user[2] or f"id{callback.from_user.id}"
     role_display = get_role_display(user[7] if len(user) > 7 else 'user')
     text = f"🔐 <b>АДМИН-ПАНЕЛЬ</b>\n\nВы вошли как: @{username} (Роль: {role_display})"
-    await callback.message.edit_text(text, reply_markup=get_admin_main_keyboard())
+    await callback.message.edit_text(text, reply_markup=get_admin_main_keyboard(moderation_queue.total()))
     await callback.answer()
 
 @router.callback_query(AdminCallback.filter(F.action == "back"))
@@ -102,6 +120,8 @@ async def economy_menu(callback: types.CallbackQuery):
     )
     await callback.message.edit_text(text, reply_markup=get_economy_keyboard())
     await callback.answer()
+    # История для предпросмотра изменений грузится, пока админ выбирает настройку
+    asyncio.get_running_loop().run_in_executor(None, whatif.prefetch)
 
 # ---- Изменение курса ----
 @router.callback_query(AdminCallback.filter(F.action == "edit_star_rate"))
@@ -116,17 +136,51 @@ async def process_star_rate(message: types.Message, state: FSMContext):
         rate = float(message.text.replace(',', '.'))
         if rate <= 0:
             raise ValueError
-        set_setting('star_rate', str(rate))
-        await invalidate_settings_cache()
-        await message.answer(f"✅ Курс изменён: 1⭐ = {rate:.2f}₽")
-        await state.clear()
-        await economy_menu_custom(message)
     except ValueError:
         await message.answer("❌ Введите положительное число.", reply_markup=get_back_to_admin_keyboard())
+        return
+    await _preview_setting(message, state, 'star_rate', rate, f"✅ Курс изменён: 1⭐ = {rate:.2f}₽")
 
 async def economy_menu_custom(message: types.Message):
     await message.answer("💰 Управление экономикой", reply_markup=get_economy_keyboard())
 
+# ---- Предпросмотр изменения ----
+async def _preview_setting(message: types.Message, state: FSMContext, key: str, value, done_text: str):
+    """Показывает, как изменение сказалось бы на истории, и ждёт подтверждения перед set_setting."""
+    stored = json.dumps(value, ensure_ascii=False) if isinstance(value, list) else str(value)
+    try:
+        report = whatif.format_preview(await asyncio.to_thread(whatif.preview, {key: value}))
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Ошибка предпросмотра {key}={stored}: {e}")
+        await state.clear()
+        await message.answer(f"❌ Недопустимое значение {key}: {html.escape(str(e))}")
+        return
+    await state.set_state(AdminStates.waiting_setting_confirm)
+    await state.update_data(pending_key=key, pending_value=stored, pending_text=done_text)
+    await message.answer(
+        f"🔮 <b>Если бы так было всегда</b>\n\n{html.escape(report)}\n\nПрименить?",
+        reply_markup=get_setting_confirm_keyboard()
+    )
+
+@router.callback_query(AdminStates.waiting_setting_confirm, AdminCallback.filter(F.action == "setting_apply"))
+async def apply_setting(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    if not set_setting(data['pending_key'], data['pending_value']):
+        await callback.answer("❌ Ошибка сохранения", show_alert=True)
+        return
+    await invalidate_settings_cache()
+    await callback.message.edit_text(data['pending_text'])
+    await callback.answer()
+    await economy_menu_custom(callback.message)
+
+@router.callback_query(AdminCallback.filter(F.action == "setting_cancel"))
+async def cancel_setting(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("❌ Изменение отменено")
+    await callback.answer()
+    await economy_menu_custom(callback.message)
+
 # ---- Комиссия вывода ----
 @router.callback_query(AdminCallback.filter(F.action == "edit_withdraw_commission"))
 async def edit_withdraw_commission(callback: types.CallbackQuery, state: FSMContext):
@@ -140,13 +194,10 @@ async def process_withdraw_commission(message: types.Message, state: FSMContext)
         comm = float(message.text.replace(',', '.'))
         if comm < 0 or comm > 100:
             raise ValueError
-        set_setting('withdraw_commission', str(comm/100))
-        await invalidate_settings_cache()
-        await message.answer(f"✅ Комиссия вывода изменена: {comm:.0f}%")
-        await state.clear()
-        await economy_menu_custom(message)
     except ValueError:
         await message.answer("❌ Введите число от 0 до 100.", reply_markup=get_back_to_admin_keyboard())
+        return
+    await _preview_setting(message, state, 'withdraw_commission', comm / 100, f"✅ Комиссия вывода изменена: {comm:.0f}%")
 
 # ---- Комиссия обмена реальные→виртуальные ----
 @router.callback_query(AdminCallback.filter(F.action == "edit_exchange_commission_real"))
@@ -161,18 +212,16 @@ async def process_exchange_commission_real(message: types.Message, state: FSMCon
         comm = float(message.text.replace(',', '.'))
         if comm < 0 or comm > 100:
             raise ValueError
-        set_setting('exchange_commission', str(comm/100))
-        await invalidate_settings_cache()
-        await message.answer(f"✅ Комиссия обмена реальные→вирт изменена: {comm:.0f}%")
-        await state.clear()
-        await economy_menu_custom(message)
     except ValueError:
         await message.answer("❌ Введите число от 0 до 100.", reply_markup=get_back_to_admin_keyboard())
+        return
+    await _preview_setting(message, state, 'exchange_commission', comm / 100,
+                           f"✅ Комиссия обмена реальные→вирт изменена: {comm:.0f}%")
 
 # ---- Комиссия обмена виртуальные→реальные ----
 @router.callback_query(AdminCallback.filter(F.action == "edit_exchange_commission_virtual"))
 async def edit_exchange_commission_virtual(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.edit_text(f"✏️ Введите новую комиссию на обмен вирт→реальные (в %):\nТекущая: {get_setting('virtual_to_real_commission', '50')}%", reply_markup=get_back_to_admin_keyboard())
+    await callback.message.edit_text(f"✏️ Введите новую комиссию на обмен вирт→реальные (в %):\nТекущая: {get_virtual_to_real_commission()*100:.0f}%", reply_markup=get_back_to_admin_keyboard())
     await state.set_state(AdminStates.waiting_exchange_commission_virtual)
     await callback.answer()
 
@@ -182,13 +231,11 @@ async def process_exchange_commission_virtual(message: types.Message, state: FSM
         comm = float(message.text.replace(',', '.'))
         if comm < 0 or comm > 100:
             raise ValueError
-        set_setting('virtual_to_real_commission', str(comm))
-        await invalidate_settings_cache()
-        await message.answer(f"✅ Комиссия обмена вирт→реальные изменена: {comm:.0f}%")
-        await state.clear()
-        await economy_menu_custom(message)
     except ValueError:
         await message.answer("❌ Введите число от 0 до 100.", reply_markup=get_back_to_admin_keyboard())
+        return
+    await _preview_setting(message, state, 'virtual_to_real_commission', comm / 100,
+                           f"✅ Комиссия обмена вирт→реальные изменена: {comm:.0f}%")
 
 # ---- Мин. покупка ----
 @router.callback_query(AdminCallback.filter(F.action == "edit_min_stars"))
@@ -255,6 +302,8 @@ async def promocodes_menu(callback: types.CallbackQuery):
 @router.callback_query(AdminCallback.filter(F.action == "create_promocode"))
 async def create_promocode_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Введите код промокода (например: SUMMER50):", reply_markup=get_back_to_admin_keyboard())
+    # Не оставляем id от прерванного редактирования — иначе вместо создания обновится старый код
+    await state.update_data(promo_id=None)
     await state.set_state(AdminStates.waiting_promo_code)
     await callback.answer()
 
@@ -294,14 +343,18 @@ async def process_promo_expires(message: types.Message, state: FSMContext):
     try:
         days = int(message.text)
         data = await state.get_data()
-        code = data['promo_code']
+        code = data.get('promo_code')
         discount = data['discount']
         max_uses = data['max_uses']
         expires_at = None
         if days > 0:
             expires_at = datetime.now() + timedelta(days=days)
-        create_promocode(code, discount, max_uses, expires_at)
-        await message.answer(f"✅ Промокод {code} создан!")
+        if data.get('promo_id'):
+            promo_service.update(data['promo_id'], discount, max_uses, expires_at)
+            await message.answer("✅ Промокод обновлён!")
+        else:
+            promo_service.create(code, discount, max_uses, expires_at)
+            await message.answer(f"✅ Промокод {code} создан!")
         await state.clear()
         await promocodes_menu_custom(message)
     except ValueError:
@@ -347,7 +400,7 @@ async def edit_promocode(callback: types.CallbackQuery, callback_data: Promocode
 
 @router.callback_query(PromocodeCallback.filter(F.action == "delete"))
 async def delete_promocode_handler(callback: types.CallbackQuery, callback_data: PromocodeCallback):
-    delete_promocode(callback_data.promo_id)
+    promo_service.delete(callback_data.promo_id)
     await callback.answer("✅ Промокод удалён", show_alert=True)
     await list_promocodes(callback, AdminCallback(action="list_promocodes", page=callback_data.page))
 
@@ -1166,18 +1219,28 @@ async def backup_menu(callback: types.CallbackQuery):
     await callback.message.edit_text("💾 <b>БЕКАПЫ</b>", reply_markup=get_backup_menu_keyboard())
     await callback.answer()
 
+async def send_backup(message: types.Message):
+    """Снимает бекап в фоновом потоке и отправляет его файлом, если он влезает в лимит Telegram."""
+    try:
+        backup_file = await asyncio.to_thread(create_backup)
+    except Exception as e:
+        logger.error(f"Ошибка создания бекапа: {e}")
+        await message.answer("❌ Ошибка создания бекапа.")
+        return
+    size = os.path.getsize(backup_file)
+    caption = f"✅ Бекап создан: {os.path.basename(backup_file)}\nРазмер: {format_file_size(size)}"
+    if size > 50 * 1024 * 1024:
+        await message.answer(caption + "\n\n⚠️ Файл больше 50 МБ и хранится только на сервере.")
+        return
+    await send_file(message.bot, message.chat.id, backup_file, 'document', caption=caption)
+
 @router.callback_query(AdminCallback.filter(F.action == "create_backup"))
 async def create_backup_cmd(callback: types.CallbackQuery):
     if not has_access(callback.from_user.id, 'tech_admin'):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
-    backup_file = create_backup()
-    doc = FSInputFile(backup_file)
-    await callback.message.answer_document(
-        doc,
-        caption=f"✅ Бекап создан: {os.path.basename(backup_file)}\nРазмер: {format_file_size(os.path.getsize(backup_file))}"
-    )
-    await callback.answer()
+    await callback.answer("⏳ Создаю бекап...")
+    await send_backup(callback.message)
 
 @router.callback_query(AdminCallback.filter(F.action == "list_backups"))
 async def list_backups_cmd(callback: types.CallbackQuery, callback_data: AdminCallback):
@@ -1195,7 +1258,12 @@ async def list_backups_cmd(callback: types.CallbackQuery, callback_data: AdminCa
 
     text = f"📋 <b>СПИСОК БЕКАПОВ</b> (стр. {page}/{total_pages})\n\n"
     for i, b in enumerate(current, start=start+1):
-        text += f"{i}. {b['name']} — {format_file_size(b['size'])} — {format_datetime(b['mtime'])}\n"
+        checked = "🔐" if b['manifest'] else "📄"
+        if b['manifest'] and b['manifest'].get('kind') == 'delta':
+            changed = b['manifest']['changed_pages']
+            text += f"{i}. └ Δ {b['name']} — {format_file_size(b['size'])} — {changed} стр. — {b['mtime'].strftime('%d.%m.%Y %H:%M')}\n"
+        else:
+            text += f"{i}. {checked} {b['name']} — {format_file_size(b['size'])} — {b['mtime'].strftime('%d.%m.%Y %H:%M')}\n"
         text += f"   [🔄 ВОССТАНОВИТЬ] [🗑️ УДАЛИТЬ]\n\n"
 
     keyboard = get_pagination_keyboard(page, total_pages, "list_backups")
@@ -1233,10 +1301,11 @@ async def confirm_restore(message: types.Message, state: FSMContext):
         return
     data = await state.get_data()
     filepath = data['backup_file']
-    if restore_backup(filepath):
+    await message.answer("⏳ Проверяю бекап и восстанавливаю базу...")
+    if await asyncio.to_thread(restore_backup, filepath):
         await message.answer("✅ База данных восстановлена из бекапа!")
     else:
-        await message.answer("❌ Ошибка восстановления.")
+        await message.answer("❌ Ошибка восстановления: бекап повреждён или недоступен.")
     await state.clear()
 
 @router.callback_query(BackupCallback.filter(F.action == "delete"))
@@ -1247,7 +1316,7 @@ async def delete_backup_cmd(callback: types.CallbackQuery, callback_data: Backup
     filename = callback_data.filename
     filepath = os.path.join(BACKUP_DIR, filename)
     try:
-        os.remove(filepath)
+        delete_backup(filepath)
         await callback.answer(f"🗑️ Бекап {filename} удалён", show_alert=True)
     except Exception as e:
         logger.error(f"Ошибка удаления бекапа: {e}")
@@ -1266,6 +1335,8 @@ async def clear_cache_cmd(callback: types.CallbackQuery):
 async def system_status(callback: types.CallbackQuery):
     import platform
     from main import bot
+    from scheduler import scheduler
+    import media
     uptime_seconds = (datetime.now() - bot.start_time).seconds if hasattr(bot, 'start_time') else 0
     try:
         import psutil
@@ -1282,6 +1353,63 @@ async def system_status(callback: types.CallbackQuery):
         f"├─ Uptime: {format_duration(uptime_seconds)}\n"
         f"└─ Платформа: {platform.system()} {platform.release()}"
     )
+    status_text += "\n\n⏱ <b>ФОНОВЫЕ ЗАДАЧИ</b>\n"
+    jobs = scheduler.stats()
+    if not jobs:
+        # планировщик работает в другом процессе — берём сохранённые данные
+        jobs = [dict(name=name, running=False, max_duration=None, **info) for name, info in get_job_runs().items()]
+    for job in jobs:
+        icon = "🔄" if job['running'] else ("🔴" if job['last_error'] else "🟢")
+        last_run = datetime.fromtimestamp(job['last_run']).strftime('%d.%m.%Y %H:%M') if job['last_run'] else "ещё не запускалась"
+        max_duration = f" (макс. {job['max_duration']:.2f} с)" if job['max_duration'] else ""
+        status_text += (
+            f"{icon} {job['name']}: {last_run}, {job['last_duration'] or 0:.2f} с{max_duration}, "
+            f"запусков {job['runs']}, ошибок {job['failures']}\n"
+        )
+    media_stats = media.stats()
+    status_text += (
+        f"\n📎 <b>МЕДИА</b>\n"
+        f"├─ По file_id: {media_stats['file_id_sends']} (p95 {media_stats['file_id_p95'] * 1000:.0f} мс)\n"
+        f"├─ Загрузок: {media_stats['uploads']}, {format_file_size(media_stats['upload_bytes'])} "
+        f"(p95 {media_stats['upload_p95'] * 1000:.0f} мс)\n"
+        f"└─ Архивировано: {media_stats['archived']}, {format_file_size(media_stats['archive_bytes'])}, "
+        f"не скачалось: {media_stats['archive_failed']}"
+    )
+    outbox_stats = outbox.stats()
+    oldest = outbox_stats['oldest_pending']
+    lag = f", старейшее ждёт {format_duration(int(datetime.now().timestamp() - oldest))}" if oldest else ""
+    status_text += (
+        f"\n\n📨 <b>УВЕДОМЛЕНИЯ</b>\n"
+        f"├─ В очереди: {outbox_stats['pending']}{lag}\n"
+        f"├─ Доставлено: {outbox_stats['sent']} (задержка p95 {outbox_stats['delay_p95']:.1f} с)\n"
+        f"└─ Не доставлено: {outbox_stats['failed']}"
+    )
+    if outbox_stats['relay']:
+        status_text += "\n\n🔁 <b>ПЕРЕСЫЛКА ТИКЕТОВ</b> (до доставки)\n"
+        relayed = list(outbox_stats['relay'].items())
+        status_text += "\n".join(
+            f"{'└─' if index == len(relayed) - 1 else '├─'} {content_type}: {info['count']}, "
+            f"p50 {info['p50']:.1f} с, p95 {info['p95']:.1f} с"
+            for index, (content_type, info) in enumerate(relayed)
+        )
+    pool_stats = topic_pool.stats()
+    status_text += (
+        f"\n\n🗂 <b>ТЕМЫ ТИКЕТОВ</b>\n"
+        f"├─ В резерве: {pool_stats['available']}, создано задачей: {pool_stats['created']}\n"
+        f"├─ Из резерва: {pool_stats['pooled']} (тикет за p50 {pool_stats['pooled_p50'] * 1000:.0f} мс, "
+        f"p95 {pool_stats['pooled_p95'] * 1000:.0f} мс)\n"
+        f"└─ Создано на месте: {pool_stats['on_demand']} (тикет за p50 {pool_stats['on_demand_p50'] * 1000:.0f} мс, "
+        f"p95 {pool_stats['on_demand_p95'] * 1000:.0f} мс)"
+    )
+    status_text += "\n\n🚦 <b>ОТПРАВКА</b> (ожидание лимитов)\n"
+    lanes = send_scheduler.stats()
+    for index, lane in enumerate(LANES):
+        info = lanes[lane]
+        branch = "└─" if index == len(LANES) - 1 else "├─"
+        status_text += (
+            f"{branch} {LANE_TITLES[lane]}: {info['requests']}, p50 {info['wait_p50'] * 1000:.0f} мс, "
+            f"p95 {info['wait_p95'] * 1000:.0f} мс, ждут {info['waiting']}, 429: {info['retry_after']}\n"
+        )
     await callback.message.edit_text(status_text, reply_markup=get_back_to_admin_keyboard())
     await callback.answer()
 
@@ -1396,60 +1524,28 @@ async def preview_mailing(message: types.Message, state: FSMContext):
 
 @router.callback_query(AdminCallback.filter(F.action == "mailing_send"))
 async def mailing_send(callback: types.CallbackQuery, state: FSMContext):
-    from main import bot
+    from scheduler import scheduler
     data = await state.get_data()
     filter_type = data.get('mailing_filter')
     text = data.get('mailing_text')
     media = data.get('mailing_media')
     button = data.get('mailing_button')
-
-    if filter_type == 'all':
-        users = get_all_users()
-    elif filter_type == 'active':
-        active, _ = get_users_by_activity(7)
-        users = active
-    elif filter_type == 'inactive':
-        _, inactive = get_users_by_activity(30)
-        users = inactive
-    elif filter_type == 'top':
-        top = get_top_buyers_no_admins(10)
-        users = [(u[0], u[1], u[2]) for u in top]
-    elif filter_type == 'test':
-        users = [(callback.from_user.id, None, None)]
-    else:
-        users = []
-
-    success = 0
-    fail = 0
-
-    for user in users:
-        user_id = user[0] if isinstance(user, tuple) else user[0]
-        try:
-            if media:
-                media_type, file_id = media
-                if media_type == 'photo':
-                    await bot.send_photo(user_id, file_id, caption=text)
-                elif media_type == 'video':
-                    await bot.send_video(user_id, file_id, caption=text)
-                elif media_type == 'animation':
-                    await bot.send_animation(user_id, file_id, caption=text)
-                elif media_type == 'sticker':
-                    await bot.send_sticker(user_id, file_id)
-                    if text:
-                        await bot.send_message(user_id, text)
-            else:
-                await bot.send_message(user_id, text)
-            success += 1
-        except Exception as e:
-            logger.error(f"Ошибка отправки {user_id}: {e}")
-            fail += 1
-
+    media_type, file_id = media if media else (None, None)
+    button_text, button_url = button if button else (None, None)
+
+    # Рассылку отправляет фоновая задача планировщика
+    mailing_id = create_mailing(
+        callback.from_user.id, filter_type, text,
+        media_file_id=file_id, media_type=media_type,
+        button_text=button_text, button_url=button_url
+    )
+    if not mailing_id:
+        await callback.answer("❌ Не удалось создать рассылку", show_alert=True)
+        return
+    scheduler.trigger("mailings")
     await callback.message.edit_text(
-        f"✅ РАССЫЛКА ЗАВЕРШЕНА\n\n"
-        f"📊 РЕЗУЛЬТАТЫ:\n"
-        f"├─ Всего: {len(users)}\n"
-        f"├─ Доставлено: {success}\n"
-        f"└─ Ошибок: {fail}"
+        f"📤 РАССЫЛКА #{mailing_id} ПОСТАВЛЕНА В ОЧЕРЕДЬ\n\n"
+        f"Итоги придут сообщением после отправки."
     )
     await state.clear()
     await callback.answer()
@@ -1475,54 +1571,117 @@ async def mailing_stats(callback: types.CallbackQuery, callback_data: AdminCallb
 # ========== ЗАКАЗЫ ==========
 @router.callback_query(AdminCallback.filter(F.action == "orders_menu"))
 async def orders_menu(callback: types.CallbackQuery):
-    orders = get_pending_orders()
-    count = len(orders)
-    text = f"📦 <b>ЗАКАЗЫ</b>\n\nОжидают подтверждения: {count}"
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="📋 Показать все", callback_data=AdminCallback(action="list_orders").pack()))
-    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=AdminCallback(action="main").pack()))
-    await callback.message.edit_text(text, reply_markup=builder.as_markup())
-    await callback.answer()
+    counts = moderation_queue.counts()
+    text = (
+        f"📦 <b>ОЧЕРЕДЬ МОДЕРАЦИИ</b>\n\n"
+        f"Ожидают решения:\n"
+        f"├─ Заказы: {counts['order']}\n"
+        f"├─ Выводы: {counts['withdrawal']}\n"
+        f"└─ Обмены: {counts['exchange']}"
+    )
+    await callback.message.edit_text(text, reply_markup=get_moderation_menu_keyboard(counts))
+    await callback.answer()
+
+def _moderation_summary(item) -> str:
+    if item.kind == 'order':
+        if item.details == 'virtual_purchase':
+            return f"{item.amount} вирт ⭐ · {item.value:.2f}₽"
+        return f"{item.amount} ⭐ · {item.value:.2f}₽ · {item.details}"
+    if item.kind == 'withdrawal':
+        return f"{item.amount} вирт → {item.value} ⭐ · {item.details}"
+    return f"{item.amount} → {item.value} · {item.details}"
+
+def _moderation_item_text(item) -> str:
+    titles = {'order': '🆔 Заявка', 'withdrawal': '📤 Вывод', 'exchange': '💱 Обмен'}
+    return (
+        f"{titles[item.kind]} <b>#{item.item_id}</b>\n\n"
+        f"👤 Пользователь: @{item.username or 'без юзернейма'} (ID: {item.user_id})\n"
+        f"📋 {_moderation_summary(item)}\n"
+        f"📅 Дата: {format_datetime(item.created_at)}"
+    )
+
+def _moderation_actions(item):
+    if item.kind == 'order':
+        return get_order_action_keyboard(item.item_id)
+    if item.kind == 'withdrawal':
+        return get_withdrawal_keyboard(item.item_id)
+    return get_exchange_approve_keyboard(item.item_id, item.details)
+
+def _moderation_page(kind: str, page: int, moderator_id: int):
+    items, claims, page, total_pages = moderation_queue.page(kind, page, MODERATION_PAGE_SIZE)
+    text = f"{KIND_TITLES[kind]} — <b>ОЧЕРЕДЬ</b> (стр. {page}/{total_pages})\n\n"
+    if not items:
+        text += "✅ Нет заявок, ожидающих решения."
+    start = (page - 1) * MODERATION_PAGE_SIZE
+    for i, item in enumerate(items, start=start + 1):
+        text += f"{i}. #{str(item.item_id)[:8]} · @{item.username or item.user_id} · {_moderation_summary(item)}\n"
+        text += f"   📅 {format_datetime(item.created_at)}"
+        claim = claims.get(str(item.item_id))
+        if claim:
+            if claim[0] == moderator_id:
+                text += " · 🔒 у вас"
+            else:
+                holder = get_user(claim[0])
+                text += f" · 🔒 @{holder[2] if holder and holder[2] else claim[0]}"
+        text += "\n"
+    keyboard = get_moderation_queue_keyboard(kind, [item.item_id for item in items], page, total_pages)
+    return text, keyboard
 
 @router.callback_query(AdminCallback.filter(F.action == "list_orders"))
 async def list_orders(callback: types.CallbackQuery):
-    orders = get_pending_orders()
-    if not orders:
-        await callback.message.edit_text("✅ Нет pending заявок.", reply_markup=get_back_to_admin_keyboard())
-        await callback.answer()
+    text, keyboard = _moderation_page('order', 1, callback.from_user.id)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+@router.callback_query(ModerationCallback.filter(F.action == "list"))
+async def moderation_list(callback: types.CallbackQuery, callback_data: ModerationCallback):
+    if not has_access(callback.from_user.id, 'admin'):
+        await callback.answer("⛔ Нет доступа", show_alert=True)
         return
-    for order in orders:
-        order_id, user_id_db, amount, recipient, screenshot, status, total_price, promocode_id, discount, created_at, _, buyer_username = order
-        final_price = total_price - (discount or 0)
-        order_text = (
-            f"🆔 <b>Заявка #{order_id}</b>\n\n"
-            f"👤 Покупатель: @{buyer_username}\n"
-            f"⭐ Количество: {amount} звёзд\n"
-            f"💰 Сумма: {final_price:.2f}₽\n"
-            f"🎯 Получатель: {recipient}\n"
-            f"📅 Дата: {format_datetime(created_at)}"
-        )
+    text, keyboard = _moderation_page(callback_data.kind, callback_data.page, callback.from_user.id)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        # страница не изменилась
+        pass
+    await callback.answer()
+
+@router.callback_query(ModerationCallback.filter(F.action == "open"))
+async def moderation_open(callback: types.CallbackQuery, callback_data: ModerationCallback):
+    if not has_access(callback.from_user.id, 'admin'):
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+    kind = callback_data.kind
+    item = moderation_queue.get(kind, callback_data.item_id)
+    if not item:
+        await callback.answer("Эта заявка уже обработана", show_alert=True)
+        await moderation_list(callback, ModerationCallback(action="list", kind=kind, page=callback_data.page))
+        return
+    if not await claim_for_callback(callback, kind, item.item_id):
+        return
+    text = _moderation_item_text(item)
+    keyboard = get_moderation_item_keyboard(kind, str(item.item_id), callback_data.page, _moderation_actions(item))
+    sent = None
+    if kind == 'order':
         try:
-            await callback.message.answer(order_text)
-            if os.path.exists(screenshot):
-                photo = FSInputFile(screenshot)
-                await callback.message.answer_photo(
-                    photo,
-                    caption=f"Заявка #{order_id}",
-                    reply_markup=get_order_action_keyboard(order_id)
-                )
-            else:
-                await callback.message.answer(
-                    "⚠️ Скриншот не найден",
-                    reply_markup=get_order_action_keyboard(order_id)
-                )
-        except Exception as e:
-            logger.error(f"Ошибка отправки заявки {order_id}: {e}")
-            await callback.message.answer(
-                f"❌ Ошибка загрузки заявки #{order_id}",
-                reply_markup=get_order_action_keyboard(order_id)
+            sent = await send_order_screenshot(
+                callback.bot, callback.message.chat.id, item.item_id, caption=text, reply_markup=keyboard
             )
-    await callback.answer()
+        except Exception as e:
+            logger.error(f"Ошибка отправки скриншота заявки {item.item_id}: {e}")
+        if not sent:
+            text += "\n\n⚠️ Скриншот не найден"
+    if not sent:
+        await callback.message.answer(text, reply_markup=keyboard)
+    await callback.answer(f"🔒 Заявка закреплена за вами на {MODERATION_LEASE_SECONDS // 60} мин")
+
+@router.callback_query(ModerationCallback.filter(F.action == "free"))
+async def moderation_release(callback: types.CallbackQuery, callback_data: ModerationCallback):
+    if moderation_queue.release(callback_data.kind, callback_data.item_id, callback.from_user.id):
+        await callback.answer("🔓 Заявка снова доступна другим модераторам")
+    else:
+        await callback.answer("Заявка уже не закреплена за вами")
+    await callback.message.edit_reply_markup(reply_markup=None)
 
 # ========== СТАТИСТИКА ==========
 @router.callback_query(AdminCallback.filter(F.action == "stats_menu"))
@@ -1585,8 +1744,9 @@ async def settings_games(callback: types.CallbackQuery):
     text = (
         "🎮 <b>Настройки игр</b>\n\n"
         f"• Мины: выигрыш +{MINES_GAME_WIN_REWARD}⭐, проигрыш -{MINES_GAME_LOSE_PENALTY}⭐\n"
-        f"• Казино: ставки {', '.join(map(str, CASINO_BET_AMOUNTS))}⭐, шанс {CASINO_WIN_CHANCE*100}%, множитель {CASINO_WIN_MULTIPLIER}x\n\n"
-        "Редактирование через config.py (требует перезапуска)"
+        f"• Казино: ставки {', '.join(map(str, CASINO_BET_AMOUNTS))}⭐, шанс {economy_sim.CASINO_DICE_CHANCE*100:.1f}%, множитель {CASINO_WIN_MULTIPLIER}x\n\n"
+        "Редактирование через config.py (требует перезапуска)\n"
+        "Проверить новые значения до перезапуска: /simulate параметр=значение"
     )
     await callback.message.edit_text(text, reply_markup=get_back_to_admin_keyboard())
     await callback.answer()
@@ -1692,12 +1852,7 @@ async def cmd_backup(message: types.Message):
     if not has_access(message.from_user.id, 'tech_admin'):
         await message.answer("⛔ Нет доступа")
         return
-    backup_file = create_backup()
-    doc = FSInputFile(backup_file)
-    await message.answer_document(
-        doc,
-        caption=f"✅ Бекап создан: {os.path.basename(backup_file)}\nРазмер: {format_file_size(os.path.getsize(backup_file))}"
-    )
+    await send_backup(message)
 
 @router.message(Command("restore"))
 async def cmd_restore(message: types.Message, state: FSMContext):
@@ -1706,7 +1861,7 @@ async def cmd_restore(message: types.Message, state: FSMContext):
         return
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        await message.answer("❌ Использование: /restore имя_файла.db")
+        await message.answer("❌ Использование: /restore имя_файла.db.gz")
         return
     filename = args[1]
     filepath = os.path.join(BACKUP_DIR, filename)
@@ -2138,7 +2293,7 @@ async def cmd_addpromo(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer("❌ Скидка и активации должны быть числами")
         return
-    create_promocode(code, discount, max_uses)
+    promo_service.create(code, discount, max_uses)
     await message.answer(f"✅ Промокод {code} создан!")
 
 @router.message(Command("helpadmin"))
@@ -2168,7 +2323,9 @@ async def cmd_helpadmin(message: types.Message):
         "📊 <b>Статистика:</b>\n"
         "/orders - Показать заявки\n"
         "/stats - Статистика бота\n"
-        "/tickets - Открытые тикеты\n"
+        "/simulate [сессий] [параметр=значение ...] - Симуляция экономики\n"
+        "/whatif настройка=значение ... - Как изменение сказалось бы на истории\n"
+        "/tickets [all | слова] - Тикеты, поиск по переписке\n"
         "/ticket ID - Инфо о тикете\n"
         "/answer ID текст - Ответить в тикет\n"
         "/creport ID - Закрыть тикет\n\n"
@@ -2178,7 +2335,7 @@ async def cmd_helpadmin(message: types.Message):
         "/addpromo код % активации\n\n"
         "🛠️ <b>Техническое:</b>\n"
         "/backup - Создать бекап\n"
-        "/restore имя_файла.db - Восстановить\n"
+        "/restore имя_файла.db.gz - Восстановить\n"
         "/teh_on - Включить тех.работы\n"
         "/teh_off - Выключить тех.работы\n"
         "/freeze @username причина - Заморозить\n"
@@ -2194,20 +2351,8 @@ async def cmd_orders(message: types.Message):
     if not has_access(message.from_user.id, 'admin'):
         await message.answer("⛔ Нет доступа")
         return
-    orders = get_pending_orders()
-    if not orders:
-        await message.answer("✅ Нет pending заявок.")
-        return
-    for order in orders:
-        order_id, user_id, amount, recipient, screenshot, status, total_price, promo_id, discount, created_at, _, buyer_username = order
-        final_price = total_price - (discount or 0)
-        text = f"🆔 <b>Заявка #{order_id}</b>\n\n👤 Покупатель: @{buyer_username}\n⭐ Количество: {amount} звёзд\n💰 Сумма: {final_price:.2f}₽\n🎯 Получатель: {recipient}\n📅 Дата: {format_datetime(created_at)}"
-        await message.answer(text)
-        if os.path.exists(screenshot):
-            photo = FSInputFile(screenshot)
-            await message.answer_photo(photo, caption=f"Заявка #{order_id}", reply_markup=get_order_action_keyboard(order_id))
-        else:
-            await message.answer("⚠️ Скриншот не найден", reply_markup=get_order_action_keyboard(order_id))
+    text, keyboard = _moderation_page('order', 1, message.from_user.id)
+    await message.answer(text, reply_markup=keyboard)
 
 @router.message(Command("stats"))
 async def cmd_stats(message: types.Message):
@@ -2244,28 +2389,55 @@ async def cmd_stats(message: types.Message):
         text += f"{i}. @{username or 'Аноним'} — {total:.2f}₽\n"
     await message.answer(text)
 
-@router.message(Command("tickets"))
-async def cmd_tickets(message: types.Message):
-    if not has_access(message.from_user.id, 'moder'):
+@router.message(Command("simulate"))
+async def cmd_simulate(message: types.Message):
+    if not has_access(message.from_user.id, 'admin'):
         await message.answer("⛔ Нет доступа")
         return
-    args = message.text.split()
-    if len(args) > 1 and args[1].lower() == 'all':
-        tickets = get_all_tickets()
-        title = "Все тикеты"
-    else:
-        tickets = get_all_tickets('open')
-        title = "Открытые тикеты"
-    if not tickets:
-        await message.answer(f"📭 {title} отсутствуют.")
-        return
-    text = f"📋 {title}:\n\n"
-    for ticket in tickets[:20]:
-        t_id, user_id, subject, status, _, _, priority, created_at = ticket[:8]
-        user = get_user(user_id)
-        username = user[2] if user else "Неизвестно"
-        text += f"{priority} #{t_id} - @{username} - {subject} - {status} - {format_datetime(created_at)}\n\n"
-    await message.answer(text)
+    args = message.text.split()[1:]
+    sessions = ECONOMY_SIM_SESSIONS
+    if args and args[0].isdigit():
+        sessions = max(1, min(int(args.pop(0)), ECONOMY_SIM_SESSIONS * 10))
+    candidates = {"сейчас": economy_sim.current_params()}
+    if args:
+        try:
+            candidates["вариант"] = economy_sim.parse_params(" ".join(args))
+        except ValueError as e:
+            await message.answer(
+                f"❌ {html.escape(str(e))}\n\n"
+                f"Использование: /simulate [сессий] параметр=значение ...\n"
+                f"Параметры: {', '.join(economy_sim.PARAMS)}"
+            )
+            return
+    status = await message.answer(f"⏳ Моделирую {sessions} сессий...")
+    results = await asyncio.to_thread(economy_sim.compare, candidates, sessions)
+    await status.edit_text(
+        f"🎲 <b>Симуляция экономики</b>\n\n{html.escape(economy_sim.format_results(results, candidates))}"
+    )
+
+@router.message(Command("whatif"))
+async def cmd_whatif(message: types.Message, state: FSMContext):
+    if not has_access(message.from_user.id, 'admin'):
+        await message.answer("⛔ Нет доступа")
+        return
+    try:
+        overrides = whatif.parse_overrides(message.text.partition(' ')[2])
+        if not overrides:
+            raise ValueError("не указаны настройки")
+    except ValueError as e:
+        await message.answer(
+            f"❌ {html.escape(str(e))}\n\n"
+            f"Использование: /whatif настройка=значение ...\n"
+            + "\n".join(f"• {key} — {title}" for key, title in whatif.SETTINGS.items())
+        )
+        return
+    if len(overrides) == 1:
+        # Одну настройку можно сразу применить после предпросмотра
+        key, value = next(iter(overrides.items()))
+        await _preview_setting(message, state, key, value, f"✅ Настройка {key} изменена")
+        return
+    report = whatif.format_preview(await asyncio.to_thread(whatif.preview, overrides))
+    await message.answer(f"🔮 <b>Если бы так было всегда</b>\n\n{html.escape(report)}")
 
 @router.message(Command("ticket"))
 async def cmd_ticket(message: types.Message):
@@ -2320,17 +2492,11 @@ async def cmd_answer(message: types.Message):
     if ticket[3] == 'closed':
         await message.answer("❌ Тикет закрыт. Нельзя отправить ответ.")
         return
-    add_ticket_message(ticket_id, message.from_user.id, answer_text, is_from_support=True)
-    from main import bot
-    try:
-        await bot.send_message(
-            ticket[1],
-            f"📩 <b>Ответ на ваш тикет #{ticket_id}</b>\n\n{answer_text}"
-        )
-        await message.answer(f"✅ Ответ отправлен в тикет #{ticket_id}")
-    except Exception as e:
-        logger.error(f"Ошибка отправки ответа: {e}")
-        await message.answer("❌ Не удалось отправить ответ пользователю")
+    add_ticket_message(ticket_id, message.from_user.id, answer_text, is_from_support=True, notifications=[
+        outbox.notification(ticket[1], f"📩 <b>Ответ на ваш тикет #{ticket_id}</b>\n\n{answer_text}")
+    ])
+    outbox.wake()
+    await message.answer(f"✅ Ответ отправлен в тикет #{ticket_id}")
 
 @router.message(Command("creport"))
 async def cmd_creport(message: types.Message):
@@ -2353,9 +2519,110 @@ async def cmd_creport(message: types.Message):
     if ticket[3] == 'closed':
         await message.answer("❌ Тикет уже закрыт.")
         return
-    update_ticket_status(ticket_id, 'closed')
+    update_ticket_status(ticket_id, 'closed', closed_by=message.from_user.id)
+    agent_dispatcher.refresh(ticket[12])
     await message.answer(f"✅ Тикет #{ticket_id} закрыт")
 
+# ========== ПРАВИЛА РАЗБОРА ТИКЕТОВ ==========
+TRIAGE_USAGE = (
+    "❌ Использование:\n"
+    "/triage_add приоритет; слова через запятую; тема=...; шаблон=...; группа=...\n"
+    "Вместо слов можно регулярное выражение: re:не\\s+приш(ли|ёл)\n"
+    "Приоритет: ⚫ 🔴 🟡 🟢 или - (не менять)"
+)
+TRIAGE_FIELDS = {'тема': 'subject', 'шаблон': 'template', 'группа': 'assign_group'}
+
+@router.message(Command("triage"))
+async def cmd_triage(message: types.Message):
+    if not has_access(message.from_user.id, 'admin'):
+        await message.answer("⛔ Нет доступа")
+        return
+    rules = triage_engine.rules()
+    if not rules:
+        await message.answer("📭 Правил разбора нет. " + TRIAGE_USAGE.split("\n", 1)[1])
+        return
+    text = "🧭 <b>ПРАВИЛА РАЗБОРА ТИКЕТОВ</b>\n\n"
+    for rule in sorted(rules, key=lambda rule: (rule.severity(), rule.id)):
+        state_icon = "✅" if rule.enabled else "⏸"
+        kind = "re" if rule.is_regex else "слова"
+        text += f"{state_icon} <b>#{rule.id}</b> {rule.priority or '—'} [{kind}] <code>{html.escape(rule.pattern)}</code>\n"
+        extras = [f"{title}: {getattr(rule, field)}" for title, field in TRIAGE_FIELDS.items() if getattr(rule, field)]
+        if extras:
+            text += "   " + ", ".join(html.escape(extra) for extra in extras) + "\n"
+        text += f"   срабатываний: {triage_engine.hits(rule.id)}\n"
+    text += "\n/triage_add, /triage_del ID, /triage_off ID, /triage_on ID"
+    await message.answer(text)
+
+@router.message(Command("triage_add"))
+async def cmd_triage_add(message: types.Message):
+    if not has_access(message.from_user.id, 'admin'):
+        await message.answer("⛔ Нет доступа")
+        return
+    args = message.text.split(maxsplit=1)
+    parts = [part.strip() for part in args[1].split(';')] if len(args) > 1 else []
+    if len(parts) < 2:
+        await message.answer(TRIAGE_USAGE)
+        return
+    priority = None if parts[0] == '-' else parts[0]
+    if priority is not None and priority not in TRIAGE_PRIORITIES:
+        await message.answer(TRIAGE_USAGE)
+        return
+    pattern = parts[1]
+    is_regex = pattern.startswith('re:')
+    if is_regex:
+        pattern = pattern[3:]
+    fields = {}
+    for part in parts[2:]:
+        key, _, value = part.partition('=')
+        if key.strip().lower() not in TRIAGE_FIELDS or not value.strip():
+            await message.answer(TRIAGE_USAGE)
+            return
+        fields[TRIAGE_FIELDS[key.strip().lower()]] = value.strip()
+    error = validate_triage_pattern(pattern, is_regex)
+    if error:
+        await message.answer(f"❌ Правило не добавлено: {error}")
+        return
+    rule_id = add_triage_rule(pattern, is_regex, priority, created_by=message.from_user.id, **fields)
+    if not rule_id:
+        await message.answer("❌ Ошибка сохранения правила")
+        return
+    triage_engine.reload()
+    log_admin_action(message.from_user.id, 'triage_add', 'triage_rule', rule_id, {'pattern': pattern})
+    await message.answer(f"✅ Правило #{rule_id} добавлено и уже действует")
+
+async def _triage_change(message: types.Message, action: str):
+    if not has_access(message.from_user.id, 'admin'):
+        await message.answer("⛔ Нет доступа")
+        return
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit():
+        await message.answer(f"❌ Использование: /triage_{action} ID")
+        return
+    rule_id = int(args[1])
+    if action == 'del':
+        ok = delete_triage_rule(rule_id)
+    else:
+        ok = update_triage_rule(rule_id, enabled=1 if action == 'on' else 0)
+    if not ok:
+        await message.answer("❌ Правило не найдено")
+        return
+    triage_engine.reload()
+    log_admin_action(message.from_user.id, f'triage_{action}', 'triage_rule', rule_id)
+    titles = {'del': 'удалено', 'on': 'включено', 'off': 'выключено'}
+    await message.answer(f"✅ Правило #{rule_id} {titles[action]}")
+
+@router.message(Command("triage_del"))
+async def cmd_triage_del(message: types.Message):
+    await _triage_change(message, 'del')
+
+@router.message(Command("triage_on"))
+async def cmd_triage_on(message: types.Message):
+    await _triage_change(message, 'on')
+
+@router.message(Command("triage_off"))
+async def cmd_triage_off(message: types.Message):
+    await _triage_change(message, 'off')
+
 # ========== ЗАГЛУШКА ==========
 @router.callback_query(F.data == "no_action")
 async def no_action(callback: types.CallbackQuery):
@@ -1,4 +1,5 @@
 # FILE: handlers/games.py
+import asyncio
 import logging
 import random
 import uuid
@@ -9,20 +10,24 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from config import (
     MINES_GAME_WIN_REWARD, MINES_GAME_LOSE_PENALTY,
-    CASINO_BET_AMOUNTS, CASINO_WIN_CHANCE, CASINO_WIN_MULTIPLIER
-)
-from database import (
-    get_user, update_balance, create_game_record, update_game_result,
-    check_game_processed
+    CASINO_BET_AMOUNTS, CASINO_WIN_MULTIPLIER, CASINO_REVEAL_DELAY
 )
+from database import get_user, place_bet, settle_game
 from keyboards import MenuCallback, GameCallback, get_games_menu, get_mines_game_keyboard, get_casino_bet_amount_keyboard, get_back_to_menu_keyboard
 from states import GameStates
 from helpers import is_duplicate_action
+from achievements import achievement_engine
+from economy_sim import CASINO_DICE_CHANCE
 
 logger = logging.getLogger(__name__)
 
 router = Router(name="games")
 
+# Значение дайса 🎰, при котором выпадает 777 (всего значений 64)
+CASINO_JACKPOT_VALUE = 64
+# Отложенные показы результата казино — ссылки держим, пока задача не завершится
+_reveals = set()
+
 # ========== МЕНЮ ИГР ==========
 @router.callback_query(MenuCallback.filter(F.action == "games"))
 async def show_games_menu(callback: types.CallbackQuery):
@@ -37,7 +42,7 @@ async def show_games_menu(callback: types.CallbackQuery):
         "🎰 <b>Рулетка</b>\n"
         f"• Ставки: {', '.join(map(str, CASINO_BET_AMOUNTS))} ⭐\n"
         "• Выигрыш только при 777\n"
-        f"• Шанс выигрыша: {CASINO_WIN_CHANCE*100}%\n"
+        f"• Шанс выигрыша: {CASINO_DICE_CHANCE*100:.1f}%\n"
         f"• Выигрыш: {CASINO_WIN_MULTIPLIER}x от ставки"
     )
     await callback.message.edit_text(games_text, reply_markup=get_games_menu())
@@ -63,9 +68,8 @@ async def start_mines_game(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("⏳ Игра уже запущена", show_alert=True)
         return
 
+    # Строка игры появится при расчёте — вместе с изменением баланса
     game_id = str(uuid.uuid4())
-    create_game_record(game_id, user_id, "mines", 0)
-
     winning_ball = random.randint(1, 3)
     await state.update_data(game_id=game_id, winning_ball=winning_ball)
 
@@ -84,38 +88,44 @@ async def process_mines_choice(callback: types.CallbackQuery, callback_data: Gam
     game_id = callback_data.game_id
     choice = callback_data.choice
 
-    if check_game_processed(game_id):
-        await callback.answer("Эта игра уже обработана!", show_alert=True)
-        return
-
     data = await state.get_data()
     if data.get('game_id') != game_id:
         await callback.answer("Игра не найдена!", show_alert=True)
         return
 
     winning_ball = data['winning_ball']
-
-    if choice == winning_ball:
-        if update_balance(user_id, MINES_GAME_WIN_REWARD, 'virtual', 'add'):
-            update_game_result(game_id, MINES_GAME_WIN_REWARD, "win")
-            result_text = (
-                f"🎉 <b>Поздравляем! Вы выиграли!</b>\n\n"
-                f"Вы выбрали шар {choice} — это выигрышный шар!\n"
-                f"На ваш виртуальный баланс начислено: +{MINES_GAME_WIN_REWARD} ⭐"
-            )
-        else:
-            result_text = "❌ Ошибка начисления приза"
+    won = choice == winning_ball
+    status, balance = settle_game(
+        game_id, user_id, "mines", 0,
+        delta=MINES_GAME_WIN_REWARD if won else -MINES_GAME_LOSE_PENALTY,
+        win_amount=MINES_GAME_WIN_REWARD if won else 0,
+        result="win" if won else "lose"
+    )
+    if status == 'processed':
+        await callback.answer("Эта игра уже обработана!", show_alert=True)
+        return
+    if status == 'ok':
+        achievement_engine.emit('game_settled', user_id=user_id, game_type="mines", won=won)
+
+    if status == 'no_funds':
+        result_text = "❌ Недостаточно виртуальных звёзд для игры"
+    elif status != 'ok':
+        result_text = "❌ Ошибка начисления приза" if won else "❌ Ошибка расчёта игры"
+    elif won:
+        result_text = (
+            f"🎉 <b>Поздравляем! Вы выиграли!</b>\n\n"
+            f"Вы выбрали шар {choice} — это выигрышный шар!\n"
+            f"На ваш виртуальный баланс начислено: +{MINES_GAME_WIN_REWARD} ⭐\n"
+            f"Баланс: {balance} ⭐"
+        )
     else:
-        if update_balance(user_id, MINES_GAME_LOSE_PENALTY, 'virtual', 'subtract'):
-            update_game_result(game_id, 0, "lose")
-            result_text = (
-                f"😢 <b>Вы проиграли</b>\n\n"
-                f"Вы выбрали шар {choice}\n"
-                f"Выигрышный шар был: {winning_ball}\n"
-                f"С вашего виртуального баланса списано: -{MINES_GAME_LOSE_PENALTY} ⭐"
-            )
-        else:
-            result_text = "❌ Недостаточно виртуальных звёзд для игры"
+        result_text = (
+            f"😢 <b>Вы проиграли</b>\n\n"
+            f"Вы выбрали шар {choice}\n"
+            f"Выигрышный шар был: {winning_ball}\n"
+            f"С вашего виртуального баланса списано: -{MINES_GAME_LOSE_PENALTY} ⭐\n"
+            f"Баланс: {balance} ⭐"
+        )
 
     await callback.message.edit_text(result_text, reply_markup=get_back_to_menu_keyboard())
     await state.clear()
@@ -132,7 +142,7 @@ async def start_casino_game(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(GameCallback.filter(F.action == "casino_bet"))
-async def process_casino_bet(callback: types.CallbackQuery, callback_data: GameCallback, state: FSMContext):
+async def process_casino_bet(callback: types.CallbackQuery, callback_data: GameCallback):
     user_id = callback.from_user.id
     bet_amount = callback_data.bet_amount
 
@@ -148,20 +158,52 @@ async def process_casino_bet(callback: types.CallbackQuery, callback_data: GameC
         return
 
     game_id = str(uuid.uuid4())
-    create_game_record(game_id, user_id, "casino_virtual", bet_amount)
-
-    if not update_balance(user_id, bet_amount, 'virtual', 'subtract'):
+    status, _ = place_bet(game_id, user_id, "casino_virtual", bet_amount)
+    if status == 'no_funds':
+        await callback.answer("❌ Недостаточно виртуальных звёзд!", show_alert=True)
+        return
+    if status != 'ok':
         await callback.answer("❌ Ошибка списания!", show_alert=True)
         return
 
-    # Отправляем дайс
-    dice_message = await callback.bot.send_dice(chat_id=user_id, emoji="🎰")
-    await state.update_data(
-        game_id=game_id,
-        dice_message_id=dice_message.message_id,
-        bet_amount=bet_amount
+    try:
+        dice_message = await callback.bot.send_dice(chat_id=user_id, emoji="🎰")
+    except Exception as e:
+        logger.error(f"Ошибка отправки дайса казино для {user_id}: {e}")
+        settle_game(game_id, user_id, "casino_virtual", bet_amount,
+                    delta=bet_amount, win_amount=0, result="refund")
+        await callback.answer("❌ Не удалось запустить игру, ставка возвращена", show_alert=True)
+        return
+
+    # Значение известно сразу из ответа send_dice: свои дайсы боту апдейтом не приходят
+    result = "win" if dice_message.dice.value == CASINO_JACKPOT_VALUE else "lose"
+    win_amount = int(bet_amount * CASINO_WIN_MULTIPLIER) if result == "win" else 0
+    status, balance = settle_game(
+        game_id, user_id, "casino_virtual", bet_amount,
+        delta=win_amount, win_amount=win_amount, result=result, dice_message_id=dice_message.message_id
     )
 
+    if status == 'ok':
+        achievement_engine.emit('game_settled', user_id=user_id, game_type="casino_virtual", won=result == "win")
+    if status != 'ok':
+        result_text = "❌ Ошибка начисления выигрыша"
+    elif result == "win":
+        result_text = (
+            f"🎉 <b>ДЖЕКПОТ! 777!</b>\n\n"
+            f"Ваша ставка: {bet_amount} ⭐\n"
+            f"Выигрыш: {win_amount} ⭐\n"
+            f"Множитель: {CASINO_WIN_MULTIPLIER}x\n"
+            f"Баланс: {balance} ⭐"
+        )
+    else:
+        result_text = (
+            f"😢 <b>Вы проиграли</b>\n\n"
+            f"Ваша ставка: {bet_amount} ⭐\n"
+            f"С вашего баланса списано: {bet_amount} ⭐\n"
+            f"Баланс: {balance} ⭐"
+        )
+    logger.info(f"Результат казино для {user_id}: {result}, ставка {bet_amount}, выигрыш {win_amount}")
+
     # Редактируем сообщение с кнопками
     try:
         await callback.message.edit_text(
@@ -173,58 +215,14 @@ async def process_casino_bet(callback: types.CallbackQuery, callback_data: GameC
 
     await callback.answer()
 
-@router.message(F.dice.emoji == "🎰")
-async def process_casino_dice(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    data = await state.get_data()
-
-    if not data or 'game_id' not in data:
-        logger.debug("Нет данных состояния для обработки дайса")
-        return
-
-    game_id = data['game_id']
-    dice_message_id = message.message_id
+    # Результат показываем, когда барабаны остановятся
+    task = asyncio.create_task(_reveal_casino_result(callback.bot, user_id, result_text))
+    _reveals.add(task)
+    task.add_done_callback(_reveals.discard)
 
-    # Проверяем, что это тот самый дайс, который мы отправили
-    if data.get('dice_message_id') != dice_message_id:
-        logger.debug("ID сообщения дайса не совпадает с сохранённым")
-        return
-
-    if check_game_processed(game_id):
-        logger.debug(f"Игра {game_id} уже обработана")
-        return
-
-    dice_value = message.dice.value
-    result = "win" if dice_value == 777 else "lose"
-    bet_amount = data['bet_amount']
-
-    if result == "win":
-        win_amount = int(bet_amount * CASINO_WIN_MULTIPLIER)
-        if update_balance(user_id, win_amount, 'virtual', 'add'):
-            update_game_result(game_id, win_amount, result, dice_message_id)
-            result_text = (
-                f"🎉 <b>ДЖЕКПОТ! 777!</b>\n\n"
-                f"Ваша ставка: {bet_amount} ⭐\n"
-                f"Выигрыш: {win_amount} ⭐\n"
-                f"Множитель: {CASINO_WIN_MULTIPLIER}x"
-            )
-        else:
-            result_text = "❌ Ошибка начисления выигрыша"
-            update_game_result(game_id, 0, "error", dice_message_id)
-    else:
-        win_amount = 0
-        update_game_result(game_id, win_amount, result, dice_message_id)
-        result_text = (
-            f"😢 <b>Вы проиграли</b>\n\n"
-            f"Ваша ставка: {bet_amount} ⭐\n"
-            f"С вашего баланса списано: {bet_amount} ⭐"
-        )
-
-    # Отправляем результат
+async def _reveal_casino_result(bot, user_id: int, result_text: str):
+    await asyncio.sleep(CASINO_REVEAL_DELAY)
     try:
-        await message.bot.send_message(user_id, result_text, reply_markup=get_back_to_menu_keyboard())
-        logger.info(f"Результат казино для {user_id}: {result}, ставка {bet_amount}, выигрыш {win_amount}")
+        await bot.send_message(user_id, result_text, reply_markup=get_back_to_menu_keyboard())
     except Exception as e:
         logger.error(f"Ошибка отправки результата казино: {e}")
-
-    await state.clear()
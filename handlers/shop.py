@@ -8,7 +8,7 @@ from datetime import datetime, timedelta
 from aiogram import Router, types, F
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters.callback_data import CallbackData
 
@@ -20,8 +20,7 @@ from config import (
     ROLE_NAMES, TICKET_GROUP_ID
 )
 from database import (
-    get_user, update_balance, create_order, get_order_status, update_order_status,
-    get_promocode, use_promocode, check_promocode_valid, get_user_orders,
+    get_user, update_balance, create_order, get_order_status, update_order_status, get_user_orders,
     create_withdrawal, get_pending_withdrawals, update_withdrawal_status,
     create_exchange, get_user_active_discount, mark_discount_used,
     create_feedback, get_order_feedback, update_feedback_status,
@@ -30,7 +29,8 @@ from database import (
     get_user_by_referral_code, add_referral, set_referral_code, create_user,
     create_ticket, update_ticket_topic, get_ticket, get_ticket_by_topic_id,
     get_ticket_messages, add_ticket_message, get_user_tickets, get_all_tickets,
-    update_ticket_status,
+    update_ticket_status, add_order_media, find_order_by_file_unique_id,
+    enqueue_notifications,
     has_user_agreed, set_user_agreed  # <-- новые функции
 )
 from keyboards import (
@@ -49,8 +49,15 @@ from states import (
     PurchaseStates, ExchangeStates, WithdrawalStates, CalculatorStates,
     TicketStates
 )
+from media import extract_file
+from moderation import moderation_queue, claim_for_callback
+from scheduler import scheduler
+import outbox
+import topic_pool
+from achievements import achievement_engine
+from promocodes import promo_service
 from helpers import (
-    get_screenshot_path, format_datetime, has_access,
+    format_datetime, has_access,
     invalidate_balance_cache, invalidate_top_cache, is_duplicate_action,
     generate_referral_code, get_role_display
 )
@@ -139,7 +146,9 @@ async def cmd_start(message: types.Message):
             ref_code = param[4:]
             referrer = get_user_by_referral_code(ref_code)
             if referrer and referrer[1] != user_id and user[9] is None:
-                add_referral(referrer[1], user_id)
+                ok, _ = add_referral(referrer[1], user_id)
+                if ok:
+                    achievement_engine.emit('referral_added', user_id=referrer[1])
         elif param.startswith('discount_'):
             code = param.replace('discount_', '')
             discount, msg = use_discount_link(code, user_id)
@@ -152,7 +161,9 @@ async def cmd_start(message: types.Message):
                 referrer_id = int(param)
                 referrer = get_user(referrer_id)
                 if referrer and referrer[1] != user_id and user[9] is None:
-                    add_referral(referrer_id, user_id)
+                    ok, _ = add_referral(referrer_id, user_id)
+                    if ok:
+                        achievement_engine.emit('referral_added', user_id=referrer_id)
             except ValueError:
                 pass
 
@@ -305,11 +316,7 @@ async def cmd_report(message: types.Message):
 
     try:
         topic_name = f"#{ticket_id} | {full_name} | Другой вопрос"
-        topic = await bot.create_forum_topic(
-            chat_id=TICKET_GROUP_ID,
-            name=topic_name
-        )
-        topic_id = topic.message_thread_id
+        topic_id, _ = await topic_pool.open_topic(bot, topic_name)
 
         update_ticket_topic(ticket_id, topic_id, topic_name)
 
@@ -456,7 +463,7 @@ async def process_promocode(message: types.Message, state: FSMContext):
     if promocode in ("ПРОПУСТИТЬ", "SKIP"):
         await process_final_payment(message, state, 0)
         return
-    is_valid, result = check_promocode_valid(promocode, user_id)
+    is_valid, result = promo_service.check(promocode, user_id)
     if not is_valid:
         await message.answer(
             f"❌ {result}\n\nПопробуйте другой промокод или нажмите 'Пропустить':",
@@ -545,43 +552,31 @@ async def process_screenshot_document(message: types.Message, state: FSMContext)
         )
 
 async def _process_screenshot_file(message: types.Message, state: FSMContext):
-    bot = message.bot
     data = await state.get_data()
     user_id = message.from_user.id
 
-    file_id = None
-    if message.photo:
-        file_id = message.photo[-1].file_id
-    elif message.document:
-        file_id = message.document.file_id
-
-    if not file_id:
+    screenshot = extract_file(message)
+    if not screenshot:
         await message.answer("❌ Не удалось получить изображение", reply_markup=get_back_to_menu_keyboard())
         return
-
-    try:
-        file_info = await bot.get_file(file_id)
-        file_path = get_screenshot_path(user_id, f"{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-        await bot.download_file(file_info.file_path, file_path)
-        logger.info(f"Скриншот сохранён: {file_path}")
-    except Exception as e:
-        logger.error(f"Ошибка сохранения скриншота: {e}")
-        await message.answer("❌ Не удалось сохранить скриншот. Попробуйте позже.", reply_markup=get_back_to_menu_keyboard())
-        await state.clear()
-        return
+    # Скриншот пересылается по file_id, на диск его позже сохранит фоновая задача
+    file_id, file_unique_id, media_type = screenshot
 
     final_price = data.get('final_price', data['total_price'])
     order_id = create_order(
         user_id=user_id,
         amount=data['amount'],
         recipient_username=data['recipient_username'],
-        screenshot_path=file_path
+        screenshot_path=None
     )
+    previous_order = find_order_by_file_unique_id(file_unique_id, order_id)
 
+    promo_error = None
     if 'promocode' in data:
-        promocode = get_promocode(data['promocode'])
-        if promocode:
-            use_promocode(user_id, promocode[0], order_id)
+        claimed, result = promo_service.claim(data['promocode'], user_id, order_id)
+        if not claimed:
+            promo_error = result
+            final_price = data['total_price']
     else:
         discount = get_user_active_discount(user_id)
         if discount:
@@ -601,22 +596,28 @@ async def _process_screenshot_file(message: types.Message, state: FSMContext):
         f"⭐ Количество: {data['amount']} звёзд\n"
         f"💳 Сумма: {final_price:.2f}₽"
     )
-    if 'promocode' in data:
+    if promo_error:
+        order_text += f"\n⚠️ Промокод {data['promocode']} не применён: {promo_error}"
+    elif 'promocode' in data:
         order_text += f"\n🎁 Промокод: {data['promocode']} (-{data['discount_percent']}%)"
     order_text += f"\n🎯 Получатель: {data['recipient_username']}"
-
-    try:
-        await bot.send_message(OWNER_ID, order_text)
-        photo = FSInputFile(file_path)
-        await bot.send_photo(OWNER_ID, photo, caption=f"Заявка #{order_id}",
-                            reply_markup=get_order_action_keyboard(order_id))
-    except Exception as e:
-        logger.error(f"Ошибка отправки владельцу: {e}")
-
-    await message.answer(
-        "✅ Ваша заявка отправлена на проверку администратору!\nОжидайте подтверждения.",
-        reply_markup=get_back_to_menu_keyboard()
-    )
+    if previous_order:
+        order_text += f"\n⚠️ Этот скриншот уже присылали к заявке #{previous_order}"
+
+    # Скриншот — последняя запись заявки: уведомления владельцу пишутся вместе с ним
+    add_order_media(order_id, file_id, file_unique_id, media_type, notifications=[
+        outbox.notification(OWNER_ID, order_text),
+        outbox.notification(OWNER_ID, f"Заявка #{order_id}", get_order_action_keyboard(order_id),
+                            media_type=media_type, file_id=file_id),
+    ])
+    outbox.wake()
+    scheduler.trigger("media_archive")
+    moderation_queue.refresh('order', order_id)
+
+    answer = "✅ Ваша заявка отправлена на проверку администратору!\nОжидайте подтверждения."
+    if promo_error:
+        answer += f"\n\n⚠️ Промокод не применён: {promo_error}. Сумма заявки: {final_price:.2f}₽"
+    await message.answer(answer, reply_markup=get_back_to_menu_keyboard())
     await state.clear()
 
 # ========== ПОКУПКА ВИРТУАЛЬНОЙ ВАЛЮТЫ ==========
@@ -667,40 +668,26 @@ async def process_virtual_screenshot_document(message: types.Message, state: FSM
         )
 
 async def _process_virtual_screenshot(message: types.Message, state: FSMContext):
-    bot = message.bot
     data = await state.get_data()
     user_id = message.from_user.id
     amount = data['virtual_amount']
     total_price = data['virtual_total_price']
 
-    file_id = None
-    if message.photo:
-        file_id = message.photo[-1].file_id
-    elif message.document:
-        file_id = message.document.file_id
-
-    if not file_id:
+    screenshot = extract_file(message)
+    if not screenshot:
         await message.answer("❌ Не удалось получить изображение", reply_markup=get_back_to_menu_keyboard())
         return
-
-    try:
-        file_info = await bot.get_file(file_id)
-        file_path = get_screenshot_path(user_id, f"virtual_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg")
-        await bot.download_file(file_info.file_path, file_path)
-        logger.info(f"Скриншот вирт покупки сохранён: {file_path}")
-    except Exception as e:
-        logger.error(f"Ошибка сохранения скриншота: {e}")
-        await message.answer("❌ Не удалось сохранить скриншот. Попробуйте позже.", reply_markup=get_back_to_menu_keyboard())
-        await state.clear()
-        return
+    # Скриншот пересылается по file_id, на диск его позже сохранит фоновая задача
+    file_id, file_unique_id, media_type = screenshot
 
     # Создаём заказ с пометкой в комментарии
     order_id = create_order(
         user_id=user_id,
         amount=amount,
         recipient_username="self",
-        screenshot_path=file_path
+        screenshot_path=None
     )
+    previous_order = find_order_by_file_unique_id(file_unique_id, order_id)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE orders SET comment = 'virtual_purchase', total_price = ? WHERE id = ?", (total_price, order_id))
@@ -713,14 +700,17 @@ async def _process_virtual_screenshot(message: types.Message, state: FSMContext)
         f"💎 Количество вирт: {amount}\n"
         f"💳 Сумма к оплате: {total_price:.2f}₽"
     )
-
-    try:
-        await bot.send_message(OWNER_ID, order_text)
-        photo = FSInputFile(file_path)
-        await bot.send_photo(OWNER_ID, photo, caption=f"Заявка на вирт #{order_id}",
-                            reply_markup=get_order_action_keyboard(order_id))
-    except Exception as e:
-        logger.error(f"Ошибка отправки владельцу: {e}")
+    if previous_order:
+        order_text += f"\n⚠️ Этот скриншот уже присылали к заявке #{previous_order}"
+
+    add_order_media(order_id, file_id, file_unique_id, media_type, notifications=[
+        outbox.notification(OWNER_ID, order_text),
+        outbox.notification(OWNER_ID, f"Заявка на вирт #{order_id}", get_order_action_keyboard(order_id),
+                            media_type=media_type, file_id=file_id),
+    ])
+    outbox.wake()
+    scheduler.trigger("media_archive")
+    moderation_queue.refresh('order', order_id)
 
     await message.answer(
         "✅ Ваша заявка на покупку виртуальной валюты отправлена!\n"
@@ -740,35 +730,38 @@ async def approve_order(callback: types.CallbackQuery, callback_data: OrderCallb
     if current_status != 'pending':
         await callback.answer(f"Этот заказ уже обработан ({current_status})", show_alert=True)
         return
-    update_order_status(order_id, "approved")
+    if not await claim_for_callback(callback, 'order', order_id):
+        return
 
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT user_id, amount, comment FROM orders WHERE id = ?",
+        # Скриншот сначала есть только в order_media, screenshot_path заполняет архивация
+        """SELECT user_id, amount, comment, total_price, discount,
+                  screenshot_path IS NOT NULL OR EXISTS (SELECT 1 FROM order_media m WHERE m.order_id = orders.id)
+           FROM orders WHERE id = ?""",
         (order_id,)
     )
     order = cursor.fetchone()
     conn.close()
-    if order:
-        user_id, amount, comment = order
-        try:
-            bot = callback.bot
-            if comment == 'virtual_purchase':
-                update_balance(user_id, amount, 'virtual', 'add')
-                await bot.send_message(
-                    user_id,
-                    f"✅ <b>Заказ #{order_id} (виртуальная валюта) подтверждён!</b>\n\n"
-                    f"Вам начислено {amount} виртуальных ⭐."
-                )
-            else:
-                await bot.send_message(
-                    user_id,
-                    f"✅ <b>Заказ #{order_id} подтверждён!</b>\n\n"
-                    f"Звёзды будут отправлены в ближайшее время."
-                )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления пользователя: {e}")
+    if not order:
+        update_order_status(order_id, "approved")
+        moderation_queue.refresh('order', order_id)
+    else:
+        user_id, amount, comment, total_price, discount, has_screenshot = order
+        if comment == 'virtual_purchase':
+            text = (f"✅ <b>Заказ #{order_id} (виртуальная валюта) подтверждён!</b>\n\n"
+                    f"Вам начислено {amount} виртуальных ⭐.")
+        else:
+            text = (f"✅ <b>Заказ #{order_id} подтверждён!</b>\n\n"
+                    f"Звёзды будут отправлены в ближайшее время.")
+        update_order_status(order_id, "approved", notifications=[outbox.notification(user_id, text)])
+        outbox.wake()
+        moderation_queue.refresh('order', order_id)
+        if comment == 'virtual_purchase':
+            update_balance(user_id, amount, 'virtual', 'add')
+        achievement_engine.emit('order_approved', user_id=user_id, price=(total_price or 0) - (discount or 0),
+                                discount=discount or 0, screenshot=bool(has_screenshot))
         log_admin_action(callback.from_user.id, 'approve_order', 'order', order_id, {'amount': amount})
         await invalidate_top_cache()
 
@@ -785,20 +778,20 @@ async def reject_order(callback: types.CallbackQuery, callback_data: OrderCallba
     if current_status != 'pending':
         await callback.answer(f"Этот заказ уже обработан ({current_status})", show_alert=True)
         return
-    update_order_status(order_id, "rejected")
+    if not await claim_for_callback(callback, 'order', order_id):
+        return
 
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_id FROM orders WHERE id = ?", (order_id,))
     row = cursor.fetchone()
     conn.close()
+    notifications = []
     if row:
-        user_id = row[0]
-        try:
-            bot = callback.bot
-            await bot.send_message(user_id, f"❌ Заявка #{order_id} отклонена. Обратитесь в поддержку.")
-        except Exception as e:
-            logger.error(f"Ошибка уведомления: {e}")
+        notifications.append(outbox.notification(row[0], f"❌ Заявка #{order_id} отклонена. Обратитесь в поддержку."))
+    update_order_status(order_id, "rejected", notifications=notifications)
+    outbox.wake()
+    moderation_queue.refresh('order', order_id)
     await callback.message.edit_reply_markup(reply_markup=get_processed_order_keyboard("rejected"))
     await callback.answer("❌ Заказ отклонён", show_alert=True)
 
@@ -842,6 +835,7 @@ async def cancel_reason_chosen(callback: types.CallbackQuery, state: FSMContext)
         }
         reason_text = reasons.get(reason_key, "Не указана")
         if cancel_order(order_id, callback.from_user.id, reason_text):
+            moderation_queue.refresh('order', order_id)
             await callback.message.edit_text(
                 f"✅ Заказ #{order_id} успешно отменён.\n"
                 f"Причина: {reason_text}",
@@ -865,6 +859,7 @@ async def process_custom_cancel_reason(message: types.Message, state: FSMContext
         return
     reason_text = message.text.strip()
     if cancel_order(order_id, message.from_user.id, reason_text):
+        moderation_queue.refresh('order', order_id)
         await message.answer(
             f"✅ Заказ #{order_id} успешно отменён.\n"
             f"Причина: {reason_text}",
@@ -952,7 +947,6 @@ async def start_exchange(callback: types.CallbackQuery, callback_data: ExchangeC
 
 @router.message(ExchangeStates.waiting_for_exchange_amount)
 async def process_exchange_amount(message: types.Message, state: FSMContext):
-    bot = message.bot
     try:
         amount = int(message.text)
         data = await state.get_data()
@@ -977,8 +971,8 @@ async def process_exchange_amount(message: types.Message, state: FSMContext):
             if not update_balance(message.from_user.id, amount, 'real', 'subtract'):
                 await message.answer("❌ Ошибка списания реальных звёзд!")
                 return
+            moderation_queue.refresh('exchange', exchange_id)
 
-            user = get_user(message.from_user.id)
             username = user[2] or "без юзернейма"
             exchange_text = (
                 f"💱 <b>Новая заявка на обмен real→virtual</b>\n\n"
@@ -987,11 +981,9 @@ async def process_exchange_amount(message: types.Message, state: FSMContext):
                 f"💸 Комиссия: {commission} виртуальных\n"
                 f"📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}"
             )
-            try:
-                await bot.send_message(OWNER_ID, exchange_text,
-                                      reply_markup=get_exchange_approve_keyboard(exchange_id, 'real_to_virtual'))
-            except Exception as e:
-                logger.error(f"Ошибка отправки владельцу: {e}")
+            outbox.notify(outbox.notification(
+                OWNER_ID, exchange_text, get_exchange_approve_keyboard(exchange_id, 'real_to_virtual')
+            ))
 
             await message.answer(
                 f"✅ Заявка на обмен создана!\n\n"
@@ -1026,7 +1018,6 @@ async def process_exchange_amount(message: types.Message, state: FSMContext):
 
 @router.message(ExchangeStates.waiting_for_recipient)
 async def process_exchange_recipient(message: types.Message, state: FSMContext):
-    bot = message.bot
     recipient = message.text.strip()
     if not recipient.startswith('@'):
         recipient = '@' + recipient
@@ -1053,6 +1044,7 @@ async def process_exchange_recipient(message: types.Message, state: FSMContext):
         await message.answer("❌ Ошибка создания заявки!")
         await state.clear()
         return
+    moderation_queue.refresh('exchange', exchange_id)
 
     user = get_user(user_id)
     username = user[2] or "без юзернейма"
@@ -1065,11 +1057,9 @@ async def process_exchange_recipient(message: types.Message, state: FSMContext):
         f"💸 Комиссия: {commission} виртуальных\n"
         f"📅 {datetime.now().strftime('%d.%m.%Y %H:%M')}"
     )
-    try:
-        await bot.send_message(OWNER_ID, exchange_text,
-                              reply_markup=get_exchange_approve_keyboard(exchange_id, 'virtual_to_real'))
-    except Exception as e:
-        logger.error(f"Ошибка отправки владельцу: {e}")
+    outbox.notify(outbox.notification(
+        OWNER_ID, exchange_text, get_exchange_approve_keyboard(exchange_id, 'virtual_to_real')
+    ))
 
     await message.answer(
         f"✅ Заявка на обмен отправлена!\n\n"
@@ -1088,10 +1078,13 @@ async def approve_exchange(callback: types.CallbackQuery, callback_data: Exchang
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
+    if not await claim_for_callback(callback, 'exchange', exchange_id):
+        return
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT user_id, amount, converted_amount, from_currency, to_currency, recipient_username FROM exchanges WHERE exchange_id = ?",
+        "SELECT user_id, amount, converted_amount, from_currency, to_currency, recipient_username, status FROM exchanges WHERE exchange_id = ?",
         (exchange_id,)
     )
     result = cursor.fetchone()
@@ -1100,7 +1093,11 @@ async def approve_exchange(callback: types.CallbackQuery, callback_data: Exchang
         await callback.answer("❌ Заявка не найдена", show_alert=True)
         return
 
-    user_id, amount, converted, from_cur, to_cur, recipient = result
+    user_id, amount, converted, from_cur, to_cur, recipient, status = result
+    if status != 'pending':
+        conn.close()
+        await callback.answer(f"Эта заявка уже обработана ({status})", show_alert=True)
+        return
 
     if from_cur == 'real' and to_cur == 'virtual':
         if not update_balance(user_id, converted, 'virtual', 'add'):
@@ -1121,14 +1118,11 @@ async def approve_exchange(callback: types.CallbackQuery, callback_data: Exchang
         "UPDATE exchanges SET status = 'approved' WHERE exchange_id = ?",
         (exchange_id,)
     )
+    enqueue_notifications(cursor, [outbox.notification(user_id, success_text)])
     conn.commit()
     conn.close()
-
-    try:
-        bot = callback.bot
-        await bot.send_message(user_id, success_text)
-    except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
+    outbox.wake()
+    moderation_queue.refresh('exchange', exchange_id)
 
     log_admin_action(callback.from_user.id, 'approve_exchange', 'exchange', None, {'exchange_id': exchange_id})
     await callback.message.edit_reply_markup(reply_markup=None)
@@ -1142,10 +1136,13 @@ async def reject_exchange(callback: types.CallbackQuery, callback_data: Exchange
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
+    if not await claim_for_callback(callback, 'exchange', exchange_id):
+        return
+
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT user_id, amount, from_currency FROM exchanges WHERE exchange_id = ?",
+        "SELECT user_id, amount, from_currency FROM exchanges WHERE exchange_id = ? AND status = 'pending'",
         (exchange_id,)
     )
     result = cursor.fetchone()
@@ -1160,18 +1157,16 @@ async def reject_exchange(callback: types.CallbackQuery, callback_data: Exchange
             "UPDATE exchanges SET status = 'rejected' WHERE exchange_id = ?",
             (exchange_id,)
         )
+        enqueue_notifications(cursor, [outbox.notification(
+            user_id,
+            f"❌ Ваша заявка на обмен #{exchange_id} отклонена.\n"
+            f"Сумма {amount} ⭐ возвращена на ваш баланс."
+        )])
         conn.commit()
-        try:
-            bot = callback.bot
-            await bot.send_message(
-                user_id,
-                f"❌ Ваша заявка на обмен #{exchange_id} отклонена.\n"
-                f"Сумма {amount} ⭐ возвращена на ваш баланс."
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
+        outbox.wake()
         log_admin_action(callback.from_user.id, 'reject_exchange', 'exchange', None, {'exchange_id': exchange_id})
     conn.close()
+    moderation_queue.refresh('exchange', exchange_id)
 
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.answer("❌ Заявка отклонена!", show_alert=True)
@@ -1218,7 +1213,6 @@ async def process_withdrawal_amount(message: types.Message, state: FSMContext):
 
 @router.message(WithdrawalStates.waiting_for_recipient)
 async def process_withdrawal_recipient(message: types.Message, state: FSMContext):
-    bot = message.bot
     recipient = message.text.strip()
     if not recipient.startswith('@'):
         recipient = '@' + recipient
@@ -1233,6 +1227,15 @@ async def process_withdrawal_recipient(message: types.Message, state: FSMContext
         return
 
     withdrawal_id = str(uuid.uuid4())
+    user = get_user(user_id)
+    username = user[2] or "без юзернейма"
+    withdrawal_text = (
+        f"📤 <b>Новая заявка на вывод #{withdrawal_id}</b>\n\n"
+        f"👤 Пользователь: @{username} (ID: {user_id})\n"
+        f"📱 Получатель: {recipient}\n"
+        f"⭐ Выведено: {amount} виртуальных\n"
+        f"💰 Получит: {real_amount} реальных"
+    )
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
@@ -1241,6 +1244,9 @@ async def process_withdrawal_recipient(message: types.Message, state: FSMContext
             VALUES (?, ?, ?, ?, ?, 'pending')""",
             (withdrawal_id, user_id, amount, real_amount, recipient)
         )
+        enqueue_notifications(cursor, [
+            outbox.notification(OWNER_ID, withdrawal_text, get_withdrawal_keyboard(withdrawal_id))
+        ])
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -1251,22 +1257,8 @@ async def process_withdrawal_recipient(message: types.Message, state: FSMContext
         return
     finally:
         conn.close()
-
-    user = get_user(user_id)
-    username = user[2] or "без юзернейма"
-
-    withdrawal_text = (
-        f"📤 <b>Новая заявка на вывод #{withdrawal_id}</b>\n\n"
-        f"👤 Пользователь: @{username} (ID: {user_id})\n"
-        f"📱 Получатель: {recipient}\n"
-        f"⭐ Выведено: {amount} виртуальных\n"
-        f"💰 Получит: {real_amount} реальных"
-    )
-    try:
-        await bot.send_message(OWNER_ID, withdrawal_text,
-                              reply_markup=get_withdrawal_keyboard(withdrawal_id))
-    except Exception as e:
-        logger.error(f"Ошибка отправки владельцу: {e}")
+    outbox.wake()
+    moderation_queue.refresh('withdrawal', withdrawal_id)
 
     await message.answer(
         f"✅ Заявка на вывод отправлена!\n\n"
@@ -1283,7 +1275,13 @@ async def approve_withdrawal(callback: types.CallbackQuery, callback_data: Withd
     if not has_access(callback.from_user.id, 'admin'):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
+    if not moderation_queue.get('withdrawal', withdrawal_id):
+        await callback.answer("Эта заявка уже обработана", show_alert=True)
+        return
+    if not await claim_for_callback(callback, 'withdrawal', withdrawal_id):
+        return
     update_withdrawal_status(withdrawal_id, 'approved')
+    moderation_queue.refresh('withdrawal', withdrawal_id)
     await callback.answer("✅ Вывод одобрен!", show_alert=True)
     await callback.message.edit_reply_markup(reply_markup=None)
 
@@ -1293,15 +1291,20 @@ async def reject_withdrawal(callback: types.CallbackQuery, callback_data: Withdr
     if not has_access(callback.from_user.id, 'admin'):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
+    if not await claim_for_callback(callback, 'withdrawal', withdrawal_id):
+        return
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT user_id, amount FROM withdrawals WHERE withdrawal_id = ?", (withdrawal_id,))
+    cursor.execute("SELECT user_id, amount FROM withdrawals WHERE withdrawal_id = ? AND status = 'pending'", (withdrawal_id,))
     row = cursor.fetchone()
-    if row:
-        user_id, amount = row
-        update_balance(user_id, amount, 'virtual', 'add')
     conn.close()
+    if not row:
+        await callback.answer("Эта заявка уже обработана", show_alert=True)
+        return
+    user_id, amount = row
+    update_balance(user_id, amount, 'virtual', 'add')
     update_withdrawal_status(withdrawal_id, 'rejected')
+    moderation_queue.refresh('withdrawal', withdrawal_id)
     await callback.answer("❌ Вывод отклонён!", show_alert=True)
     await callback.message.edit_reply_markup(reply_markup=None)
 
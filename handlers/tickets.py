@@ -1,26 +1,40 @@
 # FILE: handlers/tickets.py
+import html
 import logging
+import time
 from datetime import datetime
 from aiogram import Router, types, F
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from config import TICKET_GROUP_ID, TICKET_SUBJECTS, OWNER_ID
+from config import (
+    TICKET_GROUP_ID, TICKET_SUBJECTS, OWNER_ID, TICKET_SEARCH_PAGE_SIZE,
+    TICKET_HISTORY_PAGE_SIZE, TICKET_MESSAGE_PREVIEW, TICKET_AUTO_ASSIGN
+)
 from database import (
-    get_user, create_ticket, update_ticket_topic, get_ticket, get_ticket_by_topic_id,
-    get_ticket_messages, add_ticket_message, get_user_tickets, get_all_tickets,
+    get_user, create_ticket, update_ticket_topic, get_ticket,
+    add_ticket_message, get_user_tickets, get_all_tickets,
     update_ticket_status, get_db_connection, rate_ticket, get_agent_stats,
-    log_admin_action, get_top_agents
+    log_admin_action, get_top_agents, update_ticket_priority, get_topic_route, get_staff_role,
+    search_tickets_text, _SEARCH_HIGHLIGHT, get_ticket_messages_page, get_ticket_counters,
+    get_user_by_id_or_username, save_message_links
 )
 from keyboards import (
     TicketCallback, SubjectCallback, get_ticket_subjects_keyboard, get_ticket_action_keyboard,
     get_back_to_menu_keyboard, get_support_keyboard, get_ticket_group_menu_keyboard,
-    get_ticket_priority_keyboard, get_ticket_rating_keyboard, get_reply_to_ticket_keyboard
+    get_ticket_priority_keyboard, get_ticket_rating_keyboard, get_reply_to_ticket_keyboard,
+    TicketSearchCallback, get_ticket_search_keyboard, TicketHistoryCallback
 )
 from states import TicketStates
-from helpers import has_access, format_datetime, get_user_display_name
+from helpers import has_access, format_datetime, format_duration, get_user_display_name
+import outbox
+import relay
+import topic_pool
+from triage import triage_engine
+from assignment import agent_dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +65,7 @@ async def process_ticket_subject(callback: types.CallbackQuery, callback_data: S
 
 @router.message(TicketStates.waiting_for_message, F.photo | F.document | F.text)
 async def process_ticket_message(message: types.Message, state: FSMContext):
+    started = time.monotonic()
     bot = message.bot
     user_id = message.from_user.id
     data = await state.get_data()
@@ -81,21 +96,30 @@ async def process_ticket_message(message: types.Message, state: FSMContext):
     ticket_id = create_ticket(user_id, subject, text)
     add_ticket_message(ticket_id, user_id, text, is_from_support=False, media_type=media_type, file_id=file_id)
 
+    pooled = False
     try:
         topic_name = f"#{ticket_id} | {full_name} | {subject[:30]}"
-        topic = await bot.create_forum_topic(chat_id=TICKET_GROUP_ID, name=topic_name)
-        topic_id = topic.message_thread_id
-
-        priority = auto_set_priority_text(text)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE tickets SET priority = ?, topic_id = ?, topic_name = ? WHERE id = ?",
-                      (priority, topic_id, topic_name, ticket_id))
-        conn.commit()
-        conn.close()
+        topic_id, pooled = await topic_pool.open_topic(bot, topic_name)
+
+        triage = triage_engine.classify(text)
+        priority = triage.priority
+        update_ticket_topic(ticket_id, topic_id, topic_name)
+        update_ticket_priority(ticket_id, priority)
+        triage_lines = ""
+        if triage.subject:
+            triage_lines += f"🏷 Категория: {triage.subject}\n"
+        if triage.assign_group:
+            triage_lines += f"👥 Группа: {triage.assign_group}\n"
+        if triage.template:
+            triage_lines += f"💡 Шаблон ответа: {triage.template}\n"
+        agent_id = agent_dispatcher.assign(ticket_id, triage.assign_group) if TICKET_AUTO_ASSIGN else None
+        if agent_id:
+            agent = get_user(agent_id)
+            agent_name = html.escape(agent[3] or agent[2] or str(agent_id)) if agent else str(agent_id)
+            triage_lines += f"👨‍💼 Назначен: <a href=\"tg://user?id={agent_id}\">{agent_name}</a>\n"
 
         if media_type == 'photo':
-            await bot.send_photo(
+            sent = await bot.send_photo(
                 chat_id=TICKET_GROUP_ID,
                 message_thread_id=topic_id,
                 photo=file_id,
@@ -103,12 +127,13 @@ async def process_ticket_message(message: types.Message, state: FSMContext):
                         f"👤 Пользователь: {full_name} (@{username})\n"
                         f"🆔 ID: {user_id}\n"
                         f"📝 Тема: {subject}\n"
-                        f"🔰 Приоритет: {priority}\n\n"
+                        f"🔰 Приоритет: {priority}\n"
+                        f"{triage_lines}\n"
                         f"💬 Сообщение:\n{text}",
                 reply_markup=get_ticket_action_keyboard(ticket_id, is_staff=True)
             )
         elif media_type == 'document':
-            await bot.send_document(
+            sent = await bot.send_document(
                 chat_id=TICKET_GROUP_ID,
                 message_thread_id=topic_id,
                 document=file_id,
@@ -116,22 +141,26 @@ async def process_ticket_message(message: types.Message, state: FSMContext):
                         f"👤 Пользователь: {full_name} (@{username})\n"
                         f"🆔 ID: {user_id}\n"
                         f"📝 Тема: {subject}\n"
-                        f"🔰 Приоритет: {priority}\n\n"
+                        f"🔰 Приоритет: {priority}\n"
+                        f"{triage_lines}\n"
                         f"💬 Сообщение:\n{text}",
                 reply_markup=get_ticket_action_keyboard(ticket_id, is_staff=True)
             )
         else:
-            await bot.send_message(
+            sent = await bot.send_message(
                 chat_id=TICKET_GROUP_ID,
                 message_thread_id=topic_id,
                 text=f"🆕 <b>Тикет #{ticket_id}</b>\n\n"
                      f"👤 Пользователь: {full_name} (@{username})\n"
                      f"🆔 ID: {user_id}\n"
                      f"📝 Тема: {subject}\n"
-                     f"🔰 Приоритет: {priority}\n\n"
+                     f"🔰 Приоритет: {priority}\n"
+                     f"{triage_lines}\n"
                      f"💬 Сообщение:\n{text}",
                 reply_markup=get_ticket_action_keyboard(ticket_id, is_staff=True)
             )
+        # Реплай пользователя на своё первое сообщение попадёт реплаем на карточку тикета
+        save_message_links([(ticket_id, message.chat.id, message.message_id, TICKET_GROUP_ID, sent.message_id)])
     except Exception as e:
         logger.error(f"Ошибка создания тикета в группе: {e}")
 
@@ -141,18 +170,9 @@ async def process_ticket_message(message: types.Message, state: FSMContext):
         f"Ваше обращение передано в службу поддержки.",
         reply_markup=get_ticket_action_keyboard(ticket_id)
     )
+    topic_pool.record_ticket_created(time.monotonic() - started, pooled)
     await state.clear()
 
-def auto_set_priority_text(text: str) -> str:
-    text_lower = text.lower()
-    if any(word in text_lower for word in ["бот не работает", "не отвечает", "сломался"]):
-        return "⚫"
-    if any(word in text_lower for word in ["не пришли", "не получил", "нет звёзд"]):
-        return "🔴"
-    if any(word in text_lower for word in ["ошибка", "проблема", "баг"]):
-        return "🟡"
-    return "🟢"
-
 @router.callback_query(F.data == "cancel_ticket", TicketStates.waiting_for_subject)
 async def cancel_ticket_creation(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
@@ -172,10 +192,13 @@ async def my_tickets_callback(callback: types.CallbackQuery):
         return
     response = "📋 <b>Мои тикеты:</b>\n\n"
     for ticket in tickets:
-        ticket_id, _, subject, status, topic_id, topic_name, priority, created_at, closed_at, *_ = ticket
+        ticket_id, _, subject, status, topic_id, topic_name, priority, created_at, closed_at, *_, message_count, last_message_at = ticket
         status_icon = "🟢" if status == 'open' else "🔴"
         response += f"{status_icon} {priority} <b>#{ticket_id}</b> - {subject}\n"
-        response += f"📅 {format_datetime(created_at)}\n\n"
+        response += f"📅 {format_datetime(created_at)} · 💬 {message_count}"
+        if last_message_at:
+            response += f" · последнее {format_datetime(last_message_at)}"
+        response += "\n\n"
     await callback.message.edit_text(response, reply_markup=get_support_keyboard())
     await callback.answer()
 
@@ -209,7 +232,14 @@ async def show_ticket_details_callback(callback: types.CallbackQuery, callback_d
 
     await show_ticket_details_internal(callback, ticket_id)
 
-async def show_ticket_details_internal(callback: types.CallbackQuery, ticket_id: int):
+@router.callback_query(TicketHistoryCallback.filter())
+async def ticket_history_callback(callback: types.CallbackQuery, callback_data: TicketHistoryCallback):
+    await show_ticket_details_internal(
+        callback, callback_data.ticket_id,
+        before_id=callback_data.before or None, after_id=callback_data.after or None
+    )
+
+async def show_ticket_details_internal(callback: types.CallbackQuery, ticket_id: int, before_id: int = None, after_id: int = None):
     user_id = callback.from_user.id
     ticket = get_ticket(ticket_id)
     if not ticket:
@@ -225,7 +255,10 @@ async def show_ticket_details_internal(callback: types.CallbackQuery, ticket_id:
         await callback.answer("У вас нет доступа к этому тикету!", show_alert=True)
         return
 
-    messages = get_ticket_messages(ticket_id)
+    messages, has_older, has_newer = get_ticket_messages_page(
+        ticket_id, TICKET_HISTORY_PAGE_SIZE, before_id=before_id, after_id=after_id
+    )
+    message_count, _ = get_ticket_counters(ticket_id)
     status_text = "🟢 Открыт" if status == 'open' else "🔴 Закрыт"
     response = f"📋 <b>Тикет #{ticket_id}</b>\n"
     response += f"📝 Тема: {subject}\n"
@@ -234,10 +267,12 @@ async def show_ticket_details_internal(callback: types.CallbackQuery, ticket_id:
     response += f"📅 Создан: {format_datetime(created_at)}\n"
     if closed_at:
         response += f"📅 Закрыт: {format_datetime(closed_at)}\n"
-    response += f"\n<b>📨 Сообщения:</b>\n\n"
+    response += f"\n<b>📨 Сообщения</b> ({message_count}):\n\n"
+    if has_older:
+        response += "⋯ более ранние сообщения — кнопка «Раньше»\n\n"
 
     for msg in messages:
-        msg_id, _, user_id_msg, message_text, is_from_support, msg_created_at, username, media_type, file_id = msg
+        msg_id, user_id_msg, message_text, is_from_support, media_type, msg_created_at, username = msg
         time_str = format_datetime(msg_created_at)
         if is_from_support:
             role_icon = "👨‍💼"
@@ -245,20 +280,26 @@ async def show_ticket_details_internal(callback: types.CallbackQuery, ticket_id:
         else:
             role_icon = "👤"
             role_name = f"@{username}" if username else "Пользователь"
-        response += f"{role_icon} <b>{role_name}</b> ({time_str}):\n{message_text}\n"
+        message_text = message_text or ""
+        if len(message_text) > TICKET_MESSAGE_PREVIEW:
+            message_text = message_text[:TICKET_MESSAGE_PREVIEW] + "…"
+        response += f"{role_icon} <b>{role_name}</b> ({time_str}):\n{html.escape(message_text)}\n"
         if media_type:
             response += f"   [Прикреплён {media_type}]\n"
         response += "\n"
 
     await callback.message.edit_text(
         response,
-        reply_markup=get_ticket_action_keyboard(ticket_id, is_staff=is_staff)
+        reply_markup=get_ticket_action_keyboard(
+            ticket_id, is_staff=is_staff,
+            older_id=messages[0][0] if has_older else None,
+            newer_id=messages[-1][0] if has_newer else None
+        )
     )
     await callback.answer()
 
-@router.message(TicketStates.waiting_for_reply, F.photo | F.document | F.text)
+@router.message(TicketStates.waiting_for_reply, F.content_type.in_(relay.CONTENT_TYPES))
 async def process_ticket_reply(message: types.Message, state: FSMContext):
-    bot = message.bot
     user_id = message.from_user.id
     data = await state.get_data()
     ticket_id = data.get('ticket_id')
@@ -278,67 +319,64 @@ async def process_ticket_reply(message: types.Message, state: FSMContext):
         await state.clear()
         return
 
-    reply_text = message.caption or message.text or ""
-    media_type = None
-    file_id = None
-    if message.photo:
-        media_type = 'photo'
-        file_id = message.photo[-1].file_id
-        if not reply_text:
-            reply_text = "[Фото]"
-    elif message.document:
-        media_type = 'document'
-        file_id = message.document.file_id
-        if not reply_text:
-            reply_text = f"[Документ: {message.document.file_name}]"
+    await state.clear()
+    if _relay_to_ticket(message, ticket, get_user_role(user_id) in STAFF_ROLES):
+        await message.answer("✅ Ваше сообщение добавлено в тикет!", reply_markup=get_back_to_menu_keyboard())
 
-    user_role = get_user_role(user_id)
-    is_staff = user_role in ['agent', 'moder', 'admin', 'tech_admin', 'owner']
-    add_ticket_message(ticket_id, user_id, reply_text, is_staff, media_type, file_id)
+@router.message(F.chat.type == "private", StateFilter(None), F.content_type.in_(relay.CONTENT_TYPES), relay.linked_reply)
+async def ticket_thread_reply(message: types.Message, link: tuple):
+    """Реплай в личке на пересланное сообщение тикета — без кнопки «Ответить»."""
+    ticket_id, peer_chat_id, _ = link
+    ticket = get_ticket(ticket_id)
+    if not ticket or peer_chat_id != TICKET_GROUP_ID:
+        return
+    if ticket[3] == 'closed':
+        await message.answer("Тикет закрыт! Нельзя добавить сообщение.", reply_markup=get_back_to_menu_keyboard())
+        return
+    if _relay_to_ticket(message, ticket, get_user_role(message.from_user.id) in STAFF_ROLES):
+        await message.answer(f"✅ Сообщение добавлено в тикет #{ticket_id}")
 
+def _relay_to_ticket(message: types.Message, ticket: tuple, is_staff: bool) -> bool:
+    """
+    Сохраняет сообщение из лички в тикет и пересылает копией в тему (и пользователю, если пишет агент).
+    False — сообщение оказалось очередной частью уже начатого альбома.
+    """
+    ticket_id = ticket[0]
+    user_id = message.from_user.id
+    targets = []
     if ticket[4]:
-        try:
-            user = get_user(user_id)
-            full_name = user[3] if user else "Неизвестно"
-            role_prefix = "👨‍💼 Поддержка" if is_staff else f"👤 {full_name}"
-            if media_type == 'photo':
-                await bot.send_photo(
-                    chat_id=TICKET_GROUP_ID,
-                    message_thread_id=ticket[4],
-                    photo=file_id,
-                    caption=f"{role_prefix}:\n{reply_text}"
-                )
-            elif media_type == 'document':
-                await bot.send_document(
-                    chat_id=TICKET_GROUP_ID,
-                    message_thread_id=ticket[4],
-                    document=file_id,
-                    caption=f"{role_prefix}:\n{reply_text}"
-                )
-            else:
-                await bot.send_message(
-                    chat_id=TICKET_GROUP_ID,
-                    message_thread_id=ticket[4],
-                    text=f"{role_prefix}:\n{reply_text}"
-                )
-        except Exception as e:
-            logger.error(f"Ошибка отправки в тему: {e}")
-
-    # Отправляем уведомление пользователю (если ответ от поддержки)
+        user = get_user(user_id)
+        full_name = user[3] if user else "Неизвестно"
+        role_prefix = "👨‍💼 Поддержка" if is_staff else f"👤 {html.escape(full_name)}"
+        targets.append((TICKET_GROUP_ID, f"{role_prefix}:", ticket[4], None))
+    # Уведомление пользователю (если ответ от поддержки)
     if is_staff and user_id != ticket[1]:
-        try:
-            staff_name = message.from_user.full_name
-            await bot.send_message(
-                ticket[1],
-                f"📩 <b>Новый ответ в тикете #{ticket_id}</b>\n\n"
-                f"💬 Сообщение от {staff_name}:\n{reply_text}",
-                reply_markup=get_reply_to_ticket_keyboard(ticket_id)
-            )
-        except Exception as e:
-            logger.error(f"Ошибка уведомления пользователя: {e}")
-
-    await message.answer("✅ Ваше сообщение добавлено в тикет!", reply_markup=get_back_to_menu_keyboard())
-    await state.clear()
+        targets.append((
+            ticket[1],
+            f"📩 <b>Новый ответ в тикете #{ticket_id}</b>\n\n"
+            f"💬 Сообщение от {html.escape(message.from_user.full_name)}:",
+            None, get_reply_to_ticket_keyboard(ticket_id)
+        ))
+    text, media_type, file_id = relay.describe(message)
+    if message.media_group_id:
+        started, delivery = relay.collect_album(message, ticket_id, is_staff, targets)
+        add_ticket_message(ticket_id, user_id, text, is_staff, media_type, file_id, **delivery)
+        return started
+    notifications = [
+        relay.notification(message, ticket_id, chat_id, header, thread_id, markup)
+        for chat_id, header, thread_id, markup in targets
+    ]
+    add_ticket_message(ticket_id, user_id, text, is_staff, media_type, file_id, notifications=notifications)
+    outbox.wake()
+    return True
+
+@router.message(relay.album_part)
+async def ticket_album_part(message: types.Message, album: dict):
+    """Остальные части альбома, начатого в тикете: сохраняются и уходят вместе с первой."""
+    text, media_type, file_id = relay.describe(message)
+    _, delivery = relay.collect_album(message)
+    add_ticket_message(album['ticket_id'], message.from_user.id, text, album['from_support'], media_type, file_id,
+                       **delivery)
 
 @router.callback_query(TicketCallback.filter(F.action == "close"))
 async def close_ticket_callback(callback: types.CallbackQuery, callback_data: TicketCallback):
@@ -359,12 +397,11 @@ async def close_ticket_callback(callback: types.CallbackQuery, callback_data: Ti
         await callback.answer("У вас нет прав для закрытия этого тикета!", show_alert=True)
         return
 
-    update_ticket_status(ticket_id, 'closed')
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tickets SET closed_by = ? WHERE id = ?", (user_id, ticket_id))
-    conn.commit()
-    conn.close()
+    update_ticket_status(ticket_id, 'closed', notifications=[outbox.notification(
+        ticket_user_id, f"🔒 Ваш тикет #{ticket_id} был закрыт {callback.from_user.full_name}."
+    )], closed_by=user_id)
+    outbox.wake()
+    agent_dispatcher.refresh(ticket[12])
 
     if ticket[4]:
         try:
@@ -372,16 +409,6 @@ async def close_ticket_callback(callback: types.CallbackQuery, callback_data: Ti
         except Exception as e:
             logger.error(f"Ошибка закрытия топика: {e}")
 
-    # Уведомляем пользователя о закрытии
-    try:
-        closer_name = callback.from_user.full_name
-        await bot.send_message(
-            ticket_user_id,
-            f"🔒 Ваш тикет #{ticket_id} был закрыт {closer_name}."
-        )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления о закрытии: {e}")
-
     await callback.message.edit_text(
         f"🔒 Тикет #{ticket_id} закрыт.\nТема: {ticket[2]}",
         reply_markup=get_back_to_menu_keyboard()
@@ -490,12 +517,13 @@ async def group_message_handler(message: types.Message):
     await handle_group_message(message)
 
 async def handle_group_message(message: types.Message):
-    topic_id = message.message_thread_id
-    ticket = get_ticket_by_topic_id(topic_id)
-    if not ticket:
+    # Тема и роль берутся из карт в памяти: чужие и закрытые темы не трогают БД
+    route = get_topic_route(message.message_thread_id)
+    if not route:
         return
+    ticket_id, ticket_user_id, status = route
 
-    if ticket[3] == 'closed':
+    if status == 'closed':
         try:
             await message.reply("❌ Этот тикет закрыт. Новые сообщения не принимаются.")
         except:
@@ -503,39 +531,33 @@ async def handle_group_message(message: types.Message):
         return
 
     user_id = message.from_user.id
-    user_role = get_user_role(user_id)
-    is_staff = user_role in ['agent', 'moder', 'admin', 'tech_admin', 'owner']
-
     # Если сообщение от обычного пользователя в группе — просто игнорируем
-    if not is_staff:
+    if get_staff_role(user_id) == 'user':
         return
 
-    text = message.caption or message.text or "Вложение"
-    media_type = None
-    file_id = None
-    if message.photo:
-        media_type = 'photo'
-        file_id = message.photo[-1].file_id
-    elif message.document:
-        media_type = 'document'
-        file_id = message.document.file_id
-
-    add_ticket_message(ticket[0], user_id, text, is_from_support=True, media_type=media_type, file_id=file_id)
-
-    # Отправляем уведомление пользователю
-    try:
-        user_ticket = get_ticket(ticket[0])
-        if user_ticket:
-            user_chat_id = user_ticket[1]  # ID пользователя
-            staff_name = message.from_user.full_name
-            await message.bot.send_message(
-                user_chat_id,
-                f"📩 <b>Новый ответ в тикете #{ticket[0]}</b>\n\n"
-                f"💬 Сообщение от {staff_name}:\n{text}",
-                reply_markup=get_reply_to_ticket_keyboard(ticket[0])
-            )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя из группы: {e}")
+    if not relay.content_type(message):
+        return
+    text, media_type, file_id = relay.describe(message)
+    header = (
+        f"📩 <b>Новый ответ в тикете #{ticket_id}</b>\n\n"
+        f"💬 Сообщение от {html.escape(message.from_user.full_name)}:"
+    )
+    if message.media_group_id:
+        started, delivery = relay.collect_album(
+            message, ticket_id, True, [(ticket_user_id, header, None, get_reply_to_ticket_keyboard(ticket_id))]
+        )
+        add_ticket_message(ticket_id, user_id, text, is_from_support=True, media_type=media_type, file_id=file_id,
+                           **delivery)
+        if not started:
+            return
+    else:
+        # Сообщение и его копия пользователю сохраняются одной транзакцией
+        add_ticket_message(ticket_id, user_id, text, is_from_support=True, media_type=media_type, file_id=file_id,
+                           notifications=[relay.notification(
+                               message, ticket_id, ticket_user_id, header,
+                               reply_markup=get_reply_to_ticket_keyboard(ticket_id)
+                           )])
+        outbox.wake()
 
     try:
         await message.reply("✅ Сообщение сохранено и отправлено пользователю.")
@@ -551,6 +573,64 @@ async def cmd_ticket_menu(message: types.Message):
         reply_markup=get_ticket_group_menu_keyboard()
     )
 
+# ========== СМЕНА И АВТОНАЗНАЧЕНИЕ ==========
+async def _toggle_duty(user_id: int) -> str:
+    online = not agent_dispatcher.is_online(user_id)
+    agent_dispatcher.set_online(user_id, online)
+    if online:
+        return "🟢 Вы на смене — новые тикеты будут назначаться вам"
+    return "⚪ Смена сдана — новые тикеты вам не назначаются"
+
+@router.callback_query(TicketCallback.filter(F.action == "group_duty"))
+async def group_duty(callback: types.CallbackQuery):
+    if not has_access(callback.from_user.id, 'agent'):
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+    await callback.answer(await _toggle_duty(callback.from_user.id), show_alert=True)
+
+@router.message(Command("duty"))
+async def cmd_duty(message: types.Message):
+    if not has_access(message.from_user.id, 'agent'):
+        await message.answer("⛔ Нет доступа")
+        return
+    await message.answer(await _toggle_duty(message.from_user.id))
+
+@router.message(Command("agents"))
+async def cmd_agents(message: types.Message):
+    if not has_access(message.from_user.id, 'moder'):
+        await message.answer("⛔ Нет доступа")
+        return
+    rows = agent_dispatcher.workload()
+    if not rows:
+        await message.answer("📭 Никого на смене и нет назначенных тикетов.")
+        return
+    text = "👥 <b>НАГРУЗКА АГЕНТОВ</b>\n\n"
+    for agent_id, online, load, skills in rows[:50]:
+        user = get_user(agent_id)
+        name = f"@{user[2]}" if user and user[2] else f"ID {agent_id}"
+        skills_text = f" [{', '.join(sorted(skills))}]" if skills else ""
+        text += f"{'🟢' if online else '⚪'} {html.escape(name)} — {load} откр.{html.escape(skills_text)}\n"
+    await message.answer(text)
+
+@router.message(Command("skills"))
+async def cmd_skills(message: types.Message):
+    """/skills @agent навык1,навык2 — навыки совпадают с группами правил разбора (/triage)."""
+    if not has_access(message.from_user.id, 'admin'):
+        await message.answer("⛔ Нет доступа")
+        return
+    args = message.text.split(maxsplit=2)
+    if len(args) < 2:
+        await message.answer("❌ Использование: /skills ID|@username навык1,навык2 (без навыков — очистить)")
+        return
+    agent = get_user_by_id_or_username(args[1].lstrip('@'))
+    if not agent:
+        await message.answer("❌ Пользователь не найден")
+        return
+    skills = args[2] if len(args) > 2 else ""
+    agent_dispatcher.set_skills(agent[1], skills)
+    log_admin_action(message.from_user.id, 'agent_skills', 'user', agent[1], {'skills': skills})
+    await message.answer(f"✅ Навыки агента {agent[1]}: {html.escape(skills) or 'нет (берёт любые тикеты)'}")
+
 @router.callback_query(TicketCallback.filter(F.action == "group_open"))
 async def group_open_tickets(callback: types.CallbackQuery):
     tickets = get_all_tickets('open')
@@ -597,7 +677,7 @@ async def group_my_tickets(callback: types.CallbackQuery):
 @router.callback_query(TicketCallback.filter(F.action == "group_search"))
 async def group_search_tickets(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
-        "🔍 Введите номер тикета или @username пользователя:",
+        "🔍 Введите номер тикета, @username пользователя или слова из переписки:",
         reply_markup=get_back_to_menu_keyboard()
     )
     await state.set_state(TicketStates.waiting_for_search_query)
@@ -626,11 +706,13 @@ async def process_search_query(message: types.Message, state: FSMContext):
             await message.answer("❌ Тикет не найден.")
     else:
         clean = query.lstrip('@')
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_id FROM users WHERE username = ?", (clean,))
-        row = cursor.fetchone()
-        conn.close()
+        row = None
+        if ' ' not in clean:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id FROM users WHERE username = ?", (clean,))
+            row = cursor.fetchone()
+            conn.close()
         if row:
             user_id = row[0]
             tickets = get_user_tickets(user_id)
@@ -642,10 +724,65 @@ async def process_search_query(message: types.Message, state: FSMContext):
                 await message.answer(text)
             else:
                 await message.answer(f"📭 У пользователя @{clean} нет тикетов.")
-        else:
+        elif query.startswith('@'):
             await message.answer("❌ Пользователь не найден.")
+        else:
+            # Не номер и не пользователь — ищем по тексту тикетов; запрос нужен для листания страниц
+            await state.clear()
+            await state.update_data(ticket_search=query)
+            text, markup = _render_search(query, 1)
+            await message.answer(text, reply_markup=markup)
+            return
     await state.clear()
 
+# ========== ПОЛНОТЕКСТОВЫЙ ПОИСК ==========
+def _highlight(snippet: str, limit: int = 200) -> str:
+    start, end = _SEARCH_HIGHLIGHT
+    snippet = html.escape(snippet or "")
+    if len(snippet) > limit:
+        snippet = snippet[:limit] + "…"
+    # Обрезка могла оставить маркер без пары — закрываем его
+    if snippet.count(start) > snippet.count(end):
+        snippet += end
+    return snippet.replace(start, "<b>").replace(end, "</b>")
+
+def _render_search(query: str, page: int):
+    """Текст и клавиатура страницы результатов поиска."""
+    offset = (page - 1) * TICKET_SEARCH_PAGE_SIZE
+    # Берём на одну строку больше — так известно, есть ли следующая страница
+    hits = search_tickets_text(query, TICKET_SEARCH_PAGE_SIZE + 1, offset)
+    has_next = len(hits) > TICKET_SEARCH_PAGE_SIZE
+    hits = hits[:TICKET_SEARCH_PAGE_SIZE]
+    if not hits:
+        text = f"🔍 По запросу «{html.escape(query)}» ничего не найдено."
+        if page > 1:
+            text += f"\nСтраница {page} пуста."
+        return text, get_ticket_search_keyboard([], page, False)
+    text = f"🔍 <b>Поиск:</b> «{html.escape(query)}» — стр. {page}\n\n"
+    for ticket_id, subject, status, priority, snippet, from_subject in hits:
+        status_icon = "🟢" if status == 'open' else "🔴"
+        text += f"{priority} <b>#{ticket_id}</b> {status_icon} {html.escape(subject or '')}\n"
+        if not from_subject:
+            text += f"   💬 {_highlight(snippet)}\n"
+        text += "\n"
+    return text, get_ticket_search_keyboard([hit[0] for hit in hits], page, has_next)
+
+@router.callback_query(TicketSearchCallback.filter())
+async def search_page_callback(callback: types.CallbackQuery, callback_data: TicketSearchCallback, state: FSMContext):
+    if not has_access(callback.from_user.id, 'agent'):
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+    query = (await state.get_data()).get('ticket_search')
+    if not query:
+        await callback.answer("Поиск устарел, повторите запрос", show_alert=True)
+        return
+    text, markup = _render_search(query, max(1, callback_data.page))
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        pass
+    await callback.answer()
+
 @router.callback_query(TicketCallback.filter(F.action == "group_stats"))
 async def agent_stats_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
@@ -659,8 +796,20 @@ async def agent_stats_callback(callback: types.CallbackQuery):
         f"────────────────────\n"
         f"📋 ТИКЕТЫ:\n"
         f"├─ Всего: {stats['total_tickets']}\n"
-        f"├─ Закрыто: {stats['closed_tickets']}\n"
-        f"└─ Среднее время ответа: N/A (в разработке)\n\n"
+        f"└─ Закрыто: {stats['closed_tickets']}\n\n"
+    )
+    for title, key in (("⏱ ПЕРВЫЙ ОТВЕТ", 'response'), ("✅ РЕШЕНИЕ", 'resolution')):
+        count = stats[key + 's']
+        if not count:
+            text += f"{title}: нет данных\n\n"
+            continue
+        text += (
+            f"{title} ({count} тик.):\n"
+            f"├─ Медиана: {format_duration(int(stats[key + '_p50']))}\n"
+            f"├─ p90: {format_duration(int(stats[key + '_p90']))}\n"
+            f"└─ p99: {format_duration(int(stats[key + '_p99']))}\n\n"
+        )
+    text += (
         f"⭐ РЕЙТИНГ:\n"
         f"├─ Средняя оценка: {stats['avg_rating']}/5\n"
         f"├─ Всего оценок: {stats['ratings_count']}\n"
@@ -691,12 +840,10 @@ async def group_rating(callback: types.CallbackQuery):
     await callback.message.edit_text(text, reply_markup=get_back_to_menu_keyboard())
     await callback.answer()
 
+STAFF_ROLES = ('agent', 'moder', 'admin', 'tech_admin', 'owner')
+
 def get_user_role(user_id: int) -> str:
-    from database import get_user
-    user = get_user(user_id)
-    if user:
-        return user[7] if len(user) > 7 else 'user'
-    return 'user'
+    return get_staff_role(user_id)
 
 # ========== КОМАНДЫ ДЛЯ АДМИНИСТРАЦИИ ==========
 @router.message(Command("ticket"))
@@ -732,13 +879,20 @@ async def cmd_ticket(message: types.Message):
     await message.answer(text)
 
 @router.message(Command("tickets"))
-async def cmd_tickets(message: types.Message):
+async def cmd_tickets(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     if not has_access(user_id, 'moder'):
         await message.answer("⛔ Нет доступа")
         return
     args = message.text.split()
-    if len(args) > 1 and args[1].lower() == 'all':
+    if len(args) > 1 and args[1].lower() != 'all':
+        # /tickets <слова> — полнотекстовый поиск по переписке
+        query = message.text.split(maxsplit=1)[1]
+        await state.update_data(ticket_search=query)
+        text, markup = _render_search(query, 1)
+        await message.answer(text, reply_markup=markup)
+        return
+    if len(args) > 1:
         tickets = get_all_tickets()
         title = "Все тикеты"
     else:
@@ -778,18 +932,14 @@ async def cmd_answer(message: types.Message):
     if ticket[3] == 'closed':
         await message.answer("❌ Тикет закрыт. Нельзя отправить ответ.")
         return
-    add_ticket_message(ticket_id, user_id, answer_text, is_from_support=True)
-    try:
-        await message.bot.send_message(
-            ticket[1],
-            f"📩 <b>Ответ на ваш тикет #{ticket_id}</b>\n\n"
-            f"<b>Ответ специалиста:</b>\n{answer_text}",
-            reply_markup=get_reply_to_ticket_keyboard(ticket_id)
-        )
-        await message.answer(f"✅ Ответ на тикет #{ticket_id} отправлен!")
-    except Exception as e:
-        logger.error(f"Ошибка отправки ответа: {e}")
-        await message.answer("❌ Не удалось отправить ответ пользователю")
+    add_ticket_message(ticket_id, user_id, answer_text, is_from_support=True, notifications=[outbox.notification(
+        ticket[1],
+        f"📩 <b>Ответ на ваш тикет #{ticket_id}</b>\n\n"
+        f"<b>Ответ специалиста:</b>\n{answer_text}",
+        get_reply_to_ticket_keyboard(ticket_id)
+    )])
+    outbox.wake()
+    await message.answer(f"✅ Ответ на тикет #{ticket_id} отправлен!")
 
 @router.message(Command("creport"))
 async def cmd_creport(message: types.Message):
@@ -813,13 +963,9 @@ async def cmd_creport(message: types.Message):
     if ticket[3] == 'closed':
         await message.answer("❌ Тикет уже закрыт.")
         return
-    update_ticket_status(ticket_id, 'closed')
-    # Уведомление пользователю при закрытии
-    try:
-        await message.bot.send_message(
-            ticket[1],
-            f"🔒 Тикет #{ticket_id} был закрыт агентом поддержки."
-        )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления о закрытии: {e}")
+    update_ticket_status(ticket_id, 'closed', notifications=[outbox.notification(
+        ticket[1], f"🔒 Тикет #{ticket_id} был закрыт агентом поддержки."
+    )], closed_by=user_id)
+    outbox.wake()
+    agent_dispatcher.refresh(ticket[12])
     await message.answer(f"✅ Тикет #{ticket_id} закрыт!")
\ No newline at end of file
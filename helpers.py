@@ -1,16 +1,19 @@
 # FILE: helpers.py
+import asyncio
 import logging
 import hashlib
 import time
 import os
 import json
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Optional, List, Dict, Any, Tuple, Union
 
 from aiocache import Cache
 from aiocache.decorators import cached
 
+import cache_bus
+
 from config import (
     SCREENSHOTS_DIR, BACKUP_DIR, CACHE_TTL_BALANCE, CACHE_TTL_TOP, CACHE_TTL_STAR_RATE,
     ACTION_TIMEOUT_SECONDS, REQUIRED_CHANNELS, OWNER_ID, TECH_ADMIN_ID
@@ -35,6 +38,7 @@ async def get_cached_balance(user_id: int, currency: str = 'virtual'):
 
 async def invalidate_balance_cache(user_id: int):
     await cache.delete(f"balance:{user_id}")
+    cache_bus.publish('aiocache', f"balance:{user_id}")
 
 @cached(ttl=CACHE_TTL_TOP, key="top_buyers")
 async def get_cached_top_buyers(limit: int = 10):
@@ -42,6 +46,7 @@ async def get_cached_top_buyers(limit: int = 10):
 
 async def invalidate_top_cache():
     await cache.delete("top_buyers")
+    cache_bus.publish('aiocache', "top_buyers")
 
 @cached(ttl=CACHE_TTL_STAR_RATE, key="star_rate")
 async def get_cached_star_rate():
@@ -51,6 +56,18 @@ async def invalidate_settings_cache():
     clear_settings_cache()
     await cache.delete("star_rate")
     await cache.delete("top_buyers")
+    cache_bus.publish('aiocache', "star_rate")
+    cache_bus.publish('aiocache', "top_buyers")
+
+def _drop_aiocache(key: str = None):
+    """Сброс по сообщению от другого воркера (вызывается внутри event loop)."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    loop.create_task(cache.delete(key) if key else cache.clear())
+
+cache_bus.subscribe('aiocache', _drop_aiocache)
 
 # ========== ДЕДУПЛИКАЦИЯ ДЕЙСТВИЙ ==========
 async def is_duplicate_action(action_id: str, ttl: int = 5) -> bool:
@@ -179,11 +196,8 @@ async def check_freeze_middleware(handler, event, data):
 
 # ========== ФУНКЦИИ ДЛЯ ПРОВЕРКИ ПРАВ ДОСТУПА ==========
 def get_user_role(user_id: int) -> str:
-    from database import get_user
-    user = get_user(user_id)
-    if user:
-        return user[7] if len(user) > 7 else 'user'
-    return 'user'
+    from database import get_staff_role
+    return get_staff_role(user_id)
 
 def has_access(user_id: int, required_role: str) -> bool:
     role = get_user_role(user_id)
@@ -285,30 +299,6 @@ def get_screenshot_path(user_id: int, filename: str = None) -> str:
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     return os.path.join(SCREENSHOTS_DIR, f"{user_id}_{timestamp}.jpg")
 
-# ========== НОВАЯ ФУНКЦИЯ ДЛЯ АВТОУДАЛЕНИЯ ==========
-def cleanup_old_screenshots(days: int = 30) -> int:
-    """
-    Удаляет скриншоты старше указанного количества дней.
-    Возвращает количество удалённых файлов.
-    """
-    if not os.path.exists(SCREENSHOTS_DIR):
-        return 0
-    now = datetime.now()
-    cutoff = now - timedelta(days=days)
-    count = 0
-    for filename in os.listdir(SCREENSHOTS_DIR):
-        filepath = os.path.join(SCREENSHOTS_DIR, filename)
-        if os.path.isfile(filepath):
-            mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
-            if mtime < cutoff:
-                try:
-                    os.remove(filepath)
-                    count += 1
-                    logger.debug(f"Удалён старый скриншот: {filename}")
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении {filename}: {e}")
-    return count
-
 # ========== РАСЧЁТЫ ==========
 def calculate_total_price(amount: int, star_rate: float) -> float:
     return amount * star_rate
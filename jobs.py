@@ -0,0 +1,127 @@
+# FILE: jobs.py
+"""Фоновые задачи бота, регистрируемые в планировщике."""
+import logging
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import (
+    AUTO_BACKUP_INTERVAL_HOURS, BACKUP_KEEP_COUNT, BACKUP_MODE, SCREENSHOTS_RETENTION_DAYS,
+    RECORDS_RETENTION_DAYS, ADMIN_LOGS_RETENTION_DAYS, MAILING_CHECK_INTERVAL,
+    MEDIA_ARCHIVE_INTERVAL, MEDIA_ARCHIVE_BATCH, OUTBOX_INTERVAL, TRIAGE_HITS_FLUSH_INTERVAL,
+    TOPIC_POOL_REFILL_INTERVAL, CASINO_STALE_GAME_MINUTES, OWNER_ID
+)
+from backups import create_backup, create_incremental_backup, cleanup_old_backups
+from database import (
+    cleanup_old_records, refund_stale_games,
+    get_pending_mailings, get_mailing_recipients, start_mailing, update_mailing_status
+)
+from media import archive_pending
+import outbox
+import send_scheduler
+from scheduler import scheduler
+from screenshots import cleanup_expired_screenshots
+import topic_pool
+import triage
+
+logger = logging.getLogger(__name__)
+
+
+# ========== ОБСЛУЖИВАНИЕ ==========
+def cleanup_screenshots_job():
+    deleted = cleanup_expired_screenshots(days=SCREENSHOTS_RETENTION_DAYS)
+    return f"удалено скриншотов: {deleted}"
+
+
+def backup_job():
+    if BACKUP_MODE == "incremental":
+        backup_file = create_incremental_backup()
+    else:
+        backup_file = create_backup()
+    cleanup_old_backups(BACKUP_KEEP_COUNT)
+    return f"бекап {backup_file}"
+
+
+def retention_job():
+    deleted = cleanup_old_records(RECORDS_RETENTION_DAYS, ADMIN_LOGS_RETENTION_DAYS)
+    return f"удалено старых записей: {deleted}"
+
+
+def stale_games_job():
+    refunded = refund_stale_games("casino_virtual", CASINO_STALE_GAME_MINUTES)
+    return f"возвращено ставок: {refunded}" if refunded else None
+
+
+async def archive_media_job(bot: Bot):
+    duplicates = await archive_pending(bot, MEDIA_ARCHIVE_BATCH)
+    if duplicates:
+        outbox.notify(*[
+            outbox.notification(OWNER_ID, f"⚠️ Скриншот к заявке #{order_id} совпадает со скриншотом заявки #{previous_order}")
+            for order_id, previous_order in duplicates
+        ])
+
+
+# ========== РАССЫЛКИ ==========
+async def send_mailing_message(bot: Bot, user_id: int, text: str, media_type: str = None,
+                               file_id: str = None, reply_markup=None):
+    if media_type == 'photo':
+        await bot.send_photo(user_id, file_id, caption=text, reply_markup=reply_markup)
+    elif media_type == 'video':
+        await bot.send_video(user_id, file_id, caption=text, reply_markup=reply_markup)
+    elif media_type == 'animation':
+        await bot.send_animation(user_id, file_id, caption=text, reply_markup=reply_markup)
+    elif media_type == 'sticker':
+        await bot.send_sticker(user_id, file_id)
+        if text:
+            await bot.send_message(user_id, text, reply_markup=reply_markup)
+    else:
+        await bot.send_message(user_id, text, reply_markup=reply_markup)
+
+
+async def dispatch_mailings(bot: Bot):
+    """Отправляет все рассылки со статусом pending, время которых подошло."""
+    # Темп задаёт send_scheduler: рассылка уступает ответам и уведомлениям
+    send_scheduler.set_lane('broadcast')
+    for mailing in get_pending_mailings():
+        mailing_id, admin_id, filter_type, text, file_id, media_type, button_text, button_url = mailing[:8]
+        recipients = get_mailing_recipients(filter_type, admin_id)
+        if not start_mailing(mailing_id, len(recipients)):
+            continue
+        reply_markup = None
+        if button_text and button_url:
+            reply_markup = InlineKeyboardMarkup(
+                inline_keyboard=[[InlineKeyboardButton(text=button_text, url=button_url)]]
+            )
+        success = 0
+        fail = 0
+        for user_id in recipients:
+            try:
+                await send_mailing_message(bot, user_id, text, media_type, file_id, reply_markup)
+                success += 1
+            except Exception as e:
+                logger.error(f"Ошибка отправки {user_id}: {e}")
+                fail += 1
+        update_mailing_status(mailing_id, 'done', success, fail)
+        try:
+            await bot.send_message(
+                admin_id,
+                f"✅ РАССЫЛКА #{mailing_id} ЗАВЕРШЕНА\n\n"
+                f"📊 РЕЗУЛЬТАТЫ:\n"
+                f"├─ Всего: {len(recipients)}\n"
+                f"├─ Доставлено: {success}\n"
+                f"└─ Ошибок: {fail}"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отправить итоги рассылки: {e}")
+
+
+def register_jobs(bot: Bot):
+    scheduler.register("screenshots_cleanup", cleanup_screenshots_job, at="04:00", blocking=True)
+    scheduler.register("backup", backup_job, interval=AUTO_BACKUP_INTERVAL_HOURS * 3600, blocking=True)
+    scheduler.register("retention", retention_job, at="04:30", blocking=True)
+    scheduler.register("stale_games", stale_games_job, interval=CASINO_STALE_GAME_MINUTES * 60, blocking=True)
+    scheduler.register("media_archive", lambda: archive_media_job(bot), interval=MEDIA_ARCHIVE_INTERVAL, jitter=0)
+    scheduler.register("mailings", lambda: dispatch_mailings(bot), interval=MAILING_CHECK_INTERVAL, jitter=0)
+    scheduler.register(outbox.JOB_NAME, lambda: outbox.deliver(bot), interval=OUTBOX_INTERVAL, jitter=0)
+    scheduler.register(triage.JOB_NAME, triage.triage_engine.flush_hits, interval=TRIAGE_HITS_FLUSH_INTERVAL)
+    scheduler.register(topic_pool.JOB_NAME, lambda: topic_pool.refill(bot), interval=TOPIC_POOL_REFILL_INTERVAL)
@@ -95,6 +95,20 @@ class TemplateCallback(CallbackData, prefix="template"):
     name: str = ""
     page: int = 0
 
+class ModerationCallback(CallbackData, prefix="mod"):
+    action: str
+    kind: str = "order"
+    item_id: str = ""
+    page: int = 1
+
+class TicketSearchCallback(CallbackData, prefix="tsearch"):
+    page: int
+
+class TicketHistoryCallback(CallbackData, prefix="thist"):
+    ticket_id: int
+    before: int = 0
+    after: int = 0
+
 # ========== СУЩЕСТВУЮЩИЕ КЛАВИАТУРЫ (ОБНОВЛЁННЫЕ) ==========
 def get_main_menu() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
@@ -173,8 +187,16 @@ def get_ticket_subjects_keyboard() -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="❌ Отменить создание", callback_data="cancel_ticket"))
     return builder.as_markup()
 
-def get_ticket_action_keyboard(ticket_id: int, is_staff: bool = False) -> InlineKeyboardMarkup:
+def get_ticket_action_keyboard(ticket_id: int, is_staff: bool = False, older_id: int = None, newer_id: int = None) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
+    # Листание истории: ключ — id крайнего сообщения на текущей странице
+    nav = []
+    if older_id:
+        nav.append(InlineKeyboardButton(text="⬆️ Раньше", callback_data=TicketHistoryCallback(ticket_id=ticket_id, before=older_id).pack()))
+    if newer_id:
+        nav.append(InlineKeyboardButton(text="⬇️ Позже", callback_data=TicketHistoryCallback(ticket_id=ticket_id, after=newer_id).pack()))
+    if nav:
+        builder.row(*nav)
     if is_staff:
         # Для персонала: приоритет и закрыть
         builder.row(
@@ -257,8 +279,9 @@ def get_withdrawal_keyboard(withdrawal_id: str) -> InlineKeyboardMarkup:
 def get_exchange_approve_keyboard(exchange_id: str, exchange_type: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="✅ Одобрить", callback_data=ExchangeCallback(action="approve", exchange_id=exchange_id, exchange_type=exchange_type).pack()),
-        InlineKeyboardButton(text="❌ Отклонить", callback_data=ExchangeCallback(action="reject", exchange_id=exchange_id, exchange_type=exchange_type).pack()),
+        # exchange_type в callback_data не передаётся: с uuid заявки он не влезает в 64 байта
+        InlineKeyboardButton(text="✅ Одобрить", callback_data=ExchangeCallback(action="approve", exchange_id=exchange_id).pack()),
+        InlineKeyboardButton(text="❌ Отклонить", callback_data=ExchangeCallback(action="reject", exchange_id=exchange_id).pack()),
         width=2
     )
     return builder.as_markup()
@@ -329,11 +352,12 @@ def get_rating_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 # ========== АДМИН-ПАНЕЛЬ ==========
-def get_admin_main_keyboard() -> InlineKeyboardMarkup:
+def get_admin_main_keyboard(pending: int = 0) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
+    orders_text = f"📦 Заказы ({pending})" if pending else "📦 Заказы"
     builder.row(
         InlineKeyboardButton(text="💰 Экономика", callback_data=AdminCallback(action="economy_menu").pack()),
-        InlineKeyboardButton(text="📦 Заказы", callback_data=AdminCallback(action="orders_menu").pack()),
+        InlineKeyboardButton(text=orders_text, callback_data=AdminCallback(action="orders_menu").pack()),
         width=2
     )
     builder.row(
@@ -398,6 +422,15 @@ def get_economy_keyboard() -> InlineKeyboardMarkup:
     )
     return builder.as_markup()
 
+def get_setting_confirm_keyboard() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="✅ Применить", callback_data=AdminCallback(action="setting_apply").pack()),
+        InlineKeyboardButton(text="❌ Отмена", callback_data=AdminCallback(action="setting_cancel").pack()),
+        width=2
+    )
+    return builder.as_markup()
+
 def get_promocodes_main_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -710,15 +743,75 @@ def get_pagination_keyboard(
     builder.row(*buttons)
     return builder.as_markup()
 
+def get_moderation_menu_keyboard(counts: Dict[str, int]) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text=f"📦 Заказы ({counts['order']})", callback_data=ModerationCallback(action="list", kind="order").pack()))
+    builder.row(InlineKeyboardButton(text=f"📤 Выводы ({counts['withdrawal']})", callback_data=ModerationCallback(action="list", kind="withdrawal").pack()))
+    builder.row(InlineKeyboardButton(text=f"💱 Обмены ({counts['exchange']})", callback_data=ModerationCallback(action="list", kind="exchange").pack()))
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=AdminCallback(action="main").pack()))
+    return builder.as_markup()
+
+def get_moderation_queue_keyboard(kind: str, item_ids: list, page: int, total_pages: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    buttons = [
+        InlineKeyboardButton(
+            text=f"🔎 #{str(item_id)[:8]}",
+            callback_data=ModerationCallback(action="open", kind=kind, item_id=str(item_id), page=page).pack()
+        )
+        for item_id in item_ids
+    ]
+    for i in range(0, len(buttons), 2):
+        builder.row(*buttons[i:i + 2])
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=ModerationCallback(action="list", kind=kind, page=page - 1).pack()))
+    nav.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data=ModerationCallback(action="list", kind=kind, page=page).pack()))
+    if page < total_pages:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=ModerationCallback(action="list", kind=kind, page=page + 1).pack()))
+    builder.row(*nav)
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data=AdminCallback(action="orders_menu").pack()))
+    return builder.as_markup()
+
+def get_moderation_item_keyboard(kind: str, item_id: str, page: int, actions: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """Кнопки решения по заявке + снятие закрепления."""
+    builder = InlineKeyboardBuilder()
+    builder.attach(InlineKeyboardBuilder.from_markup(actions))
+    builder.row(InlineKeyboardButton(
+        text="🔓 Отпустить",
+        callback_data=ModerationCallback(action="free", kind=kind, item_id=str(item_id), page=page).pack()
+    ))
+    return builder.as_markup()
+
 def get_ticket_group_menu_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="🟢 ОТКРЫТЫЕ ТИКЕТЫ", callback_data=TicketCallback(action="group_open", ticket_id=0).pack()))
     builder.row(InlineKeyboardButton(text="🔵 МОИ ТИКЕТЫ (где отвечал)", callback_data=TicketCallback(action="group_my", ticket_id=0).pack()))
-    builder.row(InlineKeyboardButton(text="🔍 ПОИСК ПО НОМЕРУ/ЮЗЕРУ", callback_data=TicketCallback(action="group_search", ticket_id=0).pack()))
+    builder.row(InlineKeyboardButton(text="🔍 ПОИСК (номер, юзер или текст)", callback_data=TicketCallback(action="group_search", ticket_id=0).pack()))
+    builder.row(InlineKeyboardButton(text="🕒 СМЕНА: ВЗЯТЬ / СДАТЬ", callback_data=TicketCallback(action="group_duty", ticket_id=0).pack()))
     builder.row(InlineKeyboardButton(text="📊 МОЯ СТАТИСТИКА", callback_data=TicketCallback(action="group_stats", ticket_id=0).pack()))
     builder.row(InlineKeyboardButton(text="⭐ РЕЙТИНГ ПОДДЕРЖКИ", callback_data=TicketCallback(action="group_rating", ticket_id=0).pack()))
     return builder.as_markup()
 
+def get_ticket_search_keyboard(ticket_ids: list, page: int, has_next: bool) -> InlineKeyboardMarkup:
+    """Переход к найденным тикетам и листание результатов поиска (запрос хранится в FSM)."""
+    builder = InlineKeyboardBuilder()
+    buttons = [
+        InlineKeyboardButton(text=f"🔎 #{ticket_id}", callback_data=TicketCallback(action="view", ticket_id=ticket_id).pack())
+        for ticket_id in dict.fromkeys(ticket_ids)
+    ]
+    for i in range(0, len(buttons), 3):
+        builder.row(*buttons[i:i + 3])
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=TicketSearchCallback(page=page - 1).pack()))
+    if page > 1 or has_next:
+        nav.append(InlineKeyboardButton(text=f"стр. {page}", callback_data=TicketSearchCallback(page=page).pack()))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=TicketSearchCallback(page=page + 1).pack()))
+    if nav:
+        builder.row(*nav)
+    return builder.as_markup()
+
 def get_ticket_priority_keyboard(ticket_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     priorities = [
@@ -8,8 +8,8 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 
-from config import BOT_TOKEN, OWNER_ID, TECH_ADMIN_ID
-from database import init_db, get_user, create_user, set_user_role
+from config import BOT_TOKEN, OWNER_ID, TECH_ADMIN_ID, FSM_STORAGE, BOT_MODE, WEBHOOK_URL, WORKER_PROCESSES
+from database import init_db, get_user, create_user, set_user_role, load_ticket_routes, load_staff_roster
 
 from handlers.admin import router as admin_router
 from handlers.tickets import router as tickets_router
@@ -24,7 +24,16 @@ from middlewares import (
     check_maintenance_middleware
 )
 
-from helpers import cleanup_old_screenshots  # <-- импортируем функцию очистки
+from storage import SQLiteStorage
+from webhook import run_webhook
+from scheduler import scheduler
+from jobs import register_jobs
+from moderation import moderation_queue
+from triage import triage_engine
+from assignment import agent_dispatcher
+from achievements import achievement_engine
+from promocodes import promo_service
+from send_scheduler import send_scheduler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,8 +47,12 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 bot.start_time = datetime.now()
+# Все отправки проходят через лимиты и полосы приоритета (send_scheduler.py)
+bot.session.middleware(send_scheduler)
 
-dp = Dispatcher(storage=MemoryStorage())
+# FSM-состояния храним в SQLite, чтобы они переживали перезапуск
+storage = SQLiteStorage() if FSM_STORAGE == "sqlite" else MemoryStorage()
+dp = Dispatcher(storage=storage)
 
 # ===== ОБНОВЛЕНИЕ ПРОФИЛЕЙ АДМИНИСТРАТОРОВ =====
 async def update_admin_profiles():
@@ -64,17 +77,6 @@ async def update_admin_profiles():
     except Exception as e:
         logger.error(f"Ошибка при обновлении профилей администраторов: {e}")
 
-# ===== ФОНОВАЯ ЗАДАЧА ДЛЯ ОЧИСТКИ СКРИНШОТОВ =====
-async def scheduled_cleanup():
-    """Запускается раз в сутки и удаляет скриншоты старше 30 дней."""
-    while True:
-        await asyncio.sleep(86400)  # 24 часа
-        try:
-            deleted = cleanup_old_screenshots(days=30)
-            logger.info(f"Очистка скриншотов: удалено {deleted} файлов")
-        except Exception as e:
-            logger.error(f"Ошибка при очистке скриншотов: {e}")
-
 # ===== РЕГИСТРАЦИЯ MIDDLEWARE =====
 dp.message.middleware(check_ban_middleware)
 dp.callback_query.middleware(check_ban_middleware)
@@ -93,9 +95,38 @@ dp.include_router(errors_router)
 
 async def main():
     await update_admin_profiles()
-    asyncio.create_task(scheduled_cleanup())  # <-- запускаем фоновую задачу
+    moderation_queue.load()
+    triage_engine.load()
+    agent_dispatcher.load()
+    achievement_engine.load()
+    promo_service.load()
+    load_ticket_routes()
+    load_staff_roster()
+    register_jobs(bot)
+    scheduler.start()  # <-- очистка, бекапы, рассылки
     logger.info("Бот запущен")
-    await dp.start_polling(bot, skip_updates=True)
+    try:
+        if WORKER_PROCESSES > 1:
+            # Апдейты обрабатывают процессы-воркеры, этот процесс только раздаёт их
+            from workers import run_supervisor
+            await run_supervisor(bot, dp)
+            return
+        if BOT_MODE == "webhook" and WEBHOOK_URL:
+            try:
+                await run_webhook(dp, bot)
+                return
+            except Exception as e:
+                # Вебхук не поднялся — работаем через polling
+                logger.error(f"Не удалось запустить вебхук, переключаемся на polling: {e}")
+                await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot, skip_updates=True)
+    finally:
+        await scheduler.stop()
+        try:
+            await triage_engine.flush_hits()
+        except Exception as e:
+            logger.error(f"Ошибка сброса срабатываний правил: {e}")
+        await storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
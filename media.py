@@ -0,0 +1,146 @@
+# FILE: media.py
+"""
+Отправка медиа с приоритетом file_id. Скриншоты заявок остаются на серверах
+Telegram и пересылаются по file_id — без скачивания и повторной загрузки;
+на диск они архивируются позже фоновой задачей. Для локальных файлов
+(бекапы, старые скриншоты) file_id из ответа на первую загрузку
+сохраняется в БД и используется при следующих отправках.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from database import (
+    get_order_media, get_unarchived_media, mark_media_archived, mark_media_failed, link_screenshot,
+    get_cached_file_id, save_cached_file_id, drop_cached_file_id
+)
+from screenshots import store_screenshot
+
+logger = logging.getLogger(__name__)
+
+_counters = {
+    'file_id_sends': 0,
+    'uploads': 0,
+    'upload_bytes': 0,
+    'archived': 0,
+    'archive_bytes': 0,
+    'archive_failed': 0,
+}
+_latencies = {
+    'file_id': deque(maxlen=500),
+    'upload': deque(maxlen=500),
+}
+
+
+def extract_file(message: Message):
+    """(file_id, file_unique_id, media_type) изображения из сообщения или None."""
+    if message.photo:
+        photo = message.photo[-1]
+        return photo.file_id, photo.file_unique_id, 'photo'
+    if message.document:
+        return message.document.file_id, message.document.file_unique_id, 'document'
+    return None
+
+
+# ========== ОТПРАВКА ==========
+async def send_by_file_id(bot: Bot, chat_id: int, file_id: str, media_type: str = 'photo', **kwargs) -> Message:
+    started = time.perf_counter()
+    if media_type == 'document':
+        message = await bot.send_document(chat_id, file_id, **kwargs)
+    else:
+        message = await bot.send_photo(chat_id, file_id, **kwargs)
+    _counters['file_id_sends'] += 1
+    _latencies['file_id'].append(time.perf_counter() - started)
+    return message
+
+
+async def send_file(bot: Bot, chat_id: int, path: str, media_type: str = 'document', **kwargs) -> Message:
+    """Отправляет локальный файл: по сохранённому file_id, а если его нет — загрузкой с запоминанием file_id."""
+    stat = os.stat(path)
+    file_id = get_cached_file_id(path, stat.st_size, stat.st_mtime)
+    if file_id:
+        try:
+            return await send_by_file_id(bot, chat_id, file_id, media_type, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning(f"file_id для {path} больше не действует: {e}")
+            drop_cached_file_id(path)
+
+    started = time.perf_counter()
+    if media_type == 'photo':
+        message = await bot.send_photo(chat_id, FSInputFile(path), **kwargs)
+    else:
+        message = await bot.send_document(chat_id, FSInputFile(path), **kwargs)
+    _counters['uploads'] += 1
+    _counters['upload_bytes'] += stat.st_size
+    _latencies['upload'].append(time.perf_counter() - started)
+
+    sent = extract_file(message)
+    if sent:
+        save_cached_file_id(path, stat.st_size, stat.st_mtime, sent[0], sent[2])
+    return message
+
+
+async def send_order_screenshot(bot: Bot, chat_id: int, order_id: int, file_id: str = None,
+                                media_type: str = None, path: str = None, **kwargs):
+    """
+    Отправляет скриншот заявки: по file_id, а для заявок, созданных до появления
+    file_id, — файлом с диска. Возвращает None, если скриншота нет.
+    """
+    if not file_id:
+        media = get_order_media(order_id)
+        if media:
+            file_id, media_type = media
+    if file_id:
+        return await send_by_file_id(bot, chat_id, file_id, media_type or 'photo', **kwargs)
+    if path and os.path.exists(path):
+        return await send_file(bot, chat_id, path, 'photo', **kwargs)
+    return None
+
+
+# ========== АРХИВАЦИЯ ==========
+async def archive_pending(bot: Bot, limit: int = 20) -> list:
+    """
+    Скачивает ещё не сохранённые скриншоты заявок в хранилище (screenshots.py).
+    Возвращает [(order_id, предыдущая заявка)] для скриншотов, которые уже присылали.
+    """
+    duplicates = []
+    for order_id, user_id, file_id in get_unarchived_media(limit):
+        try:
+            buffer = await bot.download(file_id)
+            data = buffer.getvalue()
+            screenshot_id, path, previous_order = await asyncio.to_thread(store_screenshot, data, user_id)
+        except Exception as e:
+            # Истёкший file_id не скачается никогда — без счётчика такие строки заняли бы всю пачку
+            attempts = mark_media_failed(order_id)
+            logger.error(f"Ошибка архивации скриншота заявки {order_id} (попытка {attempts}): {e}")
+            _counters['archive_failed'] += 1
+            continue
+        link_screenshot(screenshot_id, order_id)
+        mark_media_archived(order_id, path)
+        _counters['archived'] += 1
+        _counters['archive_bytes'] += len(data)
+        if previous_order and previous_order != order_id:
+            duplicates.append((order_id, previous_order))
+    return duplicates
+
+
+# ========== МЕТРИКИ ==========
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def stats() -> dict:
+    result = dict(_counters)
+    for kind, values in _latencies.items():
+        result[f'{kind}_p50'] = _percentile(values, 0.5)
+        result[f'{kind}_p95'] = _percentile(values, 0.95)
+    return result
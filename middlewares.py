@@ -6,11 +6,29 @@ from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 
 from config import TICKET_GROUP_ID
-from database import is_user_banned, get_ban, is_user_frozen, get_freeze_info, is_maintenance_mode, get_maintenance_info
+from database import (
+    is_user_banned, get_ban, is_user_frozen, get_freeze_info, is_maintenance_mode, get_maintenance_info,
+    get_topic_route, get_staff_role
+)
 from helpers import has_access, format_datetime, get_user_role
 
 logger = logging.getLogger(__name__)
 
+def is_ignored_group_message(event) -> bool:
+    """
+    Сообщение в группе поддержки, которое обработчик тем всё равно пропустит
+    (пишет не персонал, или это не команда в чужой/закрытой теме). Проверки бана и заморозки
+    для него не нужны — решаем по картам в памяти, не обращаясь к БД.
+    """
+    if not isinstance(event, Message) or event.chat.id != TICKET_GROUP_ID:
+        return False
+    if get_staff_role(event.from_user.id) == 'user':
+        return True
+    if event.text and event.text.startswith('/'):
+        return False
+    route = get_topic_route(event.message_thread_id) if event.message_thread_id else None
+    return not route or route[2] == 'closed'
+
 class CheckBanMiddleware(BaseMiddleware):
     async def __call__(
         self,
@@ -21,6 +39,8 @@ class CheckBanMiddleware(BaseMiddleware):
         if isinstance(event, Message):
             if event.text and event.text.startswith(('/start', '/support')):
                 return await handler(event, data)
+            if is_ignored_group_message(event):
+                return await handler(event, data)
             user_id = event.from_user.id
         elif isinstance(event, CallbackQuery):
             user_id = event.from_user.id
@@ -61,6 +81,8 @@ class CheckFreezeMiddleware(BaseMiddleware):
         if isinstance(event, Message):
             if event.text and event.text.startswith(('/start', '/support')):
                 return await handler(event, data)
+            if is_ignored_group_message(event):
+                return await handler(event, data)
             user_id = event.from_user.id
         elif isinstance(event, CallbackQuery):
             user_id = event.from_user.id
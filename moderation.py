@@ -0,0 +1,151 @@
+# FILE: moderation.py
+"""
+Очередь модерации заказов, выводов и обменов. Ожидающие заявки держатся
+в памяти: очередь заполняется из БД один раз, а дальше обновляется точечно
+при создании заявки и смене её статуса, поэтому счётчики и страницы
+не сканируют таблицы. Чтобы два модератора не взяли одну заявку,
+её закрепляют арендой в БД (таблица moderation_claims).
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from aiogram import types
+
+import cache_bus
+from config import MODERATION_LEASE_SECONDS
+from database import (
+    get_moderation_items, get_moderation_item, claim_moderation_item,
+    release_moderation_item, get_moderation_claims, get_user
+)
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('order', 'withdrawal', 'exchange')
+KIND_TITLES = {
+    'order': '📦 Заказы',
+    'withdrawal': '📤 Выводы',
+    'exchange': '💱 Обмены',
+}
+
+
+class QueueItem:
+    __slots__ = ('kind', 'item_id', 'user_id', 'username', 'amount', 'value', 'details', 'created_at')
+
+    def __init__(self, kind: str, row: tuple):
+        self.kind = kind
+        self.item_id, self.user_id, self.username, self.amount, self.value, self.details, self.created_at = row
+
+
+class ModerationQueue:
+    def __init__(self):
+        self._items: Dict[str, OrderedDict] = {kind: OrderedDict() for kind in KINDS}
+        self._loaded = False
+        cache_bus.subscribe('moderation', self._apply)
+
+    def load(self):
+        """Заполняет очередь из БД (при старте или при первом обращении)."""
+        for kind in KINDS:
+            items = OrderedDict()
+            for row in get_moderation_items(kind):
+                item = QueueItem(kind, row)
+                items[str(item.item_id)] = item
+            self._items[kind] = items
+        self._loaded = True
+        logger.info(
+            "Очередь модерации: " + ", ".join(f"{kind} {len(items)}" for kind, items in self._items.items())
+        )
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    # ========== ОБНОВЛЕНИЕ ==========
+    def _refresh_local(self, kind: str, item_id) -> Optional[QueueItem]:
+        row = get_moderation_item(kind, item_id)
+        key = str(item_id)
+        if row is None:
+            self._items[kind].pop(key, None)
+            return None
+        item = QueueItem(kind, row)
+        self._items[kind][key] = item
+        return item
+
+    def refresh(self, kind: str, item_id):
+        """
+        Перечитывает заявку из БД после создания или смены статуса:
+        ожидающая попадает в очередь, обработанная удаляется вместе с закреплением.
+        """
+        self._ensure_loaded()
+        if self._refresh_local(kind, item_id) is None:
+            release_moderation_item(kind, item_id)
+        cache_bus.publish('moderation', f"{kind}:{item_id}")
+
+    def _apply(self, key: str = None):
+        if not self._loaded:
+            return
+        if key is None:
+            self.load()
+            return
+        kind, item_id = key.split(':', 1)
+        self._refresh_local(kind, item_id)
+
+    # ========== ЧТЕНИЕ ==========
+    def counts(self) -> dict:
+        self._ensure_loaded()
+        return {kind: len(items) for kind, items in self._items.items()}
+
+    def total(self) -> int:
+        return sum(self.counts().values())
+
+    def get(self, kind: str, item_id) -> Optional[QueueItem]:
+        self._ensure_loaded()
+        return self._items[kind].get(str(item_id))
+
+    def page(self, kind: str, page: int, per_page: int):
+        """(заявки страницы, закрепления {item_id: (moderator_id, expires_at)}, номер страницы, всего страниц)."""
+        self._ensure_loaded()
+        items = self._items[kind]
+        total_pages = max(1, (len(items) + per_page - 1) // per_page)
+        page = max(1, min(page, total_pages))
+        start = (page - 1) * per_page
+        current = []
+        for index, item in enumerate(items.values()):
+            if index >= start + per_page:
+                break
+            if index >= start:
+                current.append(item)
+        claims = get_moderation_claims(kind, [item.item_id for item in current])
+        return current, claims, page, total_pages
+
+    # ========== ЗАКРЕПЛЕНИЕ ==========
+    def claim(self, kind: str, item_id, moderator_id: int):
+        """(True, expires_at) если заявка закреплена за moderator_id, иначе (False, (владелец, expires_at))."""
+        holder = claim_moderation_item(kind, str(item_id), moderator_id, MODERATION_LEASE_SECONDS)
+        if holder is None:
+            return False, None
+        if holder[0] == moderator_id:
+            return True, holder[1]
+        return False, holder
+
+    def release(self, kind: str, item_id, moderator_id: int) -> bool:
+        return release_moderation_item(kind, str(item_id), moderator_id)
+
+
+moderation_queue = ModerationQueue()
+
+
+async def claim_for_callback(callback: types.CallbackQuery, kind: str, item_id) -> bool:
+    """Закрепляет заявку за нажавшим модератором; если её держит другой — показывает, кто."""
+    ok, holder = moderation_queue.claim(kind, item_id, callback.from_user.id)
+    if ok:
+        return True
+    if holder is None:
+        await callback.answer("❌ Не удалось закрепить заявку, попробуйте ещё раз", show_alert=True)
+        return False
+    moderator = get_user(holder[0])
+    name = f"@{moderator[2]}" if moderator and moderator[2] else f"ID {holder[0]}"
+    minutes = max(1, int((holder[1] - time.time()) // 60) + 1)
+    await callback.answer(f"🔒 Заявку уже обрабатывает {name} (ещё ~{minutes} мин)", show_alert=True)
+    return False
@@ -0,0 +1,176 @@
+# FILE: outbox.py
+"""
+Исходящие уведомления через таблицу outbox. Обработчик записывает уведомление
+в той же транзакции, что и изменение заявки или тикета, и сразу отвечает
+пользователю; доставку выполняет задача планировщика — пачками, с повторами,
+в полосе уведомлений send_scheduler. Уведомление не теряется, если Telegram
+недоступен, и не уходит, если изменение откатилось.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict, deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, ReplyParameters
+
+import send_scheduler
+from config import OUTBOX_BATCH, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE
+from database import (
+    add_notifications, get_due_notifications, mark_notifications_sent,
+    reschedule_notification, fail_notification, get_outbox_stats, save_message_links
+)
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "outbox"
+
+_counters = {
+    'sent': 0,
+    'retried': 0,
+    'failed': 0,
+}
+_delays = deque(maxlen=500)  # от записи уведомления до доставки, секунд
+_relay_delays = defaultdict(lambda: deque(maxlen=200))  # то же для сообщений тикетов, по типу содержимого
+
+
+def notification(chat_id: int, text: str = None, reply_markup: InlineKeyboardMarkup = None,
+                 media_type: str = None, file_id: str = None, thread_id: int = None, relay: tuple = None) -> tuple:
+    """
+    Уведомление для записи в outbox: текст или медиа по file_id (text становится подписью).
+    relay — сообщение тикета (ticket_id, тип содержимого, from_chat_id, [message_id], reply_to), см. relay.py;
+    с media_type='copy' оно копируется из from_chat_id, text (если задан) заменяет подпись.
+    """
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+    return chat_id, media_type or 'message', text, file_id, markup, thread_id, relay
+
+
+def wake():
+    """Просит планировщик разобрать очередь, не дожидаясь следующей проверки."""
+    scheduler.trigger(JOB_NAME)
+
+
+def notify(*notifications) -> bool:
+    """Уведомления, не привязанные к изменению в БД: записываются отдельной транзакцией."""
+    ok = add_notifications(list(notifications))
+    wake()
+    return ok
+
+
+# ========== ДОСТАВКА ==========
+async def _send(bot: Bot, method: str, chat_id: int, text: str, file_id: str, markup: str, thread_id: int,
+                from_chat_id: int = None, message_ids: list = None, reply_to: int = None) -> list:
+    """Отправляет уведомление и возвращает message_id отправленных сообщений."""
+    reply_markup = InlineKeyboardMarkup.model_validate_json(markup) if markup else None
+    reply_parameters = ReplyParameters(message_id=reply_to, allow_sending_without_reply=True) if reply_to else None
+    if method == 'copy':
+        if len(message_ids) > 1:
+            # Альбом — одним запросом; подписи и порядок сохраняются, клавиатуру к альбому не прикрепить
+            sent = await bot.copy_messages(chat_id, from_chat_id, message_ids, message_thread_id=thread_id)
+            return [message.message_id for message in sent]
+        sent = await bot.copy_message(chat_id, from_chat_id, message_ids[0], message_thread_id=thread_id,
+                                      caption=text, reply_markup=reply_markup, reply_parameters=reply_parameters)
+    elif method == 'photo':
+        sent = await bot.send_photo(chat_id, file_id, caption=text, reply_markup=reply_markup,
+                                    message_thread_id=thread_id, reply_parameters=reply_parameters)
+    elif method == 'document':
+        sent = await bot.send_document(chat_id, file_id, caption=text, reply_markup=reply_markup,
+                                       message_thread_id=thread_id, reply_parameters=reply_parameters)
+    else:
+        sent = await bot.send_message(chat_id, text, reply_markup=reply_markup, message_thread_id=thread_id,
+                                      reply_parameters=reply_parameters)
+    return [sent.message_id]
+
+
+async def _deliver_chat(bot: Bot, rows: list, sent: list, links: list) -> int:
+    """Уведомления одного чата по порядку; возвращает число недоставленных окончательно."""
+    failed = 0
+    for (notification_id, chat_id, method, text, file_id, markup, thread_id, attempts, created_at,
+         ticket_id, content_type, from_chat_id, message_ids, reply_to) in rows:
+        message_ids = json.loads(message_ids) if message_ids else None
+        try:
+            sent_ids = await _send(bot, method, chat_id, text, file_id, markup, thread_id,
+                                   from_chat_id, message_ids, reply_to)
+        except TelegramRetryAfter as e:
+            # Остальные уведомления чата ждут, чтобы не нарушить порядок
+            reschedule_notification(notification_id, time.time() + e.retry_after, str(e), count_attempt=False)
+            return failed
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или запрос некорректен — повтор не поможет
+            fail_notification(notification_id, str(e))
+            _counters['failed'] += 1
+            failed += 1
+            logger.warning(f"Уведомление {notification_id} для {chat_id} не доставлено: {e}")
+            continue
+        except Exception as e:
+            if attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+                fail_notification(notification_id, str(e))
+                _counters['failed'] += 1
+                failed += 1
+                logger.error(f"Уведомление {notification_id} для {chat_id} не доставлено после {attempts + 1} попыток: {e}")
+            else:
+                delay = OUTBOX_RETRY_BASE * 2 ** attempts
+                reschedule_notification(notification_id, time.time() + delay, str(e))
+                _counters['retried'] += 1
+            return failed
+        sent.append(notification_id)
+        _delays.append(time.time() - created_at)
+        if ticket_id:
+            _relay_delays[content_type].append(time.time() - created_at)
+            links.extend(
+                (ticket_id, from_chat_id, source_id, chat_id, sent_id)
+                for source_id, sent_id in zip(message_ids, sent_ids)
+            )
+    return failed
+
+
+async def deliver(bot: Bot):
+    """Отправляет накопившиеся уведомления. Задача планировщика, см. jobs.register_jobs."""
+    send_scheduler.set_lane('notify')
+    sent_total = 0
+    failed_total = 0
+    while True:
+        rows = get_due_notifications(OUTBOX_BATCH)
+        if not rows:
+            break
+        chats = {}
+        for row in rows:
+            chats.setdefault(row[1], []).append(row)
+        sent = []
+        links = []
+        # Чаты обслуживаются параллельно: лимит одного чата (~1 сообщение в секунду) не держит остальные,
+        # общий лимит соблюдает send_scheduler
+        failed = await asyncio.gather(*(_deliver_chat(bot, chat_rows, sent, links) for chat_rows in chats.values()))
+        failed_total += sum(failed)
+        mark_notifications_sent(sent)
+        save_message_links(links)
+        _counters['sent'] += len(sent)
+        sent_total += len(sent)
+        if len(rows) < OUTBOX_BATCH:
+            break
+    if sent_total or failed_total:
+        return f"доставлено {sent_total}, не доставлено {failed_total}"
+    return None
+
+
+# ========== МЕТРИКИ ==========
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def stats() -> dict:
+    result = dict(_counters)
+    result.update(get_outbox_stats())
+    result['delay_p50'] = _percentile(_delays, 0.5)
+    result['delay_p95'] = _percentile(_delays, 0.95)
+    result['relay'] = {
+        content_type: {'count': len(delays), 'p50': _percentile(delays, 0.5), 'p95': _percentile(delays, 0.95)}
+        for content_type, delays in sorted(_relay_delays.items())
+    }
+    return result
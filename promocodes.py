@@ -0,0 +1,144 @@
+# FILE: promocodes.py
+"""
+Промокоды: проверка при вводе и использование при создании заявки.
+Все промокоды держатся в памяти по коду, поэтому ввод промокода — одна выборка
+из БД (использовал ли его пользователь, по уникальному индексу), а неизвестный,
+истёкший или исчерпанный код отсекается вовсе без БД. Индекс перечитывается
+после создания, изменения и удаления (в других процессах — через cache_bus).
+Окончательное решение принимает claim_promocode: лимит, срок и повторное
+использование проверяются в той же транзакции, что и запись использования, так
+что устаревший индекс может лишь пропустить код до заявки, но не превысить лимит.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+import cache_bus
+from database import (
+    get_all_promocodes, create_promocode, update_promocode, delete_promocode,
+    has_used_promocode, claim_promocode
+)
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+ERRORS = {
+    'not_found': "Промокод не найден",
+    'expired': "Промокод истёк",
+    'exhausted': "Промокод уже использован максимальное количество раз",
+    'used': "Вы уже использовали этот промокод",
+    'bad_date': "Ошибка проверки срока действия промокода",
+    'error': "Не удалось применить промокод",
+}
+
+
+def _parse_date(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"неизвестный формат даты: {value}")
+
+
+class Promocode:
+    __slots__ = ('id', 'code', 'discount_percent', 'max_uses', 'used_count', 'expires_at', 'bad_date')
+
+    def __init__(self, row: tuple):
+        self.id, self.code, self.discount_percent, self.max_uses, self.used_count, _, expires_at = row
+        self.bad_date = False
+        try:
+            self.expires_at = _parse_date(expires_at)
+        except ValueError as e:
+            logger.error(f"Ошибка парсинга даты промокода {self.code}: {e}")
+            self.expires_at = None
+            self.bad_date = True
+
+    def problem(self, now: datetime = None) -> Optional[str]:
+        """Ключ ERRORS, если промокод сейчас нельзя использовать, иначе None."""
+        if self.bad_date:
+            return 'bad_date'
+        if self.expires_at and self.expires_at < (now or datetime.now()):
+            return 'expired'
+        if self.max_uses > 0 and self.used_count >= self.max_uses:
+            return 'exhausted'
+        return None
+
+
+class PromocodeService:
+    def __init__(self):
+        self._codes: Dict[str, Promocode] = {}
+        self._loaded = False
+        cache_bus.subscribe('promocodes', self._apply)
+
+    def load(self):
+        self._codes = {promo.code: promo for promo in map(Promocode, get_all_promocodes())}
+        self._loaded = True
+
+    def reload(self):
+        """После изменения промокодов: перечитать здесь и в остальных процессах."""
+        self.load()
+        cache_bus.publish('promocodes')
+
+    def _apply(self, key: str = None):
+        if self._loaded:
+            self.load()
+
+    def get(self, code: str) -> Optional[Promocode]:
+        if not self._loaded:
+            self.load()
+        return self._codes.get(code.upper())
+
+    # ========== ИЗМЕНЕНИЕ ==========
+    def create(self, code: str, discount_percent: int, max_uses: int = 1, expires_at: datetime = None):
+        create_promocode(code, discount_percent, max_uses, expires_at)
+        self.reload()
+
+    def update(self, promocode_id: int, discount_percent: int, max_uses: int, expires_at: datetime = None) -> bool:
+        ok = update_promocode(promocode_id, discount_percent, max_uses, expires_at)
+        self.reload()
+        return ok
+
+    def delete(self, promocode_id: int) -> bool:
+        ok = delete_promocode(promocode_id)
+        self.reload()
+        return ok
+
+    # ========== ИСПОЛЬЗОВАНИЕ ==========
+    def check(self, code: str, user_id: int):
+        """(True, процент скидки) или (False, причина) — для ввода промокода."""
+        promo = self.get(code)
+        if not promo:
+            return False, ERRORS['not_found']
+        problem = promo.problem()
+        if problem:
+            return False, ERRORS[problem]
+        if has_used_promocode(user_id, promo.id):
+            return False, ERRORS['used']
+        return True, promo.discount_percent
+
+    def claim(self, code: str, user_id: int, order_id: int = None):
+        """
+        Использует промокод для заявки: (True, процент скидки) или (False, причина).
+        Между вводом и заявкой код могли исчерпать — тогда скидки нет.
+        """
+        promo = self.get(code)
+        if not promo:
+            return False, ERRORS['not_found']
+        status, discount_percent, used_count = claim_promocode(user_id, promo.id, order_id)
+        if used_count is not None:
+            promo.used_count = used_count
+        if status == 'not_found':
+            self.reload()
+        elif status == 'exhausted' or (status == 'ok' and promo.problem()):
+            # Лимит исчерпан — остальные процессы должны отсекать код без БД
+            cache_bus.publish('promocodes', promo.code)
+        if status != 'ok':
+            return False, ERRORS[status]
+        return True, discount_percent
+
+
+promo_service = PromocodeService()
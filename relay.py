@@ -0,0 +1,160 @@
+# FILE: relay.py
+"""
+Пересылка сообщений тикета между личкой и темой группы поддержки.
+Медиа любого типа копируется (copy_message) прямо из исходного чата — файл не
+скачивается и не загружается заново, тип сообщения сохраняется; заголовок тикета
+ставится в подпись. Альбом приходит отдельными апдейтами: части собираются
+RELAY_ALBUM_WAIT секунд и уходят одним copy_messages. Копия альбома пишется в
+outbox вместе с первой частью и отложенной доставкой, остальные части
+дописываются в неё в своих транзакциях — перезапуск во время сбора не оставит
+в истории тикета непересланных частей. Текст отправляется заново, с заголовком.
+Доставка — через outbox, после неё outbox запоминает пары message_id
+(ticket_message_links): реплай на пересланное сообщение в личке становится
+реплаем в теме, и наоборот.
+"""
+import asyncio
+import html
+import logging
+from typing import Dict, List, Optional, Union
+
+from aiogram import types
+
+import outbox
+from config import RELAY_ALBUM_WAIT
+from database import get_message_link
+
+logger = logging.getLogger(__name__)
+
+# Порядок важен: у места есть и location, у GIF — и document
+CONTENT_TYPES = (
+    'text', 'photo', 'video', 'animation', 'audio', 'document', 'voice',
+    'video_note', 'sticker', 'venue', 'location', 'contact',
+)
+# Типы с подписью — в неё ставится заголовок тикета
+CAPTION_TYPES = ('photo', 'video', 'animation', 'audio', 'document', 'voice')
+MEDIA_TITLES = {
+    'photo': 'Фото',
+    'video': 'Видео',
+    'animation': 'GIF',
+    'audio': 'Аудио',
+    'document': 'Документ',
+    'voice': 'Голосовое сообщение',
+    'video_note': 'Видеосообщение',
+    'sticker': 'Стикер',
+    'venue': 'Место',
+    'location': 'Геопозиция',
+    'contact': 'Контакт',
+}
+# Копия альбома отправляется чуть позже окончания сбора, чтобы поздняя часть не разминулась с отправкой
+ALBUM_DELIVERY_MARGIN = 0.5
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+# (chat_id, media_group_id) -> собираемый альбом
+_albums: Dict[tuple, dict] = {}
+
+
+def content_type(message: types.Message) -> Optional[str]:
+    """Тип содержимого из CONTENT_TYPES или None — такое сообщение не пересылается."""
+    for name in CONTENT_TYPES:
+        if getattr(message, name, None):
+            return name
+    return None
+
+
+def describe(message: types.Message) -> tuple:
+    """(текст, media_type, file_id) — как сообщение сохраняется в историю тикета."""
+    kind = content_type(message)
+    text = message.caption or message.text or ""
+    if kind == 'text':
+        return text, None, None
+    media = message.photo[-1] if message.photo else getattr(message, kind, None)
+    if not text:
+        if kind == 'document':
+            text = f"[Документ: {message.document.file_name}]"
+        else:
+            text = f"[{MEDIA_TITLES.get(kind, 'Вложение')}]"
+    return text, kind, getattr(media, 'file_id', None)
+
+
+def _compose(header: str, body: str, limit: int) -> str:
+    body = html.escape(body or "")
+    text = f"{header}\n{body}" if header else body
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def reply_target(message: types.Message, chat_id: int) -> Optional[int]:
+    """message_id в chat_id, на который должна отвечать копия, если сообщение — реплай на пересланное."""
+    reply = message.reply_to_message
+    if not reply:
+        return None
+    link = get_message_link(message.chat.id, reply.message_id)
+    if link and link[1] == chat_id:
+        return link[2]
+    return None
+
+
+def linked_reply(message: types.Message) -> Union[bool, dict]:
+    """Фильтр: реплай на пересланное сообщение тикета; передаёт в обработчик link=(ticket_id, чат, message_id)."""
+    if not message.reply_to_message:
+        return False
+    link = get_message_link(message.chat.id, message.reply_to_message.message_id)
+    return {'link': link} if link else False
+
+
+def notification(message: types.Message, ticket_id: int, chat_id: int, header: str = None,
+                 thread_id: int = None, reply_markup=None) -> tuple:
+    """Уведомление outbox с копией сообщения в chat_id (для текста — с заголовком, без копии)."""
+    kind = content_type(message)
+    relay = (ticket_id, kind, message.chat.id, [message.message_id], reply_target(message, chat_id))
+    if kind == 'text':
+        return outbox.notification(chat_id, _compose(header, message.text, TEXT_LIMIT), reply_markup,
+                                   thread_id=thread_id, relay=relay)
+    caption = _compose(header, message.caption, CAPTION_LIMIT) if header and kind in CAPTION_TYPES else None
+    return outbox.notification(chat_id, caption, reply_markup, media_type='copy', thread_id=thread_id, relay=relay)
+
+
+# ========== АЛЬБОМЫ ==========
+def album_part(message: types.Message) -> Union[bool, dict]:
+    """Фильтр: очередная часть альбома, который уже собирается; передаёт в обработчик album."""
+    if not message.media_group_id:
+        return False
+    album = _albums.get((message.chat.id, message.media_group_id))
+    return {'album': album} if album else False
+
+
+def collect_album(message: types.Message, ticket_id: int = None, from_support: bool = False,
+                  targets: List[tuple] = ()) -> tuple:
+    """
+    Добавляет часть альбома. targets — [(chat_id, заголовок, thread_id, клавиатура)], куда переслать альбом.
+    Возвращает (started, аргументы add_ticket_message): started=True — с этой части альбом начался
+    (обработчику стоит ответить один раз); для первой части в аргументах копии альбома с задержкой,
+    для остальных — album, чтобы дописать часть в ещё не отправленную копию.
+    """
+    key = (message.chat.id, message.media_group_id)
+    album = _albums.get(key)
+    if album:
+        album['message_ids'].append(message.message_id)
+        return False, {'album': (key[0], album['message_ids'][0], sorted(album['message_ids']))}
+    album = _albums[key] = {
+        'ticket_id': ticket_id,
+        'from_support': from_support,
+        'message_ids': [message.message_id],
+    }
+    notifications = []
+    for chat_id, header, thread_id, markup in targets:
+        # Клавиатура и заголовок к альбому не прикрепляются — идут сообщением перед ним
+        if header:
+            notifications.append(outbox.notification(chat_id, header, markup, thread_id=thread_id))
+        notifications.append(outbox.notification(
+            chat_id, media_type='copy', thread_id=thread_id,
+            relay=(ticket_id, 'album', key[0], list(album['message_ids']), reply_target(message, chat_id))
+        ))
+    asyncio.get_running_loop().call_later(RELAY_ALBUM_WAIT, _close_album, key)
+    return True, {'notifications': notifications, 'notify_delay': RELAY_ALBUM_WAIT + ALBUM_DELIVERY_MARGIN}
+
+
+def _close_album(key: tuple):
+    """Сбор окончен: следующие части с тем же media_group_id начнут новый альбом."""
+    if _albums.pop(key, None):
+        asyncio.get_running_loop().call_later(ALBUM_DELIVERY_MARGIN, outbox.wake)
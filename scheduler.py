@@ -0,0 +1,188 @@
+# FILE: scheduler.py
+"""
+Планировщик фоновых задач: реестр задач с интервалом (или ежедневным временем),
+время последнего запуска хранится в БД, запуски не перекрываются,
+блокирующие задачи выполняются в пуле потоков.
+"""
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from config import SCHEDULER_THREADS
+from database import get_job_runs, save_job_run
+
+logger = logging.getLogger(__name__)
+
+# Повтор после ошибки: 30с, 60с, 120с ... но не реже обычного интервала
+RETRY_BASE_SECONDS = 30
+
+
+class Job:
+    def __init__(self, name: str, func: Callable, interval: float = None, at: str = None,
+                 jitter: float = 0.1, blocking: bool = False):
+        self.name = name
+        self.func = func
+        self.interval = interval if interval else 86400
+        self.at = at  # "ЧЧ:ММ" — запуск раз в сутки в это время
+        self.jitter = jitter
+        self.blocking = blocking
+        self.next_run = 0.0
+        self.last_run: Optional[float] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.failures_in_row = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_error: Optional[str] = None
+
+    def _next_after(self, moment: float) -> float:
+        if self.at:
+            hour, minute = map(int, self.at.split(':'))
+            base = datetime.fromtimestamp(moment)
+            target = base.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if target <= base:
+                target += timedelta(days=1)
+            return target.timestamp() + random.uniform(0, self.jitter * 60)
+        return moment + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def schedule(self, now: float, ok: bool = True):
+        if ok:
+            self.next_run = self._next_after(now)
+        else:
+            delay = min(self.interval, RETRY_BASE_SECONDS * 2 ** (self.failures_in_row - 1))
+            self.next_run = now + delay
+
+
+class Scheduler:
+    def __init__(self, max_threads: int = SCHEDULER_THREADS):
+        self.jobs: Dict[str, Job] = {}
+        self._max_threads = max_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._job_tasks = set()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def register(self, name: str, func: Callable, interval: float = None, at: str = None,
+                 jitter: float = 0.1, blocking: bool = False):
+        """
+        interval — период в секундах, at — ежедневное время "ЧЧ:ММ".
+        blocking=True — обычная функция, выполняется в пуле потоков; иначе корутина.
+        """
+        self.jobs[name] = Job(name, func, interval, at, jitter, blocking)
+
+    def trigger(self, name: str):
+        """Запускает задачу при ближайшей проверке (если она сейчас не выполняется)."""
+        job = self.jobs.get(name)
+        if job:
+            job.next_run = 0
+            if self._wakeup:
+                self._wakeup.set()
+
+    # ========== ЗАПУСК ==========
+    def start(self):
+        if self._loop_task:
+            return
+        now = time.time()
+        runs = get_job_runs()
+        for job in self.jobs.values():
+            saved = runs.get(job.name)
+            if saved and saved['last_run']:
+                job.last_run = saved['last_run']
+                job.runs = saved['runs'] or 0
+                job.failures = saved['failures'] or 0
+                job.last_duration = saved['last_duration'] or 0.0
+                job.last_error = saved['last_error']
+                job.next_run = max(job._next_after(job.last_run), now + random.uniform(5, 30))
+            else:
+                job.schedule(now)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_threads, thread_name_prefix="scheduler")
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._loop())
+        logger.info(f"Планировщик запущен, задач: {len(self.jobs)}")
+
+    async def stop(self, timeout: float = 30):
+        if self._loop_task:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        if self._job_tasks:
+            # Даём текущим запускам доработать
+            await asyncio.wait(self._job_tasks, timeout=timeout)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _loop(self):
+        while True:
+            now = time.time()
+            for job in self.jobs.values():
+                if not job.running and now >= job.next_run:
+                    job.running = True
+                    task = asyncio.create_task(self._run(job))
+                    self._job_tasks.add(task)
+                    task.add_done_callback(self._job_tasks.discard)
+            waiting = [job.next_run for job in self.jobs.values() if not job.running]
+            delay = min(waiting) - time.time() if waiting else 60
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(1.0, min(delay, 60)))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: Job):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        ok = True
+        error = None
+        try:
+            if job.blocking:
+                result = await loop.run_in_executor(self._executor, job.func)
+            else:
+                result = await job.func()
+            job.failures_in_row = 0
+            if result is not None:
+                logger.info(f"Задача {job.name}: {result}")
+        except Exception as e:
+            ok = False
+            error = str(e)
+            job.failures += 1
+            job.failures_in_row += 1
+            logger.error(f"Ошибка задачи {job.name}: {e}")
+        finally:
+            duration = time.perf_counter() - started
+            job.runs += 1
+            job.last_run = time.time()
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+            job.last_error = error
+            job.schedule(job.last_run, ok)
+            job.running = False
+            if self._wakeup:
+                self._wakeup.set()
+            if self._executor:
+                await loop.run_in_executor(self._executor, save_job_run, job.name, job.last_run, duration, ok, error)
+
+    # ========== МЕТРИКИ ==========
+    def stats(self) -> list:
+        result = []
+        for job in self.jobs.values():
+            result.append({
+                'name': job.name,
+                'running': job.running,
+                'runs': job.runs,
+                'failures': job.failures,
+                'last_run': job.last_run,
+                'next_run': job.next_run,
+                'last_duration': job.last_duration,
+                'max_duration': job.max_duration,
+                'last_error': job.last_error,
+            })
+        return result
+
+
+scheduler = Scheduler()
@@ -0,0 +1,120 @@
+# FILE: screenshots.py
+"""
+Хранилище скриншотов оплаты. Файлы раскладываются по папкам дат
+(SCREENSHOTS_DIR/ГГГГ/ММ/ДД) и именуются хэшем содержимого, поэтому
+повторная отправка того же изображения не создаёт второй файл.
+Индекс в БД (таблица screenshots) позволяет удалять устаревшие файлы
+запросом по created_at, не обходя каталог. Функции блокирующие —
+вызывать через asyncio.to_thread.
+"""
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from config import SCREENSHOTS_DIR, SCREENSHOTS_CLEANUP_BATCH
+from database import (
+    add_screenshot, find_screenshot_by_hash, add_legacy_screenshots, pop_expired_screenshots,
+    get_setting, set_setting
+)
+
+logger = logging.getLogger(__name__)
+
+LEGACY_BATCH = 5000
+
+
+def _shard_dir(moment: datetime) -> str:
+    return os.path.join(SCREENSHOTS_DIR, moment.strftime('%Y'), moment.strftime('%m'), moment.strftime('%d'))
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# ========== СОХРАНЕНИЕ ==========
+def store_screenshot(data: bytes, user_id: int, ext: str = "jpg"):
+    """
+    Сохраняет скриншот и добавляет запись в индекс.
+    Возвращает (id записи, путь к файлу, номер заявки, к которой этот же файл уже прикладывали).
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    existing = find_screenshot_by_hash(sha256)
+    if existing and os.path.exists(existing[1]):
+        path = existing[1]
+        previous_order = existing[2]
+        logger.info(f"Скриншот пользователя {user_id} совпадает с уже сохранённым: {path}")
+    else:
+        shard = _shard_dir(datetime.now())
+        os.makedirs(shard, exist_ok=True)
+        path = os.path.join(shard, f"{sha256}.{ext}")
+        _write_atomic(path, data)
+        previous_order = existing[2] if existing else None
+    screenshot_id = add_screenshot(path, sha256, len(data), user_id)
+    return screenshot_id, path, previous_order
+
+
+# ========== ОЧИСТКА ==========
+def index_legacy_screenshots() -> int:
+    """Однократно заносит в индекс файлы, лежащие в корне SCREENSHOTS_DIR (старая плоская схема)."""
+    if get_setting('screenshots_indexed', '0') == '1':
+        return 0
+    count = 0
+    batch = []
+    with os.scandir(SCREENSHOTS_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            created_at = datetime.utcfromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+            batch.append((entry.path, stat.st_size, created_at))
+            if len(batch) >= LEGACY_BATCH:
+                add_legacy_screenshots(batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        add_legacy_screenshots(batch)
+        count += len(batch)
+    set_setting('screenshots_indexed', '1')
+    logger.info(f"Проиндексировано старых скриншотов: {count}")
+    return count
+
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.error(f"Ошибка при удалении {path}: {e}")
+        return False
+    # Пустые папки дней/месяцев больше не нужны
+    parent = os.path.dirname(path)
+    root = os.path.abspath(SCREENSHOTS_DIR)
+    while os.path.abspath(parent) != root and parent:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+    return True
+
+
+def cleanup_expired_screenshots(days: int = 30) -> int:
+    """
+    Удаляет скриншоты старше days дней. Работа пропорциональна числу
+    устаревших записей, а не общему количеству файлов.
+    Возвращает количество удалённых файлов.
+    """
+    index_legacy_screenshots()
+    deleted = 0
+    while True:
+        count, orphans = pop_expired_screenshots(days, SCREENSHOTS_CLEANUP_BATCH)
+        for path in orphans:
+            if _remove_file(path):
+                deleted += 1
+        if count < SCREENSHOTS_CLEANUP_BATCH:
+            break
+    return deleted
@@ -0,0 +1,206 @@
+# FILE: send_scheduler.py
+"""
+Планировщик исходящих запросов к Bot API. Подключается middleware к сессии бота
+(main.py), поэтому через него проходят все send_*/edit_* из любых модулей.
+Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный чат
+и ~20 в минуту в группу. Запросы ждут места в корзине своего чата, а затем
+общего лимита; общий лимит раздаётся по полосам приоритета: ответы пользователям,
+потом уведомления (outbox), потом рассылки. На 429 запрос ждёт retry_after и повторяется.
+
+Полоса задаётся на всю задачу: send_scheduler.set_lane("broadcast") в начале корутины.
+В многопроцессном режиме лимиты делятся между процессами поровну.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Dict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE, SEND_GROUP_BURST,
+    SEND_MAX_RETRIES, SEND_MAX_RETRY_WAIT, WORKER_PROCESSES
+)
+
+logger = logging.getLogger(__name__)
+
+LANES = ('interactive', 'notify', 'broadcast')
+LANE_TITLES = {
+    'interactive': 'ответы',
+    'notify': 'уведомления',
+    'broadcast': 'рассылки',
+}
+
+# Новые сообщения — ограничены и по чату, и общим лимитом
+SEND_METHODS = {
+    'SendMessage', 'SendPhoto', 'SendDocument', 'SendVideo', 'SendAnimation', 'SendAudio',
+    'SendVoice', 'SendVideoNote', 'SendSticker', 'SendMediaGroup', 'SendDice', 'SendPoll',
+    'SendLocation', 'SendVenue', 'SendContact', 'CopyMessage', 'ForwardMessage',
+    'CreateForumTopic',  # оставляет служебное сообщение в группе
+}
+# Правки — только общим лимитом
+EDIT_METHODS = {
+    'EditMessageText', 'EditMessageCaption', 'EditMessageMedia', 'EditMessageReplyMarkup',
+    'EditForumTopic',
+}
+
+_lane = contextvars.ContextVar('send_lane', default='interactive')
+
+
+class TokenBucket:
+    """Корзина с резервированием: reserve() возвращает, сколько ждать, и очередь внутри корзины — FIFO."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self) -> bool:
+        self._refill()
+        return self.tokens >= 1
+
+    def wait_time(self) -> float:
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def block(self, seconds: float):
+        """После 429: корзина пуста ещё seconds секунд."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class _PriorityGate:
+    """Общий лимит: свободный токен достаётся ожидающему из самой приоритетной полосы."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._pump_task = None
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.bucket.ready():
+            self.bucket.reserve()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            delay = self.bucket.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.bucket.reserve()
+                future.set_result(None)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(self, processes: int = 1):
+        processes = max(1, processes)
+        self._gate = _PriorityGate(SEND_GLOBAL_RATE / processes, max(1.0, SEND_GLOBAL_RATE / processes))
+        self._chat_rate = SEND_CHAT_RATE
+        self._group_rate = SEND_GROUP_RATE / processes
+        self._chats: Dict[object, TokenBucket] = {}
+        self._counters = {lane: {'requests': 0, 'retry_after': 0} for lane in LANES}
+        self._waits = {lane: deque(maxlen=1000) for lane in LANES}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Полные корзины ничем не отличаются от новых — их можно забыть
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self._group_rate, SEND_GROUP_BURST)
+            else:
+                bucket = TokenBucket(self._chat_rate, SEND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if name not in SEND_METHODS and name not in EDIT_METHODS:
+            return await make_request(bot, method)
+
+        lane = _lane.get()
+        priority = LANES.index(lane)
+        chat_id = getattr(method, 'chat_id', None)
+        chat_bucket = self._chat_bucket(chat_id) if name in SEND_METHODS and chat_id is not None else None
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            if chat_bucket:
+                delay = chat_bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+            await self._gate.acquire(priority)
+            if attempt == 0:
+                self._waits[lane].append(time.monotonic() - started)
+                self._counters[lane]['requests'] += 1
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._counters[lane]['retry_after'] += 1
+                attempt += 1
+                if attempt > SEND_MAX_RETRIES or e.retry_after > SEND_MAX_RETRY_WAIT:
+                    raise
+                logger.warning(f"429 на {name} в чат {chat_id}: ждём {e.retry_after} с (полоса {lane})")
+                if chat_bucket:
+                    chat_bucket.block(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
+
+    def free_tokens(self, chat_id) -> float:
+        """Сколько отправок в чат пройдёт сейчас без ожидания."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            return float(SEND_GROUP_BURST if not isinstance(chat_id, int) or chat_id < 0 else SEND_CHAT_BURST)
+        bucket._refill()
+        return bucket.tokens
+
+    # ========== МЕТРИКИ ==========
+    def stats(self) -> dict:
+        result = {}
+        for lane in LANES:
+            waits = sorted(self._waits[lane])
+            result[lane] = dict(self._counters[lane])
+            result[lane]['wait_p50'] = waits[len(waits) // 2] if waits else 0.0
+            result[lane]['wait_p95'] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+            result[lane]['waiting'] = sum(1 for priority, _, f in self._gate._waiters
+                                          if priority == LANES.index(lane) and not f.done())
+        return result
+
+
+def set_lane(lane: str):
+    """Полоса для всех запросов текущей задачи (и задач, созданных из неё)."""
+    _lane.set(lane)
+
+
+send_scheduler = SendScheduler(WORKER_PROCESSES + 1 if WORKER_PROCESSES > 1 else 1)
@@ -0,0 +1,73 @@
+# FILE: sketch.py
+"""
+Потоковая оценка перцентилей (логарифмические корзины, как в DDSketch).
+Значение x попадает в корзину ceil(log_γ x), γ = (1 + a) / (1 - a), поэтому
+любой перцентиль восстанавливается с относительной ошибкой не больше a,
+а размер не зависит от числа наблюдений: для времени от секунды до месяца
+при a = 2% это не больше ~370 корзин. Хранится в БД как JSON и обновляется
+по одному значению, без пересчёта истории.
+"""
+import json
+import math
+from typing import Dict
+
+RELATIVE_ACCURACY = 0.02
+MIN_VALUE = 1.0  # всё, что быстрее секунды, считается одной корзиной
+
+
+class QuantileSketch:
+    __slots__ = ('count', 'total', 'buckets')
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets: Dict[int, int] = {}
+
+    def _index(self, value: float) -> int:
+        if value <= MIN_VALUE:
+            return 0
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        if index <= 0:
+            return 0.0 if index < 0 else MIN_VALUE
+        # Середина корзины (γ^(i-1), γ^i] с равной относительной ошибкой к краям
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value: float):
+        value = max(0.0, value)
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.buckets))
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    # ========== ХРАНЕНИЕ ==========
+    def to_json(self) -> str:
+        return json.dumps({'n': self.count, 's': round(self.total, 3), 'b': self.buckets}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> 'QuantileSketch':
+        sketch = cls()
+        if data:
+            raw = json.loads(data)
+            sketch.count = raw['n']
+            sketch.total = raw['s']
+            sketch.buckets = {int(index): count for index, count in raw['b'].items()}
+        return sketch
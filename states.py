@@ -93,6 +93,7 @@ class AdminStates(StatesGroup):
     
     waiting_economy_value = State()
     waiting_economy_key = State()
+    waiting_setting_confirm = State()
     
     # ========== ПРОМОКОДЫ ==========
     waiting_promocode_code = State()
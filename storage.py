@@ -0,0 +1,286 @@
+# FILE: storage.py
+import asyncio
+import copy
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import (
+    FSM_DATABASE_NAME,
+    FSM_STATE_TTL_HOURS,
+    FSM_FLUSH_INTERVAL,
+    FSM_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at", "dirty")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 updated_at: float = 0.0, dirty: bool = False):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+        self.dirty = dirty
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище на SQLite (отдельный файл рядом с основной БД).
+    Чтение идёт через in-memory слой, записи копятся и сбрасываются пачкой
+    раз в flush_interval секунд. Брошенные состояния удаляются по TTL.
+    Записи, которые сейчас пишутся на диск, не выгружаются из памяти, пока
+    транзакция не завершится, а при ошибке снова помечаются изменёнными.
+    """
+
+    def __init__(
+        self,
+        path: str = FSM_DATABASE_NAME,
+        ttl: Optional[float] = FSM_STATE_TTL_HOURS * 3600,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        cache_size: int = FSM_CACHE_SIZE,
+    ):
+        self.path = path
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._records: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty = set()
+        self._inflight = set()  # ключи пачки, которая сейчас пишется в БД
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+        self._closed = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data BLOB,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)")
+        self._conn.commit()
+
+    # ========== КЛЮЧИ ==========
+    @staticmethod
+    def _make_key(key: StorageKey) -> str:
+        return (
+            f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+            f"{key.business_connection_id or ''}:{key.destiny}"
+        )
+
+    def _is_expired(self, record: _Record, now: float) -> bool:
+        return self.ttl is not None and now - record.updated_at > self.ttl
+
+    # ========== IN-MEMORY СЛОЙ ==========
+    def _read(self, skey: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (skey,)
+            ).fetchone()
+
+    async def _load(self, skey: str) -> _Record:
+        record = self._records.get(skey)
+        if record is None:
+            # Лок держит и поток сброса — читаем вне event loop
+            row = await asyncio.to_thread(self._read, skey)
+            # Пока шло чтение, запись мог загрузить и изменить другой апдейт
+            record = self._records.get(skey)
+        if record is None:
+            if row:
+                record = _Record(row[0], pickle.loads(row[1]) if row[1] else {}, row[2])
+            else:
+                record = _Record(updated_at=time.time())
+            self._evict()
+            self._records[skey] = record
+        else:
+            self._records.move_to_end(skey)
+        now = time.time()
+        if self._is_expired(record, now):
+            record.state = None
+            record.data = {}
+            record.updated_at = now
+            record.dirty = True
+            self._dirty.add(skey)
+        return record
+
+    def _touch(self, skey: str, record: _Record):
+        record.updated_at = time.time()
+        record.dirty = True
+        self._dirty.add(skey)
+        self._ensure_flush_task()
+
+    def _evict(self):
+        """Освобождает место под новую запись, выгружая самые старые чистые и уже записанные."""
+        if len(self._records) < self.cache_size:
+            return
+        for skey in list(self._records.keys()):
+            if len(self._records) < self.cache_size:
+                break
+            if not self._records[skey].dirty and skey not in self._inflight:
+                del self._records[skey]
+
+    # ========== ИНТЕРФЕЙС BaseStorage ==========
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = self._make_key(key)
+        record = await self._load(skey)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(skey, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._make_key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, got {type(data).__name__}")
+        skey = self._make_key(key)
+        record = await self._load(skey)
+        record.data = copy.deepcopy(data)
+        self._touch(skey, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._load(self._make_key(key))).data)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # ========== СБРОС НА ДИСК ==========
+    def _ensure_flush_task(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                upserts, deletes = self._take_dirty()
+                if upserts or deletes:
+                    written = 0
+                    try:
+                        written = await asyncio.to_thread(self._write, upserts, deletes)
+                    finally:
+                        self._release(upserts + deletes, written)
+                if self.ttl is not None and time.time() - self._last_sweep > min(self.ttl, 3600):
+                    border = self._drop_expired_cached()
+                    await asyncio.to_thread(self._delete_expired, border)
+            except Exception as e:
+                logger.error(f"Ошибка сброса FSM-хранилища: {e}")
+
+    def _take_dirty(self):
+        """Забирает изменённые записи в пачку; до _release они не выгружаются из памяти."""
+        upserts = []
+        deletes = []
+        for skey in self._dirty:
+            record = self._records.get(skey)
+            if record is None:
+                continue
+            record.dirty = False
+            self._inflight.add(skey)
+            if record.state is None and not record.data:
+                deletes.append((skey,))
+            else:
+                upserts.append((
+                    skey,
+                    record.state,
+                    pickle.dumps(record.data, protocol=pickle.HIGHEST_PROTOCOL) if record.data else None,
+                    record.updated_at,
+                ))
+        self._dirty.clear()
+        return upserts, deletes
+
+    def _write(self, upserts: list, deletes: list) -> int:
+        """Пишет пачку одной транзакцией (в потоке). Возвращает число записей, 0 — ошибка."""
+        with self._lock:
+            try:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                        "updated_at = excluded.updated_at",
+                        upserts
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+                self._conn.commit()
+            except Exception as e:
+                self._conn.rollback()
+                logger.error(f"Ошибка записи FSM-состояний: {e}")
+                return 0
+        return len(upserts) + len(deletes)
+
+    def _release(self, rows: list, written: int):
+        """Пачка записана или нет: снимаем закрепление, при ошибке возвращаем записи в очередь."""
+        for row in rows:
+            self._inflight.discard(row[0])
+            if not written:
+                record = self._records.get(row[0])
+                if record is not None:
+                    record.dirty = True
+                    self._dirty.add(row[0])
+
+    def flush(self) -> int:
+        """Записывает все изменённые состояния одной транзакцией. Возвращает число записей."""
+        upserts, deletes = self._take_dirty()
+        if not upserts and not deletes:
+            return 0
+        written = self._write(upserts, deletes)
+        self._release(upserts + deletes, written)
+        return written
+
+    def _drop_expired_cached(self) -> float:
+        border = time.time() - self.ttl
+        for skey in [k for k, r in self._records.items()
+                     if not r.dirty and k not in self._inflight and r.updated_at < border]:
+            del self._records[skey]
+        return border
+
+    def _delete_expired(self, border: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (border,))
+            self._conn.commit()
+            deleted = cursor.rowcount
+        self._last_sweep = time.time()
+        if deleted:
+            logger.info(f"FSM: удалено {deleted} просроченных состояний")
+        return deleted
+
+    def sweep_expired(self) -> int:
+        """Удаляет брошенные состояния старше TTL из памяти и из БД."""
+        if self.ttl is None:
+            return 0
+        return self._delete_expired(self._drop_expired_cached())
+
+    def stats(self) -> dict:
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0]
+        return {'cached': len(self._records), 'dirty': len(self._dirty), 'stored': stored}
@@ -0,0 +1,111 @@
+# FILE: topic_pool.py
+"""
+Резерв тем форума для новых тикетов. Создание темы — медленный запрос с жёстким
+лимитом на группу, и под нагрузкой пользователь ждал подтверждения тикета
+секундами. Задача планировщика заранее держит в TICKET_GROUP_ID до
+TOPIC_POOL_SIZE пустых тем; новый тикет забирает готовую тему и только
+переименовывает её. Пустой резерв — тема создаётся как раньше, на месте,
+а задача пополнения запускается сразу. Пополнение идёт, только пока у группы
+есть запас в лимите send_scheduler, чтобы не задерживать сообщения тикетов.
+Резерв хранится в БД, поэтому одну тему не заберут два процесса.
+"""
+import logging
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+import send_scheduler
+from config import TICKET_GROUP_ID, TOPIC_POOL_SIZE, TOPIC_POOL_REFILL_BATCH
+from database import add_pool_topic, claim_pool_topic, count_pool_topics
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "topic_pool"
+RESERVE_NAME = "⏳ Резерв"
+# Сколько тем из резерва пробуем, если предыдущие удалены вручную
+MAX_STALE_TOPICS = 3
+
+_counters = {
+    'pooled': 0,
+    'on_demand': 0,
+    'stale': 0,
+    'created': 0,
+}
+# Время от сообщения пользователя до подтверждения тикета, секунд
+_latencies = {
+    'pooled': deque(maxlen=500),
+    'on_demand': deque(maxlen=500),
+}
+
+
+def wake():
+    scheduler.trigger(JOB_NAME)
+
+
+async def open_topic(bot: Bot, name: str) -> tuple:
+    """Тема для нового тикета: (topic_id, взята ли из резерва)."""
+    if TOPIC_POOL_SIZE > 0:
+        for _ in range(MAX_STALE_TOPICS):
+            topic_id = claim_pool_topic(TICKET_GROUP_ID)
+            if topic_id is None:
+                break
+            try:
+                await bot.edit_forum_topic(chat_id=TICKET_GROUP_ID, message_thread_id=topic_id, name=name)
+            except TelegramBadRequest as e:
+                # Тему удалили из группы — она больше не нужна в резерве
+                _counters['stale'] += 1
+                logger.warning(f"Тема {topic_id} из резерва недоступна: {e}")
+                continue
+            _counters['pooled'] += 1
+            return topic_id, True
+        wake()
+    topic = await bot.create_forum_topic(chat_id=TICKET_GROUP_ID, name=name)
+    _counters['on_demand'] += 1
+    return topic.message_thread_id, False
+
+
+def record_ticket_created(seconds: float, pooled: bool):
+    _latencies['pooled' if pooled else 'on_demand'].append(seconds)
+
+
+# ========== ПОПОЛНЕНИЕ ==========
+async def refill(bot: Bot):
+    """Досоздаёт темы до TOPIC_POOL_SIZE. Задача планировщика, см. jobs.register_jobs."""
+    if TOPIC_POOL_SIZE <= 0:
+        return None
+    # Создание тем уступает ответам пользователям и уведомлениям
+    send_scheduler.set_lane('broadcast')
+    missing = TOPIC_POOL_SIZE - count_pool_topics(TICKET_GROUP_ID)
+    created = 0
+    for _ in range(min(missing, TOPIC_POOL_REFILL_BATCH)):
+        # Последнее место в лимите группы оставляем тикетам: пополнение — только в затишье
+        if send_scheduler.send_scheduler.free_tokens(TICKET_GROUP_ID) < 2:
+            break
+        try:
+            topic = await bot.create_forum_topic(chat_id=TICKET_GROUP_ID, name=RESERVE_NAME)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Пополнение резерва тем отложено: лимит группы, {e.retry_after} с")
+            break
+        add_pool_topic(TICKET_GROUP_ID, topic.message_thread_id)
+        created += 1
+    _counters['created'] += created
+    return f"создано тем: {created}" if created else None
+
+
+# ========== МЕТРИКИ ==========
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def stats() -> dict:
+    result = dict(_counters)
+    result['available'] = count_pool_topics(TICKET_GROUP_ID)
+    for source, values in _latencies.items():
+        result[f'{source}_p50'] = _percentile(values, 0.5)
+        result[f'{source}_p95'] = _percentile(values, 0.95)
+    return result
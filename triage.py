@@ -0,0 +1,203 @@
+# FILE: triage.py
+"""
+Разбор новых тикетов по правилам из таблицы triage_rules: ключевые слова или
+регулярное выражение → приоритет, категория, шаблон ответа, группа агентов.
+Все включённые правила собираются в одно регулярное выражение: ключевые слова —
+в префиксное дерево (общие начала слов проверяются один раз), регулярные
+выражения — отдельными именованными группами. Текст проходится один раз,
+сколько бы правил ни было.
+Правила перечитываются после изменения (в том числе в других процессах,
+через cache_bus); срабатывания считаются в памяти и сбрасываются в БД задачей
+планировщика.
+"""
+import asyncio
+import logging
+import re
+from collections import Counter
+from typing import List, Optional
+
+import cache_bus
+from database import get_triage_rules, add_triage_hits
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "triage_hits"
+
+# От самого срочного к самому спокойному; так же упорядочены правила в выражении
+PRIORITIES = ('⚫', '🔴', '🟡', '🟢')
+DEFAULT_PRIORITY = '🟢'
+
+_BACKREFERENCE = re.compile(r'\\\d|\(\?P=')
+
+
+class TriageRule:
+    __slots__ = ('id', 'pattern', 'is_regex', 'priority', 'subject', 'template', 'assign_group', 'enabled', 'hits')
+
+    def __init__(self, row: tuple):
+        (self.id, self.pattern, self.is_regex, self.priority, self.subject,
+         self.template, self.assign_group, self.enabled, self.hits) = row
+
+    def keywords(self) -> List[str]:
+        return [word.strip().lower() for word in self.pattern.split(',') if word.strip()]
+
+    def severity(self) -> int:
+        return PRIORITIES.index(self.priority) if self.priority in PRIORITIES else len(PRIORITIES)
+
+
+class TriageResult:
+    __slots__ = ('priority', 'subject', 'template', 'assign_group', 'rule_ids')
+
+    def __init__(self):
+        self.priority = DEFAULT_PRIORITY
+        self.subject = None
+        self.template = None
+        self.assign_group = None
+        self.rule_ids: List[int] = []
+
+
+def _trie_expression(words) -> str:
+    """Выражение, совпадающее с любым из слов: ветвление по буквам, как в префиксном дереве."""
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # Слово кончается здесь, но может продолжаться более длинным — берём длинное, если есть
+            body = '(?:' + body + ')?' if len(branches) == 1 else body + '?'
+        return body
+
+    return build(root)
+
+
+def validate_pattern(pattern: str, is_regex: bool) -> Optional[str]:
+    """Текст ошибки, если правило нельзя включить в общее выражение, иначе None."""
+    if not pattern.strip():
+        return "пустой шаблон"
+    if not is_regex:
+        return None
+    if _BACKREFERENCE.search(pattern) or '(?P<' in pattern:
+        return "обратные ссылки и именованные группы не поддерживаются"
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return f"ошибка в выражении: {e}"
+    return None
+
+
+class TriageEngine:
+    def __init__(self):
+        self._rules = {}
+        self._keyword_rules = {}
+        self._matcher = None
+        self._loaded = False
+        self._hits = Counter()
+        cache_bus.subscribe('triage', self._apply)
+
+    def load(self):
+        """Перечитывает правила из БД и собирает общее выражение."""
+        rules = [TriageRule(row) for row in get_triage_rules()]
+        active = sorted((rule for rule in rules if rule.enabled), key=lambda rule: (rule.severity(), rule.id))
+        keywords = {}
+        regex_parts = []
+        for rule in active:
+            error = validate_pattern(rule.pattern, rule.is_regex)
+            if error:
+                logger.warning(f"Правило разбора #{rule.id} пропущено: {error}")
+                continue
+            if rule.is_regex:
+                regex_parts.append(f"(?P<r{rule.id}>(?i:{rule.pattern}))")
+            else:
+                for word in rule.keywords():
+                    keywords.setdefault(word, []).append(rule.id)
+        # Совпадение в дереве — самое длинное слово с этой позиции; слова-префиксы
+        # ("не пришли" и "не пришли звёзды") тоже считаются сработавшими
+        self._keyword_rules = {
+            word: {rule_id for end in range(1, len(word) + 1) for rule_id in keywords.get(word[:end], ())}
+            for word in keywords
+        }
+        parts = ([f"(?P<kw>{_trie_expression(keywords)})"] if keywords else []) + regex_parts
+        # Просмотр вперёд: совпадения ищутся с каждой позиции и могут перекрываться, как `word in text`.
+        # С одной позиции засчитывается первая подошедшая ветка: слова, затем выражения по срочности
+        self._rules = {rule.id: rule for rule in rules}
+        self._matcher = re.compile(f"(?=(?:{'|'.join(parts)}))") if parts else None
+        self._loaded = True
+        logger.info(
+            f"Правила разбора тикетов: {len(keywords)} слов и {len(regex_parts)} выражений из {len(rules)} правил"
+        )
+
+    def reload(self):
+        """После изменения правил: пересобрать здесь и в остальных процессах."""
+        self.load()
+        cache_bus.publish('triage')
+
+    def _apply(self, key: str = None):
+        if self._loaded:
+            self.load()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    # ========== РАЗБОР ==========
+    def classify(self, text: str) -> TriageResult:
+        self._ensure_loaded()
+        result = TriageResult()
+        if not self._matcher or not text:
+            return result
+        matched = set()
+        for match in self._matcher.finditer(text.lower()):
+            if match.lastgroup == 'kw':
+                matched.update(self._keyword_rules[match.group('kw')])
+            else:
+                matched.add(int(match.lastgroup[1:]))
+        if not matched:
+            return result
+        # Срочное правило задаёт приоритет; остальные поля — первое правило, где они заполнены
+        hit_rules = sorted((self._rules[rule_id] for rule_id in matched), key=lambda rule: (rule.severity(), rule.id))
+        for rule in hit_rules:
+            self._hits[rule.id] += 1
+            result.rule_ids.append(rule.id)
+            if rule.priority in PRIORITIES and result.priority == DEFAULT_PRIORITY:
+                result.priority = rule.priority
+            result.subject = result.subject or rule.subject
+            result.template = result.template or rule.template
+            result.assign_group = result.assign_group or rule.assign_group
+        return result
+
+    # ========== СТАТИСТИКА ==========
+    def rules(self) -> List[TriageRule]:
+        self._ensure_loaded()
+        return list(self._rules.values())
+
+    def hits(self, rule_id: int) -> int:
+        """Срабатывания правила: сохранённые в БД плюс ещё не сброшенные."""
+        rule = self._rules.get(rule_id)
+        return (rule.hits if rule else 0) + self._hits.get(rule_id, 0)
+
+    async def flush_hits(self):
+        """
+        Переносит счётчики срабатываний в БД: задача планировщика, а в режиме воркеров —
+        свой таймер в каждом процессе. Счётчик подменяется в event loop, где его
+        увеличивает classify, запись идёт в потоке; при ошибке срабатывания возвращаются.
+        """
+        if not self._hits:
+            return None
+        hits, self._hits = self._hits, Counter()
+        if not await asyncio.to_thread(add_triage_hits, hits):
+            self._hits.update(hits)
+            raise RuntimeError(f"срабатывания не сохранены, отложено: {sum(hits.values())}")
+        for rule_id, count in hits.items():
+            if rule_id in self._rules:
+                self._rules[rule_id].hits += count
+        return f"срабатываний: {sum(hits.values())}"
+
+
+triage_engine = TriageEngine()
@@ -0,0 +1,160 @@
+# FILE: webhook.py
+import asyncio
+import hmac
+import logging
+import secrets
+import time
+from collections import deque
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_DRAIN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём обновлений через вебхук. HTTP-обработчик только проверяет секрет,
+    кладёт обновление во внутреннюю очередь и сразу отвечает 200.
+    Обработку ведут workers задач, при остановке очередь дорабатывается.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = WEBHOOK_PATH,
+        secret: Optional[str] = None,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        self.workers = max(1, workers)
+        self.drain_timeout = drain_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._accepting = False
+        self._runner: Optional[web.AppRunner] = None
+        # Счётчики для /admin system_status и нагрузочного теста
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=10000)  # секунд от приёма до конца обработки
+
+    # ========== HTTP ==========
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        try:
+            update = self.parse_update(await request.json())
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response(status=200)
+
+    # ========== ОБРАБОТКА ==========
+    def parse_update(self, raw: dict):
+        return Update.model_validate(raw, context={"bot": self.bot})
+
+    async def process_update(self, update):
+        await self.dp.feed_update(self.bot, update)
+
+    async def _worker(self):
+        while True:
+            update, received_at = await self.queue.get()
+            try:
+                await self.process_update(update)
+                self.processed += 1
+                self.latencies.append(time.perf_counter() - received_at)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки обновления: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        logger.info(f"Вебхук слушает {host}:{port}{self.path} ({self.workers} воркеров)")
+
+    async def stop(self):
+        """Перестаёт принимать обновления, дорабатывает очередь и гасит воркеров."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Вебхук: не успели обработать {self.queue.qsize()} обновлений")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> dict:
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'queued': self.queue.qsize(),
+        }
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, server: Optional[WebhookServer] = None):
+    """Регистрирует вебхук в Telegram и принимает обновления до отмены задачи."""
+    server = server or WebhookServer(dp, bot)
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=server.secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=True,
+        max_connections=min(100, server.workers * 2),
+    )
+    await server.start()
+    await dp.emit_startup(bot=bot)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
@@ -0,0 +1,211 @@
+# FILE: whatif.py
+"""
+Предпросмотр изменения настроек экономики. Вся история покупок, выводов,
+обменов и реферальных наград пересчитывается так, как если бы она прошла при
+предложенных настройках, и сравнивается с пересчётом при текущих: выручка,
+выплаты реальными звёздами и стоимость рефералки.
+История читается из БД пачками в столбцы numpy и держится WHATIF_CACHE_SECONDS,
+поэтому повторный предпросмотр — это только векторный пересчёт, доли секунды
+даже на миллионах строк. Формулы те же, что при создании записей:
+create_order, create_withdrawal, create_exchange, create_referral_reward.
+"""
+import json
+import threading
+import time
+from typing import Dict
+
+import numpy as np
+
+from config import WHATIF_CACHE_SECONDS
+from database import (
+    iter_economy_history, get_star_rate, get_withdraw_commission, get_exchange_commission,
+    get_virtual_to_real_rate, get_virtual_to_real_commission, get_real_to_virtual_rate, get_referral_levels
+)
+
+CHUNK_SIZE = 100_000
+# Настройки, которые можно примерить: ключ settings → подпись
+SETTINGS = {
+    'star_rate': "курс, ₽ за звезду",
+    'withdraw_commission': "комиссия вывода, %",
+    'exchange_commission': "комиссия обмена реальные→вирт, %",
+    'virtual_to_real_rate': "курс вирт→реальные",
+    'virtual_to_real_commission': "комиссия обмена вирт→реальные, %",
+    'real_to_virtual_rate': "курс реальные→вирт",
+    'referral_levels': "проценты уровней рефералки через запятую",
+}
+COMMISSIONS = ('withdraw_commission', 'exchange_commission', 'virtual_to_real_commission')
+
+_history = None
+_loaded_at = 0.0
+# Загрузка идёт в потоках asyncio.to_thread — не дважды одновременно
+_lock = threading.Lock()
+
+
+def current_snapshot() -> dict:
+    return {
+        'star_rate': get_star_rate(),
+        'withdraw_commission': get_withdraw_commission(),
+        'exchange_commission': get_exchange_commission(),
+        'virtual_to_real_rate': get_virtual_to_real_rate(),
+        'virtual_to_real_commission': get_virtual_to_real_commission(),
+        'real_to_virtual_rate': get_real_to_virtual_rate(),
+        'referral_levels': get_referral_levels(),
+    }
+
+
+def parse_value(key: str, text: str, levels: list = None):
+    """
+    Значение настройки, как его вводит админ: комиссии — в процентах, уровни
+    рефералки — процентами через запятую (или JSON, как в settings).
+    Возвращает значение в единицах snapshot. ValueError — если ввод не подходит.
+    """
+    if key not in SETTINGS:
+        raise ValueError(f"неизвестная настройка: {key}")
+    if key == 'referral_levels':
+        if text.lstrip().startswith('['):
+            return _check_levels(json.loads(text))
+        percents = [float(part) for part in text.split(',')]
+        levels = [dict(level) for level in (levels if levels is not None else get_referral_levels())]
+        if not levels and len(percents) == 1:
+            levels = [{"min": 0, "max": 999999, "percent": 0, "name": "Базовый"}]
+        if len(percents) != len(levels):
+            raise ValueError(f"нужно процентов: {len(levels)}")
+        for level, percent in zip(levels, percents):
+            level['percent'] = percent
+        return _check_levels(levels)
+    value = float(text.replace(',', '.'))
+    if value < 0 or (key in COMMISSIONS and value > 100):
+        raise ValueError(f"{key}: недопустимое значение {text}")
+    return value / 100 if key in COMMISSIONS else value
+
+
+def _check_levels(levels) -> list:
+    """Уровни в том виде, в каком их читают get_referral_level и create_referral_reward."""
+    if not isinstance(levels, list) or not levels:
+        raise ValueError("referral_levels: нужен непустой список уровней")
+    for level in levels:
+        if not isinstance(level, dict):
+            raise ValueError(f"referral_levels: уровень должен быть объектом: {level}")
+        for field in ('min', 'max', 'percent'):
+            value = level.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"referral_levels: у уровня нет числового {field}: {level}")
+        if level['percent'] < 0:
+            raise ValueError(f"referral_levels: отрицательный процент: {level}")
+    return levels
+
+
+def parse_overrides(text: str) -> dict:
+    """«star_rate=1.7 withdraw_commission=40» → изменения поверх текущих настроек."""
+    overrides = {}
+    for item in text.split():
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"ожидается ключ=значение: {item}")
+        overrides[key] = parse_value(key, value)
+    return overrides
+
+
+# ========== ИСТОРИЯ ==========
+def _load(kind: str, columns: int, params: tuple = ()):
+    chunks = [np.array(rows, dtype=np.float64).reshape(-1, columns)
+              for rows in iter_economy_history(kind, CHUNK_SIZE, params)]
+    return np.concatenate(chunks) if chunks else np.empty((0, columns))
+
+
+def load_history(max_age: float = WHATIF_CACHE_SECONDS) -> dict:
+    """
+    Столбцы истории; обновляются, если загружены раньше max_age секунд назад.
+    Покупки только дописываются, поэтому из БД читаются лишь новые; выводы,
+    обмены и награды меняют статус и читаются целиком — их на порядок меньше.
+    """
+    global _history, _loaded_at
+    with _lock:
+        if _history is not None and time.monotonic() - _loaded_at < max_age:
+            return _history
+        previous = _history['purchases'] if _history else np.empty((0, 5))
+        last_id = int(previous[-1, 0]) if len(previous) else 0
+        purchases = np.concatenate((previous, _load('purchases', 5, (last_id,))))
+        exchanges = _load('exchanges', 2)
+        withdrawals = _load('withdrawals', 1)
+        listed = purchases[:, 4]
+        _history = {
+            'purchases': purchases,
+            'stars': purchases[:, 2],
+            # Доля цены после скидок — промокоды в процентах, поэтому она не зависит от курса
+            'paid_share': np.divide(purchases[:, 3], listed, out=np.ones_like(listed), where=listed > 0),
+            'referred': np.isin(purchases[:, 1], _load('referrals', 1)[:, 0]),
+            'withdrawals': withdrawals[:, 0],
+            'virtual_to_real': exchanges[exchanges[:, 0] == 1, 1],
+            'real_to_virtual': exchanges[exchanges[:, 0] == 0, 1],
+            'rows': len(purchases) + len(exchanges) + len(withdrawals),
+        }
+        _loaded_at = time.monotonic()
+        return _history
+
+
+def prefetch():
+    """Загрузка истории заранее, пока админ вводит значение."""
+    load_history()
+
+
+# ========== ПЕРЕСЧЁТ ==========
+def evaluate(snapshot: dict, history: dict) -> Dict[str, float]:
+    """Итоги всей истории при настройках snapshot."""
+    prices = history['stars'] * snapshot['star_rate'] * history['paid_share']
+    levels = snapshot['referral_levels']
+    # create_referral_reward берёт процент первого уровня
+    percent = levels[0]['percent'] if levels else 0
+    rewards = np.floor(prices[history['referred']] * percent / 100)
+    withdrawals = np.floor(history['withdrawals'] * (1 - snapshot['withdraw_commission']))
+    to_real = np.floor(history['virtual_to_real'] * snapshot['virtual_to_real_rate']
+                       * (1 - snapshot['virtual_to_real_commission']))
+    to_virtual = np.floor(history['real_to_virtual'] * snapshot['real_to_virtual_rate']
+                          * (1 - snapshot['exchange_commission']))
+    return {
+        'revenue': float(prices.sum()),
+        'referral_cost': float(rewards.sum()),
+        'withdraw_payout': float(withdrawals.sum()),
+        'exchange_payout': float(to_real.sum()),
+        'exchange_minted': float(to_virtual.sum()),
+    }
+
+
+def preview(overrides: dict, max_age: float = WHATIF_CACHE_SECONDS) -> dict:
+    """
+    Текущие и предложенные итоги по всей истории. Блокирующая: первая загрузка
+    читает все строки — из бота вызывать через asyncio.to_thread.
+    """
+    started = time.perf_counter()
+    history = load_history(max_age)
+    current = current_snapshot()
+    proposed = {**current, **overrides}
+    return {
+        'current': evaluate(current, history),
+        'proposed': evaluate(proposed, history),
+        'rows': history['rows'],
+        'seconds': time.perf_counter() - started,
+    }
+
+
+METRICS = (
+    ('revenue', "Выручка", "₽"),
+    ('withdraw_payout', "Выплаты по выводам", "⭐"),
+    ('exchange_payout', "Выплаты по обмену вирт→реальные", "⭐"),
+    ('exchange_minted', "Начислено по обмену реальные→вирт", "⭐ вирт."),
+    ('referral_cost', "Реферальные награды", "⭐ вирт."),
+)
+
+
+def _number(value: float, sign: str = '') -> str:
+    return f"{value:{sign},.0f}".replace(',', ' ')
+
+
+def format_preview(result: dict) -> str:
+    lines = []
+    for key, title, unit in METRICS:
+        before, after = result['current'][key], result['proposed'][key]
+        change = f" ({(after - before) / before:+.1%})" if before else ""
+        lines.append(f"• {title}: {_number(before)} → {_number(after)} {unit}, Δ {_number(after - before, '+')}{change}")
+    lines.append(f"\nПересчитано записей: {result['rows']}, {result['seconds']:.2f} с")
+    return "\n".join(lines)
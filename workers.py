@@ -0,0 +1,268 @@
+# FILE: workers.py
+"""
+Многопроцессный режим. Фронт-процесс (polling или вебхук) получает обновления
+и раздаёт их WORKER_PROCESSES воркерам по хэшу user_id, поэтому обновления
+одного пользователя всегда обрабатывает один процесс и в исходном порядке.
+Воркеры работают с общим SQLite-файлом в режиме WAL, а инвалидации кэшей
+пересылаются между ними через супервизор (см. cache_bus.py); он же применяет
+их у себя и рассылает свои — от задач планировщика.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import zlib
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import cache_bus
+from triage import triage_engine
+from config import (
+    BOT_MODE, WEBHOOK_URL, WORKER_PROCESSES, WORKER_CONCURRENCY, WORKER_QUEUE_SIZE, TRIAGE_HITS_FLUSH_INTERVAL
+)
+from webhook import WebhookServer, run_webhook
+
+logger = logging.getLogger(__name__)
+
+# Отправитель инвалидаций из супервизора (задачи планировщика); None в шине — сигнал остановки
+SUPERVISOR_ORIGIN = -1
+# Поля апдейта, в которых отправитель лежит в "from"
+_FROM_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request",
+    "business_message", "edited_business_message",
+)
+
+
+# ========== ШАРДИРОВАНИЕ ==========
+def update_user_id(raw: dict) -> Optional[int]:
+    """Достаёт user_id из «сырого» апдейта Telegram (или chat_id, если пользователя нет)."""
+    for field in _FROM_FIELDS:
+        event = raw.get(field)
+        if event:
+            user = event.get("from")
+            if user:
+                return user["id"]
+            chat = event.get("chat")
+            if chat:
+                return chat["id"]
+    for field in ("poll_answer", "message_reaction"):
+        event = raw.get(field)
+        if event and event.get("user"):
+            return event["user"]["id"]
+    return None
+
+
+def shard_for(user_id: Optional[int], workers: int) -> int:
+    if user_id is None or workers <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+# ========== ВОРКЕР ==========
+def worker_main(index: int, updates: multiprocessing.Queue, bus: multiprocessing.Queue):
+    """Точка входа процесса-воркера."""
+    logging.basicConfig(level=logging.INFO, format=f"[worker-{index}] %(levelname)s:%(name)s:%(message)s")
+    try:
+        asyncio.run(_worker_loop(index, updates, bus))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _flush_triage_hits():
+    try:
+        await triage_engine.flush_hits()
+    except Exception as e:
+        logger.error(f"Ошибка сброса срабатываний правил: {e}")
+
+
+async def _flush_triage_hits_periodically():
+    """
+    Срабатывания правил разбора копятся в памяти процесса, а задачи планировщика
+    идут в супервизоре, где тикеты не разбираются, — воркер сбрасывает свои сам.
+    """
+    while True:
+        await asyncio.sleep(TRIAGE_HITS_FLUSH_INTERVAL)
+        await _flush_triage_hits()
+
+
+async def _worker_loop(index: int, updates: multiprocessing.Queue, bus: multiprocessing.Queue):
+    import main  # бот, диспетчер, роутеры и middleware
+
+    bot, dp = main.bot, main.dp
+    cache_bus.set_publisher(lambda kind, key: bus.put_nowait((index, kind, key)))
+    await dp.emit_startup(bot=bot)
+
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    user_locks = {}
+    pending = {}
+    tasks = set()
+
+    async def process(user_id, update: Update):
+        # Лок на пользователя сохраняет порядок его апдейтов, семафор ограничивает параллелизм
+        lock = user_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock, semaphore:
+                await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            pending[user_id] -= 1
+            if not pending[user_id]:
+                del pending[user_id]
+                del user_locks[user_id]
+
+    flusher = asyncio.create_task(_flush_triage_hits_periodically())
+    logger.info(f"Воркер {index} запущен")
+    while True:
+        item = await asyncio.to_thread(updates.get)
+        if item[0] == "stop":
+            break
+        if item[0] == "invalidate":
+            cache_bus.apply(item[1], item[2])
+            continue
+        raw = item[1]
+        user_id = update_user_id(raw)
+        try:
+            update = Update.model_validate(raw, context={"bot": bot})
+        except Exception as e:
+            logger.error(f"Некорректное обновление: {e}")
+            continue
+        pending[user_id] = pending.get(user_id, 0) + 1
+        task = asyncio.create_task(process(user_id, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    flusher.cancel()
+    await _flush_triage_hits()
+    await dp.emit_shutdown(bot=bot)
+    await main.storage.close()
+    await bot.session.close()
+    logger.info(f"Воркер {index} остановлен")
+
+
+# ========== СУПЕРВИЗОР ==========
+class Supervisor:
+    """Запускает воркеров, раздаёт им апдейты и перезапускает упавшие процессы."""
+
+    def __init__(self, workers: int = WORKER_PROCESSES, queue_size: int = WORKER_QUEUE_SIZE):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.bus = self._ctx.Queue()
+        self.processes = [None] * workers
+        self.routed = [0] * workers
+        self._stopping = False
+        self._tasks = []
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self.queues[index], self.bus),
+            name=f"starfly-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        # Задачи планировщика идут в супервизоре — их инвалидации тоже расходятся по воркерам
+        cache_bus.set_publisher(lambda kind, key: self.bus.put_nowait((SUPERVISOR_ORIGIN, kind, key)))
+        self._tasks = [
+            asyncio.create_task(self._bus_loop()),
+            asyncio.create_task(self._watchdog()),
+        ]
+        logger.info(f"Запущено воркеров: {self.workers}")
+
+    async def _put(self, index: int, item: tuple):
+        try:
+            self.queues[index].put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self.queues[index].put, item)
+
+    async def route(self, raw: dict):
+        index = shard_for(update_user_id(raw), self.workers)
+        self.routed[index] += 1
+        await self._put(index, ("update", raw))
+
+    async def _bus_loop(self):
+        """Применяет инвалидации воркеров у себя и пересылает их всем воркерам, кроме отправителя."""
+        while True:
+            origin, kind, key = await asyncio.to_thread(self.bus.get)
+            if origin is None:
+                break
+            if origin != SUPERVISOR_ORIGIN:
+                cache_bus.apply(kind, key)
+            for index in range(self.workers):
+                if index != origin:
+                    await self._put(index, ("invalidate", kind, key))
+
+    async def _watchdog(self):
+        while not self._stopping:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self.processes):
+                if not self._stopping and process is not None and not process.is_alive():
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self._spawn(index)
+
+    async def stop(self, timeout: float = 30):
+        self._stopping = True
+        cache_bus.set_publisher(None)
+        for index in range(self.workers):
+            await self._put(index, ("stop",))
+        for process in self.processes:
+            if process is not None:
+                await asyncio.to_thread(process.join, timeout)
+                if process.is_alive():
+                    process.terminate()
+        self.bus.put((None, None, None))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class _ShardingWebhookServer(WebhookServer):
+    """Вебхук фронт-процесса: апдейт не разбирается, а сразу уходит воркеру."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, supervisor: Supervisor):
+        # Один обработчик очереди, чтобы не перемешать апдейты одного пользователя
+        super().__init__(dp, bot, workers=1)
+        self.supervisor = supervisor
+
+    def parse_update(self, raw: dict):
+        return raw
+
+    async def process_update(self, update):
+        await self.supervisor.route(update)
+
+
+async def _poll(bot: Bot, dp: Dispatcher, supervisor: Supervisor):
+    allowed_updates = dp.resolve_used_update_types()
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            await supervisor.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def run_supervisor(bot: Bot, dp: Dispatcher):
+    supervisor = Supervisor()
+    supervisor.start()
+    try:
+        if BOT_MODE == "webhook" and WEBHOOK_URL:
+            await run_webhook(dp, bot, server=_ShardingWebhookServer(dp, bot, supervisor))
+        else:
+            await _poll(bot, dp, supervisor)
+    finally:
+        await supervisor.stop()